@@ -4,14 +4,14 @@ import json
 
 from django.conf import settings; logging = settings.LOG
 from django.utils.translation import ugettext as _
-from django.db.models import Q, Sum, Avg
+from django.db.models import Q, Sum, Count
 
 from fle_utils.internet.classes import JsonResponse, JsonResponseMessage, JsonResponseMessageError
 
 from kalite.main.models import ExerciseLog, VideoLog, ContentLog, AttemptLog, UserLogSummary
 from kalite.facility.models import FacilityUser
 from kalite.shared.decorators.auth import require_admin
-from kalite.topic_tools.content_models import get_topic_contents, get_topic_nodes, get_leafed_topics, get_content_parents
+from kalite.topic_tools.content_models import get_topics_contents, get_topics_content_ids, get_topic_nodes, get_content_parents
 
 
 def unique_by_id_and_kind_sort(seq):
@@ -57,7 +57,7 @@ def get_learners_from_GET(request):
 
     return FacilityUser.objects.filter(learner_filter & Q(is_teacher=False)).order_by("last_name")
 
-def return_log_type_details(log_type, topic_ids=None):
+def return_log_type_details(log_type, topic_ids=None, contents=True):
     fields = ["user", "points", "complete", "completion_timestamp", "completion_counter"]
     if log_type == "exercise":
         LogModel = ExerciseLog
@@ -74,9 +74,13 @@ def return_log_type_details(log_type, topic_ids=None):
     else:
         return None
     id_field = obj_id_field.split("__")[0]
-    if topic_ids:
-        objects = [obj for topic_id in topic_ids for obj in get_topic_contents(topic_id=topic_id, kinds=[log_type.title()])]
+    if topic_ids and contents:
+        objects = get_topics_contents(topic_ids=topic_ids, kinds=[log_type.title()])
         obj_ids = {obj_id_field: [obj.get("id") for obj in objects]}
+    elif topic_ids:
+        # Only the ids are needed, which the topic tree index has without querying the content database.
+        objects = []
+        obj_ids = {obj_id_field: get_topics_content_ids(topic_ids=topic_ids, kinds=[log_type.title()])}
     else:
         objects = []
         obj_ids = {}
@@ -121,11 +125,14 @@ def learner_logs(request):
 
         log_objects = LogModel.objects.filter(user__in=learners, **obj_ids).values(*fields)
         if not topic_ids:
-            topic_objects = log_objects.filter(latest_activity_timestamp__gte=start_date, latest_activity_timestamp__lte=end_date)
-            if topic_objects.count() == 0:
-                topic_objects = log_objects
+            content_ids = set(LogModel.objects.filter(
+                user__in=learners,
+                latest_activity_timestamp__gte=start_date,
+                latest_activity_timestamp__lte=end_date).values_list(id_field, flat=True))
+            if not content_ids:
+                content_ids = set(LogModel.objects.filter(user__in=learners).values_list(id_field, flat=True))
             # Can return multiple items with same id, due to topic tree redundancy, so make unique by id here.
-            objects = dict([(item.get("id"), item) for item in get_topic_nodes(ids=[obj[id_field] for obj in topic_objects]) or []]).values()
+            objects = dict([(item.get("id"), item) for item in get_topic_nodes(ids=list(content_ids)) or []]).values()
         output_objects.extend(objects)
         output_logs.extend(log_objects)
 
@@ -148,12 +155,53 @@ def learner_logs(request):
         "limit": limit
     })
 
+def summarize_logs(log_type, log_objects, id_field):
+    """
+    Counts and totals over a set of logs of one type, computed with a single query, grouped by content item and state.
+    :param log_objects: A queryset of logs of the model for log_type.
+    :return: A dict of the set of content ids logged, the numbers of logs complete, in progress and struggling,
+    the total time spent, and the sum and number of streak progress values (for exercises).
+    """
+    group_fields = [id_field, "complete"]
+    annotations = {"log_count": Count("pk")}
+    if log_type == "exercise":
+        group_fields.append("struggling")
+        annotations["streak_progress_sum"] = Sum("streak_progress")
+        annotations["streak_progress_count"] = Count("streak_progress")
+    elif log_type == "video":
+        annotations["time_spent_sum"] = Sum("total_seconds_watched")
+    elif log_type == "content":
+        annotations["time_spent_sum"] = Sum("time_spent")
+
+    summary = {
+        "ids": set(),
+        "complete": 0,
+        "in_progress": 0,
+        "struggling": 0,
+        "time_spent": 0,
+        "streak_progress_sum": 0,
+        "streak_progress_count": 0,
+    }
+    # Clear any ordering, as Django would group by the ordering fields as well.
+    for row in log_objects.order_by().values(*group_fields).annotate(**annotations):
+        summary["ids"].add(row[id_field])
+        if row["complete"]:
+            summary["complete"] += row["log_count"]
+        if row.get("struggling"):
+            summary["struggling"] += row["log_count"]
+        elif not row["complete"]:
+            summary["in_progress"] += row["log_count"]
+        summary["time_spent"] += row.get("time_spent_sum") or 0
+        summary["streak_progress_sum"] += row.get("streak_progress_sum") or 0
+        summary["streak_progress_count"] += row.get("streak_progress_count") or 0
+    return summary
+
 @require_admin
 def aggregate_learner_logs(request):
 
     learners = get_learners_from_GET(request)
 
-    event_limit = request.GET.get("event_limit", 10)
+    event_limit = int(request.GET.get("event_limit", 10))
 
     # Look back a week by default
     time_window = request.GET.get("time_window", 7)
@@ -189,41 +237,38 @@ def aggregate_learner_logs(request):
 
     for log_type in log_types:
 
-        LogModel, fields, id_field, obj_ids, objects = return_log_type_details(log_type, topic_ids)   
+        LogModel, fields, id_field, obj_ids, objects = return_log_type_details(log_type, topic_ids, contents=False)
 
         log_objects = LogModel.objects.filter(
             user__in=learners,
             latest_activity_timestamp__gte=start_date,
             latest_activity_timestamp__lte=end_date, **obj_ids).order_by("-latest_activity_timestamp")
 
-        number_content += len(set(log_objects.values_list(id_field, flat=True)))
-
-        if log_type == "video":
-            output_dict["total_in_progress"] += log_objects.filter(complete=False).count()
-            output_dict["content_time_spent"] += log_objects.aggregate(Sum("total_seconds_watched"))["total_seconds_watched__sum"] or 0
-        elif log_type == "content":
-            output_dict["total_in_progress"] += log_objects.filter(complete=False).count()
-            output_dict["content_time_spent"] += log_objects.aggregate(Sum("time_spent"))["time_spent__sum"] or 0
-        elif log_type == "exercise":
-            output_dict["total_struggling"] = log_objects.filter(struggling=True).count()
-            output_dict["total_in_progress"] += log_objects.filter(complete=False, struggling=False).count()
+        summary = summarize_logs(log_type, log_objects, id_field)
+
+        number_content += len(summary["ids"])
+
+        output_dict["total_in_progress"] += summary["in_progress"]
+        output_dict["total_complete"] += summary["complete"]
+        output_dict["content_time_spent"] += summary["time_spent"]
+        if log_type == "exercise":
+            output_dict["total_struggling"] = summary["struggling"]
             output_dict["exercise_attempts"] = AttemptLog.objects.filter(user__in=learners,
                 timestamp__gte=start_date,
                 timestamp__lte=end_date, **obj_ids).count()
-            if log_objects.aggregate(Avg("streak_progress"))["streak_progress__avg"] is not None:
-                output_dict["exercise_mastery"] = round(log_objects.aggregate(Avg("streak_progress"))["streak_progress__avg"])
-        output_logs.extend(log_objects)
-        output_dict["total_complete"] += log_objects.filter(complete=True).count()
+            if summary["streak_progress_count"]:
+                output_dict["exercise_mastery"] = round(summary["streak_progress_sum"] / float(summary["streak_progress_count"]))
 
-        object_buffer = LogModel.objects.filter(
-            user__in=learners,
-            latest_activity_timestamp__gte=start_date,
-            latest_activity_timestamp__lte=end_date).values_list(id_field, flat=True)
+        # Only the latest logs of each type can be among the latest of all types.
+        output_logs.extend(log_objects.select_related("user")[:event_limit])
 
-        if len(object_buffer) > 1:
-            all_object_ids.update(object_buffer)
-        elif len(object_buffer) == 1:
-            all_object_ids.add(object_buffer)
+        if obj_ids:
+            all_object_ids.update(LogModel.objects.filter(
+                user__in=learners,
+                latest_activity_timestamp__gte=start_date,
+                latest_activity_timestamp__lte=end_date).values_list(id_field, flat=True).distinct())
+        else:
+            all_object_ids.update(summary["ids"])
     if len(all_object_ids) > 0:
         output_dict["available_topics"] = map(lambda x: {"id": x.get("id"), "title": x.get("title")}, get_content_parents(ids=list(all_object_ids)))
     output_dict["total_not_attempted"] = number_content*len(learners) - (
@@ -9,7 +9,7 @@ from django.utils.translation import ugettext as _
 
 from kalite.facility.models import FacilityUser
 from kalite.main.models import ExerciseLog, VideoLog
-from kalite.topic_tools.content_models import get_topic_node, get_content_parents, get_topic_contents, get_content_item,  get_topic_nodes
+from kalite.topic_tools.content_models import get_topic_node, get_content_parents, get_topics_content_ids_by_kind, get_content_item,  get_topic_nodes
 
 
 class PlaylistProgressParent:
@@ -18,10 +18,16 @@ class PlaylistProgressParent:
     @classmethod
     def get_playlist_entry_ids(cls, playlist):
         """Return a tuple of the playlist's video ids and exercise ids as sets"""
-        items = get_topic_contents(topic_id=playlist.get("id"))
-        pl_video_ids = set([item.get("id") for item in items if item.get("kind") == "Video"])
-        pl_exercise_ids = set([item.get("id") for item in items if item.get("kind") == "Exercise"])
-        return (pl_video_ids, pl_exercise_ids)
+        return cls.get_playlists_entry_ids([playlist.get("id")])[playlist.get("id")]
+
+    @classmethod
+    def get_playlists_entry_ids(cls, playlist_ids):
+        """Return a dict of playlist id to a tuple of the playlist's video ids and exercise ids as sets"""
+        content_ids = get_topics_content_ids_by_kind(kinds=["Video", "Exercise"], topic_ids=playlist_ids)
+        return dict(
+            (playlist_id, (ids["Video"], ids["Exercise"]))
+            for playlist_id, ids in content_ids.iteritems()
+        )
 
     @classmethod
     def get_user_logs(cls, user, pl_video_ids=None, pl_exercise_ids=None):
@@ -38,6 +44,14 @@ class PlaylistProgressParent:
 
         return (user_vid_logs, user_ex_logs)
 
+    @classmethod
+    def get_logs_by_id(cls, logs, id_field):
+        """Return a dict of content id to the list of logs for it, in their original order"""
+        logs_by_id = {}
+        for log in logs:
+            logs_by_id.setdefault(log[id_field], []).append(log)
+        return logs_by_id
+
 
 class PlaylistProgress(PlaylistProgressParent):
     """Users progress on playlists"""
@@ -57,30 +71,33 @@ class PlaylistProgress(PlaylistProgressParent):
 
         user = FacilityUser.objects.get(id=user_id)
 
-        # Retrieve video, exercise, and quiz logs that appear in this playlist
+        # Retrieve video, exercise, and quiz logs, by content id
         user_vid_logs, user_ex_logs = cls.get_user_logs(user)
-
-        exercise_ids = list(set([ex_log["exercise_id"] for ex_log in user_ex_logs]))
-        video_ids = list(set([vid_log["video_id"] for vid_log in user_vid_logs]))
+        vid_logs_by_id = cls.get_logs_by_id(user_vid_logs, "video_id")
+        ex_logs_by_id = cls.get_logs_by_id(user_ex_logs, "exercise_id")
 
         # Build a list of playlists for which the user has at least one data point
-        user_playlists = get_content_parents(ids=exercise_ids+video_ids, language=language)
+        user_playlists = get_content_parents(ids=ex_logs_by_id.keys() + vid_logs_by_id.keys(), language=language)
+
+        # And the videos and exercises in each of them, all at once
+        playlists_entry_ids = cls.get_playlists_entry_ids([p.get("id") for p in user_playlists])
 
         # Store stats for each playlist
         user_progress = list()
         for i, p in enumerate(user_playlists):
             # Playlist entry totals
-            pl_video_ids, pl_exercise_ids = cls.get_playlist_entry_ids(p)
+            pl_video_ids, pl_exercise_ids = playlists_entry_ids[p.get("id")]
             n_pl_videos = float(len(pl_video_ids))
             n_pl_exercises = float(len(pl_exercise_ids))
 
-            # Vid & exercise logs in this playlist
-            pl_ex_logs = [ex_log for ex_log in user_ex_logs if ex_log["exercise_id"] in pl_exercise_ids]
-            pl_vid_logs = [vid_log for vid_log in user_vid_logs if vid_log["video_id"] in pl_video_ids]
-
-            # Compute video stats
-            n_vid_complete = len([vid for vid in pl_vid_logs if vid["complete"]])
-            n_vid_started = len([vid for vid in pl_vid_logs if (vid["total_seconds_watched"] > 0) and (not vid["complete"])])
+            # Compute video stats, from the logs of videos in this playlist
+            n_vid_complete = n_vid_started = 0
+            for video_id in pl_video_ids:
+                for vid in vid_logs_by_id.get(video_id, ()):
+                    if vid["complete"]:
+                        n_vid_complete += 1
+                    elif vid["total_seconds_watched"] > 0:
+                        n_vid_started += 1
             vid_pct_complete = int(float(n_vid_complete) / n_pl_videos * 100) if n_pl_videos else 0
             vid_pct_started = int(float(n_vid_started) / n_pl_videos * 100) if n_pl_videos else 0
             if vid_pct_complete == 100:
@@ -90,11 +107,18 @@ class PlaylistProgress(PlaylistProgressParent):
             else:
                 vid_status = "notstarted"
 
-            # Compute exercise stats
-            n_ex_mastered = len([ex for ex in pl_ex_logs if ex["complete"]])
-            n_ex_started = len([ex for ex in pl_ex_logs if ex["attempts"] > 0])
-            n_ex_incomplete = len([ex for ex in pl_ex_logs if (ex["attempts"] > 0 and not ex["complete"])])
-            n_ex_struggling = len([ex for ex in pl_ex_logs if ex["struggling"]])
+            # Compute exercise stats, from the logs of exercises in this playlist
+            n_ex_mastered = n_ex_started = n_ex_incomplete = n_ex_struggling = 0
+            for exercise_id in pl_exercise_ids:
+                for ex in ex_logs_by_id.get(exercise_id, ()):
+                    if ex["complete"]:
+                        n_ex_mastered += 1
+                    if ex["attempts"] > 0:
+                        n_ex_started += 1
+                        if not ex["complete"]:
+                            n_ex_incomplete += 1
+                    if ex["struggling"]:
+                        n_ex_struggling += 1
             ex_pct_mastered = int(float(n_ex_mastered) / (n_pl_exercises or 1) * 100)
             ex_pct_incomplete = int(float(n_ex_incomplete) / (n_pl_exercises or 1) * 100)
             ex_pct_struggling = int(float(n_ex_struggling) / (n_pl_exercises or 1) * 100)
@@ -157,6 +181,8 @@ class PlaylistProgressDetail(PlaylistProgressParent):
 
         # Retrieve video, exercise, and quiz logs that appear in this playlist
         user_vid_logs, user_ex_logs = cls.get_user_logs(user, pl_video_ids, pl_exercise_ids)
+        vid_logs_by_id = cls.get_logs_by_id(user_vid_logs, "video_id")
+        ex_logs_by_id = cls.get_logs_by_id(user_ex_logs, "exercise_id")
 
         # Finally, sort an ordered list of the playlist entries, with user progress
         # injected where it exists.
@@ -169,7 +195,7 @@ class PlaylistProgressDetail(PlaylistProgressParent):
             score = 0
 
             if kind == "Video":
-                vid_log = next((vid_log for vid_log in user_vid_logs if vid_log["video_id"] == entity_id), None)
+                vid_log = vid_logs_by_id.get(entity_id, [None])[0]
                 if vid_log:
                     if vid_log.get("complete"):
                         status = "complete"
@@ -179,7 +205,7 @@ class PlaylistProgressDetail(PlaylistProgressParent):
                     score = int(float(vid_log.get("points")) / float(750) * 100)
 
             elif kind == "Exercise":
-                ex_log = next((ex_log for ex_log in user_ex_logs if ex_log["exercise_id"] == entity_id), None)
+                ex_log = ex_logs_by_id.get(entity_id, [None])[0]
                 if ex_log:
                     if ex_log.get("struggling"):
                         status = "struggling"
@@ -1,3 +1,4 @@
+import datetime
 import json
 import urllib
 import peewee
@@ -6,6 +7,7 @@ from django.conf import settings
 logging = settings.LOG
 from mock import patch
 
+from kalite.main.models import VideoLog
 from kalite.testing.base import KALiteTestCase, KALiteClientTestCase
 from kalite.testing.mixins.django_mixins import CreateAdminMixin
 from kalite.testing.mixins.securesync_mixins import CreateZoneMixin
@@ -113,6 +115,31 @@ class InternalAPITests(FacilityMixins,
             assert key in api_resp, "{key} not found in learner log API response".format(key)
         self.client.logout()
 
+    def test_aggregate_endpoint_counts(self):
+        now = datetime.datetime.now()
+        student = self.create_student(username="student2", first_name="Second", last_name="Student", facility=self.facility)
+        self.create_exercise_log(user=self.facility_user, exercise_id="ex1", streak_progress=100, complete=True,
+                                 latest_activity_timestamp=now)
+        self.create_exercise_log(user=student, exercise_id="ex1", streak_progress=20, struggling=True,
+                                 latest_activity_timestamp=now - datetime.timedelta(hours=1))
+        self.create_exercise_log(user=student, exercise_id="ex2", streak_progress=30,
+                                 latest_activity_timestamp=now - datetime.timedelta(hours=2))
+        VideoLog.objects.create(user=self.facility_user, video_id="v1", youtube_id="v1", total_seconds_watched=1800,
+                                latest_activity_timestamp=now - datetime.timedelta(hours=3))
+
+        self.client.login(username='admin', password='admin')
+        api_resp = json.loads(self.client.get("%s?facility_id=%s&event_limit=3" % (self.reverse("aggregate_learner_logs"), self.facility.id)).content)
+        self.assertEqual(api_resp["total_complete"], 1)
+        self.assertEqual(api_resp["total_struggling"], 1)
+        self.assertEqual(api_resp["total_in_progress"], 2)
+        # 3 content items for each of 2 learners, 4 of them attempted
+        self.assertEqual(api_resp["total_not_attempted"], 2)
+        self.assertEqual(api_resp["exercise_mastery"], 50)
+        self.assertEqual(api_resp["content_time_spent"], 0.5)
+        self.assertEqual([event["learner"] for event in api_resp["learner_events"]],
+                         [self.facility_user.get_name(), "Second Student", "Second Student"])
+        self.client.logout()
+
 class PlaylistProgressResourceTestCase(FacilityMixins, StudentProgressMixin, KALiteClientTestCase):
 
     @set_database
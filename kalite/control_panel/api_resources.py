@@ -1,13 +1,15 @@
 from annoying.functions import get_object_or_None
 from datetime import datetime
 
-from django.db.models import Max, Min
-from django.http import HttpResponse
+from django.db.models import Count, Max, Min
+from django.db.models.query import QuerySet
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils.translation import ugettext as _
 
 from tastypie import fields
-from tastypie.exceptions import BadRequest
+from tastypie.exceptions import BadRequest, ImmediateHttpResponse
 from tastypie.resources import ModelResource
+from tastypie.utils.mime import build_content_type
 
 from securesync.models import Zone, Device, SyncSession
 
@@ -27,6 +29,56 @@ ID_NONE = "None"
 ALL_KEY = ""
 UNGROUPED_KEY = "ungrouped"
 
+# How many objects are fetched, dehydrated and written out at a time, when streaming a CSV export.
+CSV_EXPORT_CHUNK_SIZE = 500
+
+
+def iter_chunks(objects, chunk_size=CSV_EXPORT_CHUNK_SIZE):
+    """
+    Split a list or queryset of objects into lists of up to chunk_size objects.
+    Querysets are fetched one chunk at a time, so only one chunk is in memory at once (iterating over a queryset
+    caches all of its results).  Unless they're ordered or sliced, that's by ranges of primary keys, as sliced
+    queries get slower the further in they start; otherwise it's by slices, to keep the order and bounds asked for.
+    """
+    if not isinstance(objects, QuerySet):
+        objects = list(objects)
+        for idx in range(0, len(objects), chunk_size):
+            yield objects[idx:idx + chunk_size]
+        return
+
+    if objects.query.order_by or objects.query.low_mark or objects.query.high_mark is not None:
+        idx = 0
+        while True:
+            chunk = list(objects[idx:idx + chunk_size])
+            if chunk:
+                yield chunk
+            if len(chunk) < chunk_size:
+                return
+            idx += chunk_size
+
+    objects = objects.order_by("pk")
+    last_pk = None
+    while True:
+        chunk = list((objects if last_pk is None else objects.filter(pk__gt=last_pk))[:chunk_size])
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1].pk
+
+
+def get_attempt_stats(user_ids, **filters):
+    """
+    Counts of the AttemptLogs of a set of users, with their first and last timestamps, in a single grouped query.
+    :param filters: Further filters on the AttemptLogs, e.g. exercise_id__in.
+    :return: A list of dicts of user (id), exercise_id, context_id, context_type, correct,
+    and the count, timestamp_first and timestamp_last of the AttemptLogs with those values.
+    """
+    return AttemptLog.objects.filter(user__id__in=user_ids, **filters) \
+        .values("user", "exercise_id", "context_id", "context_type", "correct") \
+        .annotate(count=Count("pk"), timestamp_first=Min("timestamp"), timestamp_last=Max("timestamp")) \
+        .order_by()
+
 
 class FacilityResource(ModelResource):
 
@@ -128,6 +180,8 @@ class ParentFacilityUserResource(ModelResource):
 
         # if not facility_user_objects:
         #     raise NotFound("Student not found.")
+        if isinstance(facility_user_objects, QuerySet):
+            facility_user_objects = facility_user_objects.select_related("facility")
         facility_user_dict = {}
         for user in facility_user_objects:
             facility_user_dict[user.id] = user
@@ -135,12 +189,51 @@ class ParentFacilityUserResource(ModelResource):
 
     def create_response(self, request, data, response_class=HttpResponse, **response_kwargs):
         response = super(ParentFacilityUserResource, self).create_response(request, data, response_class=response_class, **response_kwargs)
+        return self._add_csv_filename(request, response)
+
+    def _add_csv_filename(self, request, response):
         # add a suggested download filename if we're replying with a CSV file
         if response["Content-Type"].startswith("text/csv"):
             params = ["%s-%s" % (k,str(v)[0:8]) for (k,v) in request.GET.items() if v and k not in ["format", "limit"]]
             response["Content-Disposition"] = "filename=%s__%s__exported_at-%s.csv" % (request.path.strip("/").split("/")[-1], "__".join(params), datetime.now().strftime("%Y%m%d_%H%M%S"))
         return response
 
+    def get_list(self, request, **kwargs):
+        """
+        Stream CSV exports out in chunks, rather than building the whole export in memory.
+        They're sorted, limited and offset as a page of results would be, and each chunk goes through
+        full_dehydrate and alter_list_data_to_serialize, as the page would.
+        """
+        desired_format = self.determine_format(request)
+        if not desired_format.startswith("text/csv"):
+            return super(ParentFacilityUserResource, self).get_list(request, **kwargs)
+
+        base_bundle = self.build_bundle(request=request)
+        objects = self.obj_get_list(bundle=base_bundle, **self.remove_api_resource_names(kwargs))
+        objects = self.apply_sorting(objects, options=request.GET)
+        paginator = self._meta.paginator_class(request.GET, objects, resource_uri=self.get_resource_uri(), limit=self._meta.limit,
+                                               max_limit=self._meta.max_limit, collection_name=self._meta.collection_name)
+        limit, offset = paginator.get_limit(), paginator.get_offset()
+        if isinstance(objects, QuerySet) and (objects.query.order_by or limit or offset):
+            # Slices (which iter_chunks fetches ordered querysets in) need a total order: the one asked for,
+            # then by primary key, as the whole export is in otherwise.
+            objects = objects.order_by(*(list(objects.query.order_by) + ["pk"]))
+        if limit or offset:
+            objects = objects[offset:offset + limit] if limit else objects[offset:]
+
+        response = StreamingHttpResponse(
+            self._meta.serializer.iter_csv(self._iter_bundle_chunks(request, objects)),
+            content_type=build_content_type(desired_format),
+        )
+        # Resource.dispatch would swap anything that isn't an HttpResponse (as a StreamingHttpResponse isn't)
+        # for an empty 204 response, so hand it straight back to the view instead.
+        raise ImmediateHttpResponse(response=self._add_csv_filename(request, response))
+
+    def _iter_bundle_chunks(self, request, objects):
+        for chunk in iter_chunks(objects):
+            bundles = [self.full_dehydrate(self.build_bundle(obj=obj, request=request), for_list=True) for obj in chunk]
+            yield self.alter_list_data_to_serialize(request, {"objects": bundles})["objects"]
+
 
 class FacilityUserResource(ParentFacilityUserResource):
 
@@ -187,14 +280,26 @@ class TestLogResource(ParentFacilityUserResource):
 
     def obj_get_list(self, bundle, **kwargs):
         self._facility_users = self._get_facility_users(bundle)
-        test_logs = TestLog.objects.filter(user__id__in=self._facility_users.keys())
+        test_logs = TestLog.objects.filter(user__id__in=self._facility_users.keys()).select_related("user")
         # if not test_logs:
         #     raise NotFound("No test logs found.")
         return super(TestLogResource, self).authorized_read_list(test_logs, bundle)
 
     def alter_list_data_to_serialize(self, request, to_be_serialized):
         """Add username, user ID, facility name, and facility ID to responses"""
-        for bundle in to_be_serialized["objects"]:
+        bundles = to_be_serialized["objects"]
+        attempt_timestamps = {}
+        for stats in get_attempt_stats(
+                set(bundle.data["user"].data["id"] for bundle in bundles),
+                context_id__in=set(bundle.data["test"] for bundle in bundles),
+                context_type="test"):
+            first, last = attempt_timestamps.get((stats["user"], stats["context_id"]), (None, None))
+            attempt_timestamps[(stats["user"], stats["context_id"])] = (
+                min(first or stats["timestamp_first"], stats["timestamp_first"]),
+                max(last or stats["timestamp_last"], stats["timestamp_last"]),
+            )
+
+        for bundle in bundles:
             user_id = bundle.data["user"].data["id"]
             user = self._facility_users.get(user_id)
             bundle.data["username"] = user.username
@@ -202,9 +307,7 @@ class TestLogResource(ParentFacilityUserResource):
             bundle.data["facility_name"] = user.facility.name
             bundle.data["facility_id"] = user.facility.id
             bundle.data["is_teacher"] = user.is_teacher
-            attempt_logs = AttemptLog.objects.filter(user=user, context_id=bundle.data["test"], context_type="test")
-            bundle.data["timestamp_first"] = attempt_logs.count() and attempt_logs.aggregate(Min('timestamp'))['timestamp__min'] or None
-            bundle.data["timestamp_last"] = attempt_logs.count() and attempt_logs.aggregate(Max('timestamp'))['timestamp__max'] or None
+            bundle.data["timestamp_first"], bundle.data["timestamp_last"] = attempt_timestamps.get((user_id, bundle.data["test"]), (None, None))
             bundle.data.pop("user")
 
         return to_be_serialized
@@ -227,7 +330,7 @@ class AttemptLogResource(ParentFacilityUserResource):
 
     def obj_get_list(self, bundle, **kwargs):
         self._facility_users = self._get_facility_users(bundle)
-        attempt_logs = AttemptLog.objects.filter(user__id__in=self._facility_users.keys())
+        attempt_logs = AttemptLog.objects.filter(user__id__in=self._facility_users.keys()).select_related("user")
         # if not attempt_logs:
         #     raise NotFound("No attempt logs found.")
         return super(AttemptLogResource, self).authorized_read_list(attempt_logs, bundle)
@@ -251,6 +354,15 @@ class ExerciseLogResource(ParentFacilityUserResource):
 
     _facility_users = None
 
+    NO_ATTEMPT_STATS = {
+        "timestamp_first": None,
+        "timestamp_last": None,
+        "part1_answered": 0,
+        "part1_correct": 0,
+        "part2_attempted": 0,
+        "part2_correct": 0,
+    }
+
     user = fields.ForeignKey(FacilityUserResource, 'user', full=True)
 
     class Meta:
@@ -264,14 +376,30 @@ class ExerciseLogResource(ParentFacilityUserResource):
 
     def obj_get_list(self, bundle, **kwargs):
         self._facility_users = self._get_facility_users(bundle)
-        exercise_logs = ExerciseLog.objects.filter(user__id__in=self._facility_users.keys())
+        exercise_logs = ExerciseLog.objects.filter(user__id__in=self._facility_users.keys()).select_related("user")
         # if not exercise_logs:
         #     raise NotFound("No exercise logs found.")
         return super(ExerciseLogResource, self).authorized_read_list(exercise_logs, bundle)
 
     def alter_list_data_to_serialize(self, request, to_be_serialized):
         """Add username, user ID, facility name, and facility ID to responses"""
-        for bundle in to_be_serialized["objects"]:
+        bundles = to_be_serialized["objects"]
+        attempt_stats = {}
+        for stats in get_attempt_stats(
+                set(bundle.data["user"].data["id"] for bundle in bundles),
+                exercise_id__in=set(bundle.data["exercise_id"] for bundle in bundles),
+                context_type__in=["playlist", "exercise", "exercise_fixedblock", "playlist_fixedblock"]):
+            summary = attempt_stats.setdefault((stats["user"], stats["exercise_id"]), dict(self.NO_ATTEMPT_STATS))
+            if stats["context_type"] in ["playlist", "exercise"]:
+                summary["timestamp_first"] = min(summary["timestamp_first"] or stats["timestamp_first"], stats["timestamp_first"])
+                summary["timestamp_last"] = max(summary["timestamp_last"] or stats["timestamp_last"], stats["timestamp_last"])
+                summary["part1_answered"] += stats["count"]
+                summary["part1_correct"] += stats["count"] if stats["correct"] else 0
+            else:
+                summary["part2_attempted"] += stats["count"]
+                summary["part2_correct"] += stats["count"] if stats["correct"] else 0
+
+        for bundle in bundles:
             user_id = bundle.data["user"].data["id"]
             user = self._facility_users.get(user_id)
             bundle.data["username"] = user.username
@@ -279,13 +407,7 @@ class ExerciseLogResource(ParentFacilityUserResource):
             bundle.data["facility_name"] = user.facility.name
             bundle.data["facility_id"] = user.facility.id
             bundle.data["is_teacher"] = user.is_teacher
-            attempt_logs = AttemptLog.objects.filter(user=user, exercise_id=bundle.data["exercise_id"], context_type__in=["playlist", "exercise"])
-            bundle.data["timestamp_first"] = attempt_logs.count() and attempt_logs.aggregate(Min('timestamp'))['timestamp__min'] or None
-            bundle.data["timestamp_last"] = attempt_logs.count() and attempt_logs.aggregate(Max('timestamp'))['timestamp__max'] or None
-            bundle.data["part1_answered"] = AttemptLog.objects.filter(user=user, exercise_id=bundle.data["exercise_id"], context_type__in=["playlist", "exercise"]).count()
-            bundle.data["part1_correct"] = AttemptLog.objects.filter(user=user, exercise_id=bundle.data["exercise_id"], correct=True, context_type__in=["playlist", "exercise"]).count()
-            bundle.data["part2_attempted"] = AttemptLog.objects.filter(user=user, exercise_id=bundle.data["exercise_id"], context_type__in=["exercise_fixedblock", "playlist_fixedblock"]).count()
-            bundle.data["part2_correct"] = AttemptLog.objects.filter(user=user, exercise_id=bundle.data["exercise_id"], correct=True, context_type__in=["exercise_fixedblock", "playlist_fixedblock"]).count()
+            bundle.data.update(attempt_stats.get((user_id, bundle.data["exercise_id"]), self.NO_ATTEMPT_STATS))
             bundle.data.pop("user")
 
         return to_be_serialized
@@ -313,11 +435,16 @@ class DeviceLogResource(ParentFacilityUserResource):
 
     def alter_list_data_to_serialize(self, request, to_be_serialized):
         """Add number of syncs and last sync to response"""
-        for bundle in to_be_serialized["objects"]:
-            all_sessions = SyncSession.objects.filter(client_device__id=bundle.data.get("id"))
-            last_sync = "Never" if not all_sessions else all_sessions.order_by("-timestamp")[0].timestamp
-            bundle.data["last_sync"] = last_sync
-            bundle.data["total_sync_sessions"] = len(all_sessions)
+        bundles = to_be_serialized["objects"]
+        sync_stats = dict((stats["client_device"], stats) for stats in SyncSession.objects
+            .filter(client_device__id__in=[bundle.data.get("id") for bundle in bundles])
+            .values("client_device")
+            .annotate(total_sync_sessions=Count("pk"), last_sync=Max("timestamp"))
+            .order_by())
+        for bundle in bundles:
+            stats = sync_stats.get(bundle.data.get("id"), {})
+            bundle.data["last_sync"] = stats.get("last_sync") or "Never"
+            bundle.data["total_sync_sessions"] = stats.get("total_sync_sessions", 0)
 
         return to_be_serialized
 
@@ -338,7 +465,7 @@ class ContentRatingExportResource(ParentFacilityUserResource):
 
     def obj_get_list(self, bundle, **kwargs):
         self._facility_users = self._get_facility_users(bundle)
-        content_ratings = ContentRating.objects.filter(user__id__in=self._facility_users.keys())
+        content_ratings = ContentRating.objects.filter(user__id__in=self._facility_users.keys()).select_related("user")
         return super(ContentRatingExportResource, self).authorized_read_list(content_ratings, bundle)
 
 
@@ -11,25 +11,31 @@ class CSVSerializer(Serializer):
     }
 
     def to_csv(self, data, options=None):
+        return "".join(self.iter_csv([data.get("objects") or []], options))
+
+    def iter_csv(self, chunks, options=None):
+        """
+        Serialize an iterable of lists of objects to CSV, yielding the text for each list as it is written,
+        so that a large export never needs to be held in memory as a whole.
+        The columns are those of the first object.
+        """
         options = options or {}
-        data = self.to_simple(data, options)
         raw_data = StringIO.StringIO()
-
-        objects = data.get("objects")
-        if not objects:
+        writer = csv.writer(raw_data)
+        header = None
+
+        for objects in chunks:
+            for item in self.to_simple(objects, options):
+                if header is None:
+                    header = item.keys()
+                    writer.writerow(header)
+                writer.writerow([item.get(key) for key in header])
+            if raw_data.tell():
+                yield raw_data.getvalue()
+                raw_data.seek(0)
+                raw_data.truncate()
+
+        if header is None:
             empty_file = [""]
-            writer = csv.writer(raw_data, empty_file)
             writer.writerow(empty_file)
-            raw_data.seek(0)
-            return raw_data.read()  
-
-
-        header = objects[0].keys()
-        writer = csv.writer(raw_data, header)
-        writer.writerow(header)
-
-        for item in objects:
-            writer.writerow(item.values())
-
-        raw_data.seek(0)
-        return raw_data.read()
+            yield raw_data.getvalue()
@@ -1,10 +1,16 @@
+import csv
+import datetime
 import json
+import StringIO
 
 from django.conf import settings
 from django.test.utils import override_settings
 
 from selenium.common.exceptions import NoSuchElementException
 
+from kalite.control_panel.api_resources import iter_chunks
+from kalite.control_panel.views import _get_user_usage_data
+from kalite.main.models import AttemptLog, ExerciseLog, VideoLog
 from kalite.testing.base import KALiteBrowserTestCase, KALiteClientTestCase, KALiteTestCase
 
 from kalite.testing.mixins.browser_mixins import BrowserActionMixins
@@ -401,6 +407,9 @@ class CSVExportTestSetup(FacilityMixins,
 
 class CSVExportAPITests(CSVExportTestSetup, KALiteClientTestCase):
 
+    def get_csv(self, url):
+        return "".join(self.client.get(url).streaming_content)
+
     def test_api_auth_super_admin(self):
         # Super admin can access everything
         self.client.login(username='admin', password='admin')
@@ -496,12 +505,12 @@ class CSVExportAPITests(CSVExportTestSetup, KALiteClientTestCase):
     def test_facility_user_csv_endpoint(self):
         # Test filtering by facility
         self.client.login(username='admin', password='admin')
-        facility_filtered_resp = self.client.get(self.api_facility_user_csv_url + "?facility_id=" + self.facility.id + "&format=csv").content
+        facility_filtered_resp = self.get_csv(self.api_facility_user_csv_url + "?facility_id=" + self.facility.id + "&format=csv")
         rows = filter(None, facility_filtered_resp.split("\n"))
         self.assertEqual(len(rows), 4, "API response incorrect")
 
         # Test filtering by group
-        group_filtered_resp = self.client.get(self.api_facility_user_csv_url + "?group_id=" + self.group.id + "&format=csv").content
+        group_filtered_resp = self.get_csv(self.api_facility_user_csv_url + "?group_id=" + self.group.id + "&format=csv")
         rows = filter(None, group_filtered_resp.split("\n"))
         self.assertEqual(len(rows), 2, "API response incorrect")
         self.client.logout()
@@ -510,12 +519,12 @@ class CSVExportAPITests(CSVExportTestSetup, KALiteClientTestCase):
     def test_test_log_csv_endpoint(self):
         # Test filtering by facility
         self.client.login(username='admin', password='admin')
-        facility_filtered_resp = self.client.get(self.api_test_log_csv_url + "?facility_id=" + self.facility.id + "&format=csv").content
+        facility_filtered_resp = self.get_csv(self.api_test_log_csv_url + "?facility_id=" + self.facility.id + "&format=csv")
         rows = filter(None, facility_filtered_resp.split("\n"))
         self.assertEqual(len(rows), 3, "API response incorrect")
 
         # Test filtering by group
-        group_filtered_resp = self.client.get(self.api_test_log_csv_url + "?group_id=" + self.group.id + "&format=csv").content
+        group_filtered_resp = self.get_csv(self.api_test_log_csv_url + "?group_id=" + self.group.id + "&format=csv")
         rows = filter(None, group_filtered_resp.split("\n"))
         self.assertEqual(len(rows), 2, "API response incorrect")
         self.client.logout()
@@ -524,12 +533,12 @@ class CSVExportAPITests(CSVExportTestSetup, KALiteClientTestCase):
     def test_device_log_csv_endpoint(self):
         # Test filtering by facility
         self.client.login(username='admin', password='admin')
-        facility_filtered_resp = self.client.get(self.api_exercise_log_csv_url + "?facility_id=" + self.facility.id + "&format=csv").content
+        facility_filtered_resp = self.get_csv(self.api_exercise_log_csv_url + "?facility_id=" + self.facility.id + "&format=csv")
         rows = filter(None, facility_filtered_resp.split("\n"))
         self.assertEqual(len(rows), 3, "API response incorrect")
 
         # Test filtering by group
-        group_filtered_resp = self.client.get(self.api_exercise_log_csv_url + "?group_id=" + self.group.id + "&format=csv").content
+        group_filtered_resp = self.get_csv(self.api_exercise_log_csv_url + "?group_id=" + self.group.id + "&format=csv")
         rows = filter(None, group_filtered_resp.split("\n"))
         self.assertEqual(len(rows), 2, "API response incorrect")
         self.client.logout()
@@ -538,12 +547,12 @@ class CSVExportAPITests(CSVExportTestSetup, KALiteClientTestCase):
     def test_attempt_log_csv_endpoint(self):
         # Test filtering by facility
         self.client.login(username='admin', password='admin')
-        facility_filtered_resp = self.client.get(self.api_attempt_log_csv_url + "?facility_id=" + self.facility.id + "&format=csv").content
+        facility_filtered_resp = self.get_csv(self.api_attempt_log_csv_url + "?facility_id=" + self.facility.id + "&format=csv")
         rows = filter(None, facility_filtered_resp.split("\n"))
         self.assertEqual(len(rows), 3, "API response incorrect")
 
         # Test filtering by group
-        group_filtered_resp = self.client.get(self.api_attempt_log_csv_url + "?group_id=" + self.group.id + "&format=csv").content
+        group_filtered_resp = self.get_csv(self.api_attempt_log_csv_url + "?group_id=" + self.group.id + "&format=csv")
         rows = filter(None, group_filtered_resp.split("\n"))
         self.assertEqual(len(rows), 2, "API response incorrect")
         self.client.logout()
@@ -552,10 +561,46 @@ class CSVExportAPITests(CSVExportTestSetup, KALiteClientTestCase):
     def test_device_log_csv_endpoint(self):
         # Test filtering by zone
         self.client.login(username='admin', password='admin')
-        zone_filtered_resp = self.client.get(self.api_device_log_csv_url + "?zone_id=" + self.zone.id + "&format=csv").content
+        zone_filtered_resp = self.get_csv(self.api_device_log_csv_url + "?zone_id=" + self.zone.id + "&format=csv")
         rows = filter(None, zone_filtered_resp.split("\n"))
         self.assertEqual(len(rows), 2, "API response incorrect")
 
+    def test_exercise_log_csv_attempt_stats(self):
+        exercise_id = self.exercise_log_1.exercise_id
+        for context_type, correct in [("exercise", True), ("exercise", False), ("playlist", True), ("exercise_fixedblock", True)]:
+            AttemptLog.objects.create(user=self.stu1, exercise_id=exercise_id, context_type=context_type, correct=correct,
+                                      timestamp=datetime.datetime.now())
+
+        self.client.login(username='admin', password='admin')
+        resp = self.get_csv(self.api_exercise_log_csv_url + "?group_id=" + self.group.id + "&format=csv")
+        rows = list(csv.DictReader(StringIO.StringIO(resp)))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["username"], "stu1")
+        self.assertEqual([rows[0][key] for key in ["part1_answered", "part1_correct", "part2_attempted", "part2_correct"]], ["3", "2", "1", "1"])
+        self.assertTrue(rows[0]["timestamp_first"])
+        self.client.logout()
+
+    def test_iter_chunks(self):
+        self.assertEqual([len(chunk) for chunk in iter_chunks(ExerciseLog.objects.all(), chunk_size=1)], [1, 1])
+        self.assertEqual([len(chunk) for chunk in iter_chunks(ExerciseLog.objects.all(), chunk_size=2)], [2])
+        self.assertEqual(list(iter_chunks(ExerciseLog.objects.none())), [])
+        self.assertEqual(list(iter_chunks(range(5), chunk_size=2)), [[0, 1], [2, 3], [4]])
+
+    def test_iter_chunks_ordered(self):
+        logs = ExerciseLog.objects.order_by("-pk")
+        self.assertEqual([log.pk for chunk in iter_chunks(logs, chunk_size=1) for log in chunk], [log.pk for log in logs])
+        self.assertEqual([len(chunk) for chunk in iter_chunks(ExerciseLog.objects.order_by("pk")[1:], chunk_size=1)], [1])
+
+    def test_exercise_log_csv_limit_and_offset(self):
+        self.client.login(username='admin', password='admin')
+        url = self.api_exercise_log_csv_url + "?facility_id=" + self.facility.id + "&format=csv"
+        usernames = [row["username"] for row in csv.DictReader(StringIO.StringIO(self.get_csv(url)))]
+        self.assertEqual(len(usernames), 2)
+        for params, expected in [("&limit=1", usernames[:1]), ("&offset=1", usernames[1:]), ("&limit=1&offset=1", usernames[1:])]:
+            rows = list(csv.DictReader(StringIO.StringIO(self.get_csv(url + params))))
+            self.assertEqual([row["username"] for row in rows], expected)
+        self.client.logout()
+
 
 # class CSVExportBrowserTests(CSVExportTestSetup, BrowserActionMixins, CreateAdminMixin, KALiteBrowserTestCase):
 
@@ -614,3 +659,33 @@ class CSVExportAPITests(CSVExportTestSetup, KALiteClientTestCase):
 #         # note: not actually clicking the download since selenium cannot handle file save dialogs
 #         export = self.browser.find_element_by_id("export-button")
 #         self.assertTrue(export.is_enabled(), "UI error")
+
+
+class UserUsageDataTests(FacilityMixins, KALiteTestCase):
+
+    def setUp(self):
+        super(UserUsageDataTests, self).setUp()
+        self.facility = self.create_facility()
+        self.student = self.create_student(facility=self.facility)
+
+        day = datetime.datetime(2015, 3, 10, 12)
+        ExerciseLog(user=self.student, exercise_id="mastered", streak_progress=100, complete=True, latest_activity_timestamp=day).save()
+        ExerciseLog(user=self.student, exercise_id="attempted", streak_progress=50, latest_activity_timestamp=day).save()
+        ExerciseLog(user=self.student, exercise_id="mastered-before", streak_progress=100, complete=True, completion_timestamp=day - datetime.timedelta(days=5)).save()
+        VideoLog(user=self.student, video_id="watched", youtube_id="watched", total_seconds_watched=10, latest_activity_timestamp=day).save()
+
+    def usage(self, **kwargs):
+        user_data, group_data = _get_user_usage_data([self.student], content_ids=True, **kwargs)
+        return user_data[self.student.pk]
+
+    def test_content_ids(self):
+        usage = self.usage(period_start="2015-03-10", period_end="2015-03-10")
+        self.assertEqual(usage["exercises_mastered"], ["mastered"])
+        self.assertEqual(usage["exercises_completed"], 1)
+        self.assertEqual(usage["videos_watched"], ["watched"])
+        self.assertEqual(usage["total_videos"], 1)
+
+    def test_content_ids_over_all_time(self):
+        usage = self.usage()
+        self.assertEqual(sorted(usage["exercises_mastered"]), ["mastered", "mastered-before"])
+        self.assertEqual(usage["exercises_completed"], 2)
@@ -1,7 +1,8 @@
 """
 """
 import datetime
-import dateutil
+import dateutil.parser
+import operator
 import re
 import os
 from annoying.decorators import render_to
@@ -29,7 +30,7 @@ from kalite.facility.utils import get_users_from_group
 from kalite.facility.decorators import facility_required
 from kalite.facility.forms import FacilityForm
 from kalite.facility.models import Facility, FacilityUser, FacilityGroup
-from kalite.main.models import ExerciseLog, VideoLog, UserLog, UserLogSummary
+from kalite.main.models import ExerciseLog, UserDailyUsage, UserLog, UserLogSummary, VideoLog
 from kalite.shared.decorators.auth import require_authorized_admin, require_authorized_access_to_student_data
 from kalite.version import VERSION, VERSION_INFO
 
@@ -296,7 +297,7 @@ def facility_management_csv(request, facility, group_id=None, zone_id=None, freq
     # coaches = get_users_from_group(user_type="coaches", group_id=group_id, facility=facility)
     students = get_users_from_group(user_type="students", group_id=group_id, facility=facility)
 
-    (student_data, group_data) = _get_user_usage_data(students, groups, group_id=group_id, period_start=period_start, period_end=period_end)
+    (student_data, group_data) = _get_user_usage_data(students, groups, group_id=group_id, period_start=period_start, period_end=period_end, content_ids=True)
     # (coach_data, coach_group_data) = _get_user_usage_data(coaches, period_start=period_start, period_end=period_end)
 
     context.update({
@@ -428,9 +429,59 @@ def _get_date_range(frequency, period_start, period_end):
     return (period_start, period_end)
 
 
-def _get_user_usage_data(users, groups=None, period_start=None, period_end=None, group_id=None):
+def _get_date(value):
+    """A date from a date, a datetime or a date string (as entered into a DateRangeForm)."""
+    if isinstance(value, basestring):
+        value = dateutil.parser.parse(value)
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+def _get_day_filter(fields, period_start=None, period_end=None):
+    """
+    Q object selecting the logs counted on a day within the given date range by their get_daily_usage(),
+    which places them on the day of the first of `fields` that is set.
+    """
+    bounds = {}
+    if period_start:
+        bounds["__gte"] = datetime.datetime.combine(period_start, datetime.time())
+    if period_end:
+        bounds["__lt"] = datetime.datetime.combine(period_end + datetime.timedelta(days=1), datetime.time())
+    if not bounds:
+        return Q()
+    conditions = []
+    for idx, field in enumerate(fields):
+        # placed by this field when none of the ones before it are set
+        condition = dict((earlier + "__isnull", True) for earlier in fields[:idx])
+        condition.update((field + lookup, value) for lookup, value in bounds.iteritems())
+        conditions.append(Q(**condition))
+    return reduce(operator.or_, conditions)
+
+
+def _get_user_content_ids(users, period_start=None, period_end=None):
+    """
+    The ids of the exercises mastered and the videos watched by each user, on the days counted
+    in their UserDailyUsage over the given date range.
+    :return: Dicts of user id to list of exercise ids, and of user id to list of video ids.
+    """
+    exercises_mastered = {}
+    exercise_logs = ExerciseLog.objects.filter(user__in=users, complete=True) \
+        .filter(_get_day_filter(["latest_activity_timestamp", "completion_timestamp"], period_start, period_end))
+    for user_id, exercise_id in exercise_logs.values_list("user", "exercise_id"):
+        exercises_mastered.setdefault(user_id, []).append(exercise_id)
+
+    videos_watched = {}
+    video_logs = VideoLog.objects.filter(user__in=users, total_seconds_watched__gt=0) \
+        .filter(_get_day_filter(["completion_timestamp", "latest_activity_timestamp"], period_start, period_end))
+    for user_id, video_id in video_logs.values_list("user", "video_id"):
+        videos_watched.setdefault(user_id, []).append(video_id)
+
+    return exercises_mastered, videos_watched
+
+
+def _get_user_usage_data(users, groups=None, period_start=None, period_end=None, group_id=None, content_ids=False):
     """
     Returns facility user data, within the given date range.
+    With content_ids, also lists the ids of the exercises mastered and videos watched by each user (as in the CSV export).
     """
 
     groups = groups or set([user.group for user in users])
@@ -440,45 +491,14 @@ def _get_user_usage_data(users, groups=None, period_start=None, period_end=None,
     user_data = OrderedDict()
     group_data = OrderedDict()
 
-    # Make queries efficiently
-    exercise_logs = ExerciseLog.objects.filter(user__in=users)
-    video_logs = VideoLog.objects.filter(user__in=users, total_seconds_watched__gt=0)
-    login_logs = UserLogSummary.objects.filter(user__in=users)
-
-    # filter results
-    login_logs = login_logs.filter(total_seconds__gte=0)
-    if period_start:
-        exercise_logs = exercise_logs.filter(
-            completion_timestamp__gte=period_start)
-        video_logs = video_logs.filter(latest_activity_timestamp__gte=period_start)
-    if period_end:
-        # MUST: Fix the midnight bug where period end covers up to the prior day only because
-        # period end is datetime(year, month, day, hour=0, minute=0), meaning midnight of previous day.
-        # Example:
-        #   If period_end == '2014-12-01', we cannot include the records dated '2014-12-01 09:30'.
-        #   So to fix this, we change it to '2014-12-01 23:59.999999'.
-        period_end = dateutil.parser.parse(period_end)
-        period_end = period_end + dateutil.relativedelta.relativedelta(days=+1, microseconds=-1)
-        exercise_logs = exercise_logs.filter(latest_activity_timestamp__lte=period_end)
-        video_logs = video_logs.filter(completion_timestamp__lte=period_end)
-    if period_start and period_end:
-        exercise_logs = exercise_logs.filter(Q(latest_activity_timestamp__gte=period_start) &
-                                             Q(latest_activity_timestamp__lte=period_end))
-
-        q1 = Q(completion_timestamp__isnull=False) & \
-            Q(completion_timestamp__gte=period_start) & \
-            Q(completion_timestamp__lte=period_end)
-        video_logs = video_logs.filter(q1)
-
-        login_q1 = Q(start_datetime__gte=period_start) & Q(start_datetime__lte=period_end) & \
-            Q(end_datetime__gte=period_start) & Q(end_datetime__lte=period_end)
-        login_logs = login_logs.filter(login_q1)
-    # Force results in a single query
-    exercise_logs = list(exercise_logs.values("exercise_id", "user__pk", "streak_progress", "complete"))
-    video_logs = list(video_logs.values("video_id", "user__pk"))
-    login_logs = list(login_logs.values("activity_type", "total_seconds", "user__pk", "count"))
+    # Sum up the usage over the days of the period, rather than going over all the logs
+    period_start, period_end = _get_date(period_start), _get_date(period_end)
+    usage = UserDailyUsage.get_usage_for_users(users, period_start=period_start, period_end=period_end)
+    if content_ids:
+        exercises_mastered, videos_watched = _get_user_content_ids(users, period_start=period_start, period_end=period_end)
 
     for user in users:
+        user_usage = usage.get(user.pk, {})
         user_data[user.pk] = OrderedDict()
         user_data[user.pk]["id"] = user.pk
         user_data[user.pk]["first_name"] = user.first_name
@@ -486,36 +506,19 @@ def _get_user_usage_data(users, groups=None, period_start=None, period_end=None,
         user_data[user.pk]["username"] = user.username
         user_data[user.pk]["group"] = user.group
 
-        user_data[user.pk]["total_report_views"] = 0  # report_stats["count__sum"] or 0
-        user_data[user.pk]["total_logins"] = 0  # login_stats["count__sum"] or 0
-        user_data[user.pk]["total_hours"] = 0  # login_stats["total_seconds__sum"] or 0)/3600.
-
-        user_data[user.pk]["total_exercises"] = 0
-        user_data[user.pk]["exercises_completed"] = 0
-        user_data[user.pk]["pct_mastery"] = 0.
-        user_data[user.pk]["exercises_mastered"] = []
-
-        user_data[user.pk]["total_videos"] = 0
-        user_data[user.pk]["videos_watched"] = []
-
-
-    for elog in exercise_logs:
-        user_data[elog["user__pk"]]["pct_mastery"] += elog["streak_progress"]
-        user_data[elog["user__pk"]]["total_exercises"] += 1
-        if elog["complete"]:
-            user_data[elog["user__pk"]]["exercises_completed"] += 1
-            user_data[elog["user__pk"]]["exercises_mastered"].append(elog["exercise_id"])
+        user_data[user.pk]["total_report_views"] = user_usage.get("report_views", 0)
+        user_data[user.pk]["total_logins"] = user_usage.get("logins", 0)
+        user_data[user.pk]["total_hours"] = user_usage.get("login_seconds", 0) / 3600.
 
-    for vlog in video_logs:
-        user_data[vlog["user__pk"]]["total_videos"] += 1
-        user_data[vlog["user__pk"]]["videos_watched"].append(vlog["video_id"])
+        user_data[user.pk]["total_exercises"] = user_usage.get("exercises_attempted", 0)
+        user_data[user.pk]["exercises_completed"] = user_usage.get("exercises_mastered", 0)
+        user_data[user.pk]["pct_mastery"] = float(user_usage.get("mastery_sum", 0))
+        if content_ids:
+            user_data[user.pk]["exercises_mastered"] = exercises_mastered.get(user.pk, [])
 
-    for llog in login_logs:
-        if llog["activity_type"] == UserLog.get_activity_int("coachreport"):
-            user_data[llog["user__pk"]]["total_report_views"] += 1
-        elif llog["activity_type"] == UserLog.get_activity_int("login"):
-            user_data[llog["user__pk"]]["total_hours"] += (llog["total_seconds"]) / 3600.
-            user_data[llog["user__pk"]]["total_logins"] += llog["count"]
+        user_data[user.pk]["total_videos"] = user_usage.get("videos_watched", 0)
+        if content_ids:
+            user_data[user.pk]["videos_watched"] = videos_watched.get(user.pk, [])
 
     for group in list(groups) + [None] * (group_id == None or group_id == UNGROUPED):  # None for ungrouped, if no group_id passed.
         group_pk = getattr(group, "pk", None)
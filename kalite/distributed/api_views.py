@@ -24,7 +24,7 @@ from fle_utils.internet.decorators import api_handle_error_with_json
 from fle_utils.internet.classes import JsonResponse, JsonResponseMessage, JsonResponseMessageError
 from fle_utils.testing.decorators import allow_api_profiling
 from kalite import version
-from kalite.main.models import ExerciseLog, VideoLog, ContentLog
+from kalite.main.models import UserPoints
 from kalite.shared.decorators.auth import require_admin
 
 
@@ -35,9 +35,7 @@ def compute_total_points(user):
     if user.is_teacher:
         return None
     else:
-        return (VideoLog.get_points_for_user(user) +
-                ExerciseLog.get_points_for_user(user) +
-                ContentLog.get_points_for_user(user))
+        return UserPoints.get_points_for_user(user)
 
 
 def get_messages_for_api_calls(request):
@@ -10,6 +10,8 @@ import django
 from django.conf import settings
 from django.core.handlers.wsgi import WSGIHandler
 
+from kalite.distributed.contentserver import ContentFileApp
+
 __all__ = ['DjangoAppPlugin']
 
 # Due to #5140 (Windows XP doesn't know SVG), so we had to add this.
@@ -108,6 +110,11 @@ WELL_KNOWN_CONTENT_TYPES = {
     "htc": "text/x-component",
 }
 
+# Videos (and their thumbnails) are only ever replaced by the same file, so browsers
+# can keep them (a year) without asking again.
+CONTENT_MAX_AGE = 365 * 24 * 60 * 60
+
+
 class DjangoAppPlugin(plugins.SimplePlugin):
     def __init__(self, bus):
         """ CherryPy engine plugin to configure and mount
@@ -119,7 +126,8 @@ class DjangoAppPlugin(plugins.SimplePlugin):
         """ When the bus starts, the plugin is also started
         and we load the Django application. We then mount it on
         the CherryPy engine for serving as a WSGI application.
-        We let CherryPy serve the application's static files.
+        We let CherryPy serve the application's static files (see
+        kalite.distributed.contentserver).
         """
         cherrypy.log("Loading and serving the Django application")
         cherrypy.tree.graft(WSGIHandler())
@@ -128,59 +136,23 @@ class DjangoAppPlugin(plugins.SimplePlugin):
         if getattr(settings, "CONTENT_ROOT", None):
             # Assessment items
             from kalite.contentload.settings import ASSESSMENT_ITEM_ROOT
-            static_handler = cherrypy.tools.staticdir.handler(
-                section="/",
-                dir="",
-                root=os.path.abspath(ASSESSMENT_ITEM_ROOT),
-                content_types=WELL_KNOWN_CONTENT_TYPES,
-            )
-            cherrypy.tree.mount(static_handler, settings.CONTENT_URL + "assessment/",)
+            cherrypy.tree.graft(ContentFileApp(ASSESSMENT_ITEM_ROOT, WELL_KNOWN_CONTENT_TYPES), settings.CONTENT_URL + "assessment/")
 
             # Video content items
-            static_handler = cherrypy.tools.staticdir.handler(
-                section="/",
-                dir=os.path.split(settings.CONTENT_ROOT)[1],
-                root=os.path.abspath(os.path.split(settings.CONTENT_ROOT)[0]),
-                content_types=WELL_KNOWN_CONTENT_TYPES,
-            )
-            cherrypy.tree.mount(static_handler, settings.CONTENT_URL)
+            cherrypy.tree.graft(ContentFileApp(settings.CONTENT_ROOT, WELL_KNOWN_CONTENT_TYPES, max_age=CONTENT_MAX_AGE), settings.CONTENT_URL)
 
         # Serve the static media files
-        static_handler = cherrypy.tools.staticdir.handler(
-            section="/",
-            dir=os.path.split(settings.MEDIA_ROOT)[1],
-            root=os.path.abspath(os.path.split(settings.MEDIA_ROOT)[0]),
-            content_types=WELL_KNOWN_CONTENT_TYPES,
-        )
-        cherrypy.tree.mount(static_handler, settings.MEDIA_URL)
+        cherrypy.tree.graft(ContentFileApp(settings.MEDIA_ROOT, WELL_KNOWN_CONTENT_TYPES), settings.MEDIA_URL)
 
         # Serve the static files
-        static_handler = cherrypy.tools.staticdir.handler(
-            section="/",
-            dir=os.path.split(settings.STATIC_ROOT)[1],
-            root=os.path.abspath(os.path.split(settings.STATIC_ROOT)[0]),
-            content_types=WELL_KNOWN_CONTENT_TYPES,
-        )
-        cherrypy.tree.mount(static_handler, settings.STATIC_URL)
+        cherrypy.tree.graft(ContentFileApp(settings.STATIC_ROOT, WELL_KNOWN_CONTENT_TYPES), settings.STATIC_URL)
 
         # Serve the static files
-        static_handler = cherrypy.tools.staticdir.handler(
-            section="/",
-            dir=os.path.split(settings.CONTENT_DATA_PATH)[1],
-            root=os.path.abspath(os.path.split(settings.CONTENT_DATA_PATH)[0]),
-            content_types=WELL_KNOWN_CONTENT_TYPES,
-        )
-        cherrypy.tree.mount(static_handler, settings.CONTENT_DATA_URL)
+        cherrypy.tree.graft(ContentFileApp(settings.CONTENT_DATA_PATH, WELL_KNOWN_CONTENT_TYPES), settings.CONTENT_DATA_URL)
 
         # Serve the static admin media. From django's internal (django.core.servers.basehttp)
-        admin_static_dir = os.path.join(django.__path__[0], 'contrib', 'admin', 'static')
-        admin_static_handler = cherrypy.tools.staticdir.handler(
-            section='/',
-            dir='admin',
-            root=admin_static_dir,
-            content_types=WELL_KNOWN_CONTENT_TYPES,
-        )
-        cherrypy.tree.mount(admin_static_handler, urlparse.urljoin(settings.STATIC_URL, 'admin'))
+        admin_static_dir = os.path.join(django.__path__[0], 'contrib', 'admin', 'static', 'admin')
+        cherrypy.tree.graft(ContentFileApp(admin_static_dir, WELL_KNOWN_CONTENT_TYPES), urlparse.urljoin(settings.STATIC_URL, 'admin'))
 
     def load_settings(self):
         """ Loads the Django application's settings. You can
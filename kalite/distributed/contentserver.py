@@ -0,0 +1,399 @@
+"""
+Serving the content files (videos, above all) from `kalite start`, so that a classroom watching
+videos doesn't leave the rest of KA Lite unresponsive.
+
+* ContentFileApp is a WSGI app serving the files under a directory, with strong ETags and
+  Last-Modified (so browsers revalidate them with 304s), optionally a long Cache-Control,
+  and single byte Range requests (which is how browsers seek in videos), including If-Range.
+* StreamingWSGIServer is CherryPy's WSGI server, but the bodies of ContentFileApp's responses
+  are sent by a pool of stream threads of their own (server.stream_thread_pool), with sendfile
+  where there is one, rather than read in Python by the request threads that serve the API
+  (server.thread_pool).  Once a response is sent, its (kept alive) connection goes back to the
+  request threads, for its next request.
+"""
+import ctypes
+import ctypes.util
+import errno
+import mimetypes
+import os
+import Queue
+import select
+import socket
+import stat
+import sys
+import threading
+import time
+
+import cherrypy
+from cherrypy._cpwsgi_server import CPWSGIServer
+from cherrypy.lib.httputil import get_ranges
+from cherrypy.wsgiserver import HTTPConnection, WSGIGateway_10
+from cherrypy.wsgiserver.wsgiserver2 import socket_errors_to_ignore
+
+from django.utils.http import http_date, parse_http_date_safe
+
+__all__ = ['ContentFileApp', 'FileRange', 'StreamingWSGIServer', 'send_file_range']
+
+# How many bytes to send with each sendfile (or read and send, without it)
+BLOCK_SIZE = 256 * 1024
+
+
+def _load_sendfile():
+    """sendfile(out_fd, in_fd, offset, count), from pysendfile if it's installed, else libc's on Linux, else None."""
+    try:
+        from sendfile import sendfile
+        return sendfile
+    except ImportError:
+        pass
+
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        # The 64-bit offset one, which is there on 32-bit systems too
+        libc_sendfile = libc.sendfile64
+    except (OSError, AttributeError):
+        return None
+    libc_sendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+    libc_sendfile.restype = ctypes.c_ssize_t
+
+    def sendfile(out_fd, in_fd, offset, count):
+        sent = libc_sendfile(out_fd, in_fd, ctypes.byref(ctypes.c_int64(offset)), count)
+        if sent < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return sent
+    return sendfile
+
+sendfile = _load_sendfile()
+
+
+class FileRange(object):
+    """
+    A WSGI response body of length bytes of file, from offset.  StreamingWSGIServer sends it
+    with sendfile; to any other server, it's an iterable of the bytes, as usual.
+    """
+
+    def __init__(self, file, offset, length):
+        self.file = file
+        self.offset = offset
+        self.length = length
+
+    def __iter__(self):
+        self.file.seek(self.offset)
+        remaining = self.length
+        while remaining:
+            data = self.file.read(min(remaining, BLOCK_SIZE))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+    def close(self):
+        self.file.close()
+
+
+def send_file_range(sock, file_range):
+    """Sends file_range on sock (connected, and maybe with a timeout), with sendfile if there is one."""
+    if sendfile is None:
+        for data in file_range:
+            sock.sendall(data)
+        return
+
+    offset, remaining = file_range.offset, file_range.length
+    while remaining:
+        try:
+            sent = sendfile(sock.fileno(), file_range.file.fileno(), offset, min(remaining, BLOCK_SIZE))
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise socket.error(e.errno, e.strerror)
+            # A socket with a timeout is non-blocking underneath: wait for it as sendall would.
+            if not select.select([], [sock], [], sock.gettimeout())[1]:
+                raise socket.timeout("timed out")
+            continue
+        if not sent:
+            raise IOError("%s ended before the %d bytes to send from it" % (file_range.file.name, file_range.length))
+        offset += sent
+        remaining -= sent
+
+
+class ContentFileApp(object):
+    """
+    WSGI app serving the files under root (by their path below where it's mounted), for GET and HEAD.
+
+    :param content_types: A dict of file extension (no dot) to the Content-Type to serve it as,
+        before the mimetypes module's.
+    :param max_age: If not None, how many seconds browsers can keep the files without revalidating
+        them, for files that never change.
+    """
+
+    def __init__(self, root, content_types=None, max_age=None):
+        root = os.path.abspath(root)
+        if not isinstance(root, unicode):
+            root = root.decode(sys.getfilesystemencoding() or "utf-8")
+        self.root = root
+        self.content_types = content_types or {}
+        self.max_age = max_age
+
+    def __call__(self, environ, start_response):
+        method = environ["REQUEST_METHOD"]
+        if method not in ("GET", "HEAD"):
+            return self.simple_response(start_response, "405 Method Not Allowed", [("Allow", "GET, HEAD")])
+
+        path = self.get_path(environ.get("PATH_INFO", ""))
+        if path is None:
+            return self.simple_response(start_response, "403 Forbidden")
+        try:
+            f = open(path, "rb")
+        except IOError:
+            return self.simple_response(start_response, "404 Not Found")
+
+        try:
+            st = os.fstat(f.fileno())
+            if not stat.S_ISREG(st.st_mode):
+                f.close()
+                return self.simple_response(start_response, "404 Not Found")
+
+            mtime, size = int(st.st_mtime), st.st_size
+            etag = '"%x-%x"' % (mtime, size)
+            headers = [
+                ("Accept-Ranges", "bytes"),
+                ("ETag", etag),
+                ("Last-Modified", str(http_date(mtime))),
+            ]
+            if self.max_age is not None:
+                headers.append(("Cache-Control", "public, max-age=%d" % self.max_age))
+
+            if self.is_not_modified(environ, etag, mtime):
+                f.close()
+                start_response("304 Not Modified", headers)
+                return []
+
+            headers.append(("Content-Type", self.get_content_type(path)))
+            byte_range = self.get_range(environ, etag, mtime, size)
+            if byte_range is None:
+                status, start, stop = "200 OK", 0, size
+            elif not byte_range:
+                f.close()
+                return self.simple_response(start_response, "416 Requested Range Not Satisfiable", [("Content-Range", "bytes */%d" % size)])
+            else:
+                start, stop = byte_range
+                status = "206 Partial Content"
+                headers.append(("Content-Range", "bytes %d-%d/%d" % (start, stop - 1, size)))
+            headers.append(("Content-Length", str(stop - start)))
+        except Exception:
+            f.close()
+            raise
+
+        start_response(status, headers)
+        if method == "HEAD":
+            f.close()
+            return []
+        return FileRange(f, start, stop - start)
+
+    def simple_response(self, start_response, status, headers=[]):
+        start_response(status, headers + [("Content-Type", "text/plain"), ("Content-Length", str(len(status)))])
+        return [status]
+
+    def get_path(self, path_info):
+        """The file's path, for the PATH_INFO of a request for it, or None if that's outside root."""
+        try:
+            path_info = path_info.decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+        path = os.path.normpath(os.path.join(self.root, path_info.lstrip("/")))
+        if path != self.root and not path.startswith(self.root.rstrip(os.sep) + os.sep):
+            return None
+        return path
+
+    def get_content_type(self, path):
+        ext = os.path.splitext(path)[1].lower()
+        return self.content_types.get(ext[1:]) or mimetypes.types_map.get(ext) or "application/octet-stream"
+
+    def is_not_modified(self, environ, etag, mtime):
+        if_none_match = environ.get("HTTP_IF_NONE_MATCH")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags or "W/" + etag in tags
+        if_modified_since = parse_http_date_safe(environ.get("HTTP_IF_MODIFIED_SINCE"))
+        return if_modified_since is not None and mtime <= if_modified_since
+
+    def get_range(self, environ, etag, mtime, size):
+        """
+        The (start, stop) of the range of the file to serve, [] if the range requested can't be
+        served, or None to serve the whole file: without a Range header, with an If-Range for
+        another version of the file, or for several ranges (which HTTP lets servers ignore).
+        """
+        range_header = environ.get("HTTP_RANGE", "")
+        if not range_header.startswith("bytes="):
+            return None
+        if_range = environ.get("HTTP_IF_RANGE")
+        if if_range is not None and if_range.strip() != etag and parse_http_date_safe(if_range) != mtime:
+            return None
+
+        try:
+            ranges = get_ranges(range_header, size)
+        except ValueError:
+            return None
+        if ranges is None:
+            return None
+        ranges = [(max(start, 0), min(stop, size)) for start, stop in ranges]
+        ranges = [(start, stop) for start, stop in ranges if start < stop]
+        if len(ranges) > 1:
+            return None
+        return ranges[0] if ranges else []
+
+
+class StreamingHTTPConnection(HTTPConnection):
+    """
+    A connection whose FileRange responses are sent by the server's stream threads, once
+    the request thread that read the request lets go of it (by closing it).
+    """
+    file_range = None
+    keep_alive = False
+
+    def close(self):
+        if self.file_range is not None:
+            self.server.streams.put(self)
+        else:
+            HTTPConnection.close(self)
+
+    def stream(self):
+        """Sends the FileRange, then hands the connection back to the request threads, or closes it."""
+        file_range, self.file_range = self.file_range, None
+        try:
+            send_file_range(self.socket, file_range)
+        except Exception as e:
+            self.keep_alive = False
+            # (Clients going away, or stopping reading, are just done with the file.)
+            if not isinstance(e, socket.error) or (e.args and e.args[0] not in socket_errors_to_ignore and not isinstance(e, socket.timeout)):
+                self.server.error_log("Error sending %s: %r" % (file_range.file.name, e), traceback=True)
+        finally:
+            file_range.close()
+
+        if self.keep_alive and self.server.ready:
+            self.server.requests.put(self)
+        else:
+            HTTPConnection.close(self)
+
+    def abort(self):
+        self.file_range.close()
+        self.file_range = None
+        HTTPConnection.close(self)
+
+
+class StreamingWSGIGateway(WSGIGateway_10):
+    """Leaves FileRange responses for the connection's stream thread to send, after sending their headers."""
+
+    def respond(self):
+        response = self.req.server.wsgi_app(self.env, self.start_response)
+        if isinstance(response, FileRange) and self.req.server.ssl_adapter is None:
+            self.stream(response)
+            return
+
+        try:
+            for chunk in response:
+                if chunk:
+                    if isinstance(chunk, unicode):
+                        chunk = chunk.encode("ISO-8859-1")
+                    self.write(chunk)
+        finally:
+            if hasattr(response, "close"):
+                response.close()
+
+    def stream(self, file_range):
+        req = self.req
+        try:
+            if not req.sent_headers:
+                req.sent_headers = True
+                req.send_headers()
+        except Exception:
+            file_range.close()
+            raise
+        req.conn.keep_alive = not req.close_connection
+        req.conn.file_range = file_range
+        # So the request thread stops reading requests from the connection, and closes it
+        req.close_connection = True
+
+
+class StreamPool(object):
+    """The threads that send FileRange responses, for a StreamingWSGIServer."""
+
+    def __init__(self, server, min=10):
+        self.server = server
+        self.min = min
+        self._threads = []
+        self._queue = Queue.Queue()
+        self._streaming = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.min):
+            thread = threading.Thread(target=self.run, name="CP Stream %d" % i)
+            # So a server that never got to serving doesn't keep the process alive
+            thread.daemon = True
+            self._threads.append(thread)
+            thread.start()
+
+    def put(self, conn):
+        self._queue.put(conn)
+
+    def run(self):
+        while True:
+            conn = self._queue.get()
+            if conn is None:
+                return
+            if not self.server.ready:
+                conn.abort()
+                continue
+
+            with self._lock:
+                self._streaming.add(conn)
+            try:
+                conn.stream()
+            finally:
+                with self._lock:
+                    self._streaming.discard(conn)
+
+    def stop(self, timeout=5):
+        for thread in self._threads:
+            self._queue.put(None)
+        endtime = time.time() + timeout
+        for thread in self._threads:
+            thread.join(max(endtime - time.time(), 0))
+        if any(thread.isAlive() for thread in self._threads):
+            # Still sending: cut them off.
+            with self._lock:
+                streaming = list(self._streaming)
+            for conn in streaming:
+                try:
+                    conn.socket.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
+
+
+class StreamingWSGIServer(CPWSGIServer):
+    """
+    CherryPy's WSGI server (configured by cherrypy.server, as usual), with its FileRange
+    responses sent by server.stream_thread_pool threads of their own.
+    """
+    ConnectionClass = StreamingHTTPConnection
+
+    def __init__(self, server_adapter=cherrypy.server):
+        CPWSGIServer.__init__(self, server_adapter)
+        if self.gateway is WSGIGateway_10:
+            self.gateway = StreamingWSGIGateway
+        self.streams = StreamPool(self, getattr(server_adapter, "stream_thread_pool", 10))
+
+    def start(self):
+        self.streams.start()
+        CPWSGIServer.start(self)
+
+    def stop(self):
+        CPWSGIServer.stop(self)
+        self.streams.stop(self.shutdown_timeout)
@@ -40,3 +40,6 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
 
         self.setup_server_if_needed()
+
+        from kalite.facility.sessions import schedule_clearing_expired_sessions
+        schedule_clearing_expired_sessions()
@@ -16,6 +16,7 @@ from kalite.contentload import settings as content_settings
 from kalite.i18n.base import lcode_to_django_lang, get_po_filepath, get_locale_path, \
     download_content_pack, update_jsi18n_file, get_subtitle_file_path as get_subtitle_path, \
     extract_content_db, get_localized_exercise_dirpath
+from kalite.topic_tools.content_models import create_search_index
 from kalite.updates.management.commands.classes import UpdatesStaticCommand
 
 logging = django_settings.LOG
@@ -110,7 +111,8 @@ class Command(UpdatesStaticCommand):
         self.next_stage(_("Moving content files to the right place."))
         extract_catalog_files(zf, lang)
         update_jsi18n_file(lang)
-        extract_content_db(zf, lang, is_template=self.is_template)
+        content_db_path = extract_content_db(zf, lang, is_template=self.is_template)
+        create_search_index(database_path=content_db_path)
         extract_subtitles(zf, lang)
         extract_content_pack_metadata(zf, lang)  # always extract to the en lang
         extract_assessment_items(zf, "en")
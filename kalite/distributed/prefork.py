@@ -0,0 +1,244 @@
+"""
+Prefork serving for `kalite start`, so that Django's work is spread over the CPU's cores rather than
+sharing one process (and its GIL).
+
+The supervisor (the process `kalite start` leaves running, whose PID is in the PID file) binds the
+listening socket, then forks the workers:
+* CHERRYPY_WORKER_PROCESSES server processes, each accepting connections on the shared socket,
+  with a CherryPy server of CHERRYPY_THREAD_COUNT threads, and
+* one process for the job scheduler, so that there's still only one.
+
+Workers that exit are started again, until the supervisor is stopped (with SIGTERM, e.g. by
+`kalite stop`, or SIGINT), when it stops them.  Workers exit by themselves should the supervisor die.
+
+The server processes have no job scheduler of their own, so force_job (fle_utils.chronograph) wakes
+the one in the job scheduler's process by sending WAKE_SIGNAL to the supervisor, which passes it on
+(see Supervisor's forward_signals), whatever the scheduler's current PID.
+
+Each process has its own in-memory caches, which the others' writes don't reach:
+* FacilityUsers of sessions (kalite.facility.sessions), kept for SESSION_USER_CACHE_TIMEOUT seconds,
+* device zones and metadata (securesync.devices.cache), kept for DEVICE_STATE_CACHE_TIMEOUT seconds,
+* public keys and verified signatures (securesync.engine.verification), which don't go stale,
+* content database connections, topic tree indexes and recommendation graphs (kalite.topic_tools),
+  which are checked against the content database files, and
+* buffered UserLog activity updates (kalite.main.activity_buffer), written every
+  USER_LOG_BUFFER_SECONDS seconds, and as each process exits.
+Django's cache is kept in files (by default), so it's shared by them all.
+
+Only on POSIX (see can_prefork).
+"""
+import atexit
+import errno
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+import cherrypy
+from cherrypy.process import plugins, servers
+
+from kalite.distributed.contentserver import StreamingWSGIServer
+
+__all__ = ['can_prefork', 'bind_listen_socket', 'serve_forever', 'wait_for_stop', 'Supervisor', 'WAKE_SIGNAL']
+
+# A worker that exits sooner than this (in seconds) after it started is started again only once
+# this long has passed, so one failing as it starts isn't forked over and over.
+MIN_WORKER_LIFETIME = 10
+
+# How long (in seconds) workers have to stop, before they're killed.
+STOP_TIMEOUT = 10
+
+# Sent to the supervisor to wake the job scheduler's process
+WAKE_SIGNAL = getattr(signal, "SIGUSR1", None)
+
+
+def can_prefork():
+    return hasattr(os, "fork")
+
+
+def bind_listen_socket(host, port, backlog):
+    """The socket for all the workers to accept connections on, set up as CherryPy's server would."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+class InheritedSocketWSGIServer(StreamingWSGIServer):
+    """
+    The server `kalite start` serves with (configured by cherrypy.server, as usual), accepting
+    connections on a socket that's listening already, rather than binding its own.
+    """
+
+    def __init__(self, listen_socket, server_adapter=cherrypy.server):
+        StreamingWSGIServer.__init__(self, server_adapter)
+        self.listen_socket = listen_socket
+
+    def bind(self, family, type, proto=0):
+        self.socket = self.listen_socket
+
+
+def _exit_if_orphaned(supervisor_pid):
+    if os.getppid() != supervisor_pid:
+        cherrypy.log("Supervisor is gone, stopping", "PREFORK")
+        cherrypy.engine.exit()
+
+
+def serve_forever(listen_socket, supervisor_pid):
+    """
+    Serves the CherryPy tree, as configured, on listen_socket, in a worker, until it's stopped
+    by SIGTERM, or the supervisor exits.
+    """
+    # cherrypy.server would bind the address itself, after waiting for it to be free
+    #   (which, with the supervisor holding it, it never is).
+    cherrypy.server.unsubscribe()
+    servers.ServerAdapter(cherrypy.engine, InheritedSocketWSGIServer(listen_socket)).subscribe()
+
+    # Only SIGTERM: the engine's other handlers restart the whole process (SIGHUP), which is
+    #   for the supervisor to do.
+    cherrypy.engine.signal_handler.handlers = {'SIGTERM': cherrypy.engine.exit}
+    cherrypy.engine.signal_handler.subscribe()
+    plugins.Monitor(cherrypy.engine, lambda: _exit_if_orphaned(supervisor_pid), frequency=1, name="SupervisorMonitor").subscribe()
+
+    cherrypy.engine.start()
+    cherrypy.engine.block()
+
+
+def wait_for_stop(supervisor_pid):
+    """Returns once a worker is stopped by SIGTERM, or the supervisor exits."""
+    stopped = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.append(signum))
+    while not stopped and os.getppid() == supervisor_pid:
+        time.sleep(1)
+
+
+class Supervisor(object):
+
+    def __init__(self, workers, min_worker_lifetime=MIN_WORKER_LIFETIME, stop_timeout=STOP_TIMEOUT, forward_signals=None):
+        """
+        :param workers: A dict of worker name to the function to run in its process.
+            The process exits when the function returns.
+        :param forward_signals: A dict of signal number to the name of the worker to pass the signal on to,
+            when the supervisor receives it.  Workers ignore these signals, unless they set a handler.
+        """
+        self.workers = workers
+        self.forward_signals = forward_signals or {}
+        self.min_worker_lifetime = min_worker_lifetime
+        self.stop_timeout = stop_timeout
+        self.pids = {}  # pid -> worker name
+        self.started_at = {}  # worker name -> time its process was (last) forked
+        self.stopping = False
+        self.pid = None
+
+    def run(self):
+        """Starts the workers, and keeps them running until the supervisor is stopped, and they have exited."""
+        self.pid = os.getpid()
+        signums = [signal.SIGTERM, signal.SIGINT, signal.SIGALRM] + list(self.forward_signals)
+        handlers = dict((signum, signal.getsignal(signum)) for signum in signums)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGALRM, self.kill)
+        for signum in self.forward_signals:
+            signal.signal(signum, self.forward)
+        try:
+            for name in sorted(self.workers):
+                self.start_worker(name)
+
+            while self.pids:
+                try:
+                    pid, status = os.wait()
+                except OSError as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    if e.errno == errno.ECHILD:
+                        break
+                    raise
+
+                name = self.pids.pop(pid, None)
+                if name is None or self.stopping:
+                    continue
+
+                if os.WIFSIGNALED(status):
+                    cherrypy.log("Worker %s (PID %d) was killed by signal %d, starting it again" % (name, pid, os.WTERMSIG(status)), "PREFORK")
+                else:
+                    cherrypy.log("Worker %s (PID %d) exited with status %d, starting it again" % (name, pid, os.WEXITSTATUS(status)), "PREFORK")
+                restart_at = self.started_at[name] + self.min_worker_lifetime
+                while not self.stopping and time.time() < restart_at:
+                    # Interrupted by signals, e.g. the one to stop
+                    time.sleep(restart_at - time.time())
+                if not self.stopping:
+                    self.start_worker(name)
+        finally:
+            signal.alarm(0)
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+    def start_worker(self, name):
+        pid = os.fork()
+        if pid == 0:
+            self.run_worker(name)
+        self.pids[pid] = name
+        self.started_at[name] = time.time()
+        cherrypy.log("Started worker %s (PID %d)" % (name, pid), "PREFORK")
+        if self.stopping:
+            # Told to stop as it was forked
+            self.signal_workers(signal.SIGTERM)
+
+    def run_worker(self, name):
+        """Runs in the worker's process, and never returns (to the supervisor's code)."""
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            # Ctrl+C reaches the whole process group; the supervisor stops the workers.
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGALRM, signal.SIG_DFL)
+            for signum in self.forward_signals:
+                signal.signal(signum, signal.SIG_IGN)
+            self.workers[name]()
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        try:
+            # As on exiting normally (e.g. to write buffered updates)
+            atexit._run_exitfuncs()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def signal_workers(self, signum):
+        for pid in self.pids:
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+
+    def stop(self, signum=None, frame=None):
+        # (A worker, just forked, still has the supervisor's handlers.)
+        if os.getpid() == self.pid and not self.stopping:
+            cherrypy.log("Stopping workers", "PREFORK")
+            self.stopping = True
+            self.signal_workers(signal.SIGTERM)
+            signal.alarm(self.stop_timeout)
+
+    def forward(self, signum, frame=None):
+        if os.getpid() != self.pid:
+            return
+        for pid, name in self.pids.items():
+            if name == self.forward_signals[signum]:
+                try:
+                    os.kill(pid, signum)
+                except OSError:
+                    pass
+
+    def kill(self, signum=None, frame=None):
+        if os.getpid() != self.pid:
+            return
+        cherrypy.log("Workers didn't stop in %d seconds, killing them" % self.stop_timeout, "PREFORK")
+        self.signal_workers(signal.SIGKILL)
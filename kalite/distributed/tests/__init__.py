@@ -1,3 +1,5 @@
 from code_tests import *
 from url_tests import *
+from prefork_tests import *
+from contentserver_tests import *
 from browser_tests import *
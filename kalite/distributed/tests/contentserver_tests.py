@@ -0,0 +1,184 @@
+import httplib
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+from django.utils import unittest
+
+from kalite.distributed import contentserver
+from kalite.distributed.contentserver import ContentFileApp, FileRange, StreamingWSGIServer, send_file_range
+
+
+class ContentFileAppTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.data = "".join(chr(i % 256) for i in range(1000))
+        with open(os.path.join(self.root, "video.mp4"), "wb") as f:
+            f.write(self.data)
+        self.app = ContentFileApp(self.root, {"mp4": "video/mp4"}, max_age=3600)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def get(self, path="/video.mp4", method="GET", **headers):
+        environ = {"REQUEST_METHOD": method, "PATH_INFO": path}
+        environ.update(("HTTP_" + key, value) for key, value in headers.items())
+        response = {}
+
+        def start_response(status, headers):
+            response["status"] = status
+            response["headers"] = dict(headers)
+        body = self.app(environ, start_response)
+        try:
+            response["body"] = "".join(body)
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+        return response
+
+    def test_whole_file(self):
+        response = self.get()
+        self.assertEqual(response["status"], "200 OK")
+        self.assertEqual(response["body"], self.data)
+        self.assertEqual(response["headers"]["Content-Length"], "1000")
+        self.assertEqual(response["headers"]["Content-Type"], "video/mp4")
+        self.assertEqual(response["headers"]["Accept-Ranges"], "bytes")
+        self.assertEqual(response["headers"]["Cache-Control"], "public, max-age=3600")
+        self.assertFalse(response["headers"]["ETag"].startswith("W/"))
+
+    def test_head(self):
+        response = self.get(method="HEAD")
+        self.assertEqual(response["status"], "200 OK")
+        self.assertEqual(response["headers"]["Content-Length"], "1000")
+        self.assertEqual(response["body"], "")
+
+    def test_range(self):
+        response = self.get(RANGE="bytes=100-199")
+        self.assertEqual(response["status"], "206 Partial Content")
+        self.assertEqual(response["body"], self.data[100:200])
+        self.assertEqual(response["headers"]["Content-Range"], "bytes 100-199/1000")
+        self.assertEqual(response["headers"]["Content-Length"], "100")
+
+    def test_open_and_suffix_ranges(self):
+        self.assertEqual(self.get(RANGE="bytes=900-")["body"], self.data[900:])
+        self.assertEqual(self.get(RANGE="bytes=990-2000")["body"], self.data[990:])
+        self.assertEqual(self.get(RANGE="bytes=-10")["body"], self.data[-10:])
+        self.assertEqual(self.get(RANGE="bytes=-5000")["body"], self.data)
+
+    def test_unsatisfiable_range(self):
+        response = self.get(RANGE="bytes=1000-")
+        self.assertEqual(response["status"], "416 Requested Range Not Satisfiable")
+        self.assertEqual(response["headers"]["Content-Range"], "bytes */1000")
+
+    def test_ignored_ranges(self):
+        for range_header in ("bytes=0-9,20-29", "bytes=junk", "lines=1-2"):
+            response = self.get(RANGE=range_header)
+            self.assertEqual(response["status"], "200 OK")
+            self.assertEqual(response["body"], self.data)
+
+    def test_if_range(self):
+        headers = self.get()["headers"]
+        for validator in (headers["ETag"], headers["Last-Modified"]):
+            response = self.get(RANGE="bytes=0-9", IF_RANGE=validator)
+            self.assertEqual(response["status"], "206 Partial Content")
+            self.assertEqual(response["body"], self.data[:10])
+
+        response = self.get(RANGE="bytes=0-9", IF_RANGE='"another-version"')
+        self.assertEqual(response["status"], "200 OK")
+        self.assertEqual(response["body"], self.data)
+
+    def test_not_modified(self):
+        headers = self.get()["headers"]
+        response = self.get(IF_NONE_MATCH=headers["ETag"])
+        self.assertEqual(response["status"], "304 Not Modified")
+        self.assertEqual(response["body"], "")
+        self.assertEqual(response["headers"]["ETag"], headers["ETag"])
+        self.assertEqual(self.get(IF_MODIFIED_SINCE=headers["Last-Modified"])["status"], "304 Not Modified")
+        self.assertEqual(self.get(IF_NONE_MATCH='"another-version"')["status"], "200 OK")
+
+    def test_changed_file_gets_new_etag(self):
+        etag = self.get()["headers"]["ETag"]
+        with open(os.path.join(self.root, "video.mp4"), "ab") as f:
+            f.write("more")
+        self.assertNotEqual(self.get()["headers"]["ETag"], etag)
+
+    def test_not_found(self):
+        self.assertEqual(self.get("/nothing.mp4")["status"], "404 Not Found")
+        self.assertEqual(self.get("/")["status"], "404 Not Found")
+        self.assertEqual(self.get("/../" + os.path.basename(self.root) + "/video.mp4")["status"], "200 OK")
+        self.assertEqual(self.get("/../video.mp4")["status"], "403 Forbidden")
+        self.assertEqual(self.get(method="POST")["status"], "405 Method Not Allowed")
+
+
+class SendFileRangeTests(unittest.TestCase):
+
+    def test_sends_range(self):
+        data = os.urandom(3 * contentserver.BLOCK_SIZE + 10)
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            for sendfile in (contentserver.sendfile, None):
+                received = []
+                listener = socket.socket()
+                listener.bind(("127.0.0.1", 0))
+                listener.listen(1)
+                sender = socket.create_connection(listener.getsockname(), timeout=5)
+                receiver = listener.accept()[0]
+                listener.close()
+                thread = threading.Thread(target=lambda: received.append(receiver.makefile().read()))
+                thread.start()
+                original_sendfile, contentserver.sendfile = contentserver.sendfile, sendfile
+                try:
+                    send_file_range(sender, FileRange(f, 5, len(data) - 10))
+                finally:
+                    contentserver.sendfile = original_sendfile
+                    sender.close()
+                    thread.join()
+                    receiver.close()
+                self.assertEqual(received[0], data[5:-5])
+
+
+class StreamingWSGIServerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.data = os.urandom(100000)
+        with open(os.path.join(self.root, "video.mp4"), "wb") as f:
+            f.write(self.data)
+
+        self.server = StreamingWSGIServer()
+        self.server.bind_addr = ("127.0.0.1", 0)
+        self.server.wsgi_app = ContentFileApp(self.root)
+        self.thread = threading.Thread(target=self.server.start)
+        self.thread.start()
+        while not self.server.ready:
+            time.sleep(0.1)
+        self.port = self.server.socket.getsockname()[1]
+
+    def tearDown(self):
+        self.server.stop()
+        self.thread.join()
+        shutil.rmtree(self.root)
+
+    def test_serves_ranges_on_kept_alive_connection(self):
+        conn = httplib.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        try:
+            conn.request("GET", "/video.mp4", headers={"Range": "bytes=10-"})
+            response = conn.getresponse()
+            self.assertEqual(response.status, 206)
+            self.assertEqual(response.read(), self.data[10:])
+
+            # The connection is back with the request threads, for another request
+            conn.request("GET", "/video.mp4")
+            response = conn.getresponse()
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.read(), self.data)
+
+            conn.request("GET", "/nothing-here")
+            self.assertEqual(conn.getresponse().status, 404)
+        finally:
+            conn.close()
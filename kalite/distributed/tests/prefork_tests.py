@@ -0,0 +1,85 @@
+import httplib
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+
+from django.utils import unittest
+
+from kalite.distributed import prefork
+
+
+@unittest.skipIf(not prefork.can_prefork(), "Prefork serving needs os.fork")
+class SupervisorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.started = os.path.join(self.tempdir, "started")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_exited_workers_started_again_until_stopped(self):
+        def worker():
+            with open(self.started, "a") as f:
+                f.write("%d\n" % os.getpid())
+            if len(open(self.started).readlines()) == 3:
+                # Stop the supervisor, and wait for it to stop this worker
+                os.kill(os.getppid(), signal.SIGTERM)
+                time.sleep(30)
+
+        started_at = time.time()
+        prefork.Supervisor({"worker": worker}, min_worker_lifetime=0).run()
+
+        pids = open(self.started).read().split()
+        self.assertEqual(len(set(pids)), 3)
+        self.assertNotIn(str(os.getpid()), pids)
+        self.assertTrue(time.time() - started_at < 10)
+
+    def test_signals_forwarded(self):
+        woken = os.path.join(self.tempdir, "woken")
+
+        def wake(signum, frame):
+            open(woken, "w").close()
+            os.kill(os.getppid(), signal.SIGTERM)
+
+        def sleeper():
+            signal.signal(prefork.WAKE_SIGNAL, wake)
+            while True:
+                time.sleep(1)
+
+        def waker():
+            # Until the sleeper has set its handler (it ignores the signal until then)
+            for attempt in range(100):
+                if os.path.exists(woken):
+                    break
+                os.kill(os.getppid(), prefork.WAKE_SIGNAL)
+                time.sleep(0.1)
+            time.sleep(30)
+
+        started_at = time.time()
+        prefork.Supervisor({"sleeper": sleeper, "waker": waker}, forward_signals={prefork.WAKE_SIGNAL: "sleeper"}).run()
+
+        self.assertTrue(os.path.exists(woken))
+        self.assertTrue(time.time() - started_at < 10)
+
+
+class InheritedSocketWSGIServerTests(unittest.TestCase):
+
+    def test_serves_on_listening_socket(self):
+        listen_socket = prefork.bind_listen_socket("127.0.0.1", 0, 5)
+        port = listen_socket.getsockname()[1]
+        server = prefork.InheritedSocketWSGIServer(listen_socket)
+        thread = threading.Thread(target=server.start)
+        thread.start()
+        try:
+            while not server.ready:
+                time.sleep(0.1)
+            conn = httplib.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/nothing-here")
+            self.assertEqual(conn.getresponse().status, 404)
+        finally:
+            server.stop()
+            thread.join()
@@ -151,8 +151,9 @@ def device_redirect(request):
 def search(request):
     # Inputs
     page = int(request.GET.get('page', 1))
+    after = request.GET.get('after')
     query = request.GET.get('query')
-    max_results = request.GET.get('max_results', 50)
+    max_results = int(request.GET.get('max_results', 50))
 
     # Outputs
     query_error = None
@@ -171,7 +172,7 @@ def search(request):
         query = query.lower()
         # search for topic, video or exercise with matching title
 
-        matches, exact, pages = search_topic_nodes(query=query, language=request.language, page=page, items_per_page=max_results)
+        matches, exact, pages = search_topic_nodes(query=query, language=request.language, page=page, items_per_page=max_results, after=after)
 
         if exact:
             # Redirect to an exact match
@@ -183,11 +184,15 @@ def search(request):
 
     previous_params = request.GET.copy()
     previous_params['page'] = page - 1
+    previous_params.pop('after', None)
 
     previous_url = "?" + previous_params.urlencode()
 
     next_params = request.GET.copy()
     next_params['page'] = page + 1
+    if matches:
+        # Continue from the last match, rather than counting through all previous pages again.
+        next_params['after'] = matches[-1]['path']
 
     next_url = "?" + next_params.urlencode()
 
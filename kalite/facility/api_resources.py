@@ -228,10 +228,7 @@ class FacilityUserResource(ModelResource):
             user = request.session["facility_user"]
             data["is_logged_in"] = True
             data["username"] = user.get_name()
-            # TODO-BLOCKER(jamalex): re-enable this conditional once tastypie endpoints invalidate cached session value
-            # if "points" not in request.session:
-            request.session["points"] = compute_total_points(user)
-            data["points"] = request.session["points"] if request.session["points"] else 0
+            data["points"] = compute_total_points(user) or 0
             data["user_id"] = user.id
             data["user_uri"] = reverse("api_dispatch_detail", kwargs={"resource_name": "user", "pk": user.id})
             data["facility_id"] = user.facility.id
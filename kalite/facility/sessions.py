@@ -0,0 +1,132 @@
+"""
+Session store that keeps FacilityUsers out of the session data.
+
+With signed cookie sessions, the FacilityUser of a logged in learner is pickled into the session cookie,
+sent back and forth with every request, and unpickled again on every request.  Here, the session data
+is kept on the server (in files, as by django.contrib.sessions.backends.file), and a FacilityUser in it
+is stored as just its id and a version stamp.  On loading the session, the user is taken from an
+in-process cache of recently used users, or from the database when not there, or changed since.
+Users are dropped from the cache as they are saved in this process, and as other processes can change
+them too, only kept for SESSION_USER_CACHE_TIMEOUT seconds.
+
+This is the default SESSION_ENGINE (see kalite.settings.base).  The files of expired sessions are cleared out
+by a daily job (see schedule_clearing_expired_sessions).
+"""
+import copy
+import errno
+import os
+import threading
+import time
+import zlib
+from collections import namedtuple, OrderedDict
+
+from django.conf import settings
+from django.contrib.sessions.backends.file import SessionStore as FileSessionStore
+from django.db.models.signals import post_save
+
+from .models import FacilityUser
+from fle_utils.chronograph.models import Job
+
+
+UserReference = namedtuple("UserReference", ("id", "version"))
+
+
+def get_user_version(user):
+    """A stamp that changes along with any of the user's fields."""
+    return zlib.crc32(repr([getattr(user, field.attname) for field in user._meta.fields]))
+
+
+class UserCache(object):
+    """The most recently used FacilityUsers, by id, up to a maximum number, for a limited time."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.users = OrderedDict()  # id -> (expiry time, user)
+        self.lock = threading.Lock()
+
+    def get(self, user_id, version):
+        with self.lock:
+            entry = self.users.pop(user_id, None)
+            if entry is None or entry[0] <= time.time() or get_user_version(entry[1]) != version:
+                return None
+            self.users[user_id] = entry
+            return entry[1]
+
+    def put(self, user):
+        with self.lock:
+            self.users.pop(user.id, None)
+            self.users[user.id] = (time.time() + settings.SESSION_USER_CACHE_TIMEOUT, user)
+            while len(self.users) > self.max_size:
+                self.users.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.users.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.users.clear()
+
+
+user_cache = UserCache(settings.SESSION_USER_CACHE_SIZE)
+
+
+def invalidate_cached_user(sender, instance, **kwargs):
+    user_cache.invalidate(instance.id)
+
+post_save.connect(invalidate_cached_user, sender=FacilityUser)
+
+
+def load_user(reference):
+    """
+    The FacilityUser a session refers to, or None if it's gone.
+    Every session gets its own copy, to change as it likes.
+    """
+    user = user_cache.get(reference.id, reference.version)
+    if user is None:
+        try:
+            user = FacilityUser.objects.get(pk=reference.id)
+        except FacilityUser.DoesNotExist:
+            return None
+        user_cache.put(user)
+    return copy.copy(user)
+
+
+class SessionStore(FileSessionStore):
+
+    @classmethod
+    def _get_storage_path(cls):
+        # Create the directory (see SESSION_FILE_PATH) when the first session is loaded, not at startup.
+        if not hasattr(cls, "_storage_path") and settings.SESSION_FILE_PATH:
+            try:
+                os.makedirs(settings.SESSION_FILE_PATH)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        return super(SessionStore, cls)._get_storage_path()
+
+    def encode(self, session_dict):
+        session_dict = dict(
+            (key, UserReference(value.id, get_user_version(value)) if isinstance(value, FacilityUser) else value)
+            for key, value in session_dict.iteritems()
+        )
+        return super(SessionStore, self).encode(session_dict)
+
+    def decode(self, session_data):
+        session_dict = super(SessionStore, self).decode(session_data)
+        for key, value in session_dict.items():
+            if isinstance(value, UserReference):
+                user = load_user(value)
+                if user is None:
+                    del session_dict[key]  # e.g. deleted since; log them out
+                else:
+                    session_dict[key] = user
+        return session_dict
+
+
+def schedule_clearing_expired_sessions():
+    """
+    Have the job scheduler run clearsessions once a day, as the files of sessions that are
+    never logged out of (e.g. by closing the browser) are otherwise kept forever.
+    """
+    Job.objects.get_or_create(command="clearsessions", defaults={"name": "Clear expired sessions", "frequency": "DAILY"})
@@ -27,6 +27,11 @@ PASSWORD_CONSTRAINTS = getattr(local_settings, "PASSWORD_CONSTRAINTS", {
 })
 
 
+# How many logged in users to keep loaded, when sessions are stored with kalite.facility.sessions
+SESSION_USER_CACHE_SIZE = getattr(local_settings, "SESSION_USER_CACHE_SIZE", 200)
+# and for how many seconds, as they may be changed by other processes
+SESSION_USER_CACHE_TIMEOUT = getattr(local_settings, "SESSION_USER_CACHE_TIMEOUT", 60)
+
 DISABLE_SELF_ADMIN = getattr(local_settings, "DISABLE_SELF_ADMIN", False)  #
 
 RESTRICTED_TEACHER_PERMISSIONS = getattr(local_settings, "RESTRICTED_TEACHER_PERMISSIONS", False)  # setting this to True will disable creating/editing/deleting facilties/students for teachers
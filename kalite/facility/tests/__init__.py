@@ -4,5 +4,6 @@ from base import *
 from crypto_tests import *
 from deletion_tests import *
 from form_tests import *
+from sessions_tests import *
 from unicode_tests import *
 from api_resource_tests import *
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""
+Tests for storing facility users in sessions by id (kalite.facility.sessions)
+"""
+from django.contrib.sessions.backends.file import SessionStore as FileSessionStore
+from django.core.management import call_command
+from django.test.utils import override_settings
+
+from .base import FacilityTestCase
+from ..models import FacilityUser
+from ..sessions import SessionStore, UserReference, get_user_version, schedule_clearing_expired_sessions, user_cache
+from fle_utils.chronograph.models import Job
+
+
+class CompactSessionTestCase(FacilityTestCase):
+
+    def setUp(self):
+        super(CompactSessionTestCase, self).setUp()
+        user_cache.clear()
+
+        self.user = FacilityUser(username=self.data['username'], facility=self.facility)
+        self.user.set_password('insecure')
+        self.user.save()
+
+        session = SessionStore()
+        session["facility_user"] = self.user
+        session.save()
+        self.session_key = session.session_key
+
+    def tearDown(self):
+        SessionStore(self.session_key).delete()
+        super(CompactSessionTestCase, self).tearDown()
+
+    def test_user_stored_by_id(self):
+        session_data = FileSessionStore(self.session_key).load()
+        self.assertEqual(session_data["facility_user"], UserReference(self.user.id, get_user_version(self.user)))
+
+        user = SessionStore(self.session_key)["facility_user"]
+        self.assertEqual(user, self.user)
+        self.assertEqual(user.username, self.user.username)
+
+    def test_user_saved(self):
+        SessionStore(self.session_key)["facility_user"]  # now cached
+
+        user = FacilityUser.objects.get(pk=self.user.pk)
+        user.first_name = "Changed"
+        user.save()
+        self.assertEqual(SessionStore(self.session_key)["facility_user"].first_name, "Changed")
+
+    def test_user_changed_by_another_process(self):
+        user = SessionStore(self.session_key)["facility_user"]  # now cached
+
+        # another process changes the user, and stores it in the session
+        FacilityUser.objects.filter(pk=self.user.pk).update(first_name="Changed")
+        user.first_name = "Changed"
+        session = SessionStore(self.session_key)
+        session["facility_user"] = user
+        session.save()
+
+        self.assertEqual(SessionStore(self.session_key)["facility_user"].first_name, "Changed")
+
+    @override_settings(SESSION_USER_CACHE_TIMEOUT=0)
+    def test_cached_user_expires(self):
+        SessionStore(self.session_key)["facility_user"]
+
+        # changed by another process, but not stored in this session
+        FacilityUser.objects.filter(pk=self.user.pk).update(first_name="Changed")
+        self.assertEqual(SessionStore(self.session_key)["facility_user"].first_name, "Changed")
+
+    def test_user_deleted(self):
+        self.user.soft_delete()
+        self.assertNotIn("facility_user", SessionStore(self.session_key))
+
+    def test_expired_sessions_cleared(self):
+        schedule_clearing_expired_sessions()
+        schedule_clearing_expired_sessions()
+        self.assertEqual(Job.objects.get(command="clearsessions").frequency, "DAILY")
+
+        expired = SessionStore()
+        expired["facility_user"] = self.user
+        expired.set_expiry(-1)
+        expired.save()
+
+        call_command("clearsessions")
+        self.assertFalse(SessionStore().exists(expired.session_key))
+        self.assertTrue(SessionStore().exists(self.session_key))
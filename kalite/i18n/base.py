@@ -16,6 +16,7 @@ from contextlib import contextmanager
 
 from kalite.version import SHORTVERSION
 from kalite.topic_tools import settings as topic_settings
+from kalite.topic_tools.connections import invalidate_content_database
 
 from fle_utils.config.models import Settings
 from fle_utils.general import ensure_dir, softload_json
@@ -402,10 +403,20 @@ def download_content_pack(fobj, lang, minimal=False):
     return zf
 
 
+def _replace_file(src, dst):
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # Windows does not allow renaming over an existing file
+        os.remove(dst)
+        os.rename(src, dst)
+
+
 def extract_content_db(zf, lang, is_template=False):
     """
     :param: as_template: Extracts the result to the template destination,
                          intended for source distribution
+    :return: The path of the extracted database
     """
     if not is_template:
         content_db_path = topic_settings.CONTENT_DATABASE_PATH.format(
@@ -418,9 +429,16 @@ def extract_content_db(zf, lang, is_template=False):
             language=lang,
         )
 
-    with open(content_db_path, "wb") as f:
+    # Written next to it and moved over it, so that it's a new file to the processes that have the old one open
+    with open(content_db_path + ".new", "wb") as f:
         dbfobj = zf.open("content.db")
         shutil.copyfileobj(dbfobj, f)
+    _replace_file(content_db_path + ".new", content_db_path)
+
+    # Connections opened on the old file must not be reused
+    invalidate_content_database(content_db_path)
+
+    return content_db_path
 
 
 def reset_content_db(force=False):
@@ -432,6 +450,8 @@ def reset_content_db(force=False):
                 dest_database = os.path.join(settings.DEFAULT_DATABASE_DIR, file_name)
                 if force or not os.path.exists(dest_database):
                     print("Copying {} to {}".format(template_path, dest_database))
-                    shutil.copy(template_path, dest_database)
+                    shutil.copy(template_path, dest_database + ".new")
+                    _replace_file(dest_database + ".new", dest_database)
+                    invalidate_content_database(dest_database)
                 else:
                     print("Skipping {}".format(template_path))
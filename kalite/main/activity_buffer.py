@@ -0,0 +1,82 @@
+"""
+Write-behind buffer for UserLog activity updates.
+
+Every save of an ExerciseLog or VideoLog marks its user as active, which, written straight through, takes a query
+for the user's open UserLog, and a save of it.  Instead, the latest activity time for each (user, activity type)
+is kept here, and written for all of them together, in one transaction: every USER_LOG_BUFFER_SECONDS, before a
+user's activity begins or ends (e.g. on login and logout), and when the process exits.
+
+With USER_LOG_BUFFER_SECONDS set to 0, updates aren't buffered (see UserLog.update_user_activity).
+"""
+import threading
+
+from django.conf import settings
+from django.db import connection
+logging = settings.LOG
+
+
+class UserActivityBuffer(object):
+
+    def __init__(self, write):
+        """
+        :param write: Called with a list of (user, activity type, update datetime, language) tuples to write,
+            one for each user and activity type.
+        """
+        self.write = write
+        self.pending = {}  # (user id, activity type) -> (user, activity type, update datetime, language)
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()  # so a flush waits for one that's writing already, e.g. before a logout
+        self.timer = None
+
+    def add(self, user, activity_type, update_datetime, language=None):
+        """Record that the user was active at update_datetime, to be written with the next flush."""
+        key = (user.id, activity_type)
+        with self.lock:
+            previous = self.pending.get(key)
+            if previous:
+                update_datetime = max(update_datetime, previous[2])
+                language = language or previous[3]
+            self.pending[key] = (user, activity_type, update_datetime, language)
+
+            if self.timer is None:
+                self.timer = threading.Timer(settings.USER_LOG_BUFFER_SECONDS, self.flush_on_timer)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self, user=None):
+        """Write the pending updates, for one user or else for all."""
+        with self.write_lock:
+            with self.lock:
+                if user is None:
+                    updates = self.pending.values()
+                    self.pending = {}
+                    if self.timer is not None:
+                        self.timer.cancel()
+                        self.timer = None
+                else:
+                    updates = [self.pending.pop(key) for key in self.pending.keys() if key[0] == user.id]
+            if updates:
+                self.write(updates)
+
+    def flush_on_timer(self):
+        with self.lock:
+            self.timer = None
+        try:
+            self.flush()
+        except Exception as e:
+            logging.error("Failed to write buffered user activity: %s" % e)
+        finally:
+            # This thread is done with the database.
+            connection.close()
+
+    def clear(self):
+        """Drop the pending updates, without writing them."""
+        with self.lock:
+            self.pending = {}
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+    def count(self):
+        with self.lock:
+            return len(self.pending)
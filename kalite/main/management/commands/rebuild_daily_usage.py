@@ -0,0 +1,11 @@
+from django.core.management.base import NoArgsCommand
+
+from kalite.main.models import UserDailyUsage
+
+
+class Command(NoArgsCommand):
+    help = "Recompute the daily usage of each user shown on the facility management page from their exercise and video logs and login summaries."
+
+    def handle_noargs(self, **options):
+        UserDailyUsage.rebuild()
+        self.stdout.write("Rebuilt %d days of usage.\n" % UserDailyUsage.objects.count())
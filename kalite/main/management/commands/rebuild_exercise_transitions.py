@@ -0,0 +1,11 @@
+from django.core.management.base import NoArgsCommand
+
+from kalite.main.models import ExerciseTransition
+
+
+class Command(NoArgsCommand):
+    help = "Recompute the exercise transition counts used for group recommendations from the exercise logs."
+
+    def handle_noargs(self, **options):
+        ExerciseTransition.rebuild()
+        self.stdout.write("Rebuilt %d exercise transitions.\n" % ExerciseTransition.objects.count())
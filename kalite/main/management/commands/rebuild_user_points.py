@@ -0,0 +1,11 @@
+from django.core.management.base import NoArgsCommand
+
+from kalite.main.models import UserPoints
+
+
+class Command(NoArgsCommand):
+    help = "Recompute the total points of each learner shown in the user status from their video, exercise and content logs."
+
+    def handle_noargs(self, **options):
+        UserPoints.rebuild()
+        self.stdout.write("Rebuilt points totals for %d users.\n" % UserPoints.objects.count())
@@ -3,6 +3,7 @@ All models associated with user learning / usage, including:
 * Exercise/Video progress
 * Login stats
 """
+import atexit
 import random
 import uuid
 from math import ceil
@@ -12,22 +13,30 @@ from dateutil import relativedelta
 from django.conf import settings; logging = settings.LOG
 from django.contrib.auth.signals import user_logged_out
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import Sum
+from django.db import models, transaction
+from django.db.models import F, Q, Sum
 from django.db.models.signals import pre_save, post_save
 from django.dispatch import receiver
 
 from fle_utils.django_utils.classes import ExtendedModel
+from fle_utils.django_utils.functions import create_or_retry
 from fle_utils.general import datediff, isnumeric
 from kalite.topic_tools.content_models import get_video_from_youtube_id
-from kalite.facility.models import FacilityUser
+from kalite.facility.models import FacilityUser, FacilityGroup
 from kalite.dynamic_assets.utils import load_dynamic_settings
 from securesync.models import DeferredCountSyncedModel, Device
 from kalite.topic_tools.settings import CHANNEL
 
+from .activity_buffer import UserActivityBuffer
 from .content_rating_models import ContentRating
 
 
+def get_user_points(log):
+    """(user id, points) that a VideoLog, ExerciseLog or ContentLog counts towards in UserPoints.
+    Deleted logs count towards nobody."""
+    return (None if log.deleted else log.user_id, log.points)
+
+
 class VideoLog(DeferredCountSyncedModel):
 
     user = models.ForeignKey(FacilityUser, blank=True, null=True, db_index=True)
@@ -44,6 +53,8 @@ class VideoLog(DeferredCountSyncedModel):
     def __init__(self, *args, **kwargs):
         super(VideoLog, self).__init__(*args, **kwargs)
         self._unhashable_fields += ("latest_activity_timestamp",) # since it's being stripped out by minversion, we can't include it in the signature
+        self._saved_points = get_user_points(self)  # to tell when UserPoints need updating
+        self._saved_daily_usage = self.get_daily_usage()  # to tell when UserDailyUsage needs updating
 
     class Meta:  # needed to clear out the app_name property from SyncedClass.Meta
         pass
@@ -73,7 +84,7 @@ class VideoLog(DeferredCountSyncedModel):
             self.full_clean()
 
             try:
-                UserLog.update_user_activity(self.user, activity_type="login", update_datetime=(self.completion_timestamp or datetime.now()), language=self.language)
+                UserLog.update_user_activity(self.user, activity_type="login", update_datetime=(self.completion_timestamp or datetime.now()), language=self.language, buffered=True)
             except ValidationError as e:
                 logging.error("Failed to update userlog during video: %s" % e)
 
@@ -95,6 +106,14 @@ class VideoLog(DeferredCountSyncedModel):
     def calc_points(cls, seconds_watched, video_length):
         return ceil(float(seconds_watched) / video_length* VideoLog.POINTS_PER_VIDEO)
 
+    def get_daily_usage(self):
+        """(user id, day, usage) that this log counts towards in UserDailyUsage, or None.
+        A video counts as watched on the day it was completed, or else on the day it was last watched."""
+        if self.deleted or not self.user_id or not self.total_seconds_watched > 0:
+            return None
+        timestamp = self.completion_timestamp or self.latest_activity_timestamp
+        return (self.user_id, timestamp and timestamp.date(), {"videos_watched": 1})
+
 
 class ExerciseLog(DeferredCountSyncedModel):
     user = models.ForeignKey(FacilityUser, blank=True, null=True, db_index=True)
@@ -113,6 +132,9 @@ class ExerciseLog(DeferredCountSyncedModel):
     def __init__(self, *args, **kwargs):
         super(ExerciseLog, self).__init__(*args, **kwargs)
         self._unhashable_fields += ("latest_activity_timestamp",) # since it's being stripped out by minversion, we can't include it in the signature
+        self._saved_completion_timestamp = self.get_transition_timestamp()  # to tell when ExerciseTransitions need updating
+        self._saved_points = get_user_points(self)  # to tell when UserPoints need updating
+        self._saved_daily_usage = self.get_daily_usage()  # to tell when UserDailyUsage needs updating
 
     class Meta:  # needed to clear out the app_name property from SyncedClass.Meta
         pass
@@ -120,6 +142,23 @@ class ExerciseLog(DeferredCountSyncedModel):
     def __unicode__(self):
         return u"user=%s, exercise_id=%s, points=%d, language=%s%s" % (self.user, self.exercise_id, self.points, self.language, " (completed)" if self.complete else "")
 
+    def get_transition_timestamp(self):
+        """The completion timestamp that places this log in its learner's sequence of exercises (see ExerciseTransition),
+        or None.  Deleted logs aren't in it."""
+        return None if self.deleted else self.completion_timestamp
+
+    def get_daily_usage(self):
+        """(user id, day, usage) that this log counts towards in UserDailyUsage, or None.
+        An exercise counts on the day it was last worked on."""
+        if self.deleted or not self.user_id:
+            return None
+        timestamp = self.latest_activity_timestamp or self.completion_timestamp
+        return (self.user_id, timestamp and timestamp.date(), {
+            "exercises_attempted": 1,
+            "exercises_mastered": 1 if self.complete else 0,
+            "mastery_sum": self.streak_progress or 0,
+        })
+
     def save(self, *args, **kwargs):
         if not kwargs.get("imported", False):
             self.full_clean()
@@ -135,7 +174,7 @@ class ExerciseLog(DeferredCountSyncedModel):
                 self.attempts_before_completion = self.attempts
 
             try:
-                UserLog.update_user_activity(self.user, activity_type="login", update_datetime=(self.completion_timestamp or datetime.now()), language=self.language)
+                UserLog.update_user_activity(self.user, activity_type="login", update_datetime=(self.completion_timestamp or datetime.now()), language=self.language, buffered=True)
             except ValidationError as e:
                 logging.error("Failed to update userlog during exercise: %s" % e)
 
@@ -169,6 +208,126 @@ class ExerciseLog(DeferredCountSyncedModel):
         return AttemptLog.objects.filter(user=self.user, exercise_id=self.exercise_id, context_type__in=["playlist", "exercise"])
 
 
+class ExerciseTransition(models.Model):  # Not sync'd, derived from the ExerciseLogs on this device
+    """Counts of the learners in a group completing one exercise right after another.
+
+    Each learner's ExerciseLogs, ordered by completion timestamp, form a sequence of exercises;
+    every pair of consecutive exercises in it is counted once here, for the learner's group.
+    Kept up to date as ExerciseLogs are saved, and used for group based recommendations.
+    """
+    group = models.ForeignKey(FacilityGroup, blank=True, null=True)  # None for learners without a group
+    from_exercise_id = models.CharField(max_length=200)
+    to_exercise_id = models.CharField(max_length=200)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("group", "from_exercise_id", "to_exercise_id")
+
+    def __unicode__(self):
+        return u"group=%s, %s -> %s: %d" % (self.group_id, self.from_exercise_id, self.to_exercise_id, self.count)
+
+    @classmethod
+    def increment(cls, group_id, from_exercise_id, to_exercise_id, delta=1):
+        transitions = cls.objects.filter(group=group_id, from_exercise_id=from_exercise_id, to_exercise_id=to_exercise_id)
+        if transitions.update(count=F("count") + delta) or delta < 0:
+            return
+        create_or_retry(
+            lambda: cls.objects.create(group_id=group_id, from_exercise_id=from_exercise_id, to_exercise_id=to_exercise_id, count=delta),
+            lambda: transitions.update(count=F("count") + delta),
+        )
+
+    @classmethod
+    def _neighbors(cls, exercise_log, completion_timestamp):
+        """The exercise ids before and after a completion timestamp in a learner's sequence, excluding exercise_log."""
+        logs = ExerciseLog.objects \
+            .filter(user=exercise_log.user_id) \
+            .exclude(pk=exercise_log.pk) \
+            .exclude(completion_timestamp=None)
+        before = logs.filter(Q(completion_timestamp__lt=completion_timestamp) | Q(completion_timestamp=completion_timestamp, pk__lt=exercise_log.pk))
+        after = logs.filter(Q(completion_timestamp__gt=completion_timestamp) | Q(completion_timestamp=completion_timestamp, pk__gt=exercise_log.pk))
+        before = before.order_by("-completion_timestamp", "-pk").values_list("exercise_id", flat=True)[:1]
+        after = after.order_by("completion_timestamp", "pk").values_list("exercise_id", flat=True)[:1]
+        return (before[0] if before else None), (after[0] if after else None)
+
+    @classmethod
+    def update_for_log(cls, exercise_log, old_completion_timestamp, new_completion_timestamp):
+        """Move an exercise within its learner's sequence, after its completion timestamp has changed."""
+        groups = FacilityUser.objects.filter(pk=exercise_log.user_id).values_list("group", flat=True)
+        if not groups:
+            return
+        group_id = groups[0]
+
+        for completion_timestamp, delta in ((old_completion_timestamp, -1), (new_completion_timestamp, 1)):
+            if completion_timestamp is None:
+                continue
+            before, after = cls._neighbors(exercise_log, completion_timestamp)
+            if before:
+                cls.increment(group_id, before, exercise_log.exercise_id, delta)
+            if after:
+                cls.increment(group_id, exercise_log.exercise_id, after, delta)
+            if before and after:
+                cls.increment(group_id, before, after, -delta)
+
+    @classmethod
+    @transaction.commit_on_success
+    def rebuild(cls):
+        """Recompute all counts from the ExerciseLogs, e.g. after logs have been changed without being saved."""
+        counts = {}
+        previous = (None, None)
+        logs = ExerciseLog.objects \
+            .exclude(user=None) \
+            .exclude(completion_timestamp=None) \
+            .order_by("user", "completion_timestamp", "pk") \
+            .values_list("user", "user__group", "exercise_id")
+        for user_id, group_id, exercise_id in logs.iterator():
+            if previous[0] == user_id:
+                key = (group_id, previous[1], exercise_id)
+                counts[key] = counts.get(key, 0) + 1
+            previous = (user_id, exercise_id)
+
+        cls.objects.all().delete()
+        cls.objects.bulk_create([
+            cls(group_id=group_id, from_exercise_id=from_exercise_id, to_exercise_id=to_exercise_id, count=count)
+            for (group_id, from_exercise_id, to_exercise_id), count in counts.iteritems()
+        ])
+
+
+class UserPoints(models.Model):  # Not sync'd, derived from the logs on this device
+    """Total points of each learner, over their VideoLogs, ExerciseLogs and ContentLogs.
+
+    Kept up to date as the logs are saved, so that the total doesn't need adding up on every page view.
+    """
+    user = models.ForeignKey(FacilityUser, unique=True)
+    points = models.IntegerField(default=0)
+
+    def __unicode__(self):
+        return u"user=%s, points=%d" % (self.user_id, self.points)
+
+    @classmethod
+    def add(cls, user_id, delta):
+        points = cls.objects.filter(user=user_id)
+        if not delta or points.update(points=F("points") + delta):
+            return
+        create_or_retry(lambda: cls.objects.create(user_id=user_id, points=delta), lambda: points.update(points=F("points") + delta))
+
+    @classmethod
+    def get_points_for_user(cls, user):
+        points = cls.objects.filter(user=user).values_list("points", flat=True)
+        return points[0] if points else 0
+
+    @classmethod
+    @transaction.commit_on_success
+    def rebuild(cls):
+        """Recompute all totals from the logs, e.g. after logs have been changed without being saved."""
+        totals = {}
+        for Model in (VideoLog, ExerciseLog, ContentLog):
+            for user_id, points in Model.objects.exclude(user=None).values_list("user").annotate(Sum("points")).order_by():
+                totals[user_id] = totals.get(user_id, 0) + (points or 0)
+
+        cls.objects.all().delete()
+        cls.objects.bulk_create([cls(user_id=user_id, points=points) for user_id, points in totals.iteritems()])
+
+
 class UserLogSummary(DeferredCountSyncedModel):
     """Like UserLogs, but summarized over a longer period of time.
     Also sync'd across devices.  Unique per user, device, activity_type, and time period."""
@@ -187,6 +346,10 @@ class UserLogSummary(DeferredCountSyncedModel):
     class Meta:  # needed to clear out the app_name property from SyncedClass.Meta
         pass
 
+    def __init__(self, *args, **kwargs):
+        super(UserLogSummary, self).__init__(*args, **kwargs)
+        self._saved_daily_usage = self.get_daily_usage()  # to tell when UserDailyUsage needs updating
+
     def __unicode__(self):
         self.full_clean()  # make sure everything that has to be there, is there.
         return u"%d seconds over %d logins for %s/%s/%d, period %s to %s" % (self.total_seconds, self.count, self.device.name, self.user.username, self.activity_type, self.start_datetime, self.end_datetime)
@@ -293,6 +456,105 @@ class UserLogSummary(DeferredCountSyncedModel):
         log_summary.last_activity_datetime = user_log.last_active_datetime
         log_summary.save()
 
+    def get_daily_usage(self):
+        """(user id, day, usage) that this summary counts towards in UserDailyUsage, or None.
+        Summaries count on the first day of their period."""
+        if self.deleted or not self.user_id or not self.start_datetime:
+            return None
+        if self.activity_type == UserLog.get_activity_int("login"):
+            usage = {"login_seconds": self.total_seconds or 0, "logins": self.count or 0}
+        elif self.activity_type == UserLog.get_activity_int("coachreport"):
+            usage = {"report_views": 1}
+        else:
+            return None
+        return (self.user_id, self.start_datetime.date(), usage)
+
+
+class UserDailyUsage(models.Model):  # Not sync'd, derived from the logs on this device
+    """Usage of each user, per day: exercises and videos (from their ExerciseLogs and VideoLogs),
+    and time logged in (from their UserLogSummaries).
+
+    Kept up to date as the logs are saved, so that usage over a period is a sum over a few rows,
+    rather than over all of the logs.  Logs without a timestamp to place them on a day are counted
+    with day=None, so they only show up in totals over all time.
+    """
+    user = models.ForeignKey(FacilityUser)
+    day = models.DateField(blank=True, null=True)
+    exercises_attempted = models.IntegerField(default=0)
+    exercises_mastered = models.IntegerField(default=0)
+    mastery_sum = models.IntegerField(default=0)  # of streak_progress, over the exercises attempted
+    videos_watched = models.IntegerField(default=0)
+    login_seconds = models.IntegerField(default=0)
+    logins = models.IntegerField(default=0)
+    report_views = models.IntegerField(default=0)
+
+    USAGE_FIELDS = ("exercises_attempted", "exercises_mastered", "mastery_sum", "videos_watched", "login_seconds", "logins", "report_views")
+
+    class Meta:
+        unique_together = ("user", "day")
+
+    def __unicode__(self):
+        return u"user=%s, day=%s" % (self.user_id, self.day)
+
+    @classmethod
+    def add(cls, user_id, day, **deltas):
+        deltas = dict((field, int(delta)) for field, delta in deltas.iteritems() if delta)
+        if not deltas:
+            return
+        usage = cls.objects.filter(user=user_id, day=day)
+        updates = dict((field, F(field) + delta) for field, delta in deltas.iteritems())
+        if usage.update(**updates):
+            return
+        create_or_retry(lambda: cls.objects.create(user_id=user_id, day=day, **deltas), lambda: usage.update(**updates))
+
+    @classmethod
+    def update_for_log(cls, previous, current):
+        """Move what a log counts towards from its previous to its current get_daily_usage()."""
+        if previous and current and previous[:2] == current[:2]:
+            fields = set(previous[2]) | set(current[2])
+            cls.add(current[0], current[1], **dict((field, current[2].get(field, 0) - previous[2].get(field, 0)) for field in fields))
+            return
+        if previous:
+            cls.add(previous[0], previous[1], **dict((field, -value) for field, value in previous[2].iteritems()))
+        if current:
+            cls.add(current[0], current[1], **current[2])
+
+    @classmethod
+    def get_usage_for_users(cls, users, period_start=None, period_end=None):
+        """
+        Sum each user's usage over the days from period_start to period_end (both dates, inclusive),
+        or over all time if not given.
+        :return: A dict of user id to a dict of the usage fields.
+        """
+        usage = cls.objects.filter(user__in=users)
+        if period_start:
+            usage = usage.filter(day__gte=period_start)
+        if period_end:
+            usage = usage.filter(day__lte=period_end)
+        return dict(
+            (row["user"], dict((field, row[field + "__sum"] or 0) for field in cls.USAGE_FIELDS))
+            for row in usage.values("user").annotate(*[Sum(field) for field in cls.USAGE_FIELDS]).order_by()
+        )
+
+    @classmethod
+    @transaction.commit_on_success
+    def rebuild(cls, chunk_size=1000):
+        """Recompute all usage from the logs, e.g. after logs have been changed without being saved."""
+        totals = {}
+        for Model in (ExerciseLog, VideoLog, UserLogSummary):
+            for log in Model.objects.all().iterator():
+                daily_usage = log.get_daily_usage()
+                if daily_usage:
+                    user_id, day, usage = daily_usage
+                    total = totals.setdefault((user_id, day), {})
+                    for field, value in usage.iteritems():
+                        total[field] = total.get(field, 0) + value
+
+        cls.objects.all().delete()
+        rows = [cls(user_id=user_id, day=day, **usage) for (user_id, day), usage in totals.iteritems()]
+        for idx in range(0, len(rows), chunk_size):
+            cls.objects.bulk_create(rows[idx:idx + chunk_size])
+
 
 class UserLog(ExtendedModel):  # Not sync'd, only summaries are
     """Detailed instances of user behavior.
@@ -385,6 +647,9 @@ class UserLog(ExtendedModel):  # Not sync'd, only summaries are
             start_datetime = datetime.now()
         activity_type = cls.get_activity_int(activity_type)
 
+        # Bring the previous activity up to date first.
+        user_activity_buffer.flush(user)
+
         cur_log = cls.get_latest_open_log_or_None(user=user, activity_type=activity_type)
         if cur_log:
             # Seems we're logging in without logging out of the previous.
@@ -405,8 +670,11 @@ class UserLog(ExtendedModel):  # Not sync'd, only summaries are
         return cur_log
 
     @classmethod
-    def update_user_activity(cls, user, activity_type="login", update_datetime=None, language=None, suppress_save=False):
-        """Helper function to update an existing user activity log entry."""
+    def update_user_activity(cls, user, activity_type="login", update_datetime=None, language=None, suppress_save=False, buffered=False):
+        """
+        Helper function to update an existing user activity log entry.
+        With buffered=True, the update is only written with the next flush of user_activity_buffer (and None returned).
+        """
 
         # Do nothing if the max # of records is zero
         # (i.e. this functionality is disabled)
@@ -419,6 +687,10 @@ class UserLog(ExtendedModel):  # Not sync'd, only summaries are
             update_datetime = datetime.now()
         activity_type = cls.get_activity_int(activity_type)
 
+        if buffered and settings.USER_LOG_BUFFER_SECONDS:
+            user_activity_buffer.add(user, activity_type, update_datetime, language)
+            return None
+
         cur_log = cls.get_latest_open_log_or_None(user=user, activity_type=activity_type)
         if cur_log:
             # How could you start after you updated??
@@ -451,6 +723,9 @@ class UserLog(ExtendedModel):  # Not sync'd, only summaries are
             end_datetime = datetime.now()
         activity_type = cls.get_activity_int(activity_type)
 
+        # Bring the activity up to date first, so its total time is right.
+        user_activity_buffer.flush(user)
+
         cur_log = cls.get_latest_open_log_or_None(user=user, activity_type=activity_type)
 
         if cur_log:
@@ -468,6 +743,49 @@ class UserLog(ExtendedModel):  # Not sync'd, only summaries are
             cur_log.save()  # total-seconds will be computed here.
         return cur_log
 
+    @classmethod
+    def update_users_activity(cls, updates, chunk_size=500):
+        """
+        Write many update_user_activity calls at once, with one query for the open logs of each chunk of users,
+        all in one transaction.  Updates that fail validation are logged and skipped.
+        :param updates: A list of (user, activity type, update datetime, language) tuples,
+            at most one for each user and activity type.
+        """
+        if not cls.is_enabled():
+            return
+
+        with transaction.commit_on_success():
+            for i in range(0, len(updates), chunk_size):
+                chunk = updates[i:i + chunk_size]
+
+                # The latest open log of each user and activity type, as get_latest_open_log_or_None finds them
+                open_logs = {}
+                logs = cls.objects.exclude(end_datetime__gt="1900-01-01") \
+                    .filter(user__in=set(user.id for user, _, _, _ in chunk)) \
+                    .order_by("last_active_datetime")
+                for log in logs:
+                    open_logs[(log.user_id, log.activity_type)] = log
+
+                for user, activity_type, update_datetime, language in chunk:
+                    cur_log = open_logs.get((user.id, activity_type))
+                    if not cur_log:
+                        # No unstopped starts, as in update_user_activity.
+                        logging.warn("%s: Had to create a user log entry on an UPDATE(%d)! @ %s" % (user.username, activity_type, update_datetime))
+                        cur_log = cls(user=user, activity_type=activity_type, start_datetime=update_datetime)
+                    elif cur_log.start_datetime > update_datetime:
+                        logging.error("Failed to update userlog for %s: update time must always be later than the login time." % user.username)
+                        continue
+
+                    cur_log.last_active_datetime = update_datetime
+                    cur_log.language = language or cur_log.language
+                    cur_log.save()
+
+
+user_activity_buffer = UserActivityBuffer(UserLog.update_users_activity)
+
+# Don't lose the activity still buffered when the process exits.
+atexit.register(user_activity_buffer.flush)
+
 
 class AttemptLog(DeferredCountSyncedModel):
     """
@@ -523,6 +841,7 @@ class ContentLog(DeferredCountSyncedModel):
     def __init__(self, *args, **kwargs):
         super(ContentLog, self).__init__(*args, **kwargs)
         self._unhashable_fields += ("latest_activity_timestamp",) # since it's being stripped out by minversion, we can't include it in the signature
+        self._saved_points = get_user_points(self)  # to tell when UserPoints need updating
 
     class Meta:  # needed to clear out the app_name property from SyncedClass.Meta
         pass
@@ -547,6 +866,76 @@ class ContentLog(DeferredCountSyncedModel):
         return uuid.uuid5(namespace, hashtext.encode("utf-8")).hex
 
 
+@receiver(pre_save, sender=ExerciseLog)
+def find_previous_completion(sender, **kwargs):
+    instance = kwargs["instance"]
+    instance._previous_completion_timestamp = instance._saved_completion_timestamp
+    if instance._state.adding or instance.get_transition_timestamp() != instance._saved_completion_timestamp:
+        # The instance may not reflect what is in the database (e.g. when syncing), so look it up.
+        previous = ExerciseLog.all_objects.filter(pk=instance.pk) if instance.pk else []
+        instance._previous_completion_timestamp = previous[0].get_transition_timestamp() if previous else None
+
+
+@receiver(post_save, sender=ExerciseLog)
+def update_exercise_transitions(sender, **kwargs):
+    instance = kwargs["instance"]
+    completion_timestamp = instance._saved_completion_timestamp = instance.get_transition_timestamp()
+    if completion_timestamp != instance._previous_completion_timestamp:
+        ExerciseTransition.update_for_log(instance, instance._previous_completion_timestamp, completion_timestamp)
+
+
+@receiver(pre_save, sender=VideoLog)
+@receiver(pre_save, sender=ExerciseLog)
+@receiver(pre_save, sender=ContentLog)
+def find_previous_points(sender, **kwargs):
+    instance = kwargs["instance"]
+    instance._previous_points = instance._saved_points
+    if instance._state.adding or get_user_points(instance) != instance._saved_points:
+        # The instance may not reflect what is in the database (e.g. when syncing), so look it up.
+        previous = sender.all_objects.filter(pk=instance.pk) if instance.pk else []
+        instance._previous_points = get_user_points(previous[0]) if previous else (None, 0)
+
+
+@receiver(post_save, sender=VideoLog)
+@receiver(post_save, sender=ExerciseLog)
+@receiver(post_save, sender=ContentLog)
+def update_user_points(sender, **kwargs):
+    instance = kwargs["instance"]
+    previous_user_id, previous_points = instance._previous_points
+    user_id, points = instance._saved_points = get_user_points(instance)
+    if previous_user_id == user_id:
+        if user_id:
+            UserPoints.add(user_id, int(points or 0) - int(previous_points or 0))
+    else:
+        if previous_user_id:
+            UserPoints.add(previous_user_id, -int(previous_points or 0))
+        if user_id:
+            UserPoints.add(user_id, int(points or 0))
+
+
+@receiver(pre_save, sender=VideoLog)
+@receiver(pre_save, sender=ExerciseLog)
+@receiver(pre_save, sender=UserLogSummary)
+def find_previous_daily_usage(sender, **kwargs):
+    instance = kwargs["instance"]
+    instance._previous_daily_usage = instance._saved_daily_usage
+    if instance._state.adding or instance.get_daily_usage() != instance._saved_daily_usage:
+        # The instance may not reflect what is in the database (e.g. when syncing), so look it up.
+        previous = sender.all_objects.filter(pk=instance.pk) if instance.pk else []
+        instance._previous_daily_usage = previous[0].get_daily_usage() if previous else None
+
+
+@receiver(post_save, sender=VideoLog)
+@receiver(post_save, sender=ExerciseLog)
+@receiver(post_save, sender=UserLogSummary)
+def update_daily_usage(sender, **kwargs):
+    instance = kwargs["instance"]
+    daily_usage = instance.get_daily_usage()
+    if daily_usage != instance._previous_daily_usage:
+        UserDailyUsage.update_for_log(instance._previous_daily_usage, daily_usage)
+    instance._saved_daily_usage = daily_usage
+
+
 # issue #5157
 @receiver(pre_save, sender=UserLog)
 def add_to_summary(sender, **kwargs):
@@ -12,3 +12,7 @@ except ImportError:
 #   NOTE: None means no limit (infinite)
 USER_LOG_MAX_RECORDS_PER_USER = getattr(local_settings, "USER_LOG_MAX_RECORDS_PER_USER", 1)
 USER_LOG_SUMMARY_FREQUENCY = getattr(local_settings, "USER_LOG_SUMMARY_FREQUENCY", (1, "day"))
+
+# UserLog activity updates from exercise and video progress are buffered, and written every this many seconds
+#   (see kalite.main.activity_buffer).  0 means they are written straight through.
+USER_LOG_BUFFER_SECONDS = getattr(local_settings, "USER_LOG_BUFFER_SECONDS", 5)
@@ -1,8 +1,17 @@
+import datetime
+
+from django.db import connection
+from django.db.models import F
+from django.test.utils import override_settings
 from django.utils import unittest
 
-from ..models import VideoLog, ExerciseLog
-from kalite.facility.models import Facility, FacilityUser
+from ..models import VideoLog, ExerciseLog, ExerciseTransition, ContentLog, UserDailyUsage, UserLog, UserLogSummary, UserPoints, \
+    user_activity_buffer
+from kalite.facility.models import Facility, FacilityGroup, FacilityUser
+from fle_utils.django_utils.functions import create_or_retry
 from kalite.testing.base import KALiteTestCase
+from securesync.engine.utils import prepare_models_for_sync
+from securesync.models import Device
 
 
 class TestExerciseLogs(KALiteTestCase):
@@ -53,6 +62,17 @@ class TestExerciseLogs(KALiteTestCase):
         self.assertEqual(exerciselog2.points, self.NEW_POINTS, "The ExerciseLog's points were not updated.")
         self.assertEqual(exerciselog2.attempts, self.NEW_ATTEMPTS, "The ExerciseLog's attempts were not updated.")
 
+    def test_prepared_for_sync_as_stored(self):
+        # e.g. written by an older version, with the (no) microseconds spelled out
+        connection.cursor().execute(
+            "UPDATE %s SET completion_timestamp = '2015-01-01 10:30:00.000000' WHERE id = %%s" % ExerciseLog._meta.db_table,
+            [self.original_exerciselog.id],
+        )
+
+        exerciselog = ExerciseLog.objects.get(id=self.original_exerciselog.id)
+        self.assertEqual(prepare_models_for_sync([exerciselog]), [exerciselog])
+        self.assertTrue(ExerciseLog.objects.get(id=self.original_exerciselog.id).verify())
+
     @unittest.skip("Auto-merging is not yet automatic, so skip this")
     def test_exerciselog_collision(self):
 
@@ -72,6 +92,240 @@ class TestExerciseLogs(KALiteTestCase):
         self.assertEqual(exerciselog.attempts, max(self.ORIGINAL_ATTEMPTS, self.NEW_ATTEMPTS), "The ExerciseLog's attempts have already changed.")
 
 
+class TestExerciseTransitions(KALiteTestCase):
+
+    def setUp(self):
+        super(TestExerciseTransitions, self).setUp()
+
+        self.facility = Facility(name="Test Facility")
+        self.facility.save()
+        self.group = FacilityGroup(name="Test Group", facility=self.facility)
+        self.group.save()
+        self.user = FacilityUser(username="testuser", facility=self.facility, group=self.group)
+        self.user.set_password("dumber")
+        self.user.save()
+
+    def complete(self, exercise_id, day):
+        log = ExerciseLog(exercise_id=exercise_id, user=self.user)
+        log.completion_timestamp = datetime.datetime(2015, 1, day)
+        log.save()
+        return log
+
+    def transitions(self):
+        return sorted(ExerciseTransition.objects.filter(group=self.group, count__gt=0).values_list("from_exercise_id", "to_exercise_id", "count"))
+
+    def test_completions_in_order(self):
+        self.complete("a", 1)
+        self.complete("b", 2)
+        self.complete("c", 3)
+        self.assertEqual(self.transitions(), [("a", "b", 1), ("b", "c", 1)])
+
+    def test_completion_out_of_order(self):
+        self.complete("a", 1)
+        self.complete("c", 3)
+        self.complete("b", 2)
+        self.assertEqual(self.transitions(), [("a", "b", 1), ("b", "c", 1)])
+
+    def test_completion_moved(self):
+        self.complete("a", 1)
+        b = self.complete("b", 2)
+        self.complete("c", 3)
+
+        b = ExerciseLog.objects.get(pk=b.pk)
+        b.completion_timestamp = datetime.datetime(2015, 1, 4)
+        b.save()
+        self.assertEqual(self.transitions(), [("a", "c", 1), ("c", "b", 1)])
+
+    def test_deleted_logs(self):
+        self.complete("a", 1)
+        b = self.complete("b", 2)
+        self.complete("c", 3)
+        b.soft_delete()
+        self.assertEqual(self.transitions(), [("a", "c", 1)])
+        ExerciseTransition.rebuild()
+        self.assertEqual(self.transitions(), [("a", "c", 1)])
+
+        # undeleted, from a stale instance (e.g. an imported log)
+        b = ExerciseLog(id=b.id, exercise_id="b", user=self.user, completion_timestamp=datetime.datetime(2015, 1, 2))
+        b.save()
+        self.assertEqual(self.transitions(), [("a", "b", 1), ("b", "c", 1)])
+        ExerciseTransition.rebuild()
+        self.assertEqual(self.transitions(), [("a", "b", 1), ("b", "c", 1)])
+
+    def test_rebuild(self):
+        self.complete("a", 1)
+        self.complete("b", 2)
+        expected = self.transitions()
+        ExerciseTransition.objects.all().delete()
+        ExerciseTransition.rebuild()
+        self.assertEqual(self.transitions(), expected)
+
+
+class TestUserPoints(KALiteTestCase):
+
+    def setUp(self):
+        super(TestUserPoints, self).setUp()
+
+        self.facility = Facility(name="Test Facility")
+        self.facility.save()
+        self.user = FacilityUser(username="testuser", facility=self.facility)
+        self.user.set_password("dumber")
+        self.user.save()
+
+    def points(self):
+        return UserPoints.get_points_for_user(self.user)
+
+    def test_points_added_up(self):
+        VideoLog(video_id="video", youtube_id="video", user=self.user, points=10).save()
+        ExerciseLog(exercise_id="exercise", user=self.user, points=20).save()
+        ContentLog(content_id="content", content_kind="Document", content_source="khan", user=self.user, points=30).save()
+        self.assertEqual(self.points(), 60)
+
+    def test_points_updated(self):
+        ExerciseLog(exercise_id="exercise", user=self.user, points=20).save()
+        exerciselog = ExerciseLog.objects.get(user=self.user)
+        exerciselog.points = 25
+        exerciselog.save()
+        exerciselog.save()
+        self.assertEqual(self.points(), 25)
+
+    def test_stale_instance(self):
+        # e.g. an imported log, for one that's already here
+        videolog = VideoLog(video_id="video", youtube_id="video", user=self.user, points=20)
+        videolog.save()
+        videolog = VideoLog(id=videolog.id, video_id="video", youtube_id="video", user=self.user, points=30)
+        videolog.counter = 1
+        videolog.signed_by = Device.get_own_device()
+        videolog.save(imported=True, verified=True)
+        self.assertEqual(self.points(), 30)
+
+    def test_deleted_logs(self):
+        VideoLog(video_id="video", youtube_id="video", user=self.user, points=10).save()
+        exerciselog = ExerciseLog(exercise_id="exercise", user=self.user, points=20)
+        exerciselog.save()
+        exerciselog.soft_delete()
+        self.assertEqual(self.points(), 10)
+        UserPoints.rebuild()
+        self.assertEqual(self.points(), 10)
+
+        # undeleted, from a stale instance (e.g. an imported log)
+        exerciselog = ExerciseLog(id=exerciselog.id, exercise_id="exercise", user=self.user, points=25)
+        exerciselog.save()
+        self.assertEqual(self.points(), 35)
+        UserPoints.rebuild()
+        self.assertEqual(self.points(), 35)
+
+    def test_rebuild(self):
+        VideoLog(video_id="video", youtube_id="video", user=self.user, points=10).save()
+        ExerciseLog(exercise_id="exercise", user=self.user, points=20).save()
+        ExerciseLog.objects.filter(user=self.user).update(points=40)
+        UserPoints.rebuild()
+        self.assertEqual(self.points(), 50)
+
+    def test_created_concurrently(self):
+        UserPoints.objects.create(user=self.user, points=10)
+        points = UserPoints.objects.filter(user=self.user)
+        created = create_or_retry(
+            lambda: UserPoints.objects.create(user=self.user, points=5),
+            lambda: points.update(points=F("points") + 5),
+        )
+        self.assertFalse(created)
+        self.assertEqual(self.points(), 15)
+
+
+class TestUserDailyUsage(KALiteTestCase):
+
+    def setUp(self):
+        super(TestUserDailyUsage, self).setUp()
+
+        self.facility = Facility(name="Test Facility")
+        self.facility.save()
+        self.user = FacilityUser(username="testuser", facility=self.facility)
+        self.user.set_password("dumber")
+        self.user.save()
+
+        self.day = datetime.date(2015, 3, 2)
+        self.time = datetime.datetime(2015, 3, 2, 10, 30)
+
+    def usage(self, period_start=None, period_end=None):
+        return UserDailyUsage.get_usage_for_users([self.user], period_start=period_start, period_end=period_end).get(self.user.id, {})
+
+    def test_usage_added_up(self):
+        ExerciseLog(exercise_id="exercise1", user=self.user, streak_progress=100, complete=True, latest_activity_timestamp=self.time).save()
+        ExerciseLog(exercise_id="exercise2", user=self.user, streak_progress=40, latest_activity_timestamp=self.time).save()
+        VideoLog(video_id="video1", youtube_id="video1", user=self.user, total_seconds_watched=30, latest_activity_timestamp=self.time).save()
+        VideoLog(video_id="video2", youtube_id="video2", user=self.user, total_seconds_watched=0, latest_activity_timestamp=self.time).save()
+        UserLogSummary(device=Device.get_own_device(), user=self.user, activity_type=1, start_datetime=self.time, total_seconds=600, count=2).save()
+
+        usage = self.usage()
+        self.assertEqual(usage["exercises_attempted"], 2)
+        self.assertEqual(usage["exercises_mastered"], 1)
+        self.assertEqual(usage["mastery_sum"], 140)
+        self.assertEqual(usage["videos_watched"], 1)
+        self.assertEqual(usage["login_seconds"], 600)
+        self.assertEqual(usage["logins"], 2)
+
+    def test_usage_moves_between_days(self):
+        exerciselog = ExerciseLog(exercise_id="exercise", user=self.user, streak_progress=10, latest_activity_timestamp=self.time)
+        exerciselog.save()
+        exerciselog.streak_progress = 30
+        exerciselog.latest_activity_timestamp = self.time + datetime.timedelta(days=1)
+        exerciselog.save()
+
+        self.assertEqual(self.usage(period_end=self.day)["exercises_attempted"], 0)
+        self.assertEqual(self.usage(period_start=self.day)["exercises_attempted"], 1)
+        self.assertEqual(self.usage(period_start=self.day)["mastery_sum"], 30)
+
+    def test_rebuild(self):
+        ExerciseLog(exercise_id="exercise", user=self.user, streak_progress=10, latest_activity_timestamp=self.time).save()
+        ExerciseLog.objects.filter(user=self.user).update(streak_progress=50)
+        UserDailyUsage.rebuild()
+        self.assertEqual(self.usage(period_start=self.day, period_end=self.day)["mastery_sum"], 50)
+
+
+@override_settings(USER_LOG_BUFFER_SECONDS=60)
+class TestUserActivityBuffer(KALiteTestCase):
+
+    def setUp(self):
+        super(TestUserActivityBuffer, self).setUp()
+
+        self.facility = Facility(name="Test Facility")
+        self.facility.save()
+        self.user = FacilityUser(username="testuser", facility=self.facility)
+        self.user.set_password("dumber")
+        self.user.save()
+
+        self.time = datetime.datetime(2015, 3, 2, 10, 30)
+        user_activity_buffer.clear()
+
+    def tearDown(self):
+        user_activity_buffer.clear()
+        super(TestUserActivityBuffer, self).tearDown()
+
+    def test_updates_coalesced(self):
+        UserLog.begin_user_activity(self.user, start_datetime=self.time)
+        for minutes in (5, 2):
+            ExerciseLog(exercise_id="exercise%d" % minutes, user=self.user, language="en",
+                        completion_timestamp=self.time + datetime.timedelta(minutes=minutes)).save()
+
+        self.assertEqual(user_activity_buffer.count(), 1)
+        self.assertEqual(UserLog.objects.get(user=self.user).last_active_datetime, self.time)
+
+        user_activity_buffer.flush()
+        userlog = UserLog.objects.get(user=self.user)
+        self.assertEqual(userlog.last_active_datetime, self.time + datetime.timedelta(minutes=5))
+        self.assertEqual(userlog.language, "en")
+
+    def test_flushed_on_end(self):
+        UserLog.begin_user_activity(self.user, start_datetime=self.time)
+        VideoLog(video_id="video", youtube_id="video", user=self.user,
+                 completion_timestamp=self.time + datetime.timedelta(minutes=10)).save()
+        UserLog.end_user_activity(self.user, end_datetime=self.time + datetime.timedelta(minutes=15))
+
+        self.assertEqual(user_activity_buffer.count(), 0)
+        self.assertEqual(UserLog.objects.get(user=self.user).total_seconds, 600)
+
+
 class TestVideoLogs(KALiteTestCase):
 
     ORIGINAL_POINTS = 37
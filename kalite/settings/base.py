@@ -310,14 +310,24 @@ DEFAULT_DATABASE_PATH = getattr(local_settings, "DATABASE_PATH", DEFAULT_DATABAS
 
 DATABASES = getattr(local_settings, "DATABASES", {
     "default": {
-        "ENGINE": getattr(local_settings, "DATABASE_TYPE", "django.db.backends.sqlite3"),
+        # Sets up WAL journaling, and writes from one thread (see fle_utils.django_utils.db_backends.sqlite3.base)
+        "ENGINE": getattr(local_settings, "DATABASE_TYPE", "fle_utils.django_utils.db_backends.sqlite3"),
         "NAME": DEFAULT_DATABASE_PATH,
         "OPTIONS": {
             "timeout": 60,
         },
+        "PRAGMAS": getattr(local_settings, "DATABASE_PRAGMAS", {}),
+        "WRITE_QUEUE_SIZE": getattr(local_settings, "DATABASE_WRITE_QUEUE_SIZE", 256),
+        "WRITE_BATCH_SIZE": getattr(local_settings, "DATABASE_WRITE_BATCH_SIZE", 64),
     }
 })
 
+# South doesn't know the sqlite3 backend above, though it's sqlite3 all the same.
+SOUTH_DATABASE_ADAPTERS = dict(
+    (alias, "south.db.sqlite3") for alias, database in DATABASES.items()
+    if database["ENGINE"] == "fle_utils.django_utils.db_backends.sqlite3"
+)
+
 INTERNAL_IPS = getattr(local_settings, "INTERNAL_IPS", ("127.0.0.1",))
 ALLOWED_HOSTS = getattr(local_settings, "ALLOWED_HOSTS", ['*'])
 
@@ -502,8 +512,14 @@ CACHES = {
 KEY_PREFIX = version.VERSION
 
 # Separate session caching from file caching.
+# Sessions are kept on the server, so that only the session key goes back and forth
+# with every request, and logged in users are stored in them by id (see kalite.facility.sessions).
 SESSION_ENGINE = getattr(
-    local_settings, "SESSION_ENGINE", 'django.contrib.sessions.backends.signed_cookies' + (''))
+    local_settings, "SESSION_ENGINE", 'kalite.facility.sessions')
+
+# Where the session files are kept, created when first used; expired ones are cleared out daily
+# by the job scheduler (see kalite.facility.sessions.schedule_clearing_expired_sessions).
+SESSION_FILE_PATH = getattr(local_settings, "SESSION_FILE_PATH", os.path.join(USER_DATA_ROOT, "sessions"))
 
 # Expire session cookies after 30 minutes, but extend sessions when there's activity from the user.
 SESSION_COOKIE_AGE = 60 * 30     # 30 minutes
@@ -531,6 +547,15 @@ LOGOUT_URL = "/securesync/api/user/logout/"
 # 18 threads seems a sweet spot
 CHERRYPY_THREAD_COUNT = getattr(local_settings, "CHERRYPY_THREAD_COUNT", 18)
 
+# With more than one, `kalite start` serves from this many processes (of CHERRYPY_THREAD_COUNT threads each),
+#   forked from one that supervises them, to use more than one CPU core (POSIX only).  Each has its own in-memory
+#   caches; see kalite.distributed.prefork for which.
+CHERRYPY_WORKER_PROCESSES = getattr(local_settings, "CHERRYPY_WORKER_PROCESSES", 1)
+
+# Threads (of each process) sending content files, videos above all, which can take them for as long as
+#   a video plays, apart from the CHERRYPY_THREAD_COUNT that serve everything else
+CHERRYPY_STREAM_THREAD_COUNT = getattr(local_settings, "CHERRYPY_STREAM_THREAD_COUNT", 40)
+
 # PRAGMAs to pass to SQLite when we first open the content DBs for reading. Used mostly for optimizations.
 CONTENT_DB_SQLITE_PRAGMAS = []
 
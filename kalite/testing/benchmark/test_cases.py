@@ -38,19 +38,21 @@
 'class': 'Hello_world'
 }
  """
+import random
+import threading
 import time
 import datetime
 
 from django.conf import settings; logging = settings.LOG
 from django.core import management
-from django.db import transaction
+from django.db import connection, transaction, DatabaseError
 from selenium.webdriver.support import expected_conditions, ui
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.by import By
 
 from . import base
 from kalite.facility.models import Facility, FacilityUser, FacilityGroup
-from kalite.main.models import ExerciseLog, VideoLog, UserLog
+from kalite.main.models import AttemptLog, ExerciseLog, VideoLog, UserLog
 from kalite.topic_tools.content_models import get_content_items
 
 
@@ -186,6 +188,98 @@ class OneHundredRandomLogUpdatesSingleTransaction(OneHundredRandomLogUpdates):
         super(OneHundredRandomLogUpdatesSingleTransaction, self)._execute()
 
 
+class ConcurrentLearners(base.Common):
+    """
+    Many learners answering exercises at the same time, each in their own thread (as the server's request
+    threads would), each answer saving an AttemptLog and updating the ExerciseLog.
+    The I/O here is mostly INSERT and UPDATE, from all threads at once, so it's about contention for the database.
+
+    Reports the fraction of answers that failed on the database being locked, and the latency of answers.
+    To compare database setups, run it with DATABASE_TYPE = "django.db.backends.sqlite3" in local_settings,
+    and without (for WAL, and writes queued for one thread).
+    """
+
+    def _setup(self, learners=50, answers=20, think_time=0.0, **kwargs):
+        super(ConcurrentLearners, self)._setup(**kwargs)
+
+        self.learners = int(learners)
+        self.answers = int(answers)
+        self.think_time = float(think_time)  # the most seconds a learner waits between answers
+
+        facility = Facility.objects.get_or_create(name="Benchmark Facility")[0]
+        self.users = []
+        for i in range(self.learners):
+            try:
+                user = FacilityUser.objects.get(username="benchmark_learner_%d" % i, facility=facility)
+            except FacilityUser.DoesNotExist:
+                user = FacilityUser(username="benchmark_learner_%d" % i, facility=facility)
+                user.set_password("benchmark_pass")
+                user.save()
+            self.users.append(user)
+
+    def _execute(self):
+        self.latencies = []
+        self.lock_errors = 0
+        self.other_errors = 0
+        self.results_lock = threading.Lock()
+
+        threads = [
+            threading.Thread(target=self._answer_exercises, args=(user, self.random.random()))
+            for user in self.users
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _answer_exercises(self, user, seed):
+        rand = random.Random(seed)
+        try:
+            for i in range(self.answers):
+                exercise_id = "benchmark_exercise_%d" % rand.randint(0, 9)
+                correct = rand.random() < 0.7
+                start_time = time.time()
+                error = None
+                try:
+                    AttemptLog(user=user, exercise_id=exercise_id, correct=correct, complete=correct,
+                               timestamp=datetime.datetime.now(), context_type="benchmark").save()
+                    exercise_log = ExerciseLog.objects.get_or_create(user=user, exercise_id=exercise_id)[0]
+                    exercise_log.attempts += 1
+                    if correct:
+                        exercise_log.streak_progress = min(100, exercise_log.streak_progress + 10)
+                    exercise_log.save()
+                except DatabaseError as e:
+                    error = e
+                    logging.debug("Failed to save answer: %s" % e)
+
+                with self.results_lock:
+                    self.latencies.append(time.time() - start_time)
+                    if error is not None:
+                        if "locked" in str(error):
+                            self.lock_errors += 1
+                        else:
+                            self.other_errors += 1
+
+                time.sleep(rand.random() * self.think_time)
+        finally:
+            connection.close()
+
+    def _get_post_execute_info(self):
+        latencies = sorted(self.latencies)
+        percentile = lambda p: latencies[int(round(p * (len(latencies) - 1)))] if latencies else None
+        return {
+            "database_engine": settings.DATABASES["default"]["ENGINE"],
+            "learners": self.learners,
+            "answers": len(latencies),
+            "lock_errors": self.lock_errors,
+            "other_errors": self.other_errors,
+            "lock_error_rate": float(self.lock_errors) / len(latencies) if latencies else None,
+            "p50_latency": percentile(0.5),
+            "p99_latency": percentile(0.99),
+            "max_latency": latencies[-1] if latencies else None,
+        }
+
+
 class LoginLogout(base.SeleniumCommon):
 
     def _setup(self, **kwargs):
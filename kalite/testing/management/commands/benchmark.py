@@ -24,11 +24,14 @@ class BenchmarkThread(threading.Thread):
         with open(self.outfile, "a") as fp:
             fp.write("%s\n" % rv["average_elapsed"])
         print "Average elapsed (%d): %s" % (self.threadID, rv["average_elapsed"])
+        for iteration, info in sorted(rv["post_execute_info"].items()):
+            if info:
+                print "Results (%d), iteration %d: %s" % (self.threadID, iteration, info)
         print "Exiting (%d)" % self.threadID
 
 
 class Command(BaseCommand):
-    help = "Benchmarking.  Choose from: loginlogout, seleniumstudent, generatedata, 1000reads, 100updates, and more!"
+    help = "Benchmarking.  Choose from: loginlogout, seleniumstudent, generatedata, 1000reads, 100updates, learners, and more!"
 
     option_list = BaseCommand.option_list + (
         make_option(
@@ -97,6 +100,14 @@ class Command(BaseCommand):
             default=24601,
             help='profile (i.e. random seed)',
         ),
+        make_option(
+            '--learners',
+            action='store',
+            dest='learners',
+            type="int",
+            default=50,
+            help='# of simultaneous learners, for the learners benchmark',
+        ),
         make_option(
             '--file',
             action='store',
@@ -116,6 +127,7 @@ class Command(BaseCommand):
         "100updates_transact": OneHundredRandomLogUpdatesSingleTransaction,
         "helloworld": HelloWorld,
         "validate": ValidateModels,
+        "learners": ConcurrentLearners,
     }
 
     def handle(self, *args, **options):
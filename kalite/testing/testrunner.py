@@ -127,6 +127,12 @@ class KALiteTestRunner(DjangoTestSuiteRunner):
 
         super(KALiteTestRunner, self).__init__(*args, **kwargs)
 
+    def setup_test_environment(self, **kwargs):
+        super(KALiteTestRunner, self).setup_test_environment(**kwargs)
+        # The in-memory test database can't be seen from the thread that flushes buffered user activity,
+        #   so write it straight through.
+        settings.USER_LOG_BUFFER_SECONDS = 0
+
     def make_bdd_test_suite(self, features_dir, feature_name=None):
         return DjangoBehaveTestCase(features_dir=features_dir, option_info=self.option_info, feature_name=feature_name)
 
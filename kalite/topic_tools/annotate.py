@@ -1,3 +1,4 @@
+import hashlib
 import os
 
 from django.conf import settings as django_settings
@@ -23,6 +24,88 @@ def create_thumbnail_url(thumbnail):
     return None
 
 
+def _iter_subtitle_files():
+    """
+    Yield (language code, directory, filename) for every subtitle file.
+    """
+    if os.path.exists(get_subtitle_file_path()):
+        for (dirpath, dirnames, filenames) in os.walk(get_subtitle_file_path()):
+            # Only both looking at files that are inside a 'subtitles' directory
+            if os.path.basename(dirpath) == "subtitles":
+                lc = os.path.basename(os.path.dirname(dirpath))
+                for filename in filenames:
+                    yield lc, dirpath, filename
+
+
+def _settings_fingerprint():
+    """
+    Fingerprint of the settings that the annotation of a content item depends on, other than the files on disk.
+    """
+    values = [
+        django_settings.CONTENT_ROOT,
+        django_settings.CONTENT_URL,
+        django_settings.STATIC_URL,
+        django_settings.BACKUP_VIDEO_SOURCE,
+    ]
+    return hashlib.md5(repr(values)).hexdigest()
+
+
+# Manifest entries that are not files, but the settings the manifest was made with.
+SETTINGS_MANIFEST_PREFIX = ":settings:"
+
+
+def get_content_files_manifest():
+    """
+    Take stock of all the files that content annotation depends on: content files (videos, thumbnails),
+    and subtitles. Changes to the settings used for annotation are recorded as a pseudo-file.
+    :return: A dictionary mapping file names to (size, mtime) tuples.
+    """
+    manifest = {SETTINGS_MANIFEST_PREFIX + _settings_fingerprint(): (0, 0)}
+
+    try:
+        contents_folder = os.listdir(django_settings.CONTENT_ROOT)
+    except OSError:
+        contents_folder = []
+
+    for filename in contents_folder:
+        try:
+            stat = os.stat(os.path.join(django_settings.CONTENT_ROOT, filename))
+        except OSError:
+            continue
+        manifest[filename] = (stat.st_size, stat.st_mtime)
+
+    for lc, dirpath, filename in _iter_subtitle_files():
+        try:
+            stat = os.stat(os.path.join(dirpath, filename))
+        except OSError:
+            continue
+        manifest["/".join(["subtitles", lc, filename])] = (stat.st_size, stat.st_mtime)
+
+    return manifest
+
+
+def diff_content_files_manifest(old_manifest, new_manifest):
+    """
+    Find the content items affected by changes to files since an earlier manifest.
+    :param old_manifest: Manifest as returned by get_content_files_manifest, from the last annotation.
+    :param new_manifest: Manifest of the files as they are now.
+    :return: A set of the ids (content ids or youtube ids) that need to be annotated again,
+        or None if everything needs to be annotated.
+    """
+    if not old_manifest:
+        return None
+
+    ids = set()
+    for filename in set(old_manifest) | set(new_manifest):
+        if old_manifest.get(filename) == new_manifest.get(filename):
+            continue
+        if filename.startswith(SETTINGS_MANIFEST_PREFIX):
+            return None
+        # Content files and subtitles are named after the content id or youtube id they belong to.
+        ids.add(os.path.splitext(os.path.basename(filename))[0])
+    return ids
+
+
 def update_content_availability(content_list, language="en", channel="khan"):
     # Loop through all content items and put thumbnail urls, content urls,
     # and subtitle urls on the content dictionary, and list all languages
@@ -30,22 +113,17 @@ def update_content_availability(content_list, language="en", channel="khan"):
 
     # turn this whole function into a generator
     try:
-        contents_folder = os.listdir(django_settings.CONTENT_ROOT)
+        contents_folder = set(os.listdir(django_settings.CONTENT_ROOT))
     except OSError:
-        contents_folder = []
+        contents_folder = set()
 
     subtitle_langs = {}
 
-    if os.path.exists(get_subtitle_file_path()):
-        for (dirpath, dirnames, filenames) in os.walk(get_subtitle_file_path()):
-            # Only both looking at files that are inside a 'subtitles' directory
-            if os.path.basename(dirpath) == "subtitles":
-                lc = os.path.basename(os.path.dirname(dirpath))
-                for filename in filenames:
-                    if filename in subtitle_langs:
-                        subtitle_langs[filename].append(lc)
-                    else:
-                        subtitle_langs[filename] = [lc]
+    for lc, dirpath, filename in _iter_subtitle_files():
+        if filename in subtitle_langs:
+            subtitle_langs[filename].append(lc)
+        else:
+            subtitle_langs[filename] = [lc]
 
     subtitle_language_dir = language.replace("-", "_")
 
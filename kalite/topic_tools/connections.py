@@ -0,0 +1,172 @@
+"""
+Long-lived connections to the content databases.
+
+Opening a content database means opening the sqlite file, running the configured PRAGMAs and registering
+peewee's connection hooks. Doing that for every call into `content_models` is a large share of the cost of
+serving the topic tree, so connections are kept open and reused instead.
+
+Each thread (e.g. each CherryPy worker) gets its own connection per database file, as sqlite connections
+cannot be shared between threads. A connection is reopened when the database is invalidated explicitly
+(e.g. after a content pack has been extracted over it) or when the file on disk has been replaced (by another
+process, say). Writes to the database (e.g. annotating content availability) don't reopen anything.
+"""
+import os
+import threading
+
+from contextlib import contextmanager
+
+from peewee import SqliteDatabase, OperationalError
+
+from django.conf import settings
+
+from .search import register_search_functions
+
+
+class ContentDatabase(SqliteDatabase):
+    """
+    A content database connection, with the SQL functions used by content queries registered on it.
+    """
+
+    def _add_conn_hooks(self, conn):
+        super(ContentDatabase, self)._add_conn_hooks(conn)
+        register_search_functions(conn)
+
+
+class ContentDatabaseProxy(threading.local):
+    """
+    Stands in for the database of the content models, resolving to whichever content database
+    has been bound to the current thread by `bind_content_database`.
+    """
+    obj = None
+    depth = 0
+
+    def __getattr__(self, attr):
+        if self.obj is None:
+            raise OperationalError("No content database has been selected for this thread.")
+        return getattr(self.obj, attr)
+
+
+class ContentDatabaseRegistry(object):
+    """
+    Registry of open content database connections, keyed by database path and held per thread.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._generations = {}
+        self._stats = {
+            "opened": 0,
+            "hits": 0,
+            "misses": 0,
+            "invalidations": 0,
+        }
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _file_identity(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino
+
+    def version(self, path):
+        """
+        A value that changes whenever the database at `path` is invalidated or replaced on disk,
+        but not when it's written to.  Useful for keying data derived from its structure.
+        """
+        return self._generations.setdefault(path, 0), self._file_identity(path)
+
+    def get(self, path):
+        """
+        Return a connected SqliteDatabase for `path`, reusing this thread's connection if it is still current.
+        :param path: Path to the content database file.
+        :return: SqliteDatabase
+        """
+        databases = self._local.__dict__.setdefault("databases", {})
+        key = self.version(path)
+
+        entry = databases.get(path)
+        if entry and entry[0] == key and not entry[1].is_closed():
+            self._count("hits")
+            return entry[1]
+
+        self._count("misses")
+        if entry and not entry[1].is_closed():
+            entry[1].close()
+
+        db = ContentDatabase(path, pragmas=list(settings.CONTENT_DB_SQLITE_PRAGMAS), threadlocals=False)
+        db.connect()
+        self._count("opened")
+
+        # Connecting may have created the file, so record its identity as of now.
+        databases[path] = (self.version(path), db)
+        return db
+
+    def invalidate(self, path=None):
+        """
+        Force connections to be reopened on their next use, e.g. because a content database has been replaced.
+        Connections held by other threads are closed by those threads when they next ask for them.
+        :param path: Path to the content database to invalidate. If None, invalidate all of them.
+        """
+        with self._lock:
+            paths = [path] if path else self._generations.keys()
+            for p in paths:
+                self._generations[p] = self._generations.get(p, 0) + 1
+            self._stats["invalidations"] += 1
+
+        # Our own connections can be closed straight away.
+        databases = self._local.__dict__.get("databases", {})
+        for p in paths:
+            entry = databases.pop(p, None)
+            if entry and not entry[1].is_closed():
+                entry[1].close()
+
+    def stats(self):
+        """
+        :return: A dictionary of connection counts: opened, hits, misses and invalidations.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+
+registry = ContentDatabaseRegistry()
+
+content_database = ContentDatabaseProxy()
+
+
+@contextmanager
+def bind_content_database(db):
+    """
+    Point the content models at `db` for the current thread only.
+    The outermost binding is left in place on exit, so that querysets returned from
+    the wrapped function can still be evaluated against the right database.
+    """
+    previous = content_database.obj
+    content_database.obj = db
+    content_database.depth += 1
+    try:
+        yield db
+    finally:
+        content_database.depth -= 1
+        if content_database.depth:
+            content_database.obj = previous
+
+
+def get_content_database(path):
+    return registry.get(path)
+
+
+def get_content_database_version(path):
+    return registry.version(path)
+
+
+def invalidate_content_database(path=None):
+    registry.invalidate(path)
+
+
+def get_connection_stats():
+    return registry.stats()
@@ -16,23 +16,27 @@ import json
 
 import itertools
 
-from peewee import Model, SqliteDatabase, CharField, TextField, BooleanField, ForeignKeyField, PrimaryKeyField, Using,\
+from peewee import Model, CharField, TextField, BooleanField, ForeignKeyField, PrimaryKeyField, Using, \
     DoesNotExist, fn, IntegerField, OperationalError, FloatField
 
 from playhouse.shortcuts import model_to_dict
 
 from .base import available_content_databases
 from .settings import CONTENT_DATABASE_PATH, CHANNEL
-from .annotate import update_content_availability
+from .annotate import update_content_availability, get_content_files_manifest, diff_content_files_manifest
+from .connections import content_database, get_content_database, bind_content_database
+from .tree_index import get_topic_tree_index, path_range, TOPIC_NODE_FIELDS, LEAF_KINDS
+from . import search
 
 from django.conf import settings
 logging = settings.LOG
 
 
-# This Item is defined without a database.
+# This Item is defined without a concrete database.
 # This allows us to use a separate database for each language, so that we
 # can reduce performance cost, and keep queries simple for multiple languages.
 # In addition, we can distribute databases separately for each language pack.
+# The content_database proxy resolves to the database selected by set_database in the current thread.
 class Item(Model):
     title = CharField()
     description = TextField()
@@ -52,6 +56,7 @@ class Item(Model):
     sort_order = FloatField(default=0)
 
     class Meta:
+        database = content_database
         # Order by sort_order by default for all queries.
         order_by = ('sort_order',)
 
@@ -68,6 +73,9 @@ class AssessmentItem(Model):
     item_data = TextField()  # A serialized JSON blob
     author_names = CharField(max_length=200)  # A serialized JSON list
 
+    class Meta:
+        database = content_database
+
 
 def parse_model_data(item):
     extra_fields = item.get("extra_fields", {})
@@ -101,6 +109,7 @@ def unparse_model_data(item):
 def set_database(function):
     """
     Sets the appropriate database for the ensuing model interactions.
+    Connections are kept open per thread and reused across calls, see connections.py.
     """
 
     def wrapper(*args, **kwargs):
@@ -113,15 +122,13 @@ def set_database(function):
                 language=language
             )
 
-        db = SqliteDatabase(path, pragmas=settings.CONTENT_DB_SQLITE_PRAGMAS)
+        db = get_content_database(path)
 
         kwargs["db"] = db
 
-        db.connect()
+        # All models in the database (Item, AssessmentItem) use the bound database in the wrapped function
 
-        # This should contain all models in the database to make them available to the wrapped function
-
-        with Using(db, [Item, AssessmentItem]):
+        with bind_content_database(db), db.atomic():
 
             try:
 
@@ -133,7 +140,6 @@ def set_database(function):
             except OperationalError:
                 logging.error("No content database file found")
                 raise
-        db.close()
 
         return output
     return wrapper
@@ -154,10 +160,12 @@ def parse_data(function):
 
         if dicts and output:
             try:
+                # Functions served from the topic tree index return dictionaries already.
+                rows = output if isinstance(output, list) else output.dicts()
                 if expanded:
-                    output = map(unparse_model_data, output.dicts())
+                    output = map(unparse_model_data, rows)
                 else:
-                    output = [item for item in output.dicts()]
+                    output = [item for item in rows]
             except (TypeError, OperationalError):
                 logging.warn("No content database file found")
                 output = []
@@ -165,6 +173,37 @@ def parse_data(function):
     return wrapper
 
 
+def _topic_node_dict(node):
+    return dict((field, getattr(node, field)) for field in TOPIC_NODE_FIELDS)
+
+
+def _select_nodes(nodes, chunk_size=500):
+    """
+    Fetch the full rows for a list of topic tree index nodes, keeping their order.
+    Selects by primary key in chunks, to stay below SQLite's limit on query parameters.
+    """
+    rows = {}
+    pks = [node.pk for node in nodes]
+    for idx in range(0, len(pks), chunk_size):
+        for row in Item.select().where(Item.pk.in_(pks[idx:idx + chunk_size])).dicts():
+            rows[row["pk"]] = row
+    return [rows[pk] for pk in pks if pk in rows]
+
+
+def _child_nodes(index, parent):
+    """
+    Children of all nodes with id `parent` (or of the root nodes), in the default ordering.
+    """
+    if parent == "root":
+        parents = index.roots()
+    else:
+        parents = index.nodes_by_id(parent)
+    if len(parents) == 1:
+        return index.children(parents[0].pk)
+    children = [child for node in parents for child in index.children(node.pk)]
+    return sorted(children, key=lambda node: (node.sort_order, node.pk))
+
+
 @parse_data
 @set_database
 def get_random_content(kinds=None, limit=1, available=None, **kwargs):
@@ -227,35 +266,14 @@ def get_topic_nodes(parent=None, ids=None, **kwargs):
     :param ids: A list of ids to return.
     :return: A list of content dictionaries with limited fields.
     """
+    db = kwargs.get("db")
     if parent:
-        Parent = Item.alias()
-        if parent == "root":
-            selector = Parent.parent.is_null()
-        else:
-            selector = Parent.id == parent
-        values = Item.select(
-            Item.title,
-            Item.description,
-            Item.available,
-            Item.kind,
-            Item.children,
-            Item.id,
-            Item.path,
-            Item.slug,
-        ).join(Parent, on=(Item.parent == Parent.pk)).where(selector & Item.available)
-        return values
+        index = get_topic_tree_index(db)
+        return [_topic_node_dict(node) for node in _child_nodes(index, parent) if node.available]
     elif ids:
-        values = Item.select(
-            Item.title,
-            Item.description,
-            Item.available,
-            Item.kind,
-            Item.children,
-            Item.id,
-            Item.path,
-            Item.slug,
-        ).where(Item.id.in_(ids))
-        return values
+        index = get_topic_tree_index(db)
+        nodes = [node for id in set(ids) for node in index.nodes_by_id(id)]
+        return [_topic_node_dict(node) for node in sorted(nodes, key=lambda node: (node.sort_order, node.pk))]
 
 
 @parse_data
@@ -323,24 +341,12 @@ def get_topic_nodes_with_children(parent=None, **kwargs):
     :return: A list of content dictionaries with the specified parent, with a children field as a list of ids.
     """
     if parent:
-        Parent = Item.alias()
-        Child = Item.alias()
-        if parent == "root":
-            selector = Parent.parent.is_null()
-        else:
-            selector = Parent.id == parent
-        child_values = [item for item in Item.select(
-            Child
-        ).join(Child, on=(Child.parent == Item.pk)).join(Parent, on=(Item.parent == Parent.pk)).where(selector).dicts()]
-        parent_values = [item for item in Item.select(
-            Item
-        ).join(Parent, on=(Item.parent == Parent.pk)).where(selector).dicts()]
+        index = get_topic_tree_index(kwargs.get("db"))
         topics = []
-        for topic in parent_values:
-            output = {}
-            output.update(topic)
-            output["children"] = [child["id"] for child in child_values if child["parent"] == topic["pk"]]
-            topics.append(output)
+        for topic in _select_nodes(_child_nodes(index, parent)):
+            # Children are listed in the order they are stored in the database, not by sort_order.
+            topic["children"] = [child.id for child in sorted(index.children(topic["pk"]), key=lambda node: node.pk)]
+            topics.append(topic)
         return topics
 
 
@@ -353,13 +359,14 @@ def get_content_parents(ids=None, **kwargs):
     :return: A list of content dictionaries.
     """
     if ids:
-        Parent = Item.alias()
-        parent_values = Item.select(
-            Parent
-        ).join(Parent, on=(Item.parent == Parent.pk)).where(Item.id.in_(ids)).distinct()
-        if parent_values is None:
-            parent_values = list()
-        return parent_values
+        index = get_topic_tree_index(kwargs.get("db"))
+        parents = {}
+        for id in set(ids):
+            for node in index.nodes_by_id(id):
+                parent = index.node(node.parent)
+                if parent is not None:
+                    parents[parent.pk] = parent
+        return _select_nodes(sorted(parents.values(), key=lambda node: (node.sort_order, node.pk)))
     else:
         return list()
 
@@ -390,11 +397,80 @@ def get_topic_contents(kinds=None, topic_id=None, **kwargs):
     :return: A list of content dictionaries.
     """
     if topic_id:
-        topic_node = Item.get(Item.id == topic_id, Item.kind == "Topic")
+        topic_nodes = get_topic_tree_index(kwargs.get("db")).nodes_by_id(topic_id, topic=True)
+        if not topic_nodes:
+            return None
 
         if not kinds:
-            kinds = ["Video", "Audio", "Exercise", "Document"]
-        return Item.select(Item).where(Item.kind.in_(kinds), Item.path.contains(topic_node.path))
+            kinds = LEAF_KINDS
+        # All descendants share the path of the topic as a prefix, so use a range scan on the path index.
+        lower, upper = path_range(topic_nodes[0].path)
+        return Item.select(Item).where(Item.kind.in_(kinds), Item.path >= lower, Item.path < upper)
+
+
+def _topics_leaves(index, topic_ids, kinds=None):
+    """
+    Leaf nodes contained within any of a set of topics, each only once, in the default ordering.
+    """
+    leaves = {}
+    for topic_id in topic_ids:
+        topic_nodes = index.nodes_by_id(topic_id, topic=True)
+        if topic_nodes:
+            for node in index.leaves(topic_nodes[0].pk, kinds=kinds):
+                leaves[node.pk] = node
+    return sorted(leaves.values(), key=lambda node: (node.sort_order, node.pk))
+
+
+@set_database
+def get_topics_content_ids(kinds=None, topic_ids=None, **kwargs):
+    """
+    Convenience function for returning the ids of the content/leaf nodes contained within a set of topics.
+    Answered from the topic tree index alone, without querying the content database.
+    :param kinds: A list of content kinds to select from.
+    :param topic_ids: A list of ids of the topics to select within.
+    :return: A list of content ids.
+    """
+    if topic_ids:
+        leaves = _topics_leaves(get_topic_tree_index(kwargs.get("db")), topic_ids, kinds=kinds)
+        return list(set(node.id for node in leaves))
+    else:
+        return list()
+
+
+@set_database
+def get_topics_content_ids_by_kind(kinds=None, topic_ids=None, **kwargs):
+    """
+    Convenience function for returning the ids of the content/leaf nodes contained within each of a set of topics,
+    separately for each topic and kind.  Answered from the topic tree index alone, without querying the content database.
+    :param kinds: A list of content kinds to select from.
+    :param topic_ids: A list of ids of the topics to select within.
+    :return: A dict of topic id to a dict of content kind to a set of content ids (empty for unknown topics).
+    """
+    index = get_topic_tree_index(kwargs.get("db"))
+    content_ids = {}
+    for topic_id in topic_ids or []:
+        topic_nodes = index.nodes_by_id(topic_id, topic=True)
+        content_ids[topic_id] = dict(
+            (kind, set(node.id for node in index.leaves(topic_nodes[0].pk, kinds=[kind])) if topic_nodes else set())
+            for kind in (kinds or LEAF_KINDS)
+        )
+    return content_ids
+
+
+@parse_data
+@set_database
+def get_topics_contents(kinds=None, topic_ids=None, **kwargs):
+    """
+    Convenience function for returning the content/leaf nodes contained within any of a set of topics,
+    as get_topic_contents does for one topic, but fetched all together.
+    :param kinds: A list of content kinds to select from.
+    :param topic_ids: A list of ids of the topics to select within.
+    :return: A list of content dictionaries.
+    """
+    if topic_ids:
+        return _select_nodes(_topics_leaves(get_topic_tree_index(kwargs.get("db")), topic_ids, kinds=kinds))
+    else:
+        return list()
 
 
 @set_database
@@ -451,16 +527,42 @@ def _get_video_from_youtube_id(youtube_id=None, **kwargs):
 
 
 @set_database
-def search_topic_nodes(kinds=None, query=None, page=1, items_per_page=10, exact=True, **kwargs):
+def search_topic_nodes(kinds=None, query=None, page=1, items_per_page=10, exact=True, after=None, **kwargs):
     """
     Search all nodes and return limited fields.
+    Uses the full text search index of the content database if it has one, see search.py.
     :param kinds: A list of content kinds.
     :param query: Text string to search for in titles or extra fields.
     :param page: Which page of the paginated search to return.
     :param items_per_page: How many items on each page of the paginated search.
     :param exact: Flag to allow for an exact match, if false, always return more than one item.
+    :param after: Path of the last node on the previous page; if given, return the page following it instead of `page`.
     :return: A list of dictionaries containing content metadata.
     """
+    db = kwargs.get("db")
+    if query and search.has_search_index(db):
+        if not kinds:
+            kinds = ["Video", "Audio", "Exercise", "Document", "Topic"]
+        topic_node = search.search_exact(db, query, kinds)
+        if topic_node and exact:
+            # If allowing an exact match, just return that one match and we're done!
+            return [topic_node], True, None
+        # Fetch one more than needed to find out whether there is a next page, rather than counting all matches.
+        topic_nodes = search.search(db, query, kinds, limit=items_per_page + 1, offset=(page - 1) * items_per_page, after=after)
+        pages = page + 1 if len(topic_nodes) > items_per_page else page
+        topic_nodes = topic_nodes[:items_per_page]
+        if topic_node and page == 1 and not after:
+            # If we got an exact match, show it first.
+            topic_nodes = [topic_node] + [node for node in topic_nodes if node["path"] != topic_node["path"]]
+        return topic_nodes, False, pages
+    return _search_topic_nodes_like(kinds=kinds, query=query, page=page, items_per_page=items_per_page, exact=exact)
+
+
+def _search_topic_nodes_like(kinds=None, query=None, page=1, items_per_page=10, exact=True):
+    """
+    Search by substring, for content databases without a search index.
+    Takes the same arguments as search_topic_nodes, and must be called with the database set.
+    """
     if query:
         if not kinds:
             kinds = ["Video", "Audio", "Exercise", "Document", "Topic"]
@@ -646,6 +748,16 @@ def create_table(**kwargs):
         db.create_tables([Item, AssessmentItem])
 
 
+@set_database
+def create_search_index(**kwargs):
+    """
+    Build the full text search index used by search_topic_nodes, replacing any existing one.
+    """
+    db = kwargs.get("db")
+    if db:
+        search.build_search_index(db)
+
+
 def annotate_content_models_by_youtube_id(channel="khan", language="en", youtube_ids=None):
     """
     Annotate content models that have the youtube ids specified in a list.
@@ -656,8 +768,157 @@ def annotate_content_models_by_youtube_id(channel="khan", language="en", youtube
     annotate_content_models(channel=channel, language=language, ids=youtube_ids, iterator_content_items=iterator_content_items_by_youtube_id)
 
 
+def _apply_content_updates(db, content_models, chunk_size=500):
+    """
+    Write the updates yielded by a content item iterator, with one batched UPDATE for all items.
+    Updates to model fields are written to their columns, anything else is merged into extra_fields.
+    :param content_models: Iterable of (path, update) tuples.
+    :return: A list of (pk, parent pk) tuples of the items that were updated.
+    """
+    updates = dict((path, update) for path, update in content_models if update)
+    if not updates:
+        return []
+
+    columns = set(["extra_fields"])
+    for update in updates.values():
+        columns.update(key for key in update if key in Item._meta.fields and key not in ("pk", "path", "parent"))
+    columns = sorted(columns)
+    fields = [Item._meta.fields[column] for column in columns]
+
+    paths = updates.keys()
+    rows = []
+    for idx in range(0, len(paths), chunk_size):
+        chunk = paths[idx:idx + chunk_size]
+        rows.extend(Item.select(Item.pk, Item.parent, Item.kind, Item.path, *fields).where(Item.path.in_(chunk)).dicts())
+
+    updated_items = []
+    values = []
+    for row in rows:
+        # We have duplicates in the topic tree, make sure the stamping happens to all of them.
+        if row["kind"] == "Topic":
+            continue
+        update = updates[row["path"]]
+        extra_fields = json.loads(row["extra_fields"] or "{}")
+        for key, value in update.iteritems():
+            if key in columns:
+                row[key] = value
+            elif key not in Item._meta.fields:
+                extra_fields[key] = value
+        row["extra_fields"] = json.dumps(extra_fields)
+        values.append([field.db_value(row[field.name]) for field in fields] + [row["pk"]])
+        updated_items.append((row["pk"], row["parent"]))
+
+    sql = "UPDATE item SET {columns} WHERE pk = ?".format(
+        columns=", ".join("{column} = ?".format(column=field.db_column) for field in fields))
+    db.get_cursor().executemany(sql, values)
+    return updated_items
+
+
+def _update_topic_annotations(db, parents):
+    """
+    Recompute the availability and file counts of the given topics and all their ancestors from their children,
+    in a single bottom-up pass over the tree, and write the topics that changed with one batched UPDATE.
+    :param parents: Primary keys of the topics whose children have changed.
+    """
+    if not parents:
+        return
+
+    nodes = {}
+    children = {}
+    for pk, parent, kind, available, total_files, files_complete, remote_size, size_on_disk in db.execute_sql(
+            "SELECT pk, parent_id, kind, available, total_files, files_complete, remote_size, size_on_disk FROM item"):
+        nodes[pk] = {
+            "parent": parent,
+            "kind": kind,
+            "available": bool(available),
+            "total_files": total_files,
+            "files_complete": files_complete,
+            "remote_size": remote_size,
+            "size_on_disk": size_on_disk,
+        }
+        children.setdefault(parent, []).append(pk)
+
+    def depth(pk):
+        d = 0
+        while nodes[pk]["parent"] in nodes:
+            pk = nodes[pk]["parent"]
+            d += 1
+        return d
+
+    to_update = set()
+    for pk in parents:
+        while pk in nodes and pk not in to_update:
+            to_update.add(pk)
+            pk = nodes[pk]["parent"]
+
+    changed = []
+    # Deepest topics first, so that each topic is computed from up to date children.
+    for pk in sorted(to_update, key=depth, reverse=True):
+        node = nodes[pk]
+        child_nodes = [nodes[child] for child in children.get(pk, [])]
+
+        available = any(child["available"] for child in child_nodes)
+        total_files = sum(child["total_files"] for child in child_nodes)
+        files_complete = sum(child["files_complete"] for child in child_nodes)
+        # Topics carry the remote size of their unavailable content already.
+        child_remote = sum(child["remote_size"] for child in child_nodes if child["kind"] == "Topic" or not child["available"])
+        child_on_disk = sum(child["size_on_disk"] for child in child_nodes)
+
+        # ensure files_complete doesn't go above total_files; can be removed after fix is in for:
+        # https://github.com/fle-internal/content-pack-maker/issues/38
+        files_complete = min(total_files, files_complete)
+
+        update = {
+            "available": available,
+            "files_complete": files_complete,
+            "remote_size": child_remote,
+            "size_on_disk": child_on_disk,
+        }
+        if any(node[key] != value for key, value in update.iteritems()):
+            node.update(update)
+            changed.append((int(available), files_complete, child_remote, child_on_disk, pk))
+
+    db.get_cursor().executemany(
+        "UPDATE item SET available = ?, files_complete = ?, remote_size = ?, size_on_disk = ? WHERE pk = ?", changed)
+
+
+def _get_annotation_manifest(db):
+    db.execute_sql("CREATE TABLE IF NOT EXISTS annotation_manifest (filename TEXT PRIMARY KEY, size INTEGER, mtime REAL)")
+    return dict((filename, (size, mtime)) for filename, size, mtime in db.execute_sql(
+        "SELECT filename, size, mtime FROM annotation_manifest"))
+
+
+def _save_annotation_manifest(db, manifest):
+    db.execute_sql("DELETE FROM annotation_manifest")
+    db.get_cursor().executemany(
+        "INSERT INTO annotation_manifest (filename, size, mtime) VALUES (?, ?, ?)",
+        [(filename, size, mtime) for filename, (size, mtime) in manifest.iteritems()])
+
+
+def iterator_content_items_by_file_id(ids=None, channel="khan", language="en", chunk_size=500, **kwargs):
+    """
+    Generator to iterate over content items whose content id or youtube id is one of ids,
+    i.e. the items that the content files named after these ids belong to, run update
+    content availability on those items and then yield the required update.
+    :yield: Tuple of unique path to item, and the update to be carried out on that item
+    """
+    ids = list(ids or [])
+
+    def items():
+        for idx in range(0, len(ids), chunk_size):
+            chunk = ids[idx:idx + chunk_size]
+            for item in Item.select().where(Item.id.in_(chunk) | Item.youtube_id.in_(chunk)).dicts():
+                yield item
+
+    mapped_items = itertools.imap(unparse_model_data, items())
+    updated_mapped_items = update_content_availability(mapped_items, channel=channel, language=language)
+
+    for path, update in updated_mapped_items:
+        yield path, update
+
+
 @set_database
-def annotate_content_models(channel="khan", language="en", ids=None, iterator_content_items=iterator_content_items, **kwargs):
+def annotate_content_models(channel="khan", language="en", ids=None, iterator_content_items=iterator_content_items, incremental=False, **kwargs):
     """
     Annotate content models that have the ids specified in a list.
     Our ids can be duplicated at the moment, so this may be several content items per id.
@@ -666,66 +927,39 @@ def annotate_content_models(channel="khan", language="en", ids=None, iterator_co
     :param language: Language of channel to update.
     :param ids: List of content ids to find content models for annotation.
     :param iterator_content_items: Generator function to use to yield paths and updates.
+    :param incremental: If no ids are given, only annotate the items whose files have changed since the last
+        incremental annotation, according to the manifest of files saved in the content database.
     """
 
     db = kwargs.get("db")
 
     if db:
 
+        manifest = None
+        if incremental and ids is None:
+            manifest = get_content_files_manifest()
+            changed_ids = diff_content_files_manifest(_get_annotation_manifest(db), manifest)
+            if changed_ids is not None:
+                logging.info("Annotating content for {count} changed files".format(count=len(changed_ids)))
+                ids = changed_ids
+                iterator_content_items = iterator_content_items_by_file_id
+
         content_models = iterator_content_items(ids=ids, channel=channel, language=language)
 
         with db.atomic() as transaction:
 
-            def update_parent_annotation(parent):
-
-                children = list(Item.select(Item.available, Item.total_files, Item.files_complete, Item.remote_size, Item.size_on_disk).where(Item.parent == parent.pk))
-
-                available = any(child.available for child in children)
-                total_files = sum(child.total_files for child in children)
-                files_complete = sum(child.files_complete for child in children)
-                child_remote = sum(child.remote_size for child in children if (not child.available and child.kind != "Topic") or (child.kind == "Topic"))
-                child_on_disk = sum(child.size_on_disk for child in children)
-
-                # ensure files_complete doesn't go above total_files; can be removed after fix is in for:
-                # https://github.com/fle-internal/content-pack-maker/issues/38
-                files_complete = min(total_files, files_complete)
-
-                if parent.available != available:
-                    parent.available = available
-                if parent.files_complete != files_complete:
-                    parent.files_complete = files_complete
-                if parent.remote_size != child_remote:
-                    parent.remote_size = child_remote
-                if parent.size_on_disk != child_on_disk:
-                    parent.size_on_disk = child_on_disk
-                if parent.is_dirty():
-                    parent.save()
-                    return True  # return True to indicate we need to continue up the tree
-                else:
-                    return False  # return False to indicate we don't need to continue up the tree
-
-
-            parents_to_update = {}
-            for path, update in content_models:
-                if update:
-                    # We have duplicates in the topic tree, make sure the stamping happens to all of them.
-                    item = Item.get(Item.path == path)
-                    if item.kind != "Topic":
-                        item_data = unparse_model_data(model_to_dict(item, recurse=False))
-                        item_data.update(update)
-                        item_data = parse_model_data(item_data)
-                        for attr, val in item_data.iteritems():
-                            setattr(item, attr, val)
-                        item.save()
-                        parents_to_update[item.parent.pk] = item.parent
-
-            while parents_to_update:
-                new_parents_to_update = {}
-                for node in parents_to_update.values():
-                    changed = update_parent_annotation(node)
-                    if changed and node.parent:
-                        new_parents_to_update[node.parent.pk] = node.parent
-                parents_to_update = new_parents_to_update
+            updated_items = _apply_content_updates(db, content_models)
+
+            _update_topic_annotations(db, set(parent for pk, parent in updated_items if parent is not None))
+
+            # Annotation changes extra_fields, which are searched too.
+            if ids is None and not search.has_search_index(db):
+                search.build_search_index(db)
+            else:
+                search.update_search_index(db, [pk for pk, parent in updated_items])
+
+            if manifest is not None:
+                _save_annotation_manifest(db, manifest)
 
 
 @set_database
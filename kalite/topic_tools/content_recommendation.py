@@ -6,18 +6,20 @@ Three main functions:
     - get_explore_recommendations(user)
 '''
 import datetime
-import itertools
 import random
-import collections
 import json
+import threading
 
-from django.db.models import Count
+from django.db.models import Count, Sum
 
-from kalite.topic_tools.content_models import get_content_item, get_topic_nodes_with_children, get_topic_contents, get_content_items
+from kalite.topic_tools.content_models import get_content_item, get_topic_nodes_with_children, get_topic_contents, get_content_items, \
+    set_database
 
 from . import settings
+from .connections import get_content_database_version
+from .recommendation_graph import content_structure_hash, load_recommendation_graph
 
-from kalite.main.models import ExerciseLog, VideoLog, ContentLog
+from kalite.main.models import ExerciseLog, ExerciseTransition, VideoLog, ContentLog
 
 from kalite.facility.models import FacilityUser
 
@@ -119,21 +121,13 @@ def get_group_recommendations(user):
 
     if recent_exercises:
 
-        #If the user has recently engaged with exercises, use these exercises as the basis for filtering
-        user_exercises = ExerciseLog.objects\
-            .filter(user__in=user_list).order_by("-latest_activity_timestamp")\
-            .extra(select={'null_complete': "completion_timestamp is null"},
-                order_by=["-null_complete", "-completion_timestamp"])
-    
-        exercise_counts = collections.defaultdict(lambda: 0)
-
-        for user in user_list:
-            logs = list(user_exercises.filter(user=user))
-            for log, prev_log in itertools.izip(logs[1:], logs):
-                if log.exercise_id in recent_exercises:
-                    exercise_counts[prev_log.exercise_id] += 1
+        #If the user has recently engaged with exercises, count the exercises other users in the group
+        #completed right after them, as kept up to date in ExerciseTransition
+        exercise_counts = ExerciseTransition.objects\
+            .filter(group=user.group, from_exercise_id__in=recent_exercises, count__gt=0)\
+            .values("to_exercise_id").annotate(total=Sum("count"))
 
-        exercise_counts = [{"exercise_id": key, "count": value} for key, value in exercise_counts.iteritems()]
+        exercise_counts = [{"exercise_id": c["to_exercise_id"], "count": c["total"]} for c in exercise_counts]
 
     else:
         #If not, only look at the group data
@@ -218,32 +212,78 @@ def get_explore_recommendations(user, request):
 
     return final
 
-exercise_parents_lookup_table = {}
-CACHE_VARS.append("exercise_parents_lookup_table")
-def get_exercise_parents_lookup_table():
-    """Return a dictionary with exercise ids as keys and topic_ids as values."""
+_recommendation_graphs = {}
+_recommendation_graphs_lock = threading.Lock()
+def get_recommendation_graph(channel=settings.CHANNEL, language="en"):
+    """Return the precomputed topic tree data for recommendations from a content database.
+
+    The data is computed once per content database and saved next to it, see recommendation_graph.py,
+    then shared by all threads of the process until the content database changes.
+    """
+
+    database_path = settings.CONTENT_DATABASE_PATH.format(channel=channel, language=language)
+    version = get_content_database_version(database_path)
 
-    global exercise_parents_lookup_table
+    graph = _recommendation_graphs.get(database_path)
+    if graph is not None and graph.version == version:
+        return graph
 
-    if exercise_parents_lookup_table:
-        return exercise_parents_lookup_table
+    with _recommendation_graphs_lock:
+        graph = _recommendation_graphs.get(database_path)
+        if graph is None or graph.version != version:
+            key = get_content_structure_hash(channel=channel, language=language)
+            graph = load_recommendation_graph(database_path, key, lambda: compute_recommendation_graph(channel=channel, language=language))
+            graph.version = version
+            _recommendation_graphs[database_path] = graph
+    return graph
+
+@set_database
+def get_content_structure_hash(db=None, **kwargs):
+    """Return the key of the topic tree in a content database, which its recommendation graph is saved under."""
+    return content_structure_hash(db)
+
+def compute_recommendation_graph(channel=settings.CHANNEL, language="en"):
+    """Traverse the topic tree to compute the data saved in a recommendation graph.
+
+    Returns a dictionary with the related subtopics of each subtopic, the subtopic and
+    topic ids of each exercise, and the exercise ids in each subtopic.
+    """
 
     ### topic tree for traversal###
-    tree = get_topic_nodes_with_children(parent="root")
+    tree = get_topic_nodes_with_children(parent="root", channel=channel, language=language)
+
+    exercise_parents = {}
+    subtopic_exercises = {}
 
     #3 possible layers
     for topic in tree:
         for subtopic_id in topic['children']:
-            exercises = get_topic_contents(topic_id=subtopic_id, kinds=["Exercise"])
+            if subtopic_id not in subtopic_exercises:
+                exercises = get_topic_contents(topic_id=subtopic_id, kinds=["Exercise"], channel=channel, language=language) or []
+                subtopic_exercises[subtopic_id] = [ex['id'] for ex in exercises]
 
-            for ex in exercises:
-                if ex['id'] not in exercise_parents_lookup_table:
-                    exercise_parents_lookup_table[ ex['id'] ] = {
-                        "subtopic_id": subtopic_id,
-                        "topic_id": topic['id'],
-                    }
+            for ex_id in subtopic_exercises[subtopic_id]:
+                if ex_id not in exercise_parents:
+                    exercise_parents[ex_id] = (subtopic_id, topic['id'])
 
-    return exercise_parents_lookup_table
+    return {
+        "related_subtopics": dict((subtopic, data['related_subtopics']) for subtopic, data in generate_related_subtopics(tree).iteritems()),
+        "exercise_parents": exercise_parents,
+        "subtopic_exercises": subtopic_exercises,
+    }
+
+def get_exercise_parents_lookup_table():
+    """Return a dictionary with exercise ids as keys and topic_ids as values."""
+
+    return get_recommendation_graph().exercise_parents
+
+def get_topic_exercises(topic_id):
+    """Return the ids of all exercises under a given subtopic/topic."""
+
+    exercise_ids = get_recommendation_graph().subtopic_exercises(topic_id)
+    if exercise_ids is None:
+        exercise_ids = [ex['id'] for ex in get_topic_contents(topic_id=topic_id, kinds=["Exercise"])]
+    return exercise_ids
 
 def get_exercises_from_topics(topicId_list):
     """Return an ordered list of the first 5 exercise ids under a given subtopic/topic."""
@@ -251,9 +291,7 @@ def get_exercises_from_topics(topicId_list):
     exs = []
     for topic in topicId_list:
         if topic:
-            exercises = get_topic_contents(topic_id=topic, kinds=["Exercise"])[:5] #can change this line to allow for more to be returned
-            for e in exercises:
-                exs += [e['id']] #only add the id to the list
+            exs += get_topic_exercises(topic)[:5] #can change this line to allow for more to be returned
 
     return exs
 
@@ -299,17 +337,21 @@ def get_most_recent_exercises(user):
  
     return exercises_by_user
 
-recommendation_data = {}
-CACHE_VARS.append("recommendation_data")
 def generate_recommendation_data():
-    """Traverses topic tree to generate a dictionary with related subtopics per subtopic."""
+    """Return a dictionary with related subtopics per subtopic."""
+
+    return get_recommendation_graph().related_subtopics
 
-    global recommendation_data
-    if recommendation_data:
-        return recommendation_data
+def generate_related_subtopics(tree):
+    """Traverses topic tree to generate a dictionary with related subtopics per subtopic.
 
-    ### populate data exploiting structure of topic tree ###
-    tree = get_topic_nodes_with_children(parent="root")
+
+    Args:
+    tree -- the topics at the top of the topic tree, with their children (from get_topic_nodes_with_children(parent="root"))
+
+    """
+
+    recommendation_data = {}
 
     ######## DYNAMIC ALG #########
 
@@ -329,7 +371,7 @@ def generate_recommendation_data():
         #for each subtopic add the neighbors at distance 0 and 1 (at dist one has 2 for each)
         for subtopic_id in topic['children']:
 
-            neighbors_dist_1 = get_neighbors_at_dist_1(topic_index, subtopic_index, topic)
+            neighbors_dist_1 = get_neighbors_at_dist_1(topic_index, subtopic_index, topic, tree=tree)
 
             #add to recommendation_data - distance 0 (itself) + distance 1
             recommendation_data[ subtopic_id ] = { 'related_subtopics' : ([subtopic_id + ' 0'] + neighbors_dist_1) }
@@ -394,10 +436,7 @@ def get_recommendation_tree(data):
             
             #make sure related is not an empty string (shouldn't happen but to be safe)
             if rel_subtopic:
-                exercises = get_topic_contents(topic_id=rel_subtopic, kinds=["Exercise"])
-
-                for ex in exercises:
-                    recommendation_tree[str(subtopic)].append(ex['id'])
+                recommendation_tree[str(subtopic)] += get_topic_exercises(rel_subtopic)
 
     return recommendation_tree
       
@@ -414,12 +453,13 @@ def get_recommended_exercises(subtopic_id):
     #recommendations to a set amount??
     return tree[subtopic_id]
 
-def get_neighbors_at_dist_1(topic_index, subtopic_index, topic):
+def get_neighbors_at_dist_1(topic_index, subtopic_index, topic, tree=None):
     """Return a list of the neighbors at distance 1 from the specified subtopic."""
 
     neighbors = []  #neighbor list to be returned
 
-    tree = get_topic_nodes_with_children(parent="root")
+    if tree is None:
+        tree = get_topic_nodes_with_children(parent="root")
 
     #pointers to the previous and next subtopic (list indices)
     prev = subtopic_index - 1 
@@ -27,6 +27,11 @@ class Command(BaseCommand):
                     dest="language",
                     default="en",
                     help="Language to annotate database for."),
+        make_option("-f", "--full",
+                    action="store_true",
+                    dest="full",
+                    default=False,
+                    help="Annotate all content, not only the content whose files have changed since the last run."),
     )
 
     def handle(self, *args, **kwargs):
@@ -45,7 +50,7 @@ class Command(BaseCommand):
                 channel=channel
             )
         )
-        annotate_content_models(database_path=database_path, channel=channel, language=language)
+        annotate_content_models(database_path=database_path, channel=channel, language=language, incremental=not kwargs["full"])
 
         logging.info("Annotation complete for language: {language}, channel: {channel}".format(
             language=language,
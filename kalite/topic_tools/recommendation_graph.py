@@ -0,0 +1,295 @@
+"""
+A precomputed, memory-mapped file of the topic tree data used by content recommendation.
+
+Recommendations need, for every subtopic, the list of its related subtopics (in order of distance in the
+topic tree), and for every exercise, the subtopic and topic it belongs to. Computing them walks the whole
+topic tree, which makes the first recommendation request of every process slow. Instead they are computed
+once per content database and written next to it in a compact binary file, keyed by a hash of the topic tree
+stored in the database, which every process then memory-maps: nothing is decoded until it is looked up, and the
+pages are shared between processes by the operating system. Annotating the database (which only changes the
+availability of its items) therefore keeps the file valid.
+
+The file is laid out as follows (all integers are little-endian unsigned 32 bit):
+
+    header      MAGIC, FORMAT_VERSION, the key of the topic tree, then the counts and offsets below
+    strings     offsets of each string into the string data, followed by the UTF-8 string data
+    subtopics   (id, related start, related count, exercises start, exercises count), sorted by id
+    exercises   (id, subtopic id, topic id), sorted by id
+    lists       string indices, sliced by the subtopic records
+
+All ids are stored as indices into the string table. The subtopic and exercise records are sorted by the
+UTF-8 bytes of their ids, so they are looked up by binary search.
+"""
+import collections
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+
+from django.conf import settings
+logging = settings.LOG
+
+
+MAGIC = "KLRG"
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<4sI40s9I")
+_SUBTOPIC = struct.Struct("<5I")
+_EXERCISE = struct.Struct("<3I")
+_UINT = struct.Struct("<I")
+
+# Only the columns the recommendation data is computed from
+_STRUCTURE_QUERY = "SELECT pk, id, kind, parent_id, path, sort_order FROM item ORDER BY pk"
+
+
+def content_structure_hash(db):
+    """
+    Key identifying the topic tree of a content database, from the structure of its items.
+    :param db: The content database.
+    :return: A hex digest.
+    """
+    digest = hashlib.sha1()
+    for row in db.execute_sql(_STRUCTURE_QUERY):
+        digest.update(repr(row))
+    return digest.hexdigest()
+
+
+def recommendation_graph_path(database_path):
+    return database_path + ".recommendations"
+
+
+def _encode(value):
+    return value.encode("utf-8") if isinstance(value, unicode) else value
+
+
+def dump_recommendation_graph(key, related_subtopics, exercise_parents, subtopic_exercises):
+    """
+    Serialize recommendation data to the file format described above.
+    :param key: Key of the topic tree the data was computed from.
+    :param related_subtopics: Dictionary of subtopic id to list of related subtopic ids.
+    :param exercise_parents: Dictionary of exercise id to (subtopic id, topic id).
+    :param subtopic_exercises: Dictionary of subtopic id to list of exercise ids.
+    :return: String of the serialized data.
+    """
+    strings = {}
+
+    def intern(value):
+        return strings.setdefault(_encode(value), len(strings))
+
+    lists = []
+
+    def add_list(values):
+        start = len(lists)
+        lists.extend(intern(value) for value in values)
+        return start, len(lists) - start
+
+    subtopics = []
+    for subtopic_id in set(related_subtopics) | set(subtopic_exercises):
+        related_start, related_count = add_list(related_subtopics.get(subtopic_id, []))
+        exercises_start, exercises_count = add_list(subtopic_exercises.get(subtopic_id, []))
+        subtopics.append((_encode(subtopic_id), (intern(subtopic_id), related_start, related_count, exercises_start, exercises_count)))
+    subtopics.sort()
+
+    exercises = sorted(
+        (_encode(exercise_id), (intern(exercise_id), intern(subtopic_id), intern(topic_id)))
+        for exercise_id, (subtopic_id, topic_id) in exercise_parents.iteritems()
+    )
+
+    string_data = [value for value, index in sorted(strings.iteritems(), key=lambda item: item[1])]
+    string_offsets = [0]
+    for value in string_data:
+        string_offsets.append(string_offsets[-1] + len(value))
+
+    strings_offset = _HEADER.size
+    string_data_offset = strings_offset + _UINT.size * len(string_offsets)
+    subtopics_offset = string_data_offset + string_offsets[-1]
+    exercises_offset = subtopics_offset + _SUBTOPIC.size * len(subtopics)
+    lists_offset = exercises_offset + _EXERCISE.size * len(exercises)
+
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, key or "",
+        len(string_data), len(subtopics), len(exercises), len(lists),
+        strings_offset, string_data_offset, subtopics_offset, exercises_offset, lists_offset,
+    )
+    return "".join([
+        header,
+        struct.pack("<{count}I".format(count=len(string_offsets)), *string_offsets),
+        "".join(string_data),
+        "".join(_SUBTOPIC.pack(*record) for _, record in subtopics),
+        "".join(_EXERCISE.pack(*record) for _, record in exercises),
+        struct.pack("<{count}I".format(count=len(lists)), *lists),
+    ])
+
+
+def write_recommendation_graph(path, data):
+    """
+    Atomically replace the file at `path` with `data`, so that other processes never map a partial file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, 0644)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Windows does not allow renaming over an existing file
+            os.remove(path)
+            os.rename(tmp_path, path)
+    except (IOError, OSError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class RecommendationGraph(object):
+    """
+    Read-only view of serialized recommendation data, decoding entries as they are looked up.
+    """
+
+    def __init__(self, buf):
+        """
+        :param buf: The serialized data, as a string or a memory map.
+        """
+        self._buf = buf
+        (magic, version, key,
+         self._string_count, self._subtopic_count, self._exercise_count, self._list_count,
+         self._strings_offset, self._string_data_offset, self._subtopics_offset, self._exercises_offset,
+         self._lists_offset) = _HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Not a recommendation graph, or in an unsupported format")
+        self.key = key.rstrip("\0") or None
+
+        self.related_subtopics = _RelatedSubtopics(self)
+        self.exercise_parents = _ExerciseParents(self)
+
+    @classmethod
+    def open(cls, path):
+        """
+        Memory-map the file at `path`.
+        """
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def close(self):
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+
+    def _string_bytes(self, index):
+        start, end = struct.unpack_from("<2I", self._buf, self._strings_offset + _UINT.size * index)
+        return self._buf[self._string_data_offset + start:self._string_data_offset + end]
+
+    def _string(self, index):
+        return self._string_bytes(index).decode("utf-8")
+
+    def _list(self, start, count):
+        indices = struct.unpack_from("<{count}I".format(count=count), self._buf, self._lists_offset + _UINT.size * start)
+        return [self._string(index) for index in indices]
+
+    def _find(self, table_offset, record, count, id):
+        id = _encode(id)
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            values = record.unpack_from(self._buf, table_offset + record.size * middle)
+            value = self._string_bytes(values[0])
+            if value < id:
+                low = middle + 1
+            elif value > id:
+                high = middle
+            else:
+                return values
+        return None
+
+    def _records(self, table_offset, record, count):
+        for position in range(count):
+            yield record.unpack_from(self._buf, table_offset + record.size * position)
+
+    def _subtopic(self, subtopic_id):
+        return self._find(self._subtopics_offset, _SUBTOPIC, self._subtopic_count, subtopic_id)
+
+    def subtopic_exercises(self, subtopic_id):
+        """
+        :return: The ids of the exercises in a subtopic, or None if the subtopic is not known.
+        """
+        record = self._subtopic(subtopic_id)
+        return self._list(record[3], record[4]) if record else None
+
+
+class _RelatedSubtopics(collections.Mapping):
+    """
+    subtopic id -> {"related_subtopics": [subtopic ids]}, as returned by generate_recommendation_data
+    """
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, subtopic_id):
+        record = self._graph._subtopic(subtopic_id)
+        if record is None:
+            raise KeyError(subtopic_id)
+        return {"related_subtopics": self._graph._list(record[1], record[2])}
+
+    def __iter__(self):
+        graph = self._graph
+        for record in graph._records(graph._subtopics_offset, _SUBTOPIC, graph._subtopic_count):
+            yield graph._string(record[0])
+
+    def __len__(self):
+        return self._graph._subtopic_count
+
+
+class _ExerciseParents(collections.Mapping):
+    """
+    exercise id -> {"subtopic_id": ..., "topic_id": ...}, as returned by get_exercise_parents_lookup_table
+    """
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, exercise_id):
+        graph = self._graph
+        record = graph._find(graph._exercises_offset, _EXERCISE, graph._exercise_count, exercise_id)
+        if record is None:
+            raise KeyError(exercise_id)
+        return {"subtopic_id": graph._string(record[1]), "topic_id": graph._string(record[2])}
+
+    def __iter__(self):
+        graph = self._graph
+        for record in graph._records(graph._exercises_offset, _EXERCISE, graph._exercise_count):
+            yield graph._string(record[0])
+
+    def __len__(self):
+        return self._graph._exercise_count
+
+
+def load_recommendation_graph(database_path, key, build):
+    """
+    Return the recommendation graph of a content database, from the file next to it if that was computed
+    from the topic tree it has now, otherwise computing it and saving it for other processes.
+    :param database_path: Path to the content database.
+    :param key: Key of its topic tree, see content_structure_hash.
+    :param build: Function computing the data to serialize, as the keyword arguments of dump_recommendation_graph
+        other than the key.
+    :return: RecommendationGraph
+    """
+    path = recommendation_graph_path(database_path)
+
+    if os.path.exists(path):
+        try:
+            graph = RecommendationGraph.open(path)
+        except (IOError, OSError, ValueError, struct.error) as e:
+            logging.warn("Unable to read recommendation graph {path}: {error}".format(path=path, error=e))
+        else:
+            if graph.key == key:
+                return graph
+            graph.close()
+
+    data = dump_recommendation_graph(key, **build())
+    try:
+        write_recommendation_graph(path, data)
+        return RecommendationGraph.open(path)
+    except (IOError, OSError) as e:
+        logging.warn("Unable to save recommendation graph {path}: {error}".format(path=path, error=e))
+    return RecommendationGraph(data)
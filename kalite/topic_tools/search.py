@@ -0,0 +1,173 @@
+"""
+Full text search over the content in a content database.
+
+Searching by `LIKE` needs a scan of the whole Item table on every keystroke of the search box, so each content
+database gets a SQLite FTS4 table, `item_search`, indexing the title, description and extra fields of each item
+(keyed by the item's primary key). It is built when a content pack is installed and kept up to date when
+content is annotated.
+
+The unicode61 tokenizer folds case and removes diacritics, so queries typed without accents still match,
+and every term of a query is matched as a prefix, so that results can be shown while a word is still being
+typed. Results are ranked by where the terms were found (title, then description, then extra fields), and
+can be paged through with a keyset cursor rather than an OFFSET.
+"""
+import array
+import re
+
+from peewee import OperationalError
+
+from django.conf import settings
+logging = settings.LOG
+
+
+SEARCH_TABLE = "item_search"
+
+# Rank weights for a match in each indexed column, in the order the columns are declared.
+# Each weight must outrank any combination of matches in the columns after it.
+SEARCH_COLUMN_WEIGHTS = (100, 10, 1)
+
+_CREATE_SEARCH_TABLE = "CREATE VIRTUAL TABLE {table} USING fts4(title, description, extra_fields, tokenize=unicode61)"
+
+_POPULATE_SEARCH_TABLE = "INSERT INTO {table}(docid, title, description, extra_fields) " \
+                         "SELECT pk, title, description, extra_fields FROM item"
+
+# The fields returned for each search result, as for content_models.search_topic_nodes
+SEARCH_RESULT_FIELDS = ("title", "description", "available", "kind", "id", "path", "slug")
+
+
+def search_rank(matchinfo):
+    """
+    SQLite function ranking an FTS match from its matchinfo(..., 'pcx') blob.
+    Each phrase of the query adds the weight of every column it was found in.
+    """
+    info = array.array("I", str(matchinfo))
+    phrases, columns = info[0], info[1]
+    rank = 0
+    for phrase in range(phrases):
+        for column in range(columns):
+            if info[2 + 3 * (phrase * columns + column)]:
+                rank += SEARCH_COLUMN_WEIGHTS[column]
+    return rank
+
+
+def register_search_functions(conn):
+    conn.create_function("search_rank", 1, search_rank)
+
+
+def has_search_index(db):
+    cursor = db.execute_sql("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (SEARCH_TABLE,))
+    return cursor.fetchone() is not None
+
+
+def build_search_index(db):
+    """
+    (Re)build the search index of a content database from scratch.
+    :param db: A connected peewee database.
+    :return: True if the index was built, False if this SQLite does not support it.
+    """
+    try:
+        db.execute_sql("DROP TABLE IF EXISTS {table}".format(table=SEARCH_TABLE))
+        db.execute_sql(_CREATE_SEARCH_TABLE.format(table=SEARCH_TABLE))
+    except OperationalError as e:
+        logging.warn("Unable to create a full text search index, search will be slow: {error}".format(error=e))
+        return False
+    db.execute_sql(_POPULATE_SEARCH_TABLE.format(table=SEARCH_TABLE))
+    return True
+
+
+def update_search_index(db, pks, chunk_size=500):
+    """
+    Reindex the given items, e.g. after their extra fields have been annotated.
+    Does nothing if the database has no search index.
+    :param db: A connected peewee database.
+    :param pks: Primary keys of the items to reindex.
+    """
+    if not pks or not has_search_index(db):
+        return
+    pks = list(pks)
+    for idx in range(0, len(pks), chunk_size):
+        chunk = pks[idx:idx + chunk_size]
+        placeholders = ", ".join("?" * len(chunk))
+        db.execute_sql("DELETE FROM {table} WHERE docid IN ({pks})".format(table=SEARCH_TABLE, pks=placeholders), chunk)
+        db.execute_sql((_POPULATE_SEARCH_TABLE + " WHERE pk IN ({pks})").format(table=SEARCH_TABLE, pks=placeholders), chunk)
+
+
+def query_terms(query):
+    """
+    Split a search query into the terms to look for, dropping punctuation and FTS operators.
+    """
+    return [term for term in re.split(r"[\W_]+", query.lower(), flags=re.UNICODE) if term]
+
+
+def search(db, query, kinds, limit, offset=0, after=None):
+    """
+    Find the items matching all the terms of a query, best match first.
+    :param db: A connected peewee database with a search index.
+    :param query: Text string to search for.
+    :param kinds: A list of content kinds.
+    :param limit: Maximum number of results.
+    :param offset: Number of results to skip, when paging by page number.
+    :param after: Path of the last result of the previous page, to page by keyset instead.
+    :return: A list of dictionaries of SEARCH_RESULT_FIELDS, ordered by rank.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+    match = " ".join(term + "*" for term in terms)
+
+    sql = (
+        "SELECT {fields}, item.pk, matches.rank FROM ("
+        "SELECT docid, search_rank(matchinfo({table}, 'pcx')) AS rank FROM {table} WHERE {table} MATCH ?"
+        ") AS matches JOIN item ON item.pk = matches.docid "
+        "WHERE item.kind IN ({kinds})"
+    ).format(
+        fields=", ".join("item." + field for field in SEARCH_RESULT_FIELDS),
+        table=SEARCH_TABLE,
+        kinds=", ".join("?" * len(kinds)),
+    )
+    params = [match] + list(kinds)
+
+    if after:
+        cursor = db.execute_sql((
+            "SELECT item.pk, search_rank(matchinfo({table}, 'pcx')) FROM {table} JOIN item ON item.pk = {table}.docid "
+            "WHERE {table} MATCH ? AND item.path = ?"
+        ).format(table=SEARCH_TABLE), (match, after))
+        last = cursor.fetchone()
+        if last:
+            sql += " AND (matches.rank < ? OR (matches.rank = ? AND item.pk > ?))"
+            params += [last[1], last[1], last[0]]
+            offset = 0
+
+    sql += " ORDER BY matches.rank DESC, item.pk LIMIT ? OFFSET ?"
+    params += [limit, offset]
+
+    results = []
+    for row in db.execute_sql(sql, params):
+        result = dict(zip(SEARCH_RESULT_FIELDS, row))
+        result["available"] = bool(result["available"])
+        results.append(result)
+    return results
+
+
+def search_exact(db, query, kinds):
+    """
+    Find an item whose title is the query, ignoring case.
+    :return: A dictionary of SEARCH_RESULT_FIELDS, or None.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return None
+    sql = (
+        "SELECT {fields} FROM {table} JOIN item ON item.pk = {table}.docid "
+        "WHERE {table} MATCH ? AND lower(item.title) = ? AND item.kind IN ({kinds}) "
+        "ORDER BY item.sort_order LIMIT 1"
+    ).format(
+        fields=", ".join("item." + field for field in SEARCH_RESULT_FIELDS),
+        table=SEARCH_TABLE,
+        kinds=", ".join("?" * len(kinds)),
+    )
+    row = db.execute_sql(sql, ['"{phrase}"'.format(phrase=" ".join(terms)), query] + list(kinds)).fetchone()
+    if row:
+        result = dict(zip(SEARCH_RESULT_FIELDS, row))
+        result["available"] = bool(result["available"])
+        return result
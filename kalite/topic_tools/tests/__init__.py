@@ -2,4 +2,9 @@ from explore_tests import *
 from helper_tests import *
 from next_tests import *
 from resume_tests import *
-from content_models_tests import UpdateItemTestCase, ContentModelsTestCase, ContentModelRegressionTestCase
+from content_models_tests import UpdateItemTestCase, ContentModelsTestCase, ContentModelRegressionTestCase, \
+    ContentDatabaseConnectionTestCase
+from tree_index_tests import *
+from search_tests import *
+from annotate_tests import ContentFilesManifestTestCase, IncrementalAnnotationTestCase
+from recommendation_graph_tests import *
@@ -1,13 +1,17 @@
 
-from kalite.topic_tools.annotate import update_content_availability
+from kalite.topic_tools.annotate import update_content_availability, get_content_files_manifest, \
+    diff_content_files_manifest
 from kalite.testing.base import KALiteTestCase
 from django.test import TestCase
-from kalite.topic_tools.content_models import Item, annotate_content_models, set_database, unparse_model_data
+from kalite.topic_tools.content_models import Item, annotate_content_models, set_database, unparse_model_data, \
+    create_table, bulk_insert, update_parents, get_content_items
 from . import settings
 from peewee import Using
 from playhouse.shortcuts import model_to_dict
 import json
 import os
+import shutil
+import tempfile
 
 from django.test.utils import override_settings
 
@@ -75,3 +79,91 @@ class AnnotateTestCase(TestCase):
             os.rename(self.version_path + ".bak", self.version_path)
         except OSError:
             pass
+
+
+class ContentFilesManifestTestCase(TestCase):
+
+    def setUp(self):
+        self.content_root = tempfile.mkdtemp()
+        for filename in ["abc.mp4", "abc.png", "def.mp4"]:
+            with open(os.path.join(self.content_root, filename), "w") as f:
+                f.write(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.content_root)
+
+    def get_manifest(self):
+        with override_settings(CONTENT_ROOT=self.content_root):
+            return get_content_files_manifest()
+
+    def test_no_previous_manifest(self):
+        self.assertIsNone(diff_content_files_manifest({}, self.get_manifest()))
+
+    def test_unchanged(self):
+        manifest = self.get_manifest()
+        self.assertEqual(diff_content_files_manifest(manifest, self.get_manifest()), set())
+
+    def test_changed_files(self):
+        manifest = self.get_manifest()
+        os.remove(os.path.join(self.content_root, "abc.png"))
+        with open(os.path.join(self.content_root, "ghi.mp4"), "w") as f:
+            f.write("ghi")
+        with open(os.path.join(self.content_root, "def.mp4"), "a") as f:
+            f.write("more")
+        self.assertEqual(diff_content_files_manifest(manifest, self.get_manifest()), set(["abc", "def", "ghi"]))
+
+    def test_changed_settings(self):
+        manifest = self.get_manifest()
+        with override_settings(BACKUP_VIDEO_SOURCE="http://example.com/{youtube_id}.{video_format}"):
+            self.assertIsNone(diff_content_files_manifest(manifest, self.get_manifest()))
+
+
+class IncrementalAnnotationTestCase(TestCase):
+
+    def setUp(self):
+        self.content_root = tempfile.mkdtemp()
+        fd, self.database_path = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+        create_table(database_path=self.database_path)
+        bulk_insert([
+            {"title": "Root", "description": "", "available": False, "kind": "Topic",
+             "id": "root", "slug": "root", "path": "/khan/", "total_files": 1},
+            {"title": "Topic", "description": "", "available": False, "kind": "Topic",
+             "id": "topic", "slug": "topic", "path": "/khan/topic/", "total_files": 1},
+            {"title": "Video", "description": "", "available": False, "kind": "Video", "youtube_id": "video_yt",
+             "id": "video", "slug": "video", "path": "/khan/topic/video/", "format": "mp4", "remote_size": 10,
+             "total_files": 1},
+        ], database_path=self.database_path)
+        update_parents(parent_mapping={"/khan/topic/": "root", "/khan/topic/video/": "topic"}, database_path=self.database_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.content_root)
+        os.remove(self.database_path)
+
+    def annotate(self):
+        with override_settings(CONTENT_ROOT=self.content_root, BACKUP_VIDEO_SOURCE=""):
+            annotate_content_models(database_path=self.database_path, incremental=True)
+        return dict((item["path"], item) for item in get_content_items(database_path=self.database_path))
+
+    def test_availability_propagated(self):
+        items = self.annotate()
+        self.assertFalse(items["/khan/topic/video/"]["available"])
+        self.assertFalse(items["/khan/"]["available"])
+
+        with open(os.path.join(self.content_root, "video_yt.mp4"), "w") as f:
+            f.write("video")
+        items = self.annotate()
+        self.assertTrue(items["/khan/topic/video/"]["available"])
+        self.assertEqual(items["/khan/topic/video/"]["size_on_disk"], 5)
+        self.assertTrue(items["/khan/topic/"]["available"])
+        self.assertTrue(items["/khan/"]["available"])
+        self.assertEqual(items["/khan/"]["files_complete"], 1)
+        self.assertEqual(items["/khan/"]["size_on_disk"], 5)
+        self.assertEqual(items["/khan/"]["remote_size"], 0)
+
+        os.remove(os.path.join(self.content_root, "video_yt.mp4"))
+        items = self.annotate()
+        self.assertFalse(items["/khan/topic/video/"]["available"])
+        self.assertFalse(items["/khan/"]["available"])
+        self.assertEqual(items["/khan/"]["files_complete"], 0)
+        self.assertEqual(items["/khan/"]["remote_size"], 10)
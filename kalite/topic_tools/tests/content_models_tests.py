@@ -1,8 +1,12 @@
+import threading
+
 from peewee import Using
 
 from kalite.testing.base import KALiteTestCase
 from kalite.topic_tools.content_models import update_item, get_random_content, get_content_item, get_content_items, \
-    Item, get_topic_nodes, set_database, get_content_parents
+    Item, get_topic_nodes, set_database, get_content_parents, \
+    get_topics_content_ids_by_kind
+from kalite.topic_tools.connections import get_connection_stats, invalidate_content_database
 
 
 class ContentModelRegressionTestCase(KALiteTestCase):
@@ -60,6 +64,13 @@ class ContentModelRegressionTestCase(KALiteTestCase):
             'title': self.available_item.title,
         }])
 
+    def test_availability_updated_without_reopening(self):
+        get_topic_nodes(parent="1")
+        opened = get_connection_stats()["opened"]
+        update_item(update={"available": True}, path="unavail")
+        self.assertEqual([node["id"] for node in get_topic_nodes(parent="1")], ["2", "3"])
+        self.assertEqual(get_connection_stats()["opened"], opened)
+
 
 class UpdateItemTestCase(KALiteTestCase):
     
@@ -95,3 +106,41 @@ class ContentModelsTestCase(KALiteTestCase):
         The function get_content_parents() should return a empty list when an empty list of ids is passed to it.
         """
         self.assertEqual(get_content_parents(ids=list()), list())
+
+    def test_get_topics_content_ids_by_kind_unknown_topic(self):
+        """
+        The function get_topics_content_ids_by_kind() should return empty sets for topics that aren't there.
+        """
+        self.assertEqual(
+            get_topics_content_ids_by_kind(kinds=["Video", "Exercise"], topic_ids=["not-a-topic"]),
+            {"not-a-topic": {"Video": set(), "Exercise": set()}},
+        )
+
+
+class ContentDatabaseConnectionTestCase(KALiteTestCase):
+
+    def test_connection_reused_within_thread(self):
+        get_content_parents(ids=["1"])
+        before = get_connection_stats()
+        get_content_parents(ids=["1"])
+        after = get_connection_stats()
+        self.assertEqual(after["opened"], before["opened"])
+        self.assertEqual(after["hits"], before["hits"] + 1)
+
+    def test_connection_reopened_after_invalidation(self):
+        get_content_parents(ids=["1"])
+        invalidate_content_database()
+        before = get_connection_stats()
+        get_content_parents(ids=["1"])
+        after = get_connection_stats()
+        self.assertEqual(after["opened"], before["opened"] + 1)
+        self.assertEqual(after["misses"], before["misses"] + 1)
+
+    def test_connection_per_thread(self):
+        get_content_parents(ids=["1"])
+        before = get_connection_stats()
+        thread = threading.Thread(target=get_content_parents, kwargs={"ids": ["1"]})
+        thread.start()
+        thread.join()
+        after = get_connection_stats()
+        self.assertEqual(after["opened"], before["opened"] + 1)
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from peewee import SqliteDatabase
+
+from kalite.topic_tools.recommendation_graph import RecommendationGraph, content_structure_hash, \
+    dump_recommendation_graph, load_recommendation_graph, recommendation_graph_path
+
+
+GRAPH_DATA = {
+    "related_subtopics": {
+        u"counting": [u"counting", u"addition", u""],
+        u"addition": [u"addition", u"counting", u"subtraction"],
+        u"subtraction": [u"subtraction", u"addition", u"counting"],
+    },
+    "exercise_parents": {
+        u"count-to-10": (u"counting", u"early-math"),
+        u"add-1": (u"addition", u"arithmetic"),
+        u"f\xfcnf-minus-eins": (u"subtraction", u"arithmetic"),
+    },
+    "subtopic_exercises": {
+        u"counting": [u"count-to-10"],
+        u"addition": [u"add-1"],
+        u"subtraction": [u"f\xfcnf-minus-eins"],
+    },
+}
+
+
+class RecommendationGraphTestCase(TestCase):
+
+    def setUp(self):
+        self.graph = RecommendationGraph(dump_recommendation_graph("abc", **GRAPH_DATA))
+
+    def test_key(self):
+        self.assertEqual(self.graph.key, "abc")
+
+    def test_related_subtopics(self):
+        related = self.graph.related_subtopics
+        self.assertEqual(dict((key, related[key]["related_subtopics"]) for key in related), GRAPH_DATA["related_subtopics"])
+        self.assertNotIn("multiplication", related)
+
+    def test_exercise_parents(self):
+        parents = self.graph.exercise_parents
+        self.assertEqual(len(parents), 3)
+        self.assertEqual(parents[u"f\xfcnf-minus-eins"], {"subtopic_id": u"subtraction", "topic_id": u"arithmetic"})
+        self.assertIn("add-1", parents)
+        self.assertNotIn("add-2", parents)
+
+    def test_subtopic_exercises(self):
+        self.assertEqual(self.graph.subtopic_exercises("addition"), [u"add-1"])
+        self.assertIsNone(self.graph.subtopic_exercises("multiplication"))
+
+
+class LoadRecommendationGraphTestCase(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.database_path = os.path.join(self.tempdir, "content_khan_en.sqlite")
+        with open(self.database_path, "w") as f:
+            f.write("content")
+        self.builds = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def build(self):
+        self.builds += 1
+        return GRAPH_DATA
+
+    def test_saved_and_reused(self):
+        graph = load_recommendation_graph(self.database_path, "abc", self.build)
+        self.assertTrue(os.path.exists(recommendation_graph_path(self.database_path)))
+        graph.close()
+
+        graph = load_recommendation_graph(self.database_path, "abc", self.build)
+        self.assertEqual(self.builds, 1)
+        self.assertEqual(graph.subtopic_exercises("counting"), [u"count-to-10"])
+        graph.close()
+
+    def test_rebuilt_when_topic_tree_changes(self):
+        load_recommendation_graph(self.database_path, "abc", self.build).close()
+        load_recommendation_graph(self.database_path, "def", self.build).close()
+        self.assertEqual(self.builds, 2)
+
+
+class ContentStructureHashTestCase(TestCase):
+
+    def setUp(self):
+        self.db = SqliteDatabase(":memory:")
+        self.db.execute_sql("CREATE TABLE item (pk INTEGER PRIMARY KEY, id TEXT, kind TEXT, parent_id INTEGER, "
+                            "path TEXT, sort_order REAL, available INTEGER, title TEXT)")
+        self.db.execute_sql("INSERT INTO item VALUES (1, 'root', 'Topic', NULL, '/khan/', 0, 1, 'Khan')")
+        self.db.execute_sql("INSERT INTO item VALUES (2, 'add-1', 'Exercise', 1, '/khan/add-1/', 0, 0, 'Add 1')")
+        self.key = content_structure_hash(self.db)
+
+    def test_unchanged_by_annotation(self):
+        self.db.execute_sql("UPDATE item SET available = 1, title = 'Addition'")
+        self.assertEqual(content_structure_hash(self.db), self.key)
+
+    def test_changed_with_topic_tree(self):
+        self.db.execute_sql("UPDATE item SET parent_id = NULL WHERE pk = 2")
+        self.assertNotEqual(content_structure_hash(self.db), self.key)
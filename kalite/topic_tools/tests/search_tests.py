@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+
+from django.test import TestCase
+
+from kalite.topic_tools.content_models import create_table, bulk_insert, create_search_index, search_topic_nodes
+
+
+class SearchTopicNodesTestCase(TestCase):
+
+    def setUp(self):
+        fd, self.database_path = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+        create_table(database_path=self.database_path)
+        bulk_insert([
+            {"title": u"Addition", "description": "Adding numbers", "available": True, "kind": "Topic",
+             "id": "addition", "slug": "addition", "path": "/khan/addition/", "sort_order": 1},
+            {"title": u"Addition 1", "description": "Adding small numbers", "available": True, "kind": "Exercise",
+             "id": "addition_1", "slug": "addition_1", "path": "/khan/addition/addition_1/", "sort_order": 2},
+            {"title": u"Subtraction", "description": "The opposite of addition", "available": True, "kind": "Video",
+             "id": "subtraction", "slug": "subtraction", "path": "/khan/addition/subtraction/", "sort_order": 3},
+            {"title": u"Les élèves", "description": "", "available": False, "kind": "Video",
+             "id": "eleves", "slug": "eleves", "path": "/khan/addition/eleves/", "sort_order": 4},
+        ], database_path=self.database_path)
+        create_search_index(database_path=self.database_path)
+
+    def tearDown(self):
+        os.remove(self.database_path)
+
+    def search(self, query, **kwargs):
+        return search_topic_nodes(query=query, database_path=self.database_path, **kwargs)
+
+    def test_exact_match(self):
+        nodes, exact, pages = self.search("addition")
+        self.assertTrue(exact)
+        self.assertEqual([node["id"] for node in nodes], ["addition"])
+
+    def test_title_matches_ranked_first(self):
+        nodes, exact, pages = self.search("additi", exact=False)
+        self.assertFalse(exact)
+        self.assertEqual([node["id"] for node in nodes], ["addition", "addition_1", "subtraction"])
+
+    def test_accents_folded(self):
+        nodes, exact, pages = self.search("eleves", exact=False)
+        self.assertEqual([node["id"] for node in nodes], ["eleves"])
+
+    def test_keyset_pagination(self):
+        first, exact, pages = self.search("additi", exact=False, items_per_page=2)
+        self.assertEqual(pages, 2)
+        second, exact, pages = self.search("additi", exact=False, items_per_page=2, page=2, after=first[-1]["path"])
+        self.assertEqual([node["id"] for node in second], ["subtraction"])
+        self.assertEqual(pages, 2)
@@ -0,0 +1,62 @@
+from django.test import TestCase
+
+from kalite.topic_tools.tree_index import TopicTreeIndex, TopicTreeNode, path_range
+
+
+def node(pk, id, kind, parent, path, sort_order=0, available=True):
+    return TopicTreeNode(pk=pk, id=id, kind=kind, parent=parent, path=path, slug=id, title=id,
+                         description="", available=available, sort_order=sort_order)
+
+
+class TopicTreeIndexTestCase(TestCase):
+
+    def setUp(self):
+        self.index = TopicTreeIndex([
+            node(1, "root", "Topic", None, "/khan/"),
+            node(2, "math", "Topic", 1, "/khan/math/", sort_order=2),
+            node(3, "science", "Topic", 1, "/khan/science/", sort_order=1),
+            node(4, "addition", "Exercise", 2, "/khan/math/addition/", sort_order=2),
+            node(5, "addition-video", "Video", 2, "/khan/math/addition-video/", sort_order=1),
+            node(6, "addition", "Exercise", 3, "/khan/science/addition/", available=False),
+        ])
+
+    def test_children_sorted(self):
+        self.assertEqual([n.id for n in self.index.children(1)], ["science", "math"])
+
+    def test_nodes_by_id(self):
+        self.assertEqual([n.pk for n in self.index.nodes_by_id("addition")], [6, 4])
+        self.assertEqual(self.index.nodes_by_id("math", topic=False), [])
+
+    def test_leaves(self):
+        self.assertEqual([n.pk for n in self.index.leaves(1)], [6, 5, 4])
+        self.assertEqual([n.pk for n in self.index.leaves(2, kinds=["Exercise"])], [4])
+        self.assertEqual(self.index.leaves(4), [])
+
+    def test_ancestors(self):
+        self.assertEqual([n.pk for n in self.index.ancestors(4)], [2, 1])
+
+    def test_path_range(self):
+        lower, upper = path_range("/khan/math/")
+        self.assertTrue(lower <= "/khan/math/addition/" < upper)
+        self.assertFalse(lower <= "/khan/math2/" < upper)
+
+    def test_reload_availability(self):
+        db = FakeDatabase([(1, 1), (2, 1), (3, 1), (4, 1), (5, 1), (6, 0)])
+        self.assertIs(self.index.reload_availability(db, modified=1), self.index)
+        self.assertEqual(self.index.modified, 1)
+
+        db.rows[5] = (6, 1)
+        index = self.index.reload_availability(db, modified=2)
+        self.assertTrue(index.node(6).available)
+        self.assertFalse(self.index.node(6).available)
+        self.assertEqual([n.pk for n in index.leaves(1)], [6, 5, 4])
+        self.assertEqual(index.modified, 2)
+
+
+class FakeDatabase(object):
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute_sql(self, sql):
+        return list(self.rows)
@@ -0,0 +1,221 @@
+"""
+An in-memory index of the topic tree in a content database.
+
+The structure of the topic tree only changes when a content database is replaced or annotated, but it is
+traversed constantly (topic tree rendering, coach reports, playlists, recommendations). Rather than running
+joins and `path LIKE` scans for every traversal, the tree is loaded once per content database into an
+immutable index that answers structural questions with dictionary lookups.
+
+The index is rebuilt whenever the version of the content database changes (see connections.py), and only
+holds the fields needed to render topic nodes; full content rows are still fetched from the database.
+When the database is only written to (e.g. annotated with what content is available), just the availability
+of the nodes is read again.
+"""
+import os
+import threading
+
+from collections import namedtuple, defaultdict
+
+from peewee import OperationalError
+
+from django.conf import settings
+logging = settings.LOG
+
+from .connections import get_content_database_version
+
+
+LEAF_KINDS = ["Video", "Audio", "Exercise", "Document"]
+
+TopicTreeNode = namedtuple("TopicTreeNode", [
+    "pk",
+    "id",
+    "kind",
+    "parent",
+    "path",
+    "slug",
+    "title",
+    "description",
+    "available",
+    "sort_order",
+])
+
+# The fields returned for a node by content_models.get_topic_nodes
+TOPIC_NODE_FIELDS = ("title", "description", "available", "kind", "id", "path", "slug")
+
+_NODE_QUERY = "SELECT pk, id, kind, parent_id, path, slug, title, description, available, sort_order FROM item"
+
+_AVAILABILITY_QUERY = "SELECT pk, available FROM item"
+
+
+def path_range(path):
+    """
+    Bounds of the half-open range of paths that start with `path`, for use against the index on Item.path.
+    :param path: Path of a topic node.
+    :return: Tuple of (lower bound, upper bound).
+    """
+    return path, path[:-1] + unichr(ord(path[-1]) + 1)
+
+
+class TopicTreeIndex(object):
+    """
+    Immutable lookup tables over the nodes of one content database.
+    All lists of nodes are in the default ordering of the content models (sort_order, then pk).
+    """
+
+    def __init__(self, nodes, version=None, modified=None):
+        self.version = version
+        self.modified = modified  # modification time of the database, as of the availability of the nodes
+
+        nodes = sorted(nodes, key=lambda node: (node.sort_order, node.pk))
+
+        self._nodes = {}
+        self._nodes_by_id = defaultdict(list)
+        self._children = defaultdict(list)
+        self._roots = []
+        # topic pk -> kind -> leaf descendants of that kind
+        self._leaves = defaultdict(lambda: defaultdict(list))
+
+        for node in nodes:
+            self._nodes[node.pk] = node
+            self._nodes_by_id[node.id].append(node)
+            if node.parent is None:
+                self._roots.append(node)
+            else:
+                self._children[node.parent].append(node)
+
+        for node in nodes:
+            if node.kind == "Topic":
+                continue
+            parent = self._nodes.get(node.parent)
+            while parent is not None:
+                self._leaves[parent.pk][node.kind].append(node)
+                parent = self._nodes.get(parent.parent)
+
+        # Freeze the defaultdicts, so that lookups of missing keys do not grow them.
+        self._nodes_by_id = dict(self._nodes_by_id)
+        self._children = dict(self._children)
+        self._leaves = dict((pk, dict(kinds)) for pk, kinds in self._leaves.iteritems())
+
+    @classmethod
+    def load(cls, db, version=None, modified=None):
+        """
+        Build the index from the Item table of a content database.
+        :param db: A connected peewee database.
+        """
+        nodes = []
+        for pk, id, kind, parent, path, slug, title, description, available, sort_order in db.execute_sql(_NODE_QUERY):
+            nodes.append(TopicTreeNode(
+                pk=pk,
+                id=id,
+                kind=kind,
+                parent=parent,
+                path=path,
+                slug=slug,
+                title=title,
+                description=description,
+                available=bool(available),
+                sort_order=sort_order or 0,
+            ))
+        return cls(nodes, version=version, modified=modified)
+
+    def reload_availability(self, db, modified=None):
+        """
+        The index with the availability of its nodes as it is now in the content database.
+        :return: This index, if none of it changed, or else a new one.
+        """
+        available = dict((pk, bool(value)) for pk, value in db.execute_sql(_AVAILABILITY_QUERY))
+        if all(available.get(pk, node.available) == node.available for pk, node in self._nodes.iteritems()):
+            self.modified = modified
+            return self
+        nodes = [node._replace(available=available.get(pk, node.available)) for pk, node in self._nodes.iteritems()]
+        return TopicTreeIndex(nodes, version=self.version, modified=modified)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def node(self, pk):
+        return self._nodes.get(pk)
+
+    def nodes_by_id(self, id, topic=None):
+        """
+        :param id: Content id - these are not unique, so several nodes may be returned.
+        :param topic: If True only return topics, if False only non-topics, if None return both.
+        """
+        nodes = self._nodes_by_id.get(id, [])
+        if topic is None:
+            return list(nodes)
+        return [node for node in nodes if (node.kind == "Topic") == topic]
+
+    def roots(self):
+        return list(self._roots)
+
+    def children(self, pk):
+        return list(self._children.get(pk, []))
+
+    def parent(self, pk):
+        node = self._nodes.get(pk)
+        return self._nodes.get(node.parent) if node else None
+
+    def ancestors(self, pk):
+        """
+        :return: The ancestors of a node, starting with its parent.
+        """
+        ancestors = []
+        parent = self.parent(pk)
+        while parent is not None:
+            ancestors.append(parent)
+            parent = self._nodes.get(parent.parent)
+        return ancestors
+
+    def leaves(self, pk, kinds=None):
+        """
+        :param pk: Primary key of a topic node.
+        :param kinds: Content kinds to return, defaults to all leaf kinds.
+        :return: All non-topic descendants of the topic of the given kinds.
+        """
+        by_kind = self._leaves.get(pk, {})
+        lists = [by_kind[kind] for kind in (kinds or LEAF_KINDS) if kind in by_kind]
+        if len(lists) == 1:
+            return list(lists[0])
+        return sorted((node for nodes in lists for node in nodes), key=lambda node: (node.sort_order, node.pk))
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_topic_tree_index(db):
+    """
+    Return the index for a content database, building it if the database has changed since it was last built.
+    If the database has no content in it, an empty index is returned (and not cached).
+    :param db: A connected peewee database, as passed to functions wrapped by content_models.set_database.
+    :return: TopicTreeIndex
+    """
+    path = db.database
+    version = get_content_database_version(path)
+    modified = _get_modified(path)
+
+    index = _indexes.get(path)
+    if index is not None and index.version == version and index.modified == modified:
+        return index
+
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None or index.version != version or index.modified != modified:
+            try:
+                if index is None or index.version != version:
+                    index = TopicTreeIndex.load(db, version=version, modified=modified)
+                else:
+                    index = index.reload_availability(db, modified=modified)
+            except OperationalError:
+                logging.warn("No content database file found")
+                return TopicTreeIndex([])
+            _indexes[path] = index
+    return index
+
+
+def _get_modified(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
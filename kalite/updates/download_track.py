@@ -1,16 +1,26 @@
 import json
+import os
 
 from django.conf import settings
 logging = settings.LOG
 
 from .settings import VIDEO_DOWNLOAD_QUEUE_FILE
 
+# Videos taken off the queue are appended here (one youtube_id per line),
+# rather than rewriting the whole queue file each time.
+VIDEO_DOWNLOAD_DONE_FILE = VIDEO_DOWNLOAD_QUEUE_FILE + ".done"
+
+
 class VideoQueue(object):
     """
     This class handles queueing of videos for download.
     It is written to by functions that manipulate the queue,
     and read from by the videodownload management command that
     ultimately downloads the videos.
+
+    The queue is stored in two files, so that it survives being interrupted at any point:
+    the queue itself, which is replaced as a whole (by renaming a new file over it),
+    and a list of the youtube_ids removed from it since, which is only ever appended to.
     """
 
     def __init__(self):
@@ -29,10 +39,17 @@ class VideoQueue(object):
 
     def save(self):
         """Save the current queue to disk"""
+        tmp_file = VIDEO_DOWNLOAD_QUEUE_FILE + ".tmp"
         try:
-            with open(VIDEO_DOWNLOAD_QUEUE_FILE, "w") as f:
+            with open(tmp_file, "w") as f:
                 json.dump(self.queue, f)
-        except IOError:
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_file, VIDEO_DOWNLOAD_QUEUE_FILE)
+            # Only once the new queue is in place, so removed files aren't added back by a crash in between.
+            if os.path.exists(VIDEO_DOWNLOAD_DONE_FILE):
+                os.remove(VIDEO_DOWNLOAD_DONE_FILE)
+        except (IOError, OSError):
             logging.warn("Failed to save video queue file.")
 
     def load(self):
@@ -43,16 +60,30 @@ class VideoQueue(object):
         except (IOError, ValueError):
             self.queue = []
 
+        try:
+            with open(VIDEO_DOWNLOAD_DONE_FILE, "r") as f:
+                # A line cut short by a crash doesn't match any youtube_id, so the video just stays queued.
+                done = set(line.strip() for line in f)
+        except IOError:
+            done = set()
+        if done:
+            self.queue = [video for video in self.queue if video.get("youtube_id") not in done]
+
     def remove_file(self, youtube_id):
-        """Remove the last file from the list, and check that it matches the passed in youtube_id"""
+        """Remove a file from the queue (usually the last, as handed out by next())"""
+        for index in range(len(self.queue) - 1, -1, -1):
+            if self.queue[index].get("youtube_id") == youtube_id:
+                del self.queue[index]
+                break
+        else:
+            logging.warn("Tried to remove {youtube_id} from file queue, but it wasn't there.".format(youtube_id=youtube_id))
+            return
+
         try:
-            removed_file = self.queue.pop()
-            if removed_file.get("youtube_id") != youtube_id:
-                logging.warn("Tried to remove {youtube_id} from file queue but found {removed_file} instead.".format(youtube_id=youtube_id, removed_file=removed_file.get("youtube_id")))
-            else:
-                self.save()
-        except IndexError:
-            logging.warn("Tried to remove {youtube_id} from file queue, but was empty instead.".format(youtube_id=youtube_id))
+            with open(VIDEO_DOWNLOAD_DONE_FILE, "a") as f:
+                f.write(youtube_id + "\n")
+        except IOError:
+            logging.warn("Failed to save video queue file.")
 
     def clear(self):
         """Clear all currently queued videos"""
@@ -65,5 +96,9 @@ class VideoQueue(object):
         except IndexError:
             return None
 
+    def pending(self):
+        """All queued videos, in the order they are to be downloaded."""
+        return self.queue[::-1]
+
     def count(self):
         return len(self.queue)
@@ -1,10 +1,15 @@
 """
 """
 import os
+import Queue
+import threading
 import youtube_dl
 import time
+from collections import OrderedDict
 from functools import partial
+from multiprocessing.pool import ThreadPool
 from optparse import make_option
+from requests.exceptions import RequestException
 from youtube_dl.utils import DownloadError
 
 from django.conf import settings; logging = settings.LOG
@@ -13,6 +18,7 @@ from django.utils.translation import ugettext as _
 from .classes import UpdatesDynamicCommand
 from ...videos import download_video, DownloadCancelled, URLNotFound
 from ...download_track import VideoQueue
+from ...settings import VIDEO_DOWNLOAD_RETRIES, VIDEO_DOWNLOAD_WORKERS
 from fle_utils import set_process_priority
 from fle_utils.chronograph.management.croncommand import CronCommand
 from kalite.topic_tools.content_models import get_video_from_youtube_id, annotate_content_models_by_youtube_id
@@ -36,6 +42,13 @@ def scrape_video(youtube_id, format="mp4", force=False, quiet=False, callback=No
     yt_dl.extract_info('www.youtube.com/watch?v=%s' % youtube_id, download=True)
 
 
+def is_connection_error(e):
+    """Whether an error downloading a video is worth trying again (picking up where the download left off)."""
+    if isinstance(e, DownloadError):
+        return "[Errno 8]" in e.args[0]
+    return isinstance(e, (IOError, RequestException)) and not isinstance(e, URLNotFound)
+
+
 class Command(UpdatesDynamicCommand, CronCommand):
     help = _("Download all videos marked to be downloaded")
 
@@ -46,163 +59,234 @@ class Command(UpdatesDynamicCommand, CronCommand):
             default=False,
             help=_('Create cached files'),
             metavar="AUTO_CACHE"),
+        make_option('-w', '--workers',
+            action='store',
+            type='int',
+            dest='workers',
+            default=VIDEO_DOWNLOAD_WORKERS,
+            help=_('Number of videos to download at the same time'),
+            metavar="WORKERS"),
     )
 
     option_list = UpdatesDynamicCommand.option_list + CronCommand.unique_option_list + unique_option_list
 
 
-    def download_progress_callback(self, videofile, percent):
-
-        video_changed = (not self.video) or self.video.get("youtube_id") != videofile.get("youtube_id")
-        video_done = self.video and percent == 100
-        video_error = self.video and not video_changed and (percent - self.video.get("percent_complete", 0) > 50)
-
-        if self.video and (percent - self.video.get("percent_complete", 0)) < 1 and not video_done and not video_changed and not video_error:
-            return
-
-        self.video = videofile
-
-        video_queue = VideoQueue()
+    def download(self, video, delay=0):
+        """
+        Download a video (run by the worker threads).
 
+        Progress, and how the download ended, are reported back as events to the main thread,
+        which does everything else (the queue, the progress log, the database).
+        """
+        youtube_id = video.get("youtube_id")
         try:
-            if not video_queue.count():
-                raise DownloadCancelled()
-
-            else:
-                if video_error:
-                    self.video["percent_complete"] = 0
-                    return
+            if delay:
+                time.sleep(delay)
+            progress_callback = partial(self.download_progress_callback, video)
 
-                elif (percent - self.video.get("percent_complete", 0)) >= 1 or video_done or video_changed:
-                    # Update to output (saved in chronograph log, so be a bit more efficient
-                    if int(percent) % 5 == 0 or percent == 100:
-                        self.stdout.write("%d\n" % percent)
+            # Don't try to download a file that already exists in the content dir - just say it was successful
+            # and call it a day!
+            if not os.path.exists(os.path.join(settings.CONTENT_ROOT, "{id}.mp4".format(id=youtube_id))):
 
-                    self.video["percent_complete"] = percent
-
-                # update progress data
-                video_node = get_video_from_youtube_id(self.video.get("youtube_id"))
-                video_title = (video_node and video_node.get("title")) or self.video.get("title")
-
-                # Calling update_stage, instead of next_stage when stage changes, will auto-call next_stage appropriately.
-                self.update_stage(stage_name=self.video.get("youtube_id"), stage_percent=percent/100., notes=_("Downloading '%(video_title)s'") % {"video_title": _(video_title)})
+                try:
+                    # Download via urllib
+                    download_video(youtube_id, callback=progress_callback)
+
+                except URLNotFound:
+                    # Video was not found on amazon cloud service,
+                    #   either due to a KA mistake, or due to the fact
+                    #   that it's a dubbed video.
+                    #
+                    # We can use youtube-dl to get that video!!
+                    logging.debug(_("Retrieving youtube video %(youtube_id)s via youtube-dl") % {"youtube_id": youtube_id})
+
+                    def youtube_dl_cb(stats, progress_callback, *args, **kwargs):
+                        if stats['status'] == "finished":
+                            percent = 100.
+                        elif stats['status'] == "downloading":
+                            percent = 100. * stats['downloaded_bytes'] / stats['total_bytes']
+                        else:
+                            percent = 0.
+                        progress_callback(percent=percent)
+                    scrape_video(youtube_id, quiet=not settings.DEBUG, callback=partial(youtube_dl_cb, progress_callback=progress_callback))
+
+            self.events.put(("done", video, None))
 
-                if percent == 100:
-                    self.video = {}
+        except Exception as e:
+            self.events.put(("error", video, e))
+
+
+    def download_progress_callback(self, video, percent):
+        """Called from the worker threads; passes progress on to the main thread, a percent at a time."""
+        if self.cancelled.is_set():
+            raise DownloadCancelled()
+
+        youtube_id = video.get("youtube_id")
+        if int(percent) != int(self.reported_percent.get(youtube_id, -1)):
+            self.reported_percent[youtube_id] = percent
+            self.events.put(("progress", video, percent))
+
+
+    def update_progress(self, video, percent):
+        """
+        Record the progress of a download.  The download started first (of those still going)
+        is the current stage; the others in progress are listed in the notes.
+        """
+        youtube_id = video.get("youtube_id")
+        self.percent_complete[youtube_id] = percent
+
+        # Check (at most once a second) whether the queue has been cleared, to cancel downloading.
+        if time.time() - self.last_queue_check > 1:
+            self.last_queue_check = time.time()
+            if not VideoQueue().count():
+                if not self.cancelled.is_set():
+                    self.stdout.write(_("Download cancelled!") + "\n")
+                self.cancelled.set()
+                return
+
+        current_id = self.in_progress.keys()[0]
+        if youtube_id != current_id:
+            return
 
-        except DownloadCancelled as de:
-            if self.video:
-                self.stdout.write(_("Download cancelled!") + "\n")
+        # Update to output (saved in chronograph log, so be a bit more efficient
+        if int(percent) % 5 == 0 or percent == 100:
+            self.stdout.write("%d\n" % percent)
+
+        notes = ", ".join(
+            "%s (%d%%)" % (_("Downloading '%(video_title)s'") % {"video_title": _(self.titles[video_id])}, self.percent_complete.get(video_id, 0))
+            for video_id in self.in_progress
+        )
+        # Calling update_stage, instead of next_stage when stage changes, will auto-call next_stage appropriately.
+        self.update_stage(stage_name=current_id, stage_percent=min(percent, 100)/100., notes=notes)
+
+
+    def end_download(self, youtube_id):
+        """
+        Take a download that ended (successfully or not) out of those in progress.
+        Downloads that end before the current stage's don't move the stage on until it does.
+        """
+        current_id = self.in_progress.keys()[0]
+        del self.in_progress[youtube_id]
+        self.reported_percent.pop(youtube_id, None)
+        self.percent_complete.pop(youtube_id, None)
+
+        if youtube_id != current_id:
+            self.ended_early.append(youtube_id)
+            return
 
-                self.video = {}
+        for video_id in [youtube_id] + self.ended_early:
+            self.update_stage(stage_name=video_id, stage_percent=1.)
+        self.ended_early = []
 
-            # Progress info will be updated when this exception is caught.
-            raise
+        if self.in_progress:
+            next_id = self.in_progress.keys()[0]
+            self.update_stage(stage_name=next_id, stage_percent=0.)
+            self.update_progress(self.in_progress[next_id], self.percent_complete.get(next_id, 0))
 
 
     def handle(self, *args, **options):
         self.setup(options)
-        self.video = {}
+
+        self.events = Queue.Queue()  # (event, video, percent or error) from the worker threads
+        self.cancelled = threading.Event()
+        self.in_progress = OrderedDict()  # youtube_id -> video, in the order they were started
+        self.titles = {}
+        self.reported_percent = {}  # written by the worker threads
+        self.percent_complete = {}
+        self.ended_early = []
+        self.last_queue_check = time.time()
 
         handled_youtube_ids = []  # stored to deal with caching
         failed_youtube_ids = []  # stored to avoid requerying failures.
+        attempts = {}
 
         set_process_priority.lowest(logging=settings.LOG)
 
+        num_workers = max(1, options["workers"])
+        pool = ThreadPool(num_workers)
+
         try:
             while True:
                 # loop until the method is aborted
-                # Grab any video that hasn't been tried yet
+                # Start on videos that haven't been tried yet, as long as there are workers free for them.
+                if len(self.in_progress) < num_workers and not self.cancelled.is_set():
+                    video_queue = VideoQueue()
 
-                video_queue = VideoQueue()
+                    for video in video_queue.pending():
+                        youtube_id = video.get("youtube_id")
+                        if youtube_id in self.in_progress or youtube_id in handled_youtube_ids or youtube_id in failed_youtube_ids:
+                            continue
+                        if len(self.in_progress) >= num_workers:
+                            break
 
-                video_count = video_queue.count()
-                if video_count == 0:
-                    self.stdout.write(_("Nothing to download; exiting.") + "\n")
-                    break
+                        # Grab a video as OURS to handle, set fields to indicate to others that we're on it!
+                        # Update the video logging
+                        video["download_in_progress"] = True
+                        video["percent_complete"] = 0
+                        self.stdout.write((_("Downloading video '%(youtube_id)s'...") + "\n") % {"youtube_id": youtube_id})
 
-                # Grab a video as OURS to handle, set fields to indicate to others that we're on it!
-                # Update the video logging
-                video = video_queue.next()
+                        video_node = get_video_from_youtube_id(youtube_id)
+                        self.titles[youtube_id] = (video_node and video_node.get("title")) or video.get("title") or youtube_id
+                        self.in_progress[youtube_id] = video
+                        attempts[youtube_id] = 1
 
-                video["download_in_progress"] = True
-                video["percent_complete"] = 0
-                self.stdout.write((_("Downloading video '%(youtube_id)s'...") + "\n") % {"youtube_id": video.get("youtube_id")})
+                        # Update the progress logging
+                        self.set_stages(num_stages=video_queue.count() + len(handled_youtube_ids) + len(failed_youtube_ids) + int(options["auto_cache"]))
+                        if not self.started():
+                            self.start(stage_name=youtube_id)
 
-                # Update the progress logging
-                self.set_stages(num_stages=video_count + len(handled_youtube_ids) + len(failed_youtube_ids) + int(options["auto_cache"]))
-                if not self.started():
-                    self.start(stage_name=video.get("youtube_id"))
+                        # Initiate the download process
+                        pool.apply_async(self.download, (video,))
+
+                if not self.in_progress:
+                    self.stdout.write(_("Nothing to download; exiting.") + "\n")
+                    break
 
-                # Initiate the download process
                 try:
+                    event, video, value = self.events.get(timeout=1)
+                except Queue.Empty:
+                    self.check_if_cancel_requested()
+                    continue
 
-                    progress_callback = partial(self.download_progress_callback, video)
-
-                    # Don't try to download a file that already exists in the content dir - just say it was successful
-                    # and call it a day!
-                    if not os.path.exists(os.path.join(settings.CONTENT_ROOT, "{id}.mp4".format(id=video.get("youtube_id")))):
-
-                        try:
-                            # Download via urllib
-                            download_video(video.get("youtube_id"), callback=progress_callback)
-
-                        except URLNotFound:
-                            # Video was not found on amazon cloud service,
-                            #   either due to a KA mistake, or due to the fact
-                            #   that it's a dubbed video.
-                            #
-                            # We can use youtube-dl to get that video!!
-                            logging.debug(_("Retrieving youtube video %(youtube_id)s via youtube-dl") % {"youtube_id": video.get("youtube_id")})
-
-                            def youtube_dl_cb(stats, progress_callback, *args, **kwargs):
-                                if stats['status'] == "finished":
-                                    percent = 100.
-                                elif stats['status'] == "downloading":
-                                    percent = 100. * stats['downloaded_bytes'] / stats['total_bytes']
-                                else:
-                                    percent = 0.
-                                progress_callback(percent=percent)
-                            scrape_video(video.get("youtube_id"), quiet=not settings.DEBUG, callback=partial(youtube_dl_cb, progress_callback=progress_callback))
-
-                        except IOError as e:
-                            logging.exception(e)
-                            failed_youtube_ids.append(video.get("youtube_id"))
-                            video_queue.remove_file(video.get("youtube_id"))
-                            time.sleep(10)
-                            continue
+                youtube_id = video.get("youtube_id")
+
+                if event == "progress":
+                    self.update_progress(video, value)
+                    continue
 
+                if event == "done":
                     # If we got here, we downloaded ... somehow :)
-                    handled_youtube_ids.append(video.get("youtube_id"))
-                    video_queue.remove_file(video.get("youtube_id"))
+                    handled_youtube_ids.append(youtube_id)
+                    VideoQueue().remove_file(youtube_id)
                     self.stdout.write(_("Download is complete!") + "\n")
 
-                    annotate_content_models_by_youtube_id(youtube_ids=[video.get("youtube_id")], language=video.get("language"))
+                    annotate_content_models_by_youtube_id(youtube_ids=[youtube_id], language=video.get("language"))
 
-                except DownloadCancelled:
+                elif isinstance(value, DownloadCancelled):
                     # Cancellation event
-                    video_queue.clear()
-                    failed_youtube_ids.append(video.get("youtube_id"))
+                    VideoQueue().clear()
+                    failed_youtube_ids.append(youtube_id)
+
+                elif is_connection_error(value) and attempts[youtube_id] <= VIDEO_DOWNLOAD_RETRIES and not self.cancelled.is_set():
+                    # Whatever was downloaded is kept, so trying again picks up from there.
+                    logging.warn(_("Error in downloading %(youtube_id)s: %(error_msg)s; trying again.") % {"youtube_id": youtube_id, "error_msg": unicode(value)})
+                    attempts[youtube_id] += 1
+                    self.reported_percent.pop(youtube_id, None)
+                    pool.apply_async(self.download, (video,), {"delay": 10})
+                    continue
 
-                except Exception as e:
+                else:
                     # On error, report the error, mark the video as not downloaded,
                     #   and allow the loop to try other videos.
-                    msg = _("Error in downloading %(youtube_id)s: %(error_msg)s") % {"youtube_id": video.get("youtube_id"), "error_msg": unicode(e)}
+                    msg = _("Error in downloading %(youtube_id)s: %(error_msg)s") % {"youtube_id": youtube_id, "error_msg": unicode(value)}
                     self.stderr.write("%s\n" % msg)
 
-                    # If a connection error, we should retry.
-                    if isinstance(e, DownloadError):
-                        connection_error = "[Errno 8]" in e.args[0]
-                    elif isinstance(e, IOError) and hasattr(e, "strerror"):
-                        connection_error = e.strerror[0] == 8
-                    else:
-                        connection_error = False
-
                     # Rather than getting stuck on one video, continue to the next video.
                     self.update_stage(stage_status="error", notes=_("%(error_msg)s; continuing to next video.") % {"error_msg": msg})
-                    failed_youtube_ids.append(video.get("youtube_id"))
-                    video_queue.remove_file(video.get("youtube_id"))
-                    continue
+                    failed_youtube_ids.append(youtube_id)
+                    VideoQueue().remove_file(youtube_id)
+
+                self.end_download(youtube_id)
 
             # Update
             self.complete(notes=_("Downloaded %(num_handled_videos)s of %(num_total_videos)s videos successfully.") % {
@@ -213,3 +297,8 @@ class Command(UpdatesDynamicCommand, CronCommand):
         except Exception as e:
             self.cancel(stage_status="error", notes=_("Error: %(error_msg)s") % {"error_msg": e})
             raise
+
+        finally:
+            # Any downloads still going give up at their next progress update.
+            self.cancelled.set()
+            pool.close()
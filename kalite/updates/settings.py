@@ -13,3 +13,9 @@ import os
 from django.conf import settings
 
 VIDEO_DOWNLOAD_QUEUE_FILE = os.path.join(settings.USER_DATA_ROOT, "videos_to_download.json")
+
+# How many videos the videodownload command downloads at the same time
+VIDEO_DOWNLOAD_WORKERS = getattr(settings, "VIDEO_DOWNLOAD_WORKERS", 4)
+
+# How many times a video is tried again after a connection error (picking up where it left off)
+VIDEO_DOWNLOAD_RETRIES = getattr(settings, "VIDEO_DOWNLOAD_RETRIES", 3)
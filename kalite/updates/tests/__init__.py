@@ -2,4 +2,5 @@ from api_tests import *
 from availability_tests import *
 from base import *
 from class_tests import *
+from download_track_tests import *
 from regression_tests import *
@@ -0,0 +1,74 @@
+"""
+Testing of the video download queue
+"""
+import json
+import os
+import shutil
+import tempfile
+
+from django.utils import unittest
+from mock import patch
+
+from .. import download_track
+from ..download_track import VideoQueue
+
+
+class VideoQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.queue_file = os.path.join(self.tempdir, "videos_to_download.json")
+        self.done_file = self.queue_file + ".done"
+        self.patches = [
+            patch.object(download_track, "VIDEO_DOWNLOAD_QUEUE_FILE", self.queue_file),
+            patch.object(download_track, "VIDEO_DOWNLOAD_DONE_FILE", self.done_file),
+        ]
+        for p in self.patches:
+            p.start()
+
+        VideoQueue().add_files({"video1": "Video 1", "video2": "Video 2", "video3": "Video 3"}, language="en")
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.tempdir)
+
+    def test_remove_file_appends(self):
+        with open(self.queue_file) as f:
+            saved_queue = f.read()
+
+        queue = VideoQueue()
+        youtube_id = queue.next()["youtube_id"]
+        queue.remove_file(youtube_id)
+
+        # the queue file is left as it is, the removal is recorded on its own
+        with open(self.queue_file) as f:
+            self.assertEqual(f.read(), saved_queue)
+        with open(self.done_file) as f:
+            self.assertEqual(f.read(), youtube_id + "\n")
+
+        queue = VideoQueue()
+        self.assertEqual(queue.count(), 2)
+        self.assertNotIn(youtube_id, [video["youtube_id"] for video in queue.pending()])
+
+    def test_remove_file_out_of_order(self):
+        queue = VideoQueue()
+        first, second, third = [video["youtube_id"] for video in queue.pending()]
+        queue.remove_file(second)
+        self.assertEqual([video["youtube_id"] for video in VideoQueue().pending()], [first, third])
+
+    def test_save_compacts(self):
+        queue = VideoQueue()
+        queue.remove_file(queue.next()["youtube_id"])
+        queue.add_files({"video4": "Video 4"})
+
+        self.assertFalse(os.path.exists(self.done_file))
+        with open(self.queue_file) as f:
+            self.assertEqual(len(json.load(f)), 3)
+        self.assertEqual(VideoQueue().count(), 3)
+
+    def test_interrupted_removal(self):
+        # a crash part way through recording a removal leaves the video queued
+        with open(self.done_file, "w") as f:
+            f.write("vid")
+        self.assertEqual(VideoQueue().count(), 3)
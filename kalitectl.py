@@ -113,7 +113,9 @@ from socket import timeout
 from django.core.management import ManagementUtility, get_commands
 
 import kalite
+from kalite.distributed import prefork
 from kalite.distributed.cherrypyserver import DjangoAppPlugin
+from kalite.distributed.contentserver import StreamingWSGIServer
 from kalite.shared.compat import OrderedDict
 from fle_utils.internet.functions import get_ip_addresses
 
@@ -133,6 +135,9 @@ NODE_PID_FILE = os.path.join(KALITE_HOME, 'kalite_node.pid')
 
 STARTUP_LOCK = os.path.join(KALITE_HOME, 'kalite_startup.lock')
 
+# How long `kalite stop` waits for the server to stop, before killing it
+STOP_TIMEOUT = prefork.STOP_TIMEOUT + 5
+
 # if this environment variable is set, we activate the profiling machinery
 PROFILE = os.environ.get("PROFILE")
 
@@ -235,14 +240,18 @@ if os.name == 'posix':
         else:
             return True
 
-    def kill_pid(pid):
-        """Kill a PID by sending a posix signal"""
+    def kill_pid(pid, timeout=0):
+        """Kill a PID by sending a posix signal, giving it timeout seconds to exit"""
         import signal
         try:
             os.kill(pid, signal.SIGTERM)
         # process does not exist
         except OSError:
             return
+        waited = 0
+        while waited < timeout and pid_exists(pid):
+            time.sleep(0.1)
+            waited += 0.1
         # process didn't exit cleanly, make one last effort to kill it
         if pid_exists(pid):
             os.kill(pid, signal.SIGKILL)
@@ -260,7 +269,7 @@ else:
         else:
             return False
 
-    def kill_pid(pid):
+    def kill_pid(pid, timeout=0):
         """Kill the proces using pywin32 and pid"""
         import ctypes
         PROCESS_TERMINATE = 1
@@ -358,18 +367,15 @@ def get_pid():
         raise NotRunning(STATUS_SERVER_CONFIGURATION_ERROR)
 
     try:
-        pid = int(response.read())
+        # The PID of the process that served the request: the server's, or the
+        # PID of one of its workers when serving from several processes (see
+        # kalite.distributed.prefork), so the PID file's is the one to return
+        int(response.read())
     except ValueError:
         # Not a valid INT was returned, so probably not KA Lite
         raise NotRunning(STATUS_UNKNOWN_INSTANCE)
 
-    if pid == pid:
-        return pid, LISTEN_ADDRESS, listen_port  # Correct PID !
-    else:
-        # Not the correct PID, maybe KA Lite is running from somewhere else!
-        raise NotRunning(STATUS_UNKNOWN_INSTANCE)
-
-    raise NotRunning(STATUS_UNKNOW)  # Could not determine
+    return pid, LISTEN_ADDRESS, listen_port
 
 
 class ManageThread(Thread):
@@ -548,22 +554,18 @@ def start(debug=False, watch=False, daemonize=True, args=[], skip_job_scheduler=
         with open(PID_FILE, 'w') as f:
             f.write("%d\n%d" % (os.getpid(), port))
 
-    # Start the job scheduler (not Celery yet...)
-    cron_thread = None
-    if not skip_job_scheduler:
-        cron_thread = manage(
-            'cronserver_blocking',
-            args=[],
-            as_thread=True
-        )
+    from django.conf import settings
 
-    # Start cherrypy service
+    # Configure cherrypy service
     cherrypy.config.update({
         'server.socket_host': LISTEN_ADDRESS,
         'server.socket_port': port,
-        'server.thread_pool': 18,
+        'server.thread_pool': settings.CHERRYPY_THREAD_COUNT,
+        'server.stream_thread_pool': settings.CHERRYPY_STREAM_THREAD_COUNT,
         'checker.on': False,
     })
+    # Content files are sent by threads of their own
+    cherrypy.server.instance = StreamingWSGIServer(cherrypy.server)
 
     DjangoAppPlugin(cherrypy.engine).subscribe()
     if not watch:
@@ -572,6 +574,46 @@ def start(debug=False, watch=False, daemonize=True, args=[], skip_job_scheduler=
         # http://docs.cherrypy.org/stable/appendix/faq.html
         cherrypy.engine.autoreload.unsubscribe()
 
+    processes = settings.CHERRYPY_WORKER_PROCESSES
+    if processes > 1 and (watch or not prefork.can_prefork()):
+        # Reloading restarts the (one) process, and forking is POSIX only
+        sys.stderr.write("Serving from a single process, rather than {0:d}\n".format(processes))
+        processes = 1
+
+    if processes > 1:
+        serve_prefork(processes, port, skip_job_scheduler=skip_job_scheduler)
+    else:
+        serve(skip_job_scheduler=skip_job_scheduler)
+
+
+def start_job_scheduler():
+    """Start the job scheduler (not Celery yet...) in a thread"""
+    return manage(
+        'cronserver_blocking',
+        args=[],
+        as_thread=True
+    )
+
+
+def stop_job_scheduler(cron_thread):
+    # Do not exit thread together with the main process, let it finish
+    # cleanly
+    print("Asking KA Lite job scheduler to terminate...")
+    from fle_utils.chronograph.management.commands import cronserver_blocking
+    cronserver_blocking.shutdown = True
+    cron_thread.join()
+    print("Job scheduler terminated.")
+
+
+def serve(skip_job_scheduler=False):
+    """
+    Serve with cherrypy, as configured, from this process, running the job scheduler
+    in a thread of it.
+    """
+    cron_thread = None
+    if not skip_job_scheduler:
+        cron_thread = start_job_scheduler()
+
     try:
         cherrypy.quickstart()
     except KeyboardInterrupt:
@@ -583,13 +625,49 @@ def start(debug=False, watch=False, daemonize=True, args=[], skip_job_scheduler=
     print("FINISHED serving HTTP")
 
     if cron_thread:
-        # Do not exit thread together with the main process, let it finish
-        # cleanly
-        print("Asking KA Lite job scheduler to terminate...")
-        from fle_utils.chronograph.management.commands import cronserver_blocking
-        cronserver_blocking.shutdown = True
-        cron_thread.join()
-        print("Job scheduler terminated.")
+        stop_job_scheduler(cron_thread)
+
+
+def serve_prefork(processes, port, skip_job_scheduler=False):
+    """
+    Serve with cherrypy, as configured, from a number of worker processes, and run the
+    job scheduler in one more, all forked from (and supervised by) this one.
+    See kalite.distributed.prefork.
+    """
+    import signal
+    from django.db import connections
+    from fle_utils.chronograph.executor import set_scheduler_waker, wake_scheduler
+
+    listen_socket = prefork.bind_listen_socket(LISTEN_ADDRESS, port, cherrypy.server.socket_queue_size)
+    supervisor_pid = os.getpid()
+
+    def serve_worker():
+        if not skip_job_scheduler:
+            # Jobs forced here (see force_job) are run by the job scheduler's process, woken through the supervisor
+            set_scheduler_waker(lambda: os.kill(supervisor_pid, prefork.WAKE_SIGNAL))
+        prefork.serve_forever(listen_socket, supervisor_pid)
+
+    def run_job_scheduler():
+        cron_thread = start_job_scheduler()
+        signal.signal(prefork.WAKE_SIGNAL, lambda signum, frame: wake_scheduler())
+        prefork.wait_for_stop(supervisor_pid)
+        stop_job_scheduler(cron_thread)
+
+    workers = dict(("server-%d" % n, serve_worker) for n in range(processes))
+    forward_signals = {}
+    if not skip_job_scheduler:
+        workers["job-scheduler"] = run_job_scheduler
+        forward_signals[prefork.WAKE_SIGNAL] = "job-scheduler"
+
+    # Each worker makes its own connections
+    for connection in connections.all():
+        connection.close()
+
+    print("Serving from {0:d} processes of {1:d} threads each".format(processes, cherrypy.server.thread_pool))
+    prefork.Supervisor(workers, forward_signals=forward_signals).run()
+    listen_socket.close()
+
+    print("FINISHED serving HTTP")
 
 
 def stop(args=[], sys_exit=True):
@@ -602,7 +680,7 @@ def stop(args=[], sys_exit=True):
 
     # Kill the KA lite server
     try:
-        kill_pid(get_pid()[0])
+        kill_pid(get_pid()[0], timeout=STOP_TIMEOUT)
         os.unlink(PID_FILE)
     # Handle exceptions of kalite not already running
     except NotRunning as e:
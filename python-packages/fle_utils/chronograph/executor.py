@@ -0,0 +1,175 @@
+"""
+Runs due Jobs on a pool of worker threads, for the cronserver.
+
+Jobs used to run one after another in the cronserver's thread, so a long job (e.g. a videodownload) held up every
+other due job (e.g. syncmodels) until it finished.  Here, one scheduler thread finds the due jobs, and queues them
+for CRONSERVER_WORKERS worker threads:
+
+* A job is queued at most once at a time (until it has run), and a worker only runs it once it has marked it as
+  running in the database, so the same job never runs twice at once, even alongside the "cron" command.
+* The scheduler waits CRONSERVER_FREQUENCY seconds between looks for due jobs, unless it's woken (see wake),
+  e.g. by force_job, so a forced job starts right away.  Processes serving requests alongside a scheduler
+  running in another process wake it through the function set with set_scheduler_waker (see wake_scheduler).
+* How long each job waited in the queue, and how long it ran, is logged and kept in get_stats.
+
+Threads, rather than processes, as jobs are management commands run within the server process (see CronCommand).
+"""
+import Queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+logging = settings.LOG
+
+from .models import Job
+
+
+_executor = None
+_scheduler_waker = None
+
+
+def get_executor():
+    """The JobExecutor started in this process, if there is one."""
+    return _executor
+
+
+def set_scheduler_waker(waker):
+    """
+    Set the function waking the JobExecutor of another process, for processes without one of their own
+    (e.g. the server processes of kalite.distributed.prefork, which signal the job scheduler's).
+    """
+    global _scheduler_waker
+    _scheduler_waker = waker
+
+
+def wake_scheduler():
+    """
+    Have the JobExecutor started in this process, or else the one the waker set with set_scheduler_waker
+    reaches, look for due jobs now.  Returns whether there was one to wake.
+    """
+    executor = get_executor()
+    if executor:
+        executor.wake()
+        return True
+    if _scheduler_waker:
+        try:
+            _scheduler_waker()
+            return True
+        except OSError as e:
+            logging.warn("Failed to wake the job scheduler: %s" % e)
+    return False
+
+
+class JobExecutor(object):
+
+    def __init__(self, workers=None):
+        self.workers = workers or settings.CRONSERVER_WORKERS
+        self.queue = Queue.Queue()
+        self.jobs = {}  # job id -> job name, for the jobs queued or running here
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.threads = []
+        self.stats = {}  # job name -> {"runs", "wait", "max_wait", "runtime", "max_runtime"}, in seconds
+
+    def start(self):
+        global _executor
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.work, name="cron-worker-%d" % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        _executor = self
+
+    def stop(self):
+        """Drop the jobs not yet started, and wait for the running ones to finish."""
+        global _executor
+        if _executor is self:
+            _executor = None
+        while True:
+            try:
+                job_id, queued_at = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            with self.lock:
+                self.jobs.pop(job_id, None)
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def run_due_jobs(self):
+        """Queue the due jobs that aren't queued or running already.  Returns the jobs queued."""
+        jobs = list(Job.objects.due())
+        with self.lock:
+            jobs = [job for job in jobs if job.id not in self.jobs]
+            for job in jobs:
+                self.jobs[job.id] = job.name
+        for job in jobs:
+            self.queue.put((job.id, time.time()))
+
+        if jobs:
+            logging.info("Queued %d due jobs... (%s)" % (len(jobs), ", ".join(['"%s"' % job.name for job in jobs])))
+        else:
+            logging.debug("No jobs due to run.")
+        return jobs
+
+    def wake(self):
+        """Look for due jobs now, rather than at the end of the wait."""
+        self.wakeup.set()
+
+    def wait(self, timeout):
+        """Wait until woken, or for timeout seconds.  Returns whether it was woken."""
+        woken = self.wakeup.wait(timeout)
+        self.wakeup.clear()
+        return woken
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            job_id, queued_at = item
+            try:
+                self.run_job(job_id, time.time() - queued_at)
+            except Exception as e:
+                logging.error("Failed to run job %s: %s" % (job_id, e))
+            finally:
+                with self.lock:
+                    self.jobs.pop(job_id, None)
+                # Jobs are few and far between; don't keep this thread's connection open until the next.
+                connection.close()
+
+    def run_job(self, job_id, wait):
+        # Mark it as running, unless something else (e.g. the "cron" command) got to it first, or it's been disabled.
+        if not Job.objects.filter(id=job_id, is_running=False, disabled=False).update(is_running=True):
+            logging.debug("Job %s is already running, or disabled; skipping." % job_id)
+            return
+
+        job = Job.objects.get(id=job_id)
+        start = time.time()
+        try:
+            job.run()
+        finally:
+            runtime = time.time() - start
+            self.record(job.name, wait, runtime)
+            logging.info('Ran job "%s" in %.1fs (after waiting %.1fs to start)' % (job.name, runtime, wait))
+
+    def record(self, name, wait, runtime):
+        with self.lock:
+            stats = self.stats.setdefault(name, {"runs": 0, "wait": 0.0, "max_wait": 0.0, "runtime": 0.0, "max_runtime": 0.0})
+            stats["runs"] += 1
+            stats["wait"] += wait
+            stats["max_wait"] = max(stats["max_wait"], wait)
+            stats["runtime"] += runtime
+            stats["max_runtime"] = max(stats["max_runtime"], runtime)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "queued": self.queue.qsize(),
+                "running": len(self.jobs) - self.queue.qsize(),
+                "jobs": dict((name, dict(stats)) for name, stats in self.stats.iteritems()),
+            }
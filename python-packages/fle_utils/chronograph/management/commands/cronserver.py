@@ -1,7 +1,5 @@
 import sys
 import warnings
-from threading import Thread
-from time import sleep
 from optparse import make_option
 import os
 import gc
@@ -10,38 +8,23 @@ from django.conf import settings; logging = settings.LOG
 from django.core.management.base import BaseCommand, CommandError
 from django.utils.translation import ugettext_lazy as _
 
-from ....chronograph.models import Job
+from ....chronograph.executor import JobExecutor
 
 
-class CronThread(Thread):
-    daemon = False
-    def __init__(self, gc=False, mp=False, *args, **kwargs):
-        self.do_gc = gc
-        self.do_profile = True
-
-        return super(CronThread, self).__init__(*args, **kwargs)
+def run_due_jobs(executor, do_gc=False, do_profile=False):
+    if do_profile:
+        try:
+            import memory_profiler
+            prof_string = "[%8.2f MB] " % memory_profiler.memory_usage()[0]
+        except ImportError:
+            prof_string = "No profiler found"
+        logging.info(prof_string)
 
-    def run(self):
-        jobs = Job.objects.due()
-        
-        if self.do_profile:
-            try:
-                import memory_profiler
-                prof_string = "[%8.2f MB] " % memory_profiler.memory_usage()[0]
-            except ImportError:
-                prof_string = "No profiler found"
-        else:
-            prof_string = ""
+    executor.run_due_jobs()
 
-        if jobs:
-            logging.info("%sRunning %d due jobs... (%s)" % (prof_string, jobs.count(), ", ".join(['"%s"' % job.name for job in jobs])))
-            for job in Job.objects.due():
-                job.run()
-        else:
-            logging.debug("%sNo jobs due to run." % prof_string)
+    if do_gc:
+        gc.collect()
 
-        if self.do_gc:
-            gc.collect()
 
 class Command(BaseCommand):
     args = "time"
@@ -95,16 +78,19 @@ class Command(BaseCommand):
         except:
             raise CommandError("Invalid wait time: %s is not a number." % args[0])
 
+        executor = JobExecutor()
+        executor.start()
         try:
             sys.stdout.write("Starting cronserver.  Jobs will run every %d seconds.\n" % time_wait)
             if not options['daemon']:
                 sys.stdout.write("Quit the server with CONTROL-C.\n")
 
-            # Run server until killed
+            # Run server until killed.  Due jobs run on the executor's worker threads, so a long
+            #   job doesn't hold up the next look for due jobs, and a job is never started twice.
             while True:
-                thread = CronThread(gc=options.get("gc", False), mp=options.get("prof", False))
-                thread.start()
-                sleep(time_wait)
+                run_due_jobs(executor, do_gc=options.get("gc", False), do_profile=options.get("prof", False))
+                executor.wait(time_wait)
         except KeyboardInterrupt:
             logging.info("Exiting...\n")
+            executor.stop()
             sys.exit()
\ No newline at end of file
@@ -17,6 +17,7 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
 
+        from fle_utils.chronograph.executor import JobExecutor
         from fle_utils.chronograph.models import Job
 
         # In case any chronograph threads were interrupted the last time
@@ -26,20 +27,23 @@ class Command(BaseCommand):
         
         # Apparently, we check for jobs every 10 minutes by default
         sleep_time = getattr(settings, "CRONSERVER_FREQUENCY", 600)
-        
-        while not shutdown:
-            jobs = Job.objects.due()
-            
-            if jobs:
-                logging.info("Running %d due jobs... (%s)" % (jobs.count(), ", ".join(['"%s"' % job.name for job in jobs])))
-                for job in jobs:
-                    job.run()
-            else:
-                logging.debug("No jobs due to run.")
-            
-            # Sleep a little bit at a time to discover if we have to shutdown
-            for __ in range(60):
-                time.sleep(sleep_time // 60)
-                if shutdown:
-                    logging.info("Cronserver successfully terminated")
-                    break
+
+        # Due jobs run on the executor's worker threads; this thread just
+        # finds them, every sleep_time seconds or whenever it's woken (by force_job).
+        executor = JobExecutor()
+        executor.start()
+
+        try:
+            while not shutdown:
+                executor.run_due_jobs()
+
+                # Wait a little bit at a time to discover if we have to shutdown
+                waited = 0
+                while waited < sleep_time and not shutdown:
+                    start = time.time()
+                    if executor.wait(min(10, sleep_time - waited)):
+                        break
+                    waited += time.time() - start
+        finally:
+            executor.stop()
+        logging.info("Cronserver successfully terminated")
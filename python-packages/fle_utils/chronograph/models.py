@@ -2,6 +2,7 @@ import sys
 import traceback
 import subprocess
 import shlex
+import threading
 
 from datetime import datetime
 from dateutil import rrule
@@ -198,11 +199,9 @@ class Job(models.Model):
         stdout = StringIO()
         stderr = StringIO()
 
-        # Redirect output so that we can log it if there is any
-        ostdout = sys.stdout
-        ostderr = sys.stderr
-        sys.stdout = stdout
-        sys.stderr = stderr
+        # Redirect output so that we can log it if there is any.
+        #   Just this thread's, as other jobs may be running alongside.
+        _redirect_output(stdout, stderr)
         stdout_str, stderr_str, exception_str = "", "", ""
 
         try:
@@ -211,8 +210,7 @@ class Job(models.Model):
             exception_str = self._get_exception_string(e, sys.exc_info())
             self.last_run_successful = False
 
-        sys.stdout = ostdout
-        sys.stderr = ostderr
+        _redirect_output(None, None)
 
         stdout_str = stdout.getvalue()
         stderr_str = stderr.getvalue()
@@ -279,6 +277,31 @@ class Log(models.Model):
         else:
             return None
 
+class _ThreadRedirectedStream(object):
+    """
+    Stands in for sys.stdout or sys.stderr, writing to the stream set for the current thread, if any,
+    else to the stream it replaced.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(getattr(self.local, "stream", None) or self.stream, name)
+
+
+_redirect_lock = threading.Lock()
+
+def _redirect_output(stdout, stderr):
+    """Redirect the current thread's stdout and stderr (or, given None, stop redirecting them)."""
+    with _redirect_lock:
+        if not isinstance(sys.stdout, _ThreadRedirectedStream):
+            sys.stdout = _ThreadRedirectedStream(sys.stdout)
+        if not isinstance(sys.stderr, _ThreadRedirectedStream):
+            sys.stderr = _ThreadRedirectedStream(sys.stderr)
+    sys.stdout.local.stream = stdout
+    sys.stderr.local.stream = stderr
+
 def _escape_shell_command(command):
     for n in ('`', '$', '"'):
         command = command.replace(n, '\%s' % n)
@@ -9,3 +9,6 @@ except ImportError:
 ########################
 
 CRONSERVER_FREQUENCY = getattr(local_settings, "CRONSERVER_FREQUENCY", 600) # 10 mins (in seconds)
+
+# How many due jobs can run at once (each on its own thread; see chronograph.executor)
+CRONSERVER_WORKERS = getattr(local_settings, "CRONSERVER_WORKERS", 3)
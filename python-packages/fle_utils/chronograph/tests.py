@@ -0,0 +1,80 @@
+import sys
+import threading
+from datetime import datetime, timedelta
+from StringIO import StringIO
+
+from django.test import TestCase
+
+from .executor import JobExecutor, set_scheduler_waker, wake_scheduler
+from .models import Job, Log, _redirect_output
+
+
+class JobExecutorTestCase(TestCase):
+
+    def setUp(self):
+        self.job = Job.objects.create(name="echo", frequency="YEARLY", shell_command="echo hello", next_run=datetime.now() - timedelta(seconds=1))
+        Job.objects.create(name="later", frequency="YEARLY", shell_command="echo later", next_run=datetime.now() + timedelta(days=1))
+        # Not started, so jobs are only run when run_job is called (on this thread, which can see the test database).
+        self.executor = JobExecutor(workers=2)
+
+    def test_due_job_queued_once(self):
+        self.assertEqual([job.id for job in self.executor.run_due_jobs()], [self.job.id])
+        self.assertEqual(self.executor.run_due_jobs(), [])
+        self.assertEqual(self.executor.queue.qsize(), 1)
+
+    def test_run_job(self):
+        self.executor.run_due_jobs()
+        job_id, queued_at = self.executor.queue.get_nowait()
+        self.executor.run_job(job_id, 2.0)
+
+        job = Job.objects.get(id=job_id)
+        self.assertFalse(job.is_running)
+        self.assertTrue(job.next_run > datetime.now())
+        self.assertEqual(Log.objects.get(job=job).stdout, "hello\n")
+        stats = self.executor.get_stats()["jobs"]["echo"]
+        self.assertEqual(stats["runs"], 1)
+        self.assertEqual(stats["max_wait"], 2.0)
+
+    def test_running_job_skipped(self):
+        self.executor.run_due_jobs()
+        Job.objects.filter(id=self.job.id).update(is_running=True)
+        self.executor.run_job(self.job.id, 0)
+
+        self.assertEqual(Log.objects.count(), 0)
+        self.assertEqual(self.executor.get_stats()["jobs"], {})
+
+    def test_wake(self):
+        self.assertFalse(self.executor.wait(0))
+        self.executor.wake()
+        self.assertTrue(self.executor.wait(0))
+        self.assertFalse(self.executor.wait(0))
+
+    def test_wake_scheduler_of_another_process(self):
+        self.assertFalse(wake_scheduler())
+        set_scheduler_waker(self.executor.wake)  # as signalling it would
+        try:
+            self.assertTrue(wake_scheduler())
+            self.assertTrue(self.executor.wait(0))
+        finally:
+            set_scheduler_waker(None)
+
+
+class RedirectOutputTestCase(TestCase):
+
+    def test_redirected_per_thread(self):
+        outputs = [StringIO() for i in range(4)]
+
+        def write(n):
+            _redirect_output(outputs[n], None)
+            for i in range(100):
+                sys.stdout.write("%d" % n)
+            _redirect_output(None, None)
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for n, output in enumerate(outputs):
+            self.assertEqual(output.getvalue(), str(n) * 100)
@@ -1,5 +1,6 @@
 from datetime import datetime
 
+from .executor import wake_scheduler
 from .models import Job
 from fle_utils.django_utils.command import call_command_async
 
@@ -34,9 +35,10 @@ def force_job(command, name="", frequency="YEARLY", stop=False, **kwargs):
     # Set as variable so that we could pass as param later, if we want to!
     launch_job = not stop and not job.is_running
     if launch_job:  # don't run the same job twice
-        # Just start cron directly, so that the process starts immediately.
+        # Have the cronserver (running in this process, or serving alongside it) look for due jobs now.
+        # Otherwise, just start cron directly, so that the process starts immediately.
         # Note that if you're calling force_job frequently, then
         # you probably want to avoid doing this on every call.
-        if Job.objects.filter(disabled=False, is_running=False, next_run__lte=datetime.now()).count() > 0:
+        if not wake_scheduler() and Job.objects.filter(disabled=False, is_running=False, next_run__lte=datetime.now()).count() > 0:
             # logging.debug("Ready to launch command '%s'" % command)
             call_command_async("cron")
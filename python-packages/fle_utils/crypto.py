@@ -50,7 +50,7 @@ class Key(object):
         if self._using_m2crypto:
             signature = self._private_key.sign(hashed(message), algo="sha1")
         else:
-            signature = PYRSA.sign(message, self._private_key, "SHA-1")
+            signature = pyrsa_sign(message, self._private_key)
         
         if base64encode:
             return encode_base64(signature)
@@ -226,6 +226,17 @@ def hashed(message):
         pass
     return hashlib.sha1(message).digest()
     
+def pyrsa_sign(message, priv_key):
+    # Same as rsa.sign(message, priv_key, "SHA-1"), but exponentiating mod p and q (Chinese remainder
+    # theorem) rather than mod n, which is about three times faster, for the same signature.
+    cleartext = PYRSA.pkcs1.HASH_ASN1["SHA-1"] + PYRSA.pkcs1._hash(message, "SHA-1")
+    keylength = PYRSA.common.byte_size(priv_key.n)
+    payload = PYRSA.transform.bytes2int(PYRSA.pkcs1._pad_for_signing(cleartext, keylength))
+    m1 = pow(payload, priv_key.exp1, priv_key.p)
+    m2 = pow(payload, priv_key.exp2, priv_key.q)
+    h = (priv_key.coef * (m1 - m2)) % priv_key.p
+    return PYRSA.transform.int2bytes(m2 + h * priv_key.q, keylength)
+
 def encode_base64(data):
     return base64.encodestring(data).replace("\n", "")
 
@@ -0,0 +1,122 @@
+"""
+django.db.backends.sqlite3, set up for many threads using one database file:
+
+* Each connection is set up with the database's PRAGMAS, by default for WAL journaling (so reads
+  go on alongside a write, rather than waiting for it) and larger caches.
+* Statements that write, outside of managed transactions, are queued for one writer thread (see writer.py),
+  which commits them in groups, rather than each thread contending for the database's lock.  Reads stay on
+  each thread's own connection.  Statements in transactions (including the ones Django makes for bulk_create,
+  update and delete) run on the thread's own connection, as before, so they stay atomic.
+
+Settings, besides those of django.db.backends.sqlite3:
+    "PRAGMAS": A dict of pragma name to value, overriding those in DEFAULT_PRAGMAS.
+    "WRITE_QUEUE_SIZE": How many writes can wait for the writer thread; 0 for each thread to write for itself.
+    "WRITE_BATCH_SIZE": The most writes committed together.
+
+In-memory databases (e.g. for tests) can't be shared with the writer thread, so each thread writes for itself.
+"""
+import os
+import re
+import threading
+
+from django.db.backends.sqlite3.base import *
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper, SQLiteCursorWrapper
+
+from .writer import WriteQueue
+
+
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # with WAL, only a power loss can lose the last commits, and never corrupts the database
+    "mmap_size": 64 * 1024 * 1024,
+    "cache_size": -16 * 1024,  # in KiB, when negative
+}
+
+WRITE_STATEMENT_REGEX = re.compile(r"^\s*(INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+
+_write_queues = {}
+_write_queues_lock = threading.Lock()
+
+
+def get_write_queue(settings_dict, alias):
+    """
+    The (one) WriteQueue for a database file, in this process.  A forked process (e.g. a worker of
+    a prefork server) gets its own, as the writer thread (and its connection) stay in the parent.
+    """
+    key = (os.getpid(), settings_dict["NAME"])
+    write_queue = _write_queues.get(key)
+    if write_queue is None:
+        with _write_queues_lock:
+            if key not in _write_queues:
+                writer_settings_dict = dict(settings_dict)
+
+                def connect():
+                    database = DatabaseWrapper(writer_settings_dict, alias)
+                    database.queue_writes = False
+                    return database
+                _write_queues[key] = WriteQueue(
+                    connect,
+                    max_size=settings_dict["WRITE_QUEUE_SIZE"],
+                    batch_size=settings_dict.get("WRITE_BATCH_SIZE", 64),
+                    timeout=settings_dict["OPTIONS"].get("timeout", 5),
+                )
+            write_queue = _write_queues[key]
+    return write_queue
+
+
+class QueuedWriteCursorWrapper(SQLiteCursorWrapper):
+    """Hands writes outside of managed transactions to the write queue, and runs everything else itself."""
+
+    database = None
+    queued_write = None
+
+    def execute(self, query, params=()):
+        return self._execute("execute", query, params)
+
+    def executemany(self, query, param_list):
+        return self._execute("executemany", query, param_list)
+
+    def _execute(self, method, query, params):
+        self.queued_write = None
+        write_queue = self.database.write_queue
+        if write_queue and not self.database.is_managed() and WRITE_STATEMENT_REGEX.match(query):
+            self.queued_write = write_queue.write(method, query, params)
+            return self
+        return getattr(super(QueuedWriteCursorWrapper, self), method)(query, params)
+
+    @property
+    def rowcount(self):
+        if self.queued_write:
+            return self.queued_write.rowcount
+        return super(QueuedWriteCursorWrapper, self).rowcount
+
+    @property
+    def lastrowid(self):
+        if self.queued_write:
+            return self.queued_write.lastrowid
+        return super(QueuedWriteCursorWrapper, self).lastrowid
+
+
+class DatabaseWrapper(SQLiteDatabaseWrapper):
+
+    queue_writes = True
+
+    @property
+    def write_queue(self):
+        # Looked up each time, as the database NAME changes when a test database is set up.
+        if self.queue_writes and self.settings_dict.get("WRITE_QUEUE_SIZE") and self.settings_dict["NAME"] != ":memory:":
+            return get_write_queue(self.settings_dict, self.alias)
+        return None
+
+    def _sqlite_create_connection(self):
+        super(DatabaseWrapper, self)._sqlite_create_connection()
+        pragmas = dict(DEFAULT_PRAGMAS, **self.settings_dict.get("PRAGMAS", {}))
+        for name, value in pragmas.iteritems():
+            self.connection.execute("PRAGMA %s = %s" % (name, value))
+
+    def _cursor(self):
+        if self.connection is None:
+            self._sqlite_create_connection()
+        cursor = self.connection.cursor(factory=QueuedWriteCursorWrapper)
+        cursor.database = self
+        return cursor
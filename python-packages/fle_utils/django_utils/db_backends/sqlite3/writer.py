@@ -0,0 +1,117 @@
+"""
+A thread that does all the writing to a SQLite database, for any number of threads waiting on it.
+
+SQLite only has one writer at a time, whichever way it's done, but with each request thread writing
+for itself, they all contend for the database's lock (polling for it, up to the busy timeout), and each
+write is its own commit.  Instead, writes are queued (up to a maximum, beyond which writers wait), and
+the writer thread takes as many as are waiting (up to a batch size), runs them in one transaction, and
+commits them together (group commit).  Each caller waits until its write is committed, so it sees its
+own writes from then on, and gets the error if its statement (or the commit) failed.
+"""
+import Queue
+import sys
+import threading
+
+from django.db import utils
+from django.utils import six
+
+
+class QueuedWrite(object):
+
+    def __init__(self, method, query, params):
+        self.method = method  # "execute" or "executemany"
+        self.query = query
+        self.params = params
+        self.rowcount = -1
+        self.lastrowid = None
+        self.error = None  # exc_info, if it failed
+        self.done = threading.Event()
+
+
+class WriteQueue(object):
+
+    def __init__(self, connect, max_size=256, batch_size=64, timeout=60):
+        """
+        :param connect: Called (in the writer thread) to make the connection to write with,
+            a DatabaseWrapper with its writes not queued.
+        :param max_size: How many writes can be waiting, before more writers wait to queue theirs.
+        :param batch_size: The most writes committed together.
+        :param timeout: Seconds to wait for space in the queue, before failing as a busy database would.
+        """
+        self.connect = connect
+        self.queue = Queue.Queue(max_size)
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.thread = None
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.commits = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="sqlite-writer")
+                self.thread.daemon = True
+                self.thread.start()
+
+    def write(self, method, query, params):
+        """Queue a write, and wait for it to be committed.  Returns the QueuedWrite, with its rowcount and lastrowid."""
+        self.start()
+        write = QueuedWrite(method, query, params)
+        try:
+            self.queue.put(write, timeout=self.timeout)
+        except Queue.Full:
+            raise utils.DatabaseError("database is locked (write queue is full)")
+        write.done.wait()
+        if write.error:
+            six.reraise(*write.error)
+        return write
+
+    def run(self):
+        database = cursor = None
+        while True:
+            writes = [self.queue.get()]
+            while len(writes) < self.batch_size:
+                try:
+                    writes.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            if cursor is None:
+                try:
+                    database = self.connect()
+                    cursor = database._cursor()
+                except Exception:
+                    # Fail these, and try again with the next.
+                    error = sys.exc_info()
+                    for write in writes:
+                        write.error = error
+                        write.done.set()
+                    continue
+
+            for write in writes:
+                try:
+                    getattr(cursor, write.method)(write.query, write.params)
+                    write.rowcount, write.lastrowid = cursor.rowcount, cursor.lastrowid
+                except Exception:
+                    # SQLite undoes just the failed statement; the rest of the batch goes ahead.
+                    write.error = sys.exc_info()
+
+            try:
+                database._commit()
+            except Exception:
+                error = sys.exc_info()
+                try:
+                    database._rollback()
+                except Exception:
+                    pass
+                for write in writes:
+                    write.error = write.error or error
+
+            self.writes += len(writes)
+            self.commits += 1
+            for write in writes:
+                write.done.set()
+
+    def get_stats(self):
+        return {"writes": self.writes, "commits": self.commits, "queued": self.queue.qsize()}
@@ -1,4 +1,5 @@
 from urlparse import urlparse, urlunparse
+from django.db import transaction, IntegrityError
 from django.http import QueryDict
 
 def get_request_ip(request):
@@ -19,3 +20,22 @@ def is_loopback_connection(request):
 
     # if the requester's IP is either localhost or the same as the server's IP, then it's a loopback
     return remote_ip in ["127.0.0.1", "localhost", host_ip]
+
+
+def create_or_retry(create, retry=None, using=None):
+    """Call create() to insert a row that wasn't found, or if another connection inserted it first, call retry().
+
+    create() runs in a savepoint (as in Django's get_or_create), so that the IntegrityError doesn't
+    abort the surrounding transaction on databases like PostgreSQL.
+    Returns whether the row was created.
+    """
+    sid = transaction.savepoint(using=using)
+    try:
+        create()
+    except IntegrityError:
+        transaction.savepoint_rollback(sid, using=using)
+        if retry:
+            retry()
+        return False
+    transaction.savepoint_commit(sid, using=using)
+    return True
@@ -16,6 +16,76 @@ from .versioned_python import Deserializer as PythonDeserializer
 from fle_utils.general import version_diff
 
 
+# Types that handle_field passes through as they are (see is_protected_type), plus unicode,
+#   which value_to_string would return unchanged.
+_PLAIN_VALUE_TYPES = frozenset([unicode, int, long, float, bool, type(None), datetime.datetime, datetime.date, datetime.time, decimal.Decimal])
+
+_serialization_plans = {}
+
+
+def get_serialization_plan(Model, dest_version, selected_fields=None):
+    """
+    Returns the plan for serializing objects of Model for a device of dest_version:
+    None if they're left out (the model is newer than dest_version), else a list of
+    (handler, field) for the fields to serialize, in order.
+
+    Computed once per (Model, dest_version, selected_fields), rather than comparing
+    versions for every field of every object serialized.
+    """
+    key = (Model, dest_version, selected_fields and frozenset(selected_fields))
+    if key in _serialization_plans:
+        return _serialization_plans[key]
+
+    # See logic below.  We selectively skip serializing
+    #   objects that have a (starting) version greater than the
+    #   version we're serializing for.
+    v_diff = version_diff(dest_version, getattr(Model, "minversion", None))
+    if v_diff is not None and v_diff < 0:
+        plan = None
+    else:
+        plan = []
+        # Use the concrete parent class' _meta instead of the object's _meta
+        # This is to avoid local_fields problems for proxy models. Refs #17717.
+        concrete_model = Model._meta.concrete_model
+        for field in concrete_model._meta.local_fields:
+
+            # "and" condition added by KA Lite.
+            #
+            # Serialize the field UNLESS all of the following are true:
+            #   * we've passed in a specific dest_version
+            #   * the field is marked with a version
+            #   * that version is later than the dest_version
+            v_diff = version_diff(dest_version, getattr(field, "minversion", None))
+            if field.serialize and (v_diff is None or v_diff >= 0):
+                if field.rel is None:
+                    if selected_fields is None or field.attname in selected_fields:
+                        plan.append((_get_field_handler(field), field))
+                else:
+                    if selected_fields is None or field.attname[:-3] in selected_fields:
+                        plan.append((Serializer.handle_fk_field, field))
+        for field in concrete_model._meta.many_to_many:
+            # "and" condition added by KA Lite.  Logic the same as above.
+            v_diff = version_diff(dest_version, getattr(field, "minversion", None))
+            if field.serialize and (v_diff >= 0 or v_diff is None):
+                if selected_fields is None or field.attname in selected_fields:
+                    plan.append((Serializer.handle_m2m_field, field))
+
+    _serialization_plans[key] = plan
+    return plan
+
+
+def _get_field_handler(field):
+    """
+    Fields that get their value and its string the way models.Field does (most of them)
+    can mostly skip handle_field's method calls.
+    """
+    field_class = field.__class__
+    if field_class.value_to_string.im_func is models.Field.value_to_string.im_func and \
+            field_class._get_val_from_obj.im_func is models.Field._get_val_from_obj.im_func:
+        return Serializer.handle_plain_field
+    return Serializer.handle_field
+
+
 class Serializer(json.Serializer):
     """
     Abstract serializer base class.
@@ -40,39 +110,13 @@ class Serializer(json.Serializer):
         self.start_serialization()
         self.first = True
         for obj in queryset:
-            # See logic below.  We selectively skip serializing
-            #   objects that have a (starting) version greater than the
-            #   version we're serializing for.
-            v_diff = version_diff(dest_version, getattr(obj, "minversion", None))
-            if v_diff is not None and v_diff < 0:
+            plan = get_serialization_plan(obj.__class__, dest_version, self.selected_fields)
+            if plan is None:
                 continue
 
             self.start_object(obj)
-            # Use the concrete parent class' _meta instead of the object's _meta
-            # This is to avoid local_fields problems for proxy models. Refs #17717.
-            concrete_model = obj._meta.concrete_model
-            for field in concrete_model._meta.local_fields:
-
-                # "and" condition added by KA Lite.
-                #
-                # Serialize the field UNLESS all of the following are true:
-                #   * we've passed in a specific dest_version
-                #   * the field is marked with a version
-                #   * that version is later than the dest_version
-                v_diff = version_diff(dest_version, getattr(field, "minversion", None))
-                if field.serialize and (v_diff is None or v_diff >= 0):
-                    if field.rel is None:
-                        if self.selected_fields is None or field.attname in self.selected_fields:
-                            self.handle_field(obj, field)
-                    else:
-                        if self.selected_fields is None or field.attname[:-3] in self.selected_fields:
-                            self.handle_fk_field(obj, field)
-            for field in concrete_model._meta.many_to_many:
-                # "and" condition added by KA Lite.  Logic the same as above.
-                v_diff = version_diff(dest_version, getattr(field, "minversion", None))
-                if field.serialize and (v_diff >= 0 or v_diff is None):
-                    if self.selected_fields is None or field.attname in self.selected_fields:
-                        self.handle_m2m_field(obj, field)
+            for handler, field in plan:
+                handler(self, obj, field)
             self.end_object(obj)
 
             self.first = False
@@ -80,6 +124,29 @@ class Serializer(json.Serializer):
         self.end_serialization()
         return self.getvalue()
 
+    def handle_plain_field(self, obj, field):
+        """handle_field, for fields that use models.Field's value_to_string, without its method calls for common values."""
+        value = getattr(obj, field.attname)
+        if value.__class__ in _PLAIN_VALUE_TYPES:
+            self._current[field.name] = value
+        else:
+            self.handle_field(obj, field)
+
+    def end_object(self, obj):
+        """
+        Same as json.Serializer.end_object, but encoding the object in one go (with the C encoder, when it's
+        available), rather than streaming it, piece by piece, through the Python one.
+        """
+        indent = self.options.get("indent")
+        if not self.first:
+            self.stream.write(",")
+            if not indent:
+                self.stream.write(" ")
+        if indent:
+            self.stream.write("\n")
+        self.stream.write(simplejson.dumps(self.get_dump_object(obj), cls=json.DjangoJSONEncoder, **self.json_kwargs))
+        self._current = None
+
 
 def Deserializer(stream_or_string, **options):
     """
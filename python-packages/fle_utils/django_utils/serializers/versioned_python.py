@@ -10,6 +10,86 @@ from django.utils.encoding import smart_unicode, is_protected_type
 from fle_utils.general import version_diff
 
 
+# How each field's value is put into the data for a new object
+_M2M, _FK, _PLAIN = range(3)
+
+_deserialization_plans = {}
+
+
+def get_deserialization_plan(model_identifier, dest_version):
+    """
+    Returns the plan for deserializing objects of a model (given by its "app_label.model_name")
+    on a device of dest_version: None if they're skipped (the model is newer than dest_version),
+    else (Model, {field name: (kind, key, convert)}), where the converted value goes into the
+    m2m data (kind _M2M) or the object's data (_FK and _PLAIN), under key.
+
+    Computed once per (model, dest_version), rather than for every field of every object deserialized.
+    """
+    key = (model_identifier, dest_version)
+    if key in _deserialization_plans:
+        return _deserialization_plans[key]
+
+    Model = _get_model(model_identifier)
+
+    # See comment in Deserializer for versioned fields; same logic
+    #   applies here as well.
+    plan = (Model, {})
+    if hasattr(Model, "version"):
+        v_diff = version_diff(Model.minversion, dest_version)
+        if v_diff > 0 or v_diff is None:
+            plan = None
+
+    if plan:
+        for field in Model._meta.fields + Model._meta.many_to_many:
+            # Handle M2M relations
+            if field.rel and isinstance(field.rel, models.ManyToManyRel):
+                plan[1][field.name] = (_M2M, field.name, _get_m2m_convert(field))
+
+            # Handle FK fields
+            elif field.rel and isinstance(field.rel, models.ManyToOneRel):
+                plan[1][field.name] = (_FK, field.attname, _get_fk_convert(field))
+
+            # Handle all other fields
+            else:
+                plan[1][field.name] = (_PLAIN, field.name, field.to_python)
+
+    _deserialization_plans[key] = plan
+    return plan
+
+
+def _get_m2m_convert(field):
+    to_python = field.rel.to._meta.pk.to_python
+    if hasattr(field.rel.to._default_manager, 'get_by_natural_key'):
+        def m2m_convert(value, db):
+            if hasattr(value, '__iter__'):
+                return field.rel.to._default_manager.db_manager(db).get_by_natural_key(*value).pk
+            else:
+                return smart_unicode(to_python(value))
+    else:
+        m2m_convert = lambda v, db: smart_unicode(to_python(v))
+    return lambda field_value, db: [m2m_convert(pk, db) for pk in field_value]
+
+
+def _get_fk_convert(field):
+    to_python = field.rel.to._meta.get_field(field.rel.field_name).to_python
+    if hasattr(field.rel.to._default_manager, 'get_by_natural_key'):
+        def fk_convert(field_value, db):
+            if field_value is None:
+                return None
+            if hasattr(field_value, '__iter__'):
+                obj = field.rel.to._default_manager.db_manager(db).get_by_natural_key(*field_value)
+                value = getattr(obj, field.rel.field_name)
+                # If this is a natural foreign key to an object that
+                # has a FK/O2O as the foreign key, use the FK value
+                if field.rel.to._meta.pk.rel:
+                    value = value.pk
+                return value
+            return to_python(field_value)
+    else:
+        fk_convert = lambda field_value, db: None if field_value is None else to_python(field_value)
+    return fk_convert
+
+
 def Deserializer(object_list, **options):
     """
     Deserialize simple Python objects back into Django ORM instances.
@@ -18,82 +98,55 @@ def Deserializer(object_list, **options):
     stream or a string) to the constructor
     """
     db = options.pop('using', DEFAULT_DB_ALIAS)
+    encoding = options.get("encoding", settings.DEFAULT_CHARSET)
 
     #
     src_version = options.pop("src_version")  # version that was serialized
     dest_version = options.pop("dest_version")  # version that we're deserializing to
     assert dest_version, "For KA Lite, we should always set the dest version to the current device."
 
+    # Fields we don't have:
+    #   If src version is newer than dest version,
+    #   or if it's unknown, then assume that the field
+    #   is a new one and skip it.
+    # We can't know for sure, because
+    #   we don't have that field (we are the dest!),
+    #   so we don't know what version it came in on.
+    v_diff = version_diff(src_version, dest_version)
+    skip_unknown_fields = v_diff > 0 or v_diff is None
+
     models.get_apps()
     for d in object_list:
-        # Look up the model and starting build a dict of data for it.
-        Model = _get_model(d["model"])
-
-        # See comment below for versioned fields; same logic
-        #   applies here as well.
-        if hasattr(Model, "version"):
-            v_diff = version_diff(Model.minversion, dest_version)
-            if v_diff > 0 or v_diff is None:
-                continue
+        # Look up the model, and how to deserialize its fields.
+        #   Models newer than our version are skipped (the plan is None).
+        plan = get_deserialization_plan(d["model"], dest_version)
+        if plan is None:
+            continue
+        Model, fields = plan
 
+        # Start building a dict of data for it.
         data = {Model._meta.pk.attname : Model._meta.pk.to_python(d["pk"])}
         m2m_data = {}
 
         # Handle each field
         for (field_name, field_value) in d["fields"].iteritems():
             if isinstance(field_value, str):
-                field_value = smart_unicode(field_value, options.get("encoding", settings.DEFAULT_CHARSET), strings_only=True)
+                field_value = smart_unicode(field_value, encoding, strings_only=True)
 
             try:
-                field = Model._meta.get_field(field_name)
-            except models.FieldDoesNotExist as fdne:
-                # If src version is newer than dest version,
-                #   or if it's unknown, then assume that the field
-                #   is a new one and skip it.
-                # We can't know for sure, because
-                #   we don't have that field (we are the dest!),
-                #   so we don't know what version it came in on.
-                v_diff = version_diff(src_version, dest_version)
-                if v_diff > 0 or v_diff is None:
+                kind, key, convert = fields[field_name]
+            except KeyError:
+                if skip_unknown_fields:
                     continue
+                # Something else must be going on, so raise (as Django would).
+                Model._meta.get_field(field_name)
+                raise
 
-                # Something else must be going on, so re-raise.
-                else:
-                    raise fdne
-
-            # Handle M2M relations
-            if field.rel and isinstance(field.rel, models.ManyToManyRel):
-                if hasattr(field.rel.to._default_manager, 'get_by_natural_key'):
-                    def m2m_convert(value):
-                        if hasattr(value, '__iter__'):
-                            return field.rel.to._default_manager.db_manager(db).get_by_natural_key(*value).pk
-                        else:
-                            return smart_unicode(field.rel.to._meta.pk.to_python(value))
-                else:
-                    m2m_convert = lambda v: smart_unicode(field.rel.to._meta.pk.to_python(v))
-                m2m_data[field.name] = [m2m_convert(pk) for pk in field_value]
-
-            # Handle FK fields
-            elif field.rel and isinstance(field.rel, models.ManyToOneRel):
-                if field_value is not None:
-                    if hasattr(field.rel.to._default_manager, 'get_by_natural_key'):
-                        if hasattr(field_value, '__iter__'):
-                            obj = field.rel.to._default_manager.db_manager(db).get_by_natural_key(*field_value)
-                            value = getattr(obj, field.rel.field_name)
-                            # If this is a natural foreign key to an object that
-                            # has a FK/O2O as the foreign key, use the FK value
-                            if field.rel.to._meta.pk.rel:
-                                value = value.pk
-                        else:
-                            value = field.rel.to._meta.get_field(field.rel.field_name).to_python(field_value)
-                        data[field.attname] = value
-                    else:
-                        data[field.attname] = field.rel.to._meta.get_field(field.rel.field_name).to_python(field_value)
-                else:
-                    data[field.attname] = None
-
-            # Handle all other fields
+            if kind == _PLAIN:
+                data[key] = convert(field_value)
+            elif kind == _FK:
+                data[key] = convert(field_value, db)
             else:
-                data[field.name] = field.to_python(field_value)
+                m2m_data[key] = convert(field_value, db)
 
         yield base.DeserializedObject(Model(**data), m2m_data)
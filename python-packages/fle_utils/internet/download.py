@@ -7,6 +7,12 @@ from requests.utils import default_user_agent
 
 socket.setdefaulttimeout(20)
 
+# Large enough to keep per-chunk overhead down on fast links, small enough for frequent progress updates.
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# Downloads in progress are kept under their destination path with this suffix, until complete.
+PARTIAL_SUFFIX = ".partial"
+
 
 class DownloadCancelled(Exception):
 
@@ -47,35 +53,83 @@ def _nullhook(*args, **kwargs):
     pass
 
 
-def download_file(url, dst=None, callback=None):
+def get_total_size(response):
+    """
+    The size of the whole file behind a response: for a partial (206) or unsatisfiable (416) response
+    to a Range request, from its Content-Range header, otherwise from its Content-Length header.
+    None if unknown.
+    """
+    content_range = response.headers.get("content-range")
+    if content_range and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1].strip()
+        return int(total) if total.isdigit() else None
+    if "content-length" in response.headers:
+        return int(response.headers["content-length"])
+    return None
+
+
+def download_file(url, dst=None, callback=None, resume=False, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """
+    Download url to dst (or a temporary file), calling callback with the fraction done along the way.
+
+    With resume=True, the file is downloaded to dst + PARTIAL_SUFFIX first, and only moved to dst
+    once it is complete; if a partial file is already there (e.g. from a dropped connection), only
+    the rest of it is requested (with an HTTP Range request), rather than starting over.  Raises
+    IOError if the download ends before the file is complete, leaving the partial file in place.
+    """
     if sys.stdout.isatty():
         callback = callback or _reporthook
     else:
         callback = callback or _nullhook
     dst = dst or tempfile.mkstemp()[1]
+    partial_dst = dst + PARTIAL_SUFFIX if resume else dst
+    offset = os.path.getsize(partial_dst) if resume and os.path.isfile(partial_dst) else 0
 
     # Assuming the KA Lite version is included in user agent because of an
     # intention to create stats on learningequality.org
     from kalite.version import user_agent
+    headers = {"user-agent": user_agent()}
+    if offset:
+        headers["range"] = "bytes=%d-" % offset
     response = requests.get(
         url,
         allow_redirects=True,
         stream=True,
-        headers={"user-agent": user_agent()}
+        headers=headers
     )
+    if response.status_code == 404:
+        raise URLNotFound("%s was not found" % url)
+
+    total_size = get_total_size(response)
+    if response.status_code == 416 and offset and offset == total_size:
+        # Everything there was to get is already there.
+        offset = None
+    elif response.status_code == 206 and offset:
+        pass
+    else:
+        if response.status_code == 416:
+            os.remove(partial_dst)  # doesn't match the file on the server; start over next time
+
+        response.raise_for_status()
+        offset = 0  # The server sent the whole file, rather than the requested range.
+
     # If a destination is set, then we'll write a file and send back updates
-    if dst:
-        chunk_size = 1024
-        with open(dst, 'wb') as fd:
-            for chunk_number, chunk in enumerate(response.iter_content(chunk_size)):
+    if dst and offset is not None:
+        bytes_fetched = offset
+        with open(partial_dst, "ab" if offset else "wb") as fd:
+            for chunk in response.iter_content(chunk_size):
                 fd.write(chunk)
-                bytes_fetched = chunk_number * chunk_size
-                if 'content-length' not in response.headers:
-                    fraction = 0.0
-                elif int(response.headers['content-length']) == 0:
+                bytes_fetched += len(chunk)
+                if not total_size:
                     fraction = 0.0
                 else:
-                    total_size = float(response.headers['content-length'])
                     fraction = min(float(bytes_fetched) / total_size, 1.0)
                 callback(fraction)
+
+    if resume:
+        if total_size is not None and os.path.getsize(partial_dst) != total_size:
+            raise IOError("Download of %s ended at %d of %d bytes" % (url, os.path.getsize(partial_dst), total_size))
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.rename(partial_dst, dst)
     return response
@@ -11,11 +11,13 @@ import os
 import shutil
 import sys
 import tempfile
+import threading
 import unittest
 from mock import patch, Mock
 from unittest import TestCase
 
 import fle_utils.videos as videos
+from fle_utils.internet import download
 from general import datediff, version_diff, ensure_dir
 
 
@@ -178,5 +180,175 @@ class DownloadFileTests(TestCase):
         url, filepath, func = download_file_method.call_args_list[0][0]
         self.assertEqual(filepath, expected_path)
 
+class ResumeDownloadTests(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.dst = os.path.join(self.tempdir, "video.mp4")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def response(self, status_code, headers, content):
+        return Mock(status_code=status_code, headers=headers, iter_content=Mock(return_value=[content]))
+
+    @patch.object(download.requests, "get")
+    def test_resumes_partial_file(self, get):
+        with open(self.dst + download.PARTIAL_SUFFIX, "wb") as f:
+            f.write("abcd")
+        get.return_value = self.response(206, {"content-range": "bytes 4-9/10", "content-length": "6"}, "efghij")
+
+        download.download_file("http://example.com/video.mp4", self.dst, Mock(), resume=True)
+
+        self.assertEqual(get.call_args[1]["headers"]["range"], "bytes=4-")
+        self.assertFalse(os.path.exists(self.dst + download.PARTIAL_SUFFIX))
+        with open(self.dst, "rb") as f:
+            self.assertEqual(f.read(), "abcdefghij")
+
+    @patch.object(download.requests, "get")
+    def test_incomplete_download_is_kept(self, get):
+        get.return_value = self.response(200, {"content-length": "10"}, "abcd")
+
+        self.assertRaises(IOError, download.download_file, "http://example.com/video.mp4", self.dst, Mock(), resume=True)
+
+        self.assertFalse(os.path.exists(self.dst))
+        self.assertEqual(os.path.getsize(self.dst + download.PARTIAL_SUFFIX), 4)
+
+
+class QueuedWriteDatabaseTests(TestCase):
+
+    def setUp(self):
+        from fle_utils.django_utils.db_backends.sqlite3 import base
+        self.base = base
+        self.tempdir = tempfile.mkdtemp()
+        self.settings_dict = {
+            "ENGINE": "fle_utils.django_utils.db_backends.sqlite3",
+            "NAME": os.path.join(self.tempdir, "data.sqlite"),
+            "OPTIONS": {"timeout": 5},
+            "WRITE_QUEUE_SIZE": 8,
+            "WRITE_BATCH_SIZE": 4,
+            "USER": "", "PASSWORD": "", "HOST": "", "PORT": "", "TIME_ZONE": None,
+        }
+        self.cursor = self.connect()
+        self.cursor.execute("CREATE TABLE item (id INTEGER PRIMARY KEY AUTOINCREMENT, value INTEGER UNIQUE)")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def connect(self):
+        return self.base.DatabaseWrapper(dict(self.settings_dict), "test")._cursor()
+
+    def test_wal(self):
+        self.assertEqual(self.cursor.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+    def test_writes_from_threads(self):
+        errors = []
+        ids = []
+
+        def write(n):
+            cursor = self.connect()
+            for i in range(10):
+                cursor.execute("INSERT INTO item (value) VALUES (%s)", [n * 100 + i])
+                ids.append(cursor.lastrowid)
+            try:
+                cursor.execute("INSERT INTO item (value) VALUES (%s)", [n * 100])
+            except Exception as e:
+                errors.append(e)
+            cursor.execute("UPDATE item SET value = value WHERE value >= %s AND value < %s", [n * 100, n * 100 + 5])
+            self.assertEqual(cursor.rowcount, 5)
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.cursor.execute("SELECT count(*) FROM item").fetchone()[0], 50)
+        self.assertEqual(len(set(ids)), 50)
+        self.assertEqual(len(errors), 5)  # the duplicates, and only those
+        stats = self.base.get_write_queue(self.settings_dict, "test").get_stats()
+        self.assertEqual(stats["writes"], 60)
+
+    def values(self):
+        return [row[0] for row in self.cursor.execute("SELECT value FROM item ORDER BY value").fetchall()]
+
+    def test_errors_raised_in_writing_thread(self):
+        from django.db.utils import IntegrityError
+        errors = {}
+
+        def write(n):
+            cursor = self.connect()
+            cursor.execute("INSERT INTO item (value) VALUES (%s)", [n])
+            try:
+                cursor.execute("INSERT INTO item (value) VALUES (%s)", [n])
+            except Exception as e:
+                errors[n] = e
+            cursor.execute("INSERT INTO item (value) VALUES (%s)", [n + 100])
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(errors), range(8))
+        self.assertTrue(all(isinstance(e, IntegrityError) for e in errors.values()))
+        # the others in their batches were committed all the same
+        self.assertEqual(self.values(), range(8) + range(100, 108))
+
+    def test_failed_commit_rolled_back(self):
+        from django.db.utils import DatabaseError
+        cursor = self.connect()
+        with patch.object(self.base.DatabaseWrapper, "_commit", side_effect=DatabaseError("disk I/O error")):
+            self.assertRaises(DatabaseError, cursor.execute, "INSERT INTO item (value) VALUES (%s)", [1])
+        cursor.execute("INSERT INTO item (value) VALUES (%s)", [2])
+        self.assertEqual(self.values(), [2])
+
+    def test_transactions_alongside_queued_writes(self):
+        inserted, finish = threading.Event(), threading.Event()
+        seen = []
+
+        def write_in_transaction():
+            database = self.base.DatabaseWrapper(dict(self.settings_dict), "test")
+            database.enter_transaction_management()
+            database.managed(True)
+            try:
+                cursor = database._cursor()
+                cursor.execute("INSERT INTO item (value) VALUES (%s)", [1])  # on its own connection, not queued
+                seen.append(cursor.execute("SELECT count(*) FROM item").fetchone()[0])
+                inserted.set()
+                finish.wait()
+                database.rollback()
+            finally:
+                database.leave_transaction_management()
+
+        def write(n):
+            self.connect().execute("INSERT INTO item (value) VALUES (%s)", [n])
+
+        transaction_thread = threading.Thread(target=write_in_transaction)
+        transaction_thread.start()
+        inserted.wait()
+        self.assertEqual(self.values(), [])  # not committed
+
+        # queued writes wait for the database's lock, until the transaction is done
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(10, 15)]
+        for thread in threads:
+            thread.start()
+        finish.set()
+        for thread in threads + [transaction_thread]:
+            thread.join()
+
+        self.assertEqual(seen, [1])
+        self.assertEqual(self.values(), range(10, 15))
+        self.assertEqual(self.base.get_write_queue(self.settings_dict, "test").get_stats()["writes"], 5)
+
+    def test_write_queue_per_process(self):
+        write_queue = self.base.get_write_queue(self.settings_dict, "test")
+        self.assertIs(self.base.get_write_queue(self.settings_dict, "test"), write_queue)
+        with patch("os.getpid", return_value=os.getpid() + 1):
+            # as in a forked process, where the parent's writer thread doesn't run
+            self.assertIsNot(self.base.get_write_queue(self.settings_dict, "test"), write_queue)
+
+
 if __name__ == '__main__':
     sys.exit(unittest.main())
@@ -6,7 +6,7 @@ import os
 import socket
 
 from general import ensure_dir
-from internet.download import callback_percent_proxy, download_file, URLNotFound, DownloadCancelled
+from internet.download import callback_percent_proxy, download_file, get_total_size, URLNotFound, DownloadCancelled
 
 OUTSIDE_DOWNLOAD_BASE_URL = "http://s3.amazonaws.com/KA-youtube-converted/"  # needed for redirects
 OUTSIDE_DOWNLOAD_URL = OUTSIDE_DOWNLOAD_BASE_URL + "%s/%s"  # needed for default behavior, below
@@ -38,18 +38,14 @@ def download_video(youtube_id, download_path="../content/", download_url=OUTSIDE
     thumb_filepath = os.path.join(download_path, thumb_filename)
 
     try:
-        response = download_file(url, filepath, callback_percent_proxy(callback, end_percent=95))
-        if (
-                not os.path.isfile(filepath) or
-                "content-length" not in response.headers or
-                not len(open(filepath, "rb").read()) == int(response.headers['content-length'])):
-            raise URLNotFound("Video was not found, tried: {}".format(url))
-
-        response = download_file(thumb_url, thumb_filepath, callback_percent_proxy(callback, start_percent=95, end_percent=100))
-        if (
-                not os.path.isfile(thumb_filepath) or
-                "content-length" not in response.headers or
-                not len(open(thumb_filepath, "rb").read()) == int(response.headers['content-length'])):
+        # Downloads are only moved into place once complete, so a video that's there is done.
+        if not os.path.isfile(filepath):
+            response = download_file(url, filepath, callback_percent_proxy(callback, end_percent=95), resume=True)
+            if not _is_complete(filepath, response):
+                raise URLNotFound("Video was not found, tried: {}".format(url))
+
+        response = download_file(thumb_url, thumb_filepath, callback_percent_proxy(callback, start_percent=95, end_percent=100), resume=True)
+        if not _is_complete(thumb_filepath, response):
             raise URLNotFound("Thumbnail was not found, tried: {}".format(thumb_url))
 
     except DownloadCancelled:
@@ -59,7 +55,7 @@ def download_video(youtube_id, download_path="../content/", download_url=OUTSIDE
     except (socket.timeout, IOError) as e:
         logging.exception(e)
         logging.info("Timeout -- Network UnReachable")
-        delete_downloaded_files(youtube_id, download_path)
+        # Keep what was downloaded so far, to pick up from there next time.
         raise
 
     except Exception as e:
@@ -68,6 +64,12 @@ def download_video(youtube_id, download_path="../content/", download_url=OUTSIDE
         raise
 
 
+def _is_complete(filepath, response):
+    """Whether the file is there, with as many bytes as the server said there are (without reading it back in)."""
+    total_size = get_total_size(response)
+    return os.path.isfile(filepath) and total_size is not None and os.path.getsize(filepath) == total_size
+
+
 def delete_downloaded_files(youtube_id, download_path):
     files_deleted = 0
     for filepath in glob.glob(os.path.join(download_path, youtube_id + ".*")):
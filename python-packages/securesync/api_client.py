@@ -31,10 +31,12 @@ class BaseClient(object):
 
         if self.verbose:
             print "CLIENT: post %s" % path
+        kwargs['headers'] = kwargs.get('headers', {})
+        kwargs['headers']["user-agent"] = user_agent()
         return requests.post(
             self.path_to_url(path),
             data=json.dumps(payload),
-            headers={"user-agent": user_agent()}
+            **kwargs
         )
 
     def get(self, path, payload={}, *args, **kwargs):
@@ -0,0 +1,65 @@
+"""
+Per-process cache of device state that's looked up all the time, but rarely changes:
+the zone a device is in, and its DeviceMetadata (whether it's trusted, or our own, and its counter position).
+
+Entries are dropped as the models they come from are saved or deleted in this process (see the signal
+handlers in devices.models).  As other processes can change them too, entries are also only kept for
+DEVICE_STATE_CACHE_TIMEOUT seconds.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+
+class DeviceStateCache(object):
+
+    def __init__(self):
+        self.entries = {}  # (kind, device id) -> (expiry time, value)
+        self.generation = 0  # to tell when entries were invalidated while computing a value
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, device_id, compute):
+        """
+        The cached value of a kind (e.g. "zone") for a device, or else the result of calling compute,
+        cached for next time.
+        """
+        key = (kind, device_id)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self.generation
+
+        value = compute()
+
+        with self.lock:
+            # Don't cache what may have changed since computing it.
+            if generation == self.generation:
+                self.entries[key] = (now + settings.DEVICE_STATE_CACHE_TIMEOUT, value)
+        return value
+
+    def invalidate(self, kind, device_id=None):
+        """Drop the cached values of a kind, for one device or else for all."""
+        with self.lock:
+            self.generation += 1
+            for key in self.entries.keys():
+                if key[0] == kind and (device_id is None or key[1] == device_id):
+                    del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def get_stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+
+device_state_cache = DeviceStateCache()
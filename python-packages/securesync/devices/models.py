@@ -1,5 +1,6 @@
 """
 """
+import copy
 import datetime
 import logging
 import uuid
@@ -11,12 +12,15 @@ from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.db import models, transaction, IntegrityError
 from django.db.models import Q
 from django.db.models.expressions import F
+from django.db.models.signals import post_delete, post_save
 from django.utils.text import compress_string
 from django.utils.translation import ugettext_lazy as _
 
 from .. import ID_MAX_LENGTH, IP_MAX_LENGTH, VERSION
 from .. import crypto
+from .cache import device_state_cache
 from ..engine.models import SyncedModel, SyncedModelManager
+from ..engine.verification import get_key
 from fle_utils.general import get_host_name
 from fle_utils.django_utils.debugging import validate_via_booleans
 from fle_utils.django_utils.classes import ExtendedModel
@@ -216,7 +220,8 @@ class Device(SyncedModel):
                 # get_metadata can fail if the Device instance hasn't been persisted to the db
                 pass
             if not self.key and self.public_key:
-                self.key = crypto.Key(public_key_string=self.public_key)
+                # Shared with every other instance of this device, rather than parsed again.
+                self.key = get_key(self.public_key)
         return self.key
 
     def _hashable_representation(self):
@@ -224,6 +229,16 @@ class Device(SyncedModel):
         return super(Device, self)._hashable_representation(fields=fields)
 
     def get_metadata(self):
+        """
+        The (cached) metadata of this device.  To change it, use get_fresh_metadata instead,
+        so as not to write back cached values that may have been changed since.
+        """
+        if not self.id:
+            return self.get_fresh_metadata()
+        # A copy, so that changes to it don't end up in the cache.
+        return copy.copy(device_state_cache.get("metadata", self.id, self.get_fresh_metadata))
+
+    def get_fresh_metadata(self):
         try:
             return DeviceMetadata.objects.get_or_create(device=self)[0]
         except IntegrityError as e:
@@ -241,14 +256,14 @@ class Device(SyncedModel):
             return self.get_metadata().counter_position
 
     def set_counter_position(self, counter_position, soft_set=False):
-        metadata = self.get_metadata()
+        metadata = self.get_fresh_metadata()
         if not metadata.device.id:  # only happens if device has not been saved yet.  Should be changed to self.id
             return
 
         # It's often convenient to reset the position ONLY if the new counter position
         #   is higher than the old.  So, let people be lazy--but need to send in a flag,
         #   so it's clear that something a bit unusual is happening in a "set"
-        if soft_set and self.signed_by.get_counter_position() >= counter_position:
+        if soft_set and self.signed_by.get_fresh_metadata().counter_position >= counter_position:
             return
 
         assert counter_position >= metadata.counter_position, "You should not be setting the counter position to a number lower than its current value!"
@@ -261,10 +276,21 @@ class Device(SyncedModel):
         TODO-BLOCKER(jamalex): While from testing, this new version seems much less prone to race conditions,
         it still seems like a possibility. Further testing would be good.
         """
-        metadata = self.get_metadata()
+        metadata = self.get_fresh_metadata()
         metadata.counter_position = F("counter_position") + 1
         metadata.save()
-        return self.get_metadata().counter_position
+        return self.get_fresh_metadata().counter_position
+
+    @transaction.commit_on_success
+    def reserve_counter_positions(self, count):
+        """
+        Increment the counter position for this device by count at once, as increment_counter_position does by one,
+        and return the first of the count positions reserved.
+        """
+        metadata = self.get_fresh_metadata()
+        metadata.counter_position = F("counter_position") + count
+        metadata.save()
+        return self.get_fresh_metadata().counter_position - count + 1
 
     def full_clean(self, *args, **kwargs):
         # TODO(jamalex): we skip out here, because otherwise self-signed devices will fail
@@ -312,7 +338,10 @@ class Device(SyncedModel):
         own_device.sign(device=own_device)  # must sign, in order to use imported codepath
         super(Device, own_device).save(imported=True, increment_counters=False)
 
-        metadata = own_device.get_metadata()
+        # A new own device (e.g. a fresh database), so whatever was known about devices is no more.
+        device_state_cache.clear()
+
+        metadata = own_device.get_fresh_metadata()
         metadata.is_own_device = True
         metadata.is_trusted = settings.CENTRAL_SERVER  # this is OK to set, as DeviceMetata is NEVER synced.
         metadata.save()
@@ -323,9 +352,14 @@ class Device(SyncedModel):
         return self.name or self.id[0:5]
 
     def get_zone(self):
+        if not self.id:
+            return None
+        return device_state_cache.get("zone", self.id, self._get_zone)
+    get_zone.short_description = "Zone"
+
+    def _get_zone(self):
         zones = self.devicezone_set.filter(revoked=False)
         return zones and zones[0].zone or None
-    get_zone.short_description = "Zone"
 
     @validate_via_booleans
     def validate(self):
@@ -348,7 +382,7 @@ class Device(SyncedModel):
         super(Device, self).save(*args, **kwargs)
 
         if is_trusted:
-            metadata = self.get_metadata()
+            metadata = self.get_fresh_metadata()
             metadata.is_trusted = True
             metadata.save()
 
@@ -652,3 +686,23 @@ class ChainOfTrust(object):
         if obj and not (terminal_device.is_creator(obj) or terminal_device.is_trusted()):
             logging.warn("Could not verify chain of trust.")
         return chain
+
+
+def invalidate_device_zone(sender, instance, **kwargs):
+    device_state_cache.invalidate("zone", instance.device_id)
+
+post_save.connect(invalidate_device_zone, sender=DeviceZone)
+post_delete.connect(invalidate_device_zone, sender=DeviceZone)
+
+
+def invalidate_zones(sender, instance, **kwargs):
+    device_state_cache.invalidate("zone")
+
+post_save.connect(invalidate_zones, sender=Zone)
+
+
+def invalidate_device_metadata(sender, instance, **kwargs):
+    device_state_cache.invalidate("metadata", instance.device_id)
+
+post_save.connect(invalidate_device_metadata, sender=DeviceMetadata)
+post_delete.connect(invalidate_device_metadata, sender=DeviceMetadata)
@@ -2,8 +2,12 @@
 """
 import re
 import json
+import requests
 
+from django.conf import settings
 
+from .streaming import CHUNK_CONTENT_TYPE, decode_chunks, encode_chunk, get_cursors, \
+    get_resume_points, iter_chunks, iter_models_to_sync, save_chunk
 from .utils import get_serialized_models, save_serialized_models, get_device_counters, deserialize
 from .models import *
 from ..api_client import BaseClient
@@ -19,6 +23,7 @@ class SyncClient(BaseClient):
     Note that in the future, this object may be used to sync
     between two distributed servers (i.e. peer-to-peer sync)!"""
     session = None
+    server_cursors = None  # how far the server got with models streamed from us, as of the last counters request
 
     def post(self, path, payload={}, *args, **kwargs):
         if self.session and self.session.client_nonce:
@@ -31,6 +36,19 @@ class SyncClient(BaseClient):
         # add a random parameter to ensure the request is not cached
         return super(SyncClient, self).get(path, payload, *args, **kwargs)
 
+    def post_chunk(self, path, chunk):
+        """Post a chunk of streamed models, as-is."""
+        from kalite.version import user_agent
+
+        if self.verbose:
+            print "CLIENT: post chunk %s (%d bytes)" % (path, len(chunk))
+        return requests.post(
+            self.path_to_url(path),
+            params={"client_nonce": self.session.client_nonce},
+            data=chunk,
+            headers={"user-agent": user_agent(), "content-type": CHUNK_CONTENT_TYPE},
+        )
+
     def start_session(self):
         """A 'session' to exchange data"""
 
@@ -148,6 +166,7 @@ class SyncClient(BaseClient):
         data = json.loads(r.content or "{}")
         if "error" in data:
             raise Exception("Server error in retrieving counters: " + data["error"])
+        self.server_cursors = data.get("cursors", {})
         return data.get("device_counters", {})
 
     def get_client_device_counters(self):
@@ -245,6 +264,9 @@ class SyncClient(BaseClient):
         is called in a loop elsewhere)
         """
 
+        if settings.SYNCING_STREAMING:
+            return self.stream_models()
+
         if self.verbose:
             print "\nCLIENT: sync_models"
 
@@ -298,3 +320,83 @@ class SyncClient(BaseClient):
         self.session.save()
 
         return {"download_results": download_results, "upload_results": upload_results}
+
+    def stream_models(self):
+        """
+        Like sync_models, but streams all models to download and to upload, in chunks (see streaming.py).
+        Each chunk is saved as soon as it has arrived, so if the connection drops, the next call resumes
+        from the last chunk that made it, rather than starting over.
+        """
+
+        if self.verbose:
+            print "\nCLIENT: stream_models"
+
+        counters_to_download, counters_to_upload = self.sync_device_records()
+
+        # Download (but prepare for errors--both thrown and unthrown!)
+        download_results = {
+            "saved_model_count" : 0,
+            "unsaved_model_count" : 0,
+        }
+        try:
+
+            if self.verbose:
+                print "CLIENT: stream_models, downloading"
+
+            server_device = self.session.server_device
+            response = self.post("models/stream/download", {
+                "device_counters": counters_to_download,
+                "resume_points": get_resume_points(counters_to_download, get_cursors(server_device)),
+            }, stream=True)
+            if response.status_code != 200:
+                raise Exception(json.loads(response.content).get("error", response.content))
+
+            # As usual, we're deserializing from the central server, so we assume that what we're getting
+            #   is "smartly" dumbed down for us.
+            for objects in decode_chunks(response.iter_content(chunk_size=64 * 1024)):
+                chunk_results = save_chunk(objects, peer=server_device, verbose=self.verbose)
+                download_results["saved_model_count"] += chunk_results["saved_model_count"]
+                download_results["unsaved_model_count"] += chunk_results["unsaved_model_count"]
+                self.session.models_downloaded += chunk_results["saved_model_count"]
+                self.display_and_count_errors(chunk_results, context_name="downloading models")
+        except Exception as e:
+            print "Exception downloading models (in api_client): %s, %s, %s" % (e.__class__.__name__, e.message, e.args)
+            download_results["error"] = e
+            self.session.errors += 1
+
+        # Upload (but prepare for errors--both thrown and unthrown!)
+        upload_results = {
+            "saved_model_count" : 0,
+            "unsaved_model_count" : 0,
+        }
+        try:
+
+            if self.verbose:
+                print "CLIENT: stream_models, uploading"
+
+            # Resume from where the server says it got to, one chunk per request.
+            models = iter_models_to_sync(
+                counters_to_upload,
+                zone=self.session.client_device.get_zone(),
+                resume_points=get_resume_points(counters_to_upload, self.server_cursors or {}),
+            )
+            for chunk in iter_chunks(models):
+                # Serializing for our own version, we're sending everything.
+                #   Again, this is OK because we're sending to the central server.
+                response = self.post_chunk("models/stream/upload", encode_chunk(chunk, dest_version=self.session.client_device.get_version()))
+                chunk_results = json.loads(response.content)
+                upload_results["saved_model_count"] += chunk_results.get("saved_model_count", 0)
+                upload_results["unsaved_model_count"] += chunk_results.get("unsaved_model_count", 0)
+                self.session.models_uploaded += chunk_results.get("saved_model_count", 0)
+                self.display_and_count_errors(chunk_results, context_name="uploading models")
+                if "error" in chunk_results:
+                    upload_results["error"] = chunk_results["error"]
+                    break
+        except Exception as e:
+            print "Exception uploading models (in api_client): %s, %s, %s" % (e.__class__.__name__, e.message, e.args)
+            upload_results["error"] = e
+            self.session.errors += 1
+
+        self.session.save()
+
+        return {"download_results": download_results, "upload_results": upload_results}
@@ -10,6 +10,8 @@ urlpatterns = patterns('securesync.engine.api_views',
     url(r'^device/download$', 'device_download', {}, 'device_download'),
     url(r'^models/download$', 'model_download', {}, 'model_download'),
     url(r'^models/upload$', 'model_upload', {}, 'model_upload'),
+    url(r'^models/stream/download$', 'model_stream_download', {}, 'model_stream_download'),
+    url(r'^models/stream/upload$', 'model_stream_upload', {}, 'model_stream_upload'),
 
     url(r'^force_sync$', 'force_sync', {}, 'api_force_sync'),
 )
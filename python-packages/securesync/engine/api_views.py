@@ -1,9 +1,11 @@
 import re
 
+from django.http import StreamingHttpResponse
 from django.utils import simplejson
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.gzip import gzip_page
 
+from .streaming import CHUNK_CONTENT_TYPE, decode_chunks, encode_chunk, get_cursors, iter_chunks, iter_models_to_sync, save_chunk
 from .utils import get_serialized_models, save_serialized_models, get_device_counters, serialize
 from .models import *
 from ..devices.models import *  # inter-dependence
@@ -16,7 +18,11 @@ from kalite.shared.decorators.auth import require_admin
 def require_sync_session(handler):
     @api_handle_error_with_json
     def require_sync_session_wrapper_fn(request):
-        if request.body:
+        if request.META.get("CONTENT_TYPE", "").startswith(CHUNK_CONTENT_TYPE):
+            # streamed chunks of models; the rest of the data is in the query string
+            data = request.GET.dict()
+            data["chunks"] = request.body
+        elif request.body:
             data = simplejson.loads(request.body)
         else:
             data = request.GET
@@ -143,6 +149,8 @@ def device_counters(data, session):
     device_counters = get_device_counters(zone=session.client_device.get_zone())
     return JsonResponse({
         "device_counters": device_counters,
+        # how far streamed uploads from this device got, to resume them
+        "cursors": get_cursors(session.client_device),
     })
 
 
@@ -188,6 +196,53 @@ def model_download(data, session):
     return JsonResponse(result)
 
 
+@csrf_exempt
+@require_sync_session
+@api_handle_error_with_json
+def model_stream_upload(data, session):
+    """This device is getting chunks of data-related objects streamed from another device."""
+
+    result = {"saved_model_count": 0, "unsaved_model_count": 0}
+    try:
+        # Unserialize, knowing that the models were serialized by a client of its given version.
+        #   dest_version assumed to be this device's version
+        for objects in decode_chunks([data.get("chunks", "")]):
+            chunk_result = save_chunk(objects, peer=session.client_device, src_version=session.client_version)
+            result["saved_model_count"] += chunk_result["saved_model_count"]
+            result["unsaved_model_count"] += chunk_result["unsaved_model_count"]
+            if "exceptions" in chunk_result:
+                result["exceptions"] = result.get("exceptions", "") + chunk_result["exceptions"]
+    except Exception as e:
+        print "Exception uploading models (in api_views): %s, %s, %s" % (e.__class__.__name__, e.message, e.args)
+        result["error"] = e.message
+
+    session.models_uploaded += result["saved_model_count"]
+    session.errors += result.has_key("error")
+    result["cursors"] = get_cursors(session.client_device)
+    return JsonResponse(result)
+
+
+@csrf_exempt
+@require_sync_session
+@api_handle_error_with_json
+def model_stream_download(data, session):
+    """This device is having its own data streamed to another device, in chunks"""
+
+    if "device_counters" not in data:
+        return JsonResponseMessageError("Must provide device counters.", status=400)
+
+    models = iter_models_to_sync(data["device_counters"], zone=session.client_device.get_zone(), resume_points=data.get("resume_points"))
+
+    def stream():
+        # Return the objects serialized to the version of the other device.
+        for chunk in iter_chunks(models):
+            yield encode_chunk(chunk, dest_version=session.client_version)
+            session.models_downloaded += len(chunk)
+        session.save()
+
+    return StreamingHttpResponse(stream(), content_type=CHUNK_CONTENT_TYPE)
+
+
 @require_admin
 @api_handle_error_with_json
 def force_sync(request):
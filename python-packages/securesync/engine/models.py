@@ -18,10 +18,12 @@ from django.utils.text import compress_string
 from django.utils.translation import ugettext_lazy as _
 
 from .utils import add_syncing_models
+from .verification import verify_signature
 from .. import ID_MAX_LENGTH, IP_MAX_LENGTH
 from fle_utils.config.models import Settings
 from fle_utils.django_utils.debugging import validate_via_booleans
 from fle_utils.django_utils.classes import ExtendedModel
+from fle_utils.django_utils.functions import create_or_retry
 
 
 def _get_own_device():
@@ -151,6 +153,10 @@ class SyncedModelMetaclass(ModelBase):
                 # Add subclass to set of syncing models.
                 add_syncing_models([cls])
 
+            # Models are looked up by signing device and counter position when syncing.
+            if ("signed_by", "counter") not in cls._meta.index_together:
+                cls._meta.index_together = list(cls._meta.index_together) + [("signed_by", "counter")]
+
         super(SyncedModelMetaclass, cls).__init__(name, bases, clsdict)
 
 
@@ -281,7 +287,8 @@ class SyncedModel(ExtendedModel):
         # by this point, we know that we're ok with accepting this model from the device that it says signed it
         # now, we just need to check whether or not it is actually signed by that model's private key
         try:
-            return self.signed_by.get_key().verify(self._hashable_representation(), self.signature)
+            key = self.signed_by.get_key()
+            return verify_signature(self.signed_by.public_key, self._hashable_representation(), self.signature, key=key)
         except:
             return False
 
@@ -304,16 +311,31 @@ class SyncedModel(ExtendedModel):
 
         return fields
 
+    @classmethod
+    def _foreign_keys_to_pk(cls):
+        """The ForeignKey fields of this class that refer to a primary key, by name."""
+        if "_foreign_keys_to_pk_cache" not in cls.__dict__:
+            cls._foreign_keys_to_pk_cache = dict(
+                (field.name, field) for field in cls._meta.fields
+                if isinstance(field, models.ForeignKey) and field.rel.field_name == field.rel.to._meta.pk.name
+            )
+        return cls._foreign_keys_to_pk_cache
+
     def _hashable_representation(self, fields=None):
         fields = self._hashable_fields(fields)
+        foreign_keys = self._foreign_keys_to_pk()
         chunks = []
         for field in fields:
 
-            try:
-                val = getattr(self, field)
-            except ObjectDoesNotExist as e:
-                # if it's a foreign key and is broken, just use the id of the related model
-                val = getattr(self, field + "_id")
+            if field in foreign_keys and not hasattr(self, foreign_keys[field].get_cache_name()):
+                # a foreign key is hashed as the id of the related model, so don't look the model up to get it
+                val = getattr(self, foreign_keys[field].attname)
+            else:
+                try:
+                    val = getattr(self, field)
+                except ObjectDoesNotExist as e:
+                    # if it's a foreign key and is broken, just use the id of the related model
+                    val = getattr(self, field + "_id")
 
             if val:
                 # convert models to just an id
@@ -334,11 +356,12 @@ class SyncedModel(ExtendedModel):
 
         return "&".join(chunks)
 
-    def save(self, imported=False, increment_counters=True, sign=True, *args, **kwargs):
+    def save(self, imported=False, increment_counters=True, sign=True, verified=False, *args, **kwargs):
         """
         Some of the heavy lifting happens here.  There are two saving scenarios:
         (a) We are saving an imported model.
             In this case, we need to make sure that the data check out (but nothing we mark on the object)
+            (unless verified is set, because the caller has already verified the signature)
         (b) We are saving our own model
             In this case, we need to mark the model with appropriate fields, so that
             it can be sync'd (self.counter), and that it will verify (self.signature)
@@ -347,11 +370,12 @@ class SyncedModel(ExtendedModel):
             # imported models are signed by other devices; make sure they check out
             if not self.signed_by_id:
                 raise ValidationError("Imported models must be signed.")
-            if not self.verify():
+            if not verified and not self.verify():
                 raise ValidationError("Could not verify the imported model.")  #Imported model's signature did not match.")
 
             # call the base Django Model save to write to the DB
             super(SyncedModel, self).save(*args, **kwargs)
+            SyncedModelCounter.record(self.__class__, self.signed_by_id, self.counter)
 
             # For imported models, we want to keep track of the counter position we're at for that device.
             #   so, if it's ahead of what we had, set it!
@@ -384,6 +408,12 @@ class SyncedModel(ExtendedModel):
             # call the base Django Model save to write to the DB
             super(SyncedModel, self).save(*args, **kwargs)
 
+            # keep track of what there is to sync
+            if sign:
+                SyncedModelCounter.record(self.__class__, own_device.id, self.counter)
+            else:
+                UnsyncedModel.add(self)
+
 
     def set_id(self):
         self.id = self.id or self.get_uuid()
@@ -511,3 +541,96 @@ class ImportPurgatory(ExtendedModel):
     def save(self, *args, **kwargs):
         self.counter = self.counter or _get_own_device().get_counter_position()
         super(ImportPurgatory, self).save(*args, **kwargs)
+
+
+class SyncCursor(ExtendedModel):
+    """
+    How far a streaming sync from a peer has got through the models signed by one device:
+    the counter position and id of the last model received and saved, as models are streamed
+    in order of (counter, id).  An interrupted stream resumes right after it.
+    """
+    peer = models.ForeignKey("Device", related_name="+")
+    device = models.ForeignKey("Device", related_name="+")
+    counter = models.IntegerField(default=0)
+    model_id = models.CharField(max_length=ID_MAX_LENGTH, blank=True)
+    timestamp = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        app_label = "securesync"
+        unique_together = ("peer", "device")
+
+    def __unicode__(self):
+        return u"%s... from %s...: %d (%s)" % (self.device_id[0:5], self.peer_id[0:5], self.counter, self.model_id[0:5])
+
+
+class SyncedModelCounter(ExtendedModel):
+    """
+    The highest counter position of the models of one class signed by one device,
+    so that syncing can tell which classes have anything newer than a counter position without querying them.
+    """
+    model_name = models.CharField(max_length=100)  # db_table of the model class
+    device = models.ForeignKey("Device", related_name="+")
+    counter = models.IntegerField(default=0)
+
+    class Meta:
+        app_label = "securesync"
+        unique_together = ("model_name", "device")
+
+    def __unicode__(self):
+        return u"%s, %s...: %d" % (self.model_name, self.device_id[0:5], self.counter)
+
+    @classmethod
+    def record(cls, model_class, device_id, counter):
+        """
+        Note that a model of model_class, signed by device_id, has been saved at the given counter position.
+        """
+        if not device_id or counter is None:
+            return
+        model_name = model_class._meta.db_table
+        if cls.objects.filter(model_name=model_name, device=device_id, counter__lt=counter).update(counter=counter):
+            return
+        if not cls.objects.filter(model_name=model_name, device=device_id).exists():
+            # if somebody else got there first, go through the update again
+            create_or_retry(
+                lambda: cls(model_name=model_name, device_id=device_id, counter=counter).save(),
+                lambda: cls.record(model_class, device_id, counter),
+            )
+
+    @classmethod
+    def get_counters(cls):
+        """
+        :return: Dictionary of (model db_table, device id) -> highest counter position.
+        """
+        return dict(((c.model_name, c.device_id), c.counter) for c in cls.objects.all())
+
+
+class UnsyncedModel(ExtendedModel):
+    """
+    Our own models that have been saved without a counter position or signature (see DeferredSignSyncedModel),
+    and are to be given them when they are synced.
+    """
+    model_name = models.CharField(max_length=100)  # db_table of the model class
+    model_id = models.CharField(max_length=ID_MAX_LENGTH)
+
+    class Meta:
+        app_label = "securesync"
+        unique_together = ("model_name", "model_id")
+
+    def __unicode__(self):
+        return u"%s, %s..." % (self.model_name, self.model_id[0:5])
+
+    @classmethod
+    def add(cls, model):
+        model_name = model._meta.db_table
+        if not cls.objects.filter(model_name=model_name, model_id=model.pk).exists():
+            create_or_retry(lambda: cls(model_name=model_name, model_id=model.pk).save())  # unless somebody else got there first
+
+    @classmethod
+    def remove(cls, model_class, ids, chunk_size=500):
+        ids = list(ids)
+        for idx in range(0, len(ids), chunk_size):
+            cls.objects.filter(model_name=model_class._meta.db_table, model_id__in=ids[idx:idx + chunk_size]).delete()
+
+    @classmethod
+    def get_model_ids(cls, model_class):
+        return list(cls.objects.filter(model_name=model_class._meta.db_table).values_list("model_id", flat=True))
@@ -0,0 +1,184 @@
+"""
+Streaming sync, for unreliable links.
+
+Instead of sending up to SYNCING_MAX_RECORDS_PER_REQUEST models as one JSON document per request,
+models are sent as newline-delimited JSON (one serialized model per line), in chunks of
+SYNCING_STREAM_CHUNK_SIZE models, each compressed and prefixed by its length.
+
+Models are streamed one signing device at a time, in order of (counter, id).  The receiving side saves
+each chunk as soon as it has arrived whole, then records a SyncCursor for each device in it: the counter
+and id of the last model it got.  When the connection drops, only the chunk in flight is lost, and the
+next sync asks for the models after the cursors instead of starting over.
+"""
+import heapq
+import struct
+import zlib
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import simplejson
+
+from .models import SyncCursor, SyncedModelCounter, UnsyncedModel
+from .utils import _get_unsynced_models, _syncing_models, ensure_sync_state, prepare_models_for_sync, save_serialized_models
+from fle_utils.django_utils import serializers
+
+
+CHUNK_CONTENT_TYPE = "application/x-securesync-chunks"
+
+_CHUNK_HEADER = struct.Struct("!I")
+
+
+class IncompleteChunkError(Exception):
+    """The stream ended part way through a chunk, e.g. because the connection dropped."""
+    pass
+
+
+def get_cursors(peer):
+    """
+    :return: Dictionary of device id -> (counter, model id) of the last models received from a peer.
+    """
+    return dict((cursor.device_id, (cursor.counter, cursor.model_id)) for cursor in SyncCursor.objects.filter(peer=peer))
+
+
+def get_resume_points(device_counters, cursors):
+    """
+    For the devices whose cursor is at the counter position that models are requested from,
+    the id of the last model received at that position, to resume right after it.
+    """
+    return dict(
+        (device_id, cursors[device_id][1])
+        for device_id, counter in device_counters.iteritems()
+        if device_id in cursors and cursors[device_id][0] == counter and cursors[device_id][1]
+    )
+
+
+def _ordered(queryset, index):
+    for model in queryset.order_by("counter", "id").iterator():
+        yield (model.counter, model.id, index, model)
+
+
+def iter_models_to_sync(device_counters, zone, resume_points=None):
+    """
+    Like get_models, but yields all models to sync at once, rather than up to a limit:
+    for each device, the models it signed after the given counter position, in order of (counter, id).
+    :param device_counters: Dictionary of device id -> counter position the other side is at.
+    :param zone: The zone being synced.
+    :param resume_points: Dictionary of device id -> id of the last model received at its counter position.
+    """
+    from ..devices.models import Device
+    own_device = Device.get_own_device()
+    resume_points = resume_points or {}
+
+    ensure_sync_state()
+
+    # Our own models that have put off getting a counter position need one now, to be put in order.
+    if own_device.id in device_counters:
+        for Model in _syncing_models:
+            unsynced_ids = UnsyncedModel.get_model_ids(Model)
+            if unsynced_ids:
+                prepare_models_for_sync(_get_unsynced_models(Model, unsynced_ids))
+
+    synced_counters = SyncedModelCounter.get_counters()
+    devices = Device.all_objects.in_bulk(device_counters.keys())
+    for device_id, counter in device_counters.iteritems():
+        # skip requested devices that either don't exist or aren't in the correct zone
+        device = devices.get(device_id)
+        if not device or not (device.in_zone(zone) or device.is_trusted()):
+            continue
+
+        after = Q(counter__gt=counter)
+        if resume_points.get(device_id):
+            after |= Q(counter=counter, id__gt=resume_points[device_id])
+
+        querysets = []
+        for Model in _syncing_models:
+            # skip querying when nothing of this class was signed by the device since then
+            if synced_counters.get((Model._meta.db_table, device_id), 0) < counter:
+                continue
+            queryset = Model.all_objects.filter(after, signed_by=device)
+            # for trusted (central) device, only include models with the correct fallback zone
+            if not device.in_zone(zone):
+                queryset = queryset.filter(zone_fallback=zone)
+            querysets.append(queryset)
+
+        for _, _, _, model in heapq.merge(*[_ordered(queryset, index) for index, queryset in enumerate(querysets)]):
+            yield model
+
+
+def iter_chunks(models, chunk_size=None):
+    """
+    Group models into lists of chunk_size (default: settings.SYNCING_STREAM_CHUNK_SIZE).
+    """
+    chunk_size = chunk_size or settings.SYNCING_STREAM_CHUNK_SIZE
+    chunk = []
+    for model in models:
+        chunk.append(model)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def encode_chunk(models, dest_version):
+    """
+    Serialize models (for a device of version=dest_version) to a compressed, length-prefixed chunk
+    of newline-delimited JSON.
+    """
+    # Models in a chunk are saved in the order they are sent, so send the ones others depend on first.
+    order = dict((Model, index) for index, Model in enumerate(_syncing_models))
+    models = sorted(models, key=lambda model: order.get(model.__class__, len(order)))
+
+    lines = []
+    for model in models:
+        line = serializers.serialize("versioned-json", [model], dest_version=dest_version, ensure_ascii=False)[1:-1]
+        if line:  # models newer than dest_version are left out
+            lines.append(line.encode("utf-8") if isinstance(line, unicode) else line)
+
+    data = zlib.compress("\n".join(lines))
+    return _CHUNK_HEADER.pack(len(data)) + data
+
+
+def decode_chunks(pieces):
+    """
+    Decode chunks from an iterable of strings (e.g. the content of a streamed response, as it arrives),
+    yielding the models of each chunk as a list of dictionaries as soon as it is complete.
+    Raises IncompleteChunkError if the content ends part way through a chunk.
+    """
+    buf = ""
+    for piece in pieces:
+        buf += piece
+        while len(buf) >= _CHUNK_HEADER.size:
+            (length,) = _CHUNK_HEADER.unpack_from(buf)
+            end = _CHUNK_HEADER.size + length
+            if len(buf) < end:
+                break
+            data, buf = buf[_CHUNK_HEADER.size:end], buf[end:]
+            yield [simplejson.loads(line) for line in zlib.decompress(data).split("\n") if line]
+
+    if buf:
+        raise IncompleteChunkError("Content ended part way through a chunk (%d bytes left over)." % len(buf))
+
+
+def save_chunk(objects, peer, src_version=None, verbose=False):
+    """
+    Save the models of a chunk received from a peer, then move the cursors of the devices that signed them
+    past the chunk.  Models that could not be saved go to purgatory, and are passed over like by the counters.
+    :return: The results of save_serialized_models.
+    """
+    from ..devices.models import Device
+
+    result = save_serialized_models(objects, src_version=src_version, verbose=verbose)
+
+    last = {}
+    for obj in objects:
+        device_id, counter = obj["fields"].get("signed_by"), obj["fields"].get("counter")
+        if device_id and counter is not None:
+            last[device_id] = max(last.get(device_id), (counter, obj["pk"]))
+
+    for device in Device.all_objects.filter(pk__in=last.keys()):
+        cursor, _ = SyncCursor.objects.get_or_create(peer=peer, device=device)
+        cursor.counter, cursor.model_id = last[device.pk]
+        cursor.save()
+
+    return result
@@ -3,14 +3,17 @@ Used for labeling models that use securesync.
 This is where the heavy lifting happens!
 """
 import logging
-from annoying.functions import get_object_or_None
+from collections import OrderedDict
 
 from django.conf import settings
-from django.core.exceptions import ValidationError
-from django.db.models import Q
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.db import connection, transaction
+from django.db.models import Max, Q
 from django.db.models.fields.related import ForeignKey
+from django.db.models.signals import pre_save, post_save
 
 from .. import VERSION
+from .verification import get_key, get_verified, set_verified
 from fle_utils.django_utils import serializers
 
 
@@ -54,6 +57,7 @@ def get_device_counters(**kwargs):
     """Get device counters, filtered by zone"""
     assert ("zone" in kwargs) + ("devices" in kwargs) == 1, "Must specify zone or devices, and not both."
 
+    from .models import UnsyncedModel
     from ..devices.models import Device
     devices = kwargs.get("devices") or Device.all_objects.by_zone(kwargs["zone"])  # include deleted objects
 
@@ -65,14 +69,50 @@ def get_device_counters(**kwargs):
             # The local device may have items that haven't incremented the device counter,
             #   but instead have deferred until sync time.  Include those!
             if device.is_own_device():
-                cnt = 0
-                for Model in _syncing_models:
-                    cnt += Model.all_objects.filter(Q(counter__isnull=True) | Q(signature__isnull=True)).count()  # include deleted records
-                device_counters[device.id] += cnt
+                ensure_sync_state()
+                device_counters[device.id] += UnsyncedModel.objects.count()  # includes deleted records
 
     return device_counters
 
 
+_sync_state_built = False
+
+
+def ensure_sync_state():
+    """
+    Build the sync state tables (SyncedModelCounter and UnsyncedModel) from the synced models
+    if they haven't been yet, e.g. on a database from before they existed.
+    """
+    global _sync_state_built
+    if _sync_state_built:
+        return
+
+    from fle_utils.config.models import Settings
+    if not Settings.get("sync_state_built"):
+        rebuild_sync_state()
+        Settings.set("sync_state_built", True)
+    _sync_state_built = True
+
+
+@transaction.commit_on_success
+def rebuild_sync_state(chunk_size=500):
+    """
+    Recompute the sync state tables from the synced models, scanning all of them.
+    """
+    from .models import SyncedModelCounter, UnsyncedModel
+
+    SyncedModelCounter.objects.all().delete()
+    UnsyncedModel.objects.all().delete()
+
+    for Model in _syncing_models:
+        for row in Model.all_objects.filter(signature__isnull=False).values("signed_by").annotate(max_counter=Max("counter")):
+            SyncedModelCounter.record(Model, row["signed_by"], row["max_counter"])
+
+        ids = list(Model.all_objects.filter(Q(counter__isnull=True) | Q(signature__isnull=True)).values_list("pk", flat=True))
+        for idx in range(0, len(ids), chunk_size):
+            UnsyncedModel.objects.bulk_create([UnsyncedModel(model_name=Model._meta.db_table, model_id=pk) for pk in ids[idx:idx + chunk_size]])
+
+
 def get_models(device_counters=None, limit=None, zone=None, dest_version=None, **kwargs):
     """Serialize models for some intended version (dest_version)
     Default is our own version--i.e. include all known fields.
@@ -80,6 +120,7 @@ def get_models(device_counters=None, limit=None, zone=None, dest_version=None, *
     """
     limit = limit or settings.SYNCING_MAX_RECORDS_PER_REQUEST  # must be specified
 
+    from .models import SyncedModelCounter, UnsyncedModel
     from ..devices.models import Device # cannot be top-level, otherwise inter-dependency of this and models fouls things up
     own_device = Device.get_own_device()
 
@@ -97,11 +138,15 @@ def get_models(device_counters=None, limit=None, zone=None, dest_version=None, *
         device_counters = dict((device.id, 0) for device in Device.all_objects.by_zone(zone))  # include deleted devices
 
     # remove all requested devices that either don't exist or aren't in the correct zone
+    devices = Device.all_objects.in_bulk(device_counters.keys())
     for device_id in device_counters.keys():
-        device = get_object_or_None(Device.all_objects, pk=device_id)
+        device = devices.get(device_id)
         if not device or not (device.in_zone(zone) or device.is_trusted()):
             del device_counters[device_id]
 
+    ensure_sync_state()
+    synced_counters = SyncedModelCounter.get_counters()
+
     models = []
     remaining = limit
 
@@ -111,62 +156,45 @@ def get_models(device_counters=None, limit=None, zone=None, dest_version=None, *
     #    otherwise they will be forgotten FOREVER)
     for Model in _syncing_models:
 
+        # Our own models that haven't been given a counter position or signature yet are sent along
+        #   with the first device (they'll be given them when serialized).
+        unsynced_ids = UnsyncedModel.get_model_ids(Model)
+
         # loop through each of the devices of interest
         #   Do devices first, because each device is independent.
         #   Models within a device are highly dependent (on explicit dependencies,
         #   as well as counter position)
         for device_id, counter in device_counters.items():
             # We need to track the min counter position (send things above this value)
-            #   and the max (we're sending up to this value, so make sure nothing
-            #   below it is left behind)
             counter_min = counter + 1
-            counter_max = 0
 
-            device = Device.all_objects.get(pk=device_id)
+            # skip querying when nothing of this class was signed by the device since then
+            if synced_counters.get((Model._meta.db_table, device_id), 0) < counter_min and not unsynced_ids:
+                continue
+
+            device = devices[device_id]
 
-            queryset = Model.all_objects.filter(Q(signed_by=device) | Q(signed_by__isnull=True) | Q(counter__isnull=True))
+            # Select relevant items that have been updated since the last sync event,
+            #   in order, so that nothing below the counter position we send up to is left behind.
+            queryset = Model.all_objects.filter(signed_by=device, counter__gte=counter_min).order_by("counter")
 
             # for trusted (central) device, only include models with the correct fallback zone
             if not device.in_zone(zone):
                 assert device.is_trusted(), "Should never include devices not ACTUALLY in the zone, except trusted devices."
                 queryset = queryset.filter(zone_fallback=zone)
 
-            # Now select relevant items that have been updated since the last sync event
-            queryset = queryset.filter(Q(counter__gte=counter_min) | Q(counter__isnull=True))
-            if not queryset:
-                continue
-
-            # Make sure you send anything that HAS to be sent (i.e. send anything that is BELOW
-            #   the max counter position that we do plan to send.  If we find things that we
-            #   unexpectedly need to send, make sure to add room for them.
-
-            if remaining is None: # this means limit was None, so we just sync everything
-                new_models = queryset
-            else:
-                if counter_max is None:
-                    # If we're sending something with counter=None, then this will set
-                    #   the devicecounter above anything downstream, so these downstream items
-                    #   must be sent NOW
-                    remaining += max(0, (queryset.filter(counter__isnull=False).count() - remaining))
-                else:
-                    # If we're sending something with counter=10, then anything with a lower
-                    #   counter must be sent along with it.  So, squeeze it in
-                    remaining += max(0, (queryset.filter(counter__lt=counter_max).count() - remaining))
-
-                # Grab up to (remaining) model instances, then decrease the remaining to the total limit remaining
-                new_models = queryset[:remaining]
+            # Grab up to (remaining) model instances, then decrease the remaining to the total limit remaining
+            new_models = list(queryset if remaining is None else queryset[:remaining])
+            if unsynced_ids and (remaining is None or len(new_models) < remaining):
+                new_ids = set(model.pk for model in new_models)
+                new_models += [model for model in _get_unsynced_models(Model, unsynced_ids) if model.pk not in new_ids]
+                if remaining is not None:
+                    new_models = new_models[:remaining]
+                unsynced_ids = []
 
             if not new_models:
                 continue
 
-            if counter_max is not None:
-                # None is the most severe, so only check if we're not already sending things with None
-                counters = [m.counter for m in new_models]
-                if None in counters:
-                    counter_max = None
-                else:
-                    counter_max = max(counter_max, max(counters))
-
             models += new_models
             if remaining is not None:
                 remaining -= len(new_models)
@@ -178,6 +206,21 @@ def get_models(device_counters=None, limit=None, zone=None, dest_version=None, *
     return models
 
 
+def _get_unsynced_models(Model, ids, chunk_size=500):
+    """
+    Look up models by the ids of their UnsyncedModel entries, dropping the entries of models that
+    have nothing left to be done (e.g. because they were overwritten by a signed model from elsewhere).
+    """
+    from .models import UnsyncedModel
+
+    models = []
+    for idx in range(0, len(ids), chunk_size):
+        models += [model for model in Model.all_objects.filter(pk__in=ids[idx:idx + chunk_size]) if model.counter is None or not model.signature]
+
+    UnsyncedModel.remove(Model, set(ids) - set(model.pk for model in models))
+    return models
+
+
 def get_serialized_models(*args, **kwargs):
     from ..devices.models import Device
 
@@ -200,8 +243,180 @@ def get_serialized_models(*args, **kwargs):
         return serialized_models
 
 
-#@transaction.commit_on_success
-def save_serialized_models(data, increment_counters=True, src_version=None, verbose=False):
+def _verify_signature(job):
+    """Verify one (public key string, message, signature) tuple."""
+    public_key, message, signature = job
+    try:
+        return bool(get_key(public_key).verify(message, signature))
+    except Exception:
+        return False
+
+
+def verify_signatures(jobs):
+    """
+    Verify many signatures at once.  Signatures verified before (see engine.verification) aren't verified again.
+    :param jobs: A list of (public key string, message, signature) tuples.
+    :return: A list of booleans, in the order of the jobs.
+    """
+    results = [get_verified(*job) for job in jobs]
+    for index, (job, result) in enumerate(zip(jobs, results)):
+        if result is None:
+            results[index] = _verify_signature(job)
+            set_verified(*(job + (results[index],)))
+    return results
+
+
+def _can_bulk_save(Model):
+    """
+    Imported models can be written with bulk queries when saving them doesn't do anything
+    besides what SyncedModel.save does for imported models.
+    """
+    from .models import SyncedModel, DeferredSignSyncedModel, DeferredCountSyncedModel
+    plain_saves = (SyncedModel.save.im_func, DeferredSignSyncedModel.save.im_func, DeferredCountSyncedModel.save.im_func)
+    return Model.save.im_func in plain_saves \
+        and not Model._meta.parents \
+        and not pre_save.has_listeners(Model) \
+        and not post_save.has_listeners(Model)
+
+
+def _bulk_save(Model, models, chunk_size=500):
+    """Insert or update imported models of one class, without saving them one by one."""
+    ids = [model.pk for model in models]
+    existing = set()
+    for idx in range(0, len(ids), chunk_size):
+        existing.update(Model.all_objects.filter(pk__in=ids[idx:idx + chunk_size]).values_list("pk", flat=True))
+
+    fields = [field for field in Model._meta.local_fields if not field.primary_key]
+    new_models = []
+    for model in models:
+        if model.pk in existing:
+            Model.all_objects.filter(pk=model.pk).update(**dict((field.name, field.pre_save(model, False)) for field in fields))
+        else:
+            for field in fields:
+                setattr(model, field.attname, field.pre_save(model, True))
+            new_models.append(model)
+    Model.all_objects.bulk_create(new_models)
+
+    for model in models:
+        model._state.adding = False
+    _record_sync_state(models)
+
+
+@transaction.commit_on_success
+def _save_model_batch(modelwrappers, increment_counters=True, verbose=False):
+    """
+    Verify and save one batch of deserialized models, in one transaction.
+    Signatures are verified up front, then the models are validated and written in order.
+    Models of classes that allow it are written with bulk queries, other models are saved one at a time.
+    Counter positions of the signing devices are advanced once, at the end.
+
+    Returns the number of models saved, and a list of (model, error) of models that could not be saved.
+    """
+    from ..devices.models import Device
+
+    models = []
+    unsaved_models = []
+    for modelwrapper in modelwrappers:
+        # extract the model from the deserialization wrapper
+        model = modelwrapper.object
+
+        # only allow the importing of models that are subclasses of SyncedModel
+        if not hasattr(model, "verify"):
+            unsaved_models.append((model, ValidationError("Cannot save model: %s does not have a verify method (not a subclass of SyncedModel?)" % model.__class__)))
+            continue
+
+        # TODO(jamalex): more robust way to do this? (otherwise, it might barf about the id already existing)
+        model._state.adding = False
+        models.append(model)
+
+    # Look up all signing devices at once, and check whether we accept models from them at all
+    devices = Device.all_objects.in_bulk(set(model.signed_by_id for model in models if model.signed_by_id))
+    valid_devices = {}
+    jobs = []
+    for model in models:
+        device = devices.get(model.signed_by_id)
+        if not device:
+            # signed by a device that isn't saved yet (e.g. one earlier in this batch); verify it when we get to it
+            jobs.append(None)
+            continue
+        model.signed_by = device
+        job = False
+        try:
+            if device.pk not in valid_devices:
+                valid_devices[device.pk] = model.validate()
+            if valid_devices[device.pk] and device.public_key and model.signature:
+                job = (device.public_key, model._hashable_representation(), model.signature)
+        except ValidationError:
+            pass
+        jobs.append(job)
+
+    results = iter(verify_signatures([job for job in jobs if job]))
+    verified = [next(results) if job else job for job in jobs]
+
+    saved_model_count = 0
+    counters = {}
+    pending = OrderedDict()  # Model -> OrderedDict of pk -> model, waiting to be written in bulk
+
+    def flush():
+        for Model, pending_models in pending.iteritems():
+            _bulk_save(Model, pending_models.values())
+        pending.clear()
+
+    for model, is_verified in zip(models, verified):
+        if is_verified is None:
+            flush()
+            try:
+                is_verified = model.verify()
+            except ValidationError:
+                is_verified = False
+            except ObjectDoesNotExist:
+                # signed by a device we don't have (not even earlier in this batch); keep it to try again later
+                unsaved_models.append((model, ValidationError("Could not find the device that signed the imported model.")))
+                continue
+        try:
+            # verify that all fields are valid, and that foreign keys can be resolved,
+            # which requires the models they refer to to have been written already
+            if any(field.rel.to in pending for field in model._meta.fields if isinstance(field, ForeignKey)):
+                flush()
+            model.full_clean(imported=True)
+
+            if not model.signed_by_id:
+                raise ValidationError("Imported models must be signed.")
+            if not is_verified:
+                raise ValidationError("Could not verify the imported model.")
+
+            # save the imported model
+            if _can_bulk_save(model.__class__):
+                pending.setdefault(model.__class__, OrderedDict())[model.pk] = model
+            else:
+                flush()
+                model.save(imported=True, verified=True, increment_counters=False)
+
+            # keep track of how many models have been successfully saved
+            saved_model_count += 1
+
+            if verbose:
+                print "IMPORTED %s (id: %s, counter: %d, signed_by: %s)" % (model.__class__.__name__, model.id[0:5], model.counter, model.signed_by.id[0:5])
+
+        except ValidationError as e: # the model could not be saved
+            unsaved_models.append((model, e))
+
+        # if the model is at least properly signed, advance the counter for the signing device
+        # (because otherwise we may never ask for additional models)
+        if is_verified and model.counter is not None:
+            devices[model.signed_by_id] = model.signed_by
+            counters[model.signed_by_id] = max(counters.get(model.signed_by_id), model.counter)
+
+    flush()
+
+    if increment_counters:
+        for device_id, counter in counters.iteritems():
+            devices[device_id].set_counter_position(counter, soft_set=True)
+
+    return saved_model_count, unsaved_models
+
+
+def save_serialized_models(data, increment_counters=True, src_version=None, verbose=False, batch_size=None):
     """Unserializes models (from a device of version=src_version) in data and saves them to the django database.
     If src_version is None, all unrecognized fields are (silently) stripped off.
     If it is set to some value, then only fields of versions higher than ours are stripped off.
@@ -211,6 +426,8 @@ def save_serialized_models(data, increment_counters=True, src_version=None, verb
 
     So, care must be taken in calling this function
 
+    Models are saved in batches of batch_size (default: settings.SYNCING_IMPORT_BATCH_SIZE), see _save_model_batch.
+
     Returns a dictionary of the # of saved models, # unsaved, and any exceptions during saving"""
 
     from .models import ImportPurgatory # cannot be top-level, otherwise inter-dependency of this and models fouls things up
@@ -219,6 +436,7 @@ def save_serialized_models(data, increment_counters=True, src_version=None, verb
     own_device = Device.get_own_device()
     if not src_version:  # default version: our own
         src_version = own_device.get_version()
+    batch_size = batch_size or getattr(settings, "SYNCING_IMPORT_BATCH_SIZE", 500)
 
     # if data is from a purgatory object, load it up
     if isinstance(data, ImportPurgatory):
@@ -228,58 +446,34 @@ def save_serialized_models(data, increment_counters=True, src_version=None, verb
         purgatory = None
 
     # deserialize the models, either from text or a list of dictionaries
-    if isinstance(data, str) or isinstance(data, unicode):
-        models = deserialize(data, src_version=src_version, dest_version=own_device.get_version())
-    else:
-        models = deserialize(data, src_version=src_version, dest_version=own_device.get_version())
+    models = deserialize(data, src_version=src_version, dest_version=own_device.get_version())
 
-    # try importing each of the models in turn
+    # try importing the models, a batch at a time
     unsaved_models = []
     exceptions = ""
     saved_model_count = 0
     try:
+        batch = []
         for modelwrapper in models:
-            try:
-
-                # extract the model from the deserialization wrapper
-                model = modelwrapper.object
-
-                # only allow the importing of models that are subclasses of SyncedModel
-                if not hasattr(model, "verify"):
-                    raise ValidationError("Cannot save model: %s does not have a verify method (not a subclass of SyncedModel?)" % model.__class__)
-
-                # TODO(jamalex): more robust way to do this? (otherwise, it might barf about the id already existing)
-                model._state.adding = False
-
-                # verify that all fields are valid, and that foreign keys can be resolved
-                model.full_clean(imported=True)
-
-                # save the imported model (checking that the signature is valid in the process)
-                model.save(imported=True, increment_counters=increment_counters)
-
-                # keep track of how many models have been successfully saved
-                saved_model_count += 1
-
-                if verbose:
-                    print "IMPORTED %s (id: %s, counter: %d, signed_by: %s)" % (model.__class__.__name__, model.id[0:5], model.counter, model.signed_by.id[0:5])
-
-            except ValidationError as e: # the model could not be saved
-
-                # keep a running list of models and exceptions, to be stored in purgatory
-                exceptions += "%s: %s\n" % (model.pk, e)
-                unsaved_models.append(model)
-
-                # if the model is at least properly signed, try incrementing the counter for the signing device
-                # (because otherwise we may never ask for additional models)
-                try:
-                    if increment_counters and model.verify():
-                        model.signed_by.set_counter_position(model.counter, soft_set=True)
-                except:
-                    pass
+            batch.append(modelwrapper)
+            if len(batch) < batch_size:
+                continue
+            saved_count, unsaved = _save_model_batch(batch, increment_counters=increment_counters, verbose=verbose)
+            saved_model_count += saved_count
+            unsaved_models += unsaved
+            batch = []
+        if batch:
+            saved_count, unsaved = _save_model_batch(batch, increment_counters=increment_counters, verbose=verbose)
+            saved_model_count += saved_count
+            unsaved_models += unsaved
 
     except Exception as e:
         exceptions += unicode(e)
 
+    # keep a running list of models and exceptions, to be stored in purgatory
+    exceptions = "".join("%s: %s\n" % (model.pk, e) for model, e in unsaved_models) + exceptions
+    unsaved_models = [model for model, e in unsaved_models]
+
     # deal with any models that didn't validate properly; throw them into purgatory so we can try again later
     if unsaved_models:
         if not purgatory:
@@ -291,7 +485,7 @@ def save_serialized_models(data, increment_counters=True, src_version=None, verb
         purgatory.model_count = len(unsaved_models)
         purgatory.retry_attempts += 1
         purgatory.save()
-    elif purgatory: # everything saved properly this time, so we can eliminate the purgatory instance
+    elif purgatory and not exceptions: # everything saved properly this time, so we can eliminate the purgatory instance
         purgatory.delete()
 
     out_dict = {
@@ -309,32 +503,171 @@ def serialize(models, sign=True, increment_counters=True, dest_version=VERSION,
     This function encapsulates serialization, and ensures that any final steps needed before syncing
     (e.g. signing, incrementing counters, etc) are done.
     """
+    models = prepare_models_for_sync(models, sign=sign, increment_counters=increment_counters)
+
+    return serializers.serialize("versioned-json", models, dest_version=dest_version, *args, **kwargs)
+
+
+def prepare_models_for_sync(models, sign=True, increment_counters=True):
+    """
+    Assign counter positions to, and sign, any of our own models that deferred doing so until sync time.
+    This is done for all of them at once: their counter positions are reserved together, and they're written
+    back in one transaction.
+
+    Models that were changed in the database in the meantime are left to be prepared again next time.
+    Returns the models that are ready to sync.
+    """
     from .models import SyncedModel
     from ..devices.models import Device
     own_device = Device.get_own_device()
 
-    for model in models:
-        resave = False
-
-        if increment_counters or sign:
+    if increment_counters or sign:
+        for model in models:
             assert isinstance(model, SyncedModel), "Can only serialize SyncedModel instances"
 
-        if increment_counters and not model.counter:
-            model.counter = own_device.increment_counter_position()
-            resave = True
+    prepared_models = OrderedDict()  # id(model) -> (model, values it was read with), for the models that need to be written back
+
+    def prepare(model):
+        if id(model) not in prepared_models:
+            prepared_models[id(model)] = (model, (model.counter, model.signature, model.signed_by_id))
+
+    if increment_counters:
+        models_to_count = [model for model in models if not model.counter]
+        if models_to_count:
+            first_counter = own_device.reserve_counter_positions(len(models_to_count))
+            for counter, model in enumerate(models_to_count, first_counter):
+                prepare(model)
+                model.counter = counter
+
+    if sign:
+        models_to_sign = [model for model in models if not model.signature]
+        if models_to_sign:
+            # Same as SyncedModel.sign, but all the signatures at once
+            key = own_device.get_key()
+            assert key, "Cannot sign with device %s: key does not exist." % (own_device.name or "")
+            for model in models_to_sign:
+                prepare(model)
+                model.set_id()
+                model.signed_by = own_device
+                model.full_clean()  # make sure the model data is of the appropriate types
+            for model in models_to_sign:
+                model.signature = key.sign(model._hashable_representation())
+
+    if prepared_models:
+        changed_models = set(id(model) for model in _save_prepared_models(prepared_models.values()))
+        models = [model for model in models if id(model) not in changed_models]
+
+    # these are all synced up now
+    if increment_counters or sign:
+        _record_sync_state(models)
+
+    return models
 
-        if sign and not model.signature:
-            model.sign()
-            resave = True
 
-        if resave:
+@transaction.commit_on_success
+def _save_prepared_models(prepared_models, chunk_size=500):
+    """
+    Write the counters and signatures of models back to the database, with an UPDATE or two per model class.
+    Only rows that are still as they were read (and signed) are written, so that changes saved since aren't
+    overwritten: the rows are read again and compared on what the signature covers, and the UPDATEs only
+    apply to rows whose counter and signature are still as they were.
+    :param prepared_models: A list of (model, (counter, signature, signed_by_id) it was read with).
+    :return: The models whose rows were changed, and so weren't written.
+    """
+    from .models import SyncedModel
+
+    models_by_class = OrderedDict()
+    for model, read_values in prepared_models:
+        if model._state.adding:
+            # not in the database yet, so there's nothing to update
             super(SyncedModel, model).save()
+        else:
+            models_by_class.setdefault(model.__class__, []).append((model, read_values))
+
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    changed_models = []
+    for Model, class_models in models_by_class.iteritems():
+        ids = [model.pk for model, read_values in class_models]
+        rows = {}
+        for idx in range(0, len(ids), chunk_size):
+            rows.update(Model.all_objects.select_for_update().in_bulk(ids[idx:idx + chunk_size]))
+
+        set_fields = [Model._meta.get_field(name) for name in ("counter", "signature", "signed_by")]
+        statements = OrderedDict()  # WHERE clause -> list of parameters, one UPDATE for each
+        written_models = []
+        for model, read_values in class_models:
+            row = rows.get(model.pk)
+            if row is None or (row.counter, row.signature) != read_values[:2]:
+                changed_models.append((model, read_values))
+                continue
+            row.counter = model.counter
+            if row._hashable_representation() != model._hashable_representation():
+                changed_models.append((model, read_values))
+                continue
 
-    return serializers.serialize("versioned-json", models, dest_version=dest_version, *args, **kwargs)
+            # the row's counter and signature as read, in case they've been set since
+            where = " AND ".join(["%s = %%s" % qn(Model._meta.pk.column)] + [
+                "%s IS NULL" % qn(field.column) if value is None else "%s = %%s" % qn(field.column)
+                for field, value in zip(set_fields, read_values[:2])
+            ])
+            statements.setdefault(where, []).append(
+                [field.get_db_prep_save(getattr(model, field.attname), connection) for field in set_fields] + [model.pk]
+                + [field.get_db_prep_save(value, connection) for field, value in zip(set_fields, read_values[:2]) if value is not None]
+            )
+            written_models.append((model, read_values))
+
+        updated = 0
+        for where, param_list in statements.iteritems():
+            cursor.executemany(
+                "UPDATE %s SET %s WHERE %s" % (
+                    qn(Model._meta.db_table),
+                    ", ".join("%s = %%s" % qn(field.column) for field in set_fields),
+                    where,
+                ),
+                param_list,
+            )
+            updated += cursor.rowcount
+        if updated != len(written_models):
+            # some were set in the meantime; find out which
+            signatures = {}
+            for idx in range(0, len(ids), chunk_size):
+                signatures.update(Model.all_objects.filter(pk__in=ids[idx:idx + chunk_size]).values_list("pk", "signature"))
+            changed_models += [(model, read_values) for model, read_values in written_models if signatures.get(model.pk) != model.signature]
+
+    transaction.set_dirty()  # raw queries don't mark the transaction as having something to commit
+
+    # these will be prepared again, as they are now, next time
+    for model, read_values in changed_models:
+        model.counter, model.signature, model.signed_by_id = read_values
+    return [model for model, read_values in changed_models]
+
+
+def _record_sync_state(models):
+    """
+    Update the sync state tables for models saved without going through SyncedModel.save.
+    """
+    from .models import SyncedModelCounter, UnsyncedModel
+
+    counters = {}
+    synced_ids = {}
+    for model in models:
+        if model.counter is not None and model.signature:
+            key = (model.__class__, model.signed_by_id)
+            counters[key] = max(counters.get(key), model.counter)
+            synced_ids.setdefault(model.__class__, []).append(model.pk)
+
+    for (Model, device_id), counter in counters.iteritems():
+        SyncedModelCounter.record(Model, device_id, counter)
+    for Model, ids in synced_ids.iteritems():
+        UnsyncedModel.remove(Model, ids)
 
 
 def deserialize(data, src_version=VERSION, dest_version=VERSION, *args, **kwargs):
     """
     Similar to serialize, except for deserialization.
+    Data can be a JSON string, or a list of dictionaries already decoded from JSON.
     """
+    if isinstance(data, list):
+        return serializers.deserialize("versioned-python", data, src_version=src_version, dest_version=dest_version, *args, **kwargs)
     return serializers.deserialize("versioned-json", data, src_version=src_version, dest_version=dest_version, *args, **kwargs)
@@ -0,0 +1,106 @@
+"""
+Per-process caches for verifying the signatures of synced models, which is most of what syncing spends
+its time on, on small devices (more so without M2Crypto, as signatures from old versions that double-hashed
+can take two RSA verifications in pure Python).
+
+* Parsed keys are kept by the fingerprint of their public key string, for the SYNCING_KEY_CACHE_SIZE most
+  recently used, rather than parsed again for every model: each imported model has its own instance of
+  the Device that signed it, so the key it caches (Device.get_key) isn't shared.
+* Whether a signature verified is kept for the SYNCING_VERIFIED_SIGNATURE_CACHE_SIZE most recent ones, so
+  models sent again, or retried from ImportPurgatory, aren't verified again.  It's kept by a hash of the
+  public key, message (which includes the model's id, along with all its signed fields) and signature,
+  so a model changed since its signature was verified is verified again, and fails.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from fle_utils.crypto import Key
+
+
+class LRUCache(object):
+    """The most recently used values, by key, up to a maximum number."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.values.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.values[key] = value
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.values.pop(key, None)
+            self.values[key] = value
+            while len(self.values) > self.max_size:
+                self.values.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def get_stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.values)}
+
+
+key_cache = LRUCache(settings.SYNCING_KEY_CACHE_SIZE)  # public key fingerprint -> Key
+verified_signature_cache = LRUCache(settings.SYNCING_VERIFIED_SIGNATURE_CACHE_SIZE)  # signature hash -> bool
+
+
+def _to_bytes(value):
+    return value.encode("utf-8") if isinstance(value, unicode) else value
+
+
+def get_fingerprint(public_key_string):
+    return hashlib.sha1(_to_bytes(public_key_string)).hexdigest()
+
+
+def get_key(public_key_string):
+    """The (cached) Key for a public key string."""
+    fingerprint = get_fingerprint(public_key_string)
+    key = key_cache.get(fingerprint)
+    if key is None:
+        key = Key(public_key_string=public_key_string)
+        key_cache.put(fingerprint, key)
+    return key
+
+
+def get_signature_hash(public_key_string, message, signature):
+    return hashlib.sha1("\0".join(_to_bytes(value) for value in (public_key_string, message, signature))).digest()
+
+
+def get_verified(public_key_string, message, signature):
+    """Whether the signature was verified before (True or False), or None if it wasn't (or was forgotten)."""
+    return verified_signature_cache.get(get_signature_hash(public_key_string, message, signature))
+
+
+def set_verified(public_key_string, message, signature, verified):
+    verified_signature_cache.put(get_signature_hash(public_key_string, message, signature), bool(verified))
+
+
+def verify_signature(public_key_string, message, signature, key=None):
+    """
+    Whether signature is the signature of message by the key of public_key_string,
+    remembered for next time.  Pass key to verify with, if it's at hand already.
+    """
+    verified = get_verified(public_key_string, message, signature)
+    if verified is None:
+        try:
+            verified = bool((key or get_key(public_key_string)).verify(message, signature))
+        except Exception:
+            verified = False
+        set_verified(public_key_string, message, signature, verified)
+    return verified
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from ...engine.utils import rebuild_sync_state
+from ...models import SyncedModelCounter, UnsyncedModel
+
+
+class Command(BaseCommand):
+    help = "Recompute which models there are to sync (counter positions per model class and device, and unsynced models) from scratch."
+
+    def stdout_writeln(self, str):  self.stdout.write("%s\n"%str)
+
+    def handle(self, *args, **options):
+        rebuild_sync_state()
+        self.stdout_writeln("%d %s, %d %s." % (
+            SyncedModelCounter.objects.count(), ("counter positions"),
+            UnsyncedModel.objects.count(), ("unsynced models")))
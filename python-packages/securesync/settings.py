@@ -17,3 +17,22 @@ SYNC_SESSIONS_MAX_RECORDS = getattr(local_settings, "SYNC_SESSIONS_MAX_RECORDS",
 SHOW_DELETED_OBJECTS = getattr(local_settings, "SHOW_DELETED_OBJECTS", False)
 
 DEBUG_ALLOW_DELETIONS = getattr(local_settings, "DEBUG_ALLOW_DELETIONS", False)
+
+# Imported models are verified and saved in batches of this many, each batch in one transaction
+SYNCING_IMPORT_BATCH_SIZE = getattr(local_settings, "SYNCING_IMPORT_BATCH_SIZE", 500)
+
+# Parsed public keys of this many devices are kept in each process (see engine.verification)
+SYNCING_KEY_CACHE_SIZE = getattr(local_settings, "SYNCING_KEY_CACHE_SIZE", 1000)
+
+# Whether signatures verified is remembered for this many of the most recently imported models, in each process
+SYNCING_VERIFIED_SIGNATURE_CACHE_SIZE = getattr(local_settings, "SYNCING_VERIFIED_SIGNATURE_CACHE_SIZE", 20000)
+
+# Sync by streaming models in compressed chunks, resuming where an interrupted sync left off
+#   (the other side must support it too)
+SYNCING_STREAMING = getattr(local_settings, "SYNCING_STREAMING", False)
+
+# Number of models per streamed chunk; a dropped connection loses at most one chunk
+SYNCING_STREAM_CHUNK_SIZE = getattr(local_settings, "SYNCING_STREAM_CHUNK_SIZE", 100)
+
+# Seconds to keep device state (zones, device metadata) cached for, in each process
+DEVICE_STATE_CACHE_TIMEOUT = getattr(local_settings, "DEVICE_STATE_CACHE_TIMEOUT", 60)
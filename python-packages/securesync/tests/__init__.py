@@ -1,5 +1,10 @@
 from base import *
 from crypto_tests import *
 from decorators import *
+from device_cache_tests import *
+from import_tests import *
+from serializer_tests import *
+from streaming_tests import *
+from sync_state_tests import *
 from trust_tests import *
 from unicode_tests import *
@@ -162,6 +162,11 @@ class TestExistingKeysAndSignatures(unittest.TestCase):
         self.assertTrue(key.verify(self.message_actual, self.signature))
         self.assertFalse(key.verify(self.message_fake, self.signature))
 
+    def test_signature_pyrsa(self):
+        key = crypto.Key(private_key_string=self.priv_key_with_pem_header, use_m2crypto=False)
+        self.assertEqual(key.sign(self.message_actual, base64encode=False), self.signature)
+        self.assertEqual(key.sign(self.message_actual), self.signature_base64)
+
     def test_base64_signature_verification(self):
         key = crypto.Key(public_key_string=self.pub_key_with_no_headers)
         self.assertTrue(key.verify(self.message_actual, self.signature_base64))
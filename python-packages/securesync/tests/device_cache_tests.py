@@ -0,0 +1,53 @@
+"""
+Tests for caching device state (securesync.devices.cache)
+"""
+from django.test import TestCase
+
+from ..devices.cache import device_state_cache
+from ..models import Device, DeviceZone, Zone
+
+
+class DeviceStateCacheTest(TestCase):
+
+    def setUp(self):
+        Device.own_device = None  # cached within securesync, never cleared out
+        self.own_device = Device.get_own_device()
+
+    def tearDown(self):
+        Device.own_device = None
+
+    def test_zone_cached(self):
+        self.assertIsNone(self.own_device.get_zone())
+        stats = device_state_cache.get_stats()
+        with self.assertNumQueries(0):
+            self.assertFalse(self.own_device.is_registered())
+        self.assertEqual(device_state_cache.get_stats()["hits"], stats["hits"] + 1)
+
+    def test_zone_invalidated(self):
+        self.assertFalse(self.own_device.is_registered())
+        zone = Zone.objects.create(name="test_zone")
+        device_zone = DeviceZone.objects.create(zone=zone, device=self.own_device)
+        self.assertEqual(self.own_device.get_zone(), zone)
+
+        device_zone.revoked = True
+        device_zone.save()
+        self.assertFalse(self.own_device.is_registered())
+
+    def test_metadata_cached(self):
+        counter_position = self.own_device.get_counter_position()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.own_device.get_counter_position(), counter_position)
+            self.assertTrue(self.own_device.is_own_device())
+
+        # changes to the metadata returned don't end up in the cache
+        metadata = self.own_device.get_metadata()
+        metadata.counter_position = 1000
+        self.assertEqual(self.own_device.get_counter_position(), counter_position)
+
+    def test_metadata_invalidated(self):
+        counter_position = self.own_device.get_counter_position()
+        self.assertEqual(self.own_device.increment_counter_position(), counter_position + 1)
+        self.assertEqual(self.own_device.get_counter_position(), counter_position + 1)
+
+        self.own_device.set_counter_position(counter_position + 5)
+        self.assertEqual(self.own_device.get_counter_position(), counter_position + 5)
@@ -0,0 +1,135 @@
+"""
+Tests for importing serialized models (securesync.engine.utils.save_serialized_models)
+"""
+from django.db import connection
+from django.test import TestCase
+from mock import patch
+
+from ..engine.utils import save_serialized_models, serialize, verify_signatures
+from ..engine.verification import key_cache, verified_signature_cache
+from ..models import Device, DeviceZone, Zone, ImportPurgatory
+from fle_utils.crypto import Key
+
+
+class SaveSerializedModelsTest(TestCase):
+
+    def setUp(self):
+        Device.own_device = None  # cached within securesync, never cleared out
+        Device.get_own_device()
+
+        self.device = Device(name="remote device")
+        self.device.set_key(Key())
+        self.device.save()
+        self.device.get_metadata().save()
+
+        key_cache.clear()
+        verified_signature_cache.clear()
+
+    def tearDown(self):
+        Device.own_device = None
+
+    def make_zones(self, count, first_counter=100):
+        """Make zones as the remote device would have, without saving them here."""
+        zones = []
+        for counter in range(first_counter, first_counter + count):
+            zone = Zone(name="zone %d" % counter)
+            zone.counter = counter
+            zone.sign(device=self.device)
+            zones.append(zone)
+        return zones
+
+    def test_import_in_batches(self):
+        zones = self.make_zones(5)
+        result = save_serialized_models(serialize(zones, sign=False, increment_counters=False), batch_size=2)
+
+        self.assertEqual(result["saved_model_count"], 5)
+        self.assertEqual(result["unsaved_model_count"], 0)
+        self.assertEqual(Zone.objects.filter(signed_by=self.device).count(), 5)
+        self.assertEqual(self.device.get_metadata().counter_position, 104)
+
+    def test_import_updates_existing_models(self):
+        zone = self.make_zones(1)[0]
+        save_serialized_models(serialize([zone], sign=False, increment_counters=False))
+
+        zone = Zone.objects.get(pk=zone.pk)
+        zone.name = "renamed"
+        zone.counter = 101
+        zone.sign(device=self.device)
+        result = save_serialized_models(serialize([zone], sign=False, increment_counters=False))
+
+        self.assertEqual(result["saved_model_count"], 1)
+        self.assertEqual(Zone.objects.get(pk=zone.pk).name, "renamed")
+        self.assertEqual(self.device.get_metadata().counter_position, 101)
+
+    def test_unverified_models_go_to_purgatory(self):
+        zones = self.make_zones(3)
+        zones[1].name = "tampered"
+        result = save_serialized_models(serialize(zones, sign=False, increment_counters=False))
+
+        self.assertEqual(result["saved_model_count"], 2)
+        self.assertEqual(result["unsaved_model_count"], 1)
+        self.assertFalse(Zone.objects.filter(pk=zones[1].pk).exists())
+        self.assertEqual(ImportPurgatory.objects.get().model_count, 1)
+        # the counter is only advanced for models whose signature checks out
+        self.assertEqual(self.device.get_metadata().counter_position, 102)
+
+    def test_models_signed_by_unknown_devices_go_to_purgatory(self):
+        unknown_device = Device(name="unknown device")
+        unknown_device.set_key(Key())
+        unknown_device.save()
+        zone = Zone(name="zone")
+        zone.save()
+        # (validating a DeviceZone looks up the device that signed it)
+        device_zone = DeviceZone(device=self.device, zone=zone)
+        device_zone.counter = 100
+        device_zone.sign(device=unknown_device)
+        # as if it had been signed elsewhere (SyncedModels can't be deleted otherwise)
+        connection.cursor().execute("DELETE FROM %s WHERE id = %%s" % Device._meta.db_table, [unknown_device.pk])
+        self.assertFalse(Device.all_objects.filter(pk=unknown_device.pk).exists())
+        models = self.make_zones(1) + [device_zone]
+        result = save_serialized_models(serialize(models, sign=False, increment_counters=False))
+
+        self.assertEqual(result["saved_model_count"], 1)
+        self.assertEqual(result["unsaved_model_count"], 1)
+        self.assertFalse(DeviceZone.objects.filter(pk=device_zone.pk).exists())
+        purgatory = ImportPurgatory.objects.get()
+        self.assertEqual(purgatory.model_count, 1)
+        self.assertIn(device_zone.pk, purgatory.serialized_models)
+
+    def test_purgatory_kept_when_import_fails(self):
+        zones = self.make_zones(1)
+        purgatory = ImportPurgatory(serialized_models=serialize(zones, sign=False, increment_counters=False), model_count=1)
+        purgatory.save()
+        with patch("securesync.engine.utils._save_model_batch", side_effect=Exception("database is locked")):
+            result = save_serialized_models(purgatory)
+
+        self.assertIn("database is locked", result["exceptions"])
+        self.assertTrue(ImportPurgatory.objects.filter(pk=purgatory.pk).exists())
+
+    def test_verify_signatures(self):
+        zone = self.make_zones(1)[0]
+        message = zone._hashable_representation()
+        jobs = [
+            (self.device.public_key, message, zone.signature),
+            (self.device.public_key, message + "x", zone.signature),
+            ("not a key", message, zone.signature),
+        ]
+        self.assertEqual(verify_signatures(jobs), [True, False, False])
+
+    def test_verified_signatures_remembered(self):
+        zones = self.make_zones(2)
+        jobs = [(self.device.public_key, zone._hashable_representation(), zone.signature) for zone in zones]
+        self.assertEqual(verify_signatures(jobs[:1]), [True])
+
+        with patch.object(Key, "verify", return_value=True) as verify:
+            self.assertEqual(verify_signatures(jobs), [True, True])
+            # only the one not verified before
+            self.assertEqual(verify.call_count, 1)
+
+            # and when verifying a model on its own, as for models signed by devices in the same batch
+            zones[0].signed_by = Device.objects.get(pk=self.device.pk)
+            self.assertTrue(zones[0].verify())
+            self.assertEqual(verify.call_count, 1)
+
+    def test_keys_shared_between_device_instances(self):
+        self.assertIs(Device.objects.get(pk=self.device.pk).get_key(), Device.objects.get(pk=self.device.pk).get_key())
@@ -0,0 +1,38 @@
+"""
+Tests for the versioned serializers (fle_utils.django_utils.serializers), as used for syncing.
+"""
+import json
+
+from django.db import models
+from django.test import TestCase
+
+from ..engine.utils import deserialize, serialize
+from ..models import Device, Zone
+from fle_utils.django_utils.serializers.versioned_json import get_serialization_plan
+
+
+class VersionedSerializerTest(TestCase):
+
+    def setUp(self):
+        self.device = Device(name="remote device", version="0.9.4")
+
+    def test_fields_newer_than_dest_version_left_out(self):
+        old = json.loads(serialize([self.device], sign=False, increment_counters=False, dest_version="0.9.2"))
+        new = json.loads(serialize([self.device], sign=False, increment_counters=False, dest_version="0.9.3"))
+
+        self.assertNotIn("version", old[0]["fields"])
+        self.assertEqual(new[0]["fields"]["version"], "0.9.4")
+        self.assertEqual(new[0]["fields"]["name"], "remote device")
+
+    def test_plan_computed_once(self):
+        plan = get_serialization_plan(Device, "0.9.2")
+        self.assertIs(get_serialization_plan(Device, "0.9.2"), plan)
+        self.assertIsNot(get_serialization_plan(Device, "0.9.3"), plan)
+
+    def test_unknown_fields_from_newer_version_skipped(self):
+        data = json.loads(serialize([Zone(name="zone")], sign=False, increment_counters=False))
+        data[0]["fields"]["new_field"] = 1
+
+        zones = [obj.object for obj in deserialize(data, src_version="0.99.0", dest_version="0.9.4")]
+        self.assertEqual(zones[0].name, "zone")
+        self.assertRaises(models.FieldDoesNotExist, list, deserialize(data, src_version="0.9.4", dest_version="0.9.4"))
@@ -0,0 +1,110 @@
+"""
+Tests for streaming sync (securesync.engine.streaming), with the test client standing in for the server.
+"""
+import json
+import uuid
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from .. import VERSION
+from ..engine.streaming import CHUNK_CONTENT_TYPE, IncompleteChunkError, decode_chunks, encode_chunk, \
+    get_cursors, get_resume_points, iter_chunks, iter_models_to_sync, save_chunk
+from ..engine.utils import save_serialized_models, serialize
+from ..models import Device, SyncSession, Zone
+from fle_utils.crypto import Key
+
+
+class StreamingSyncTest(TestCase):
+
+    def setUp(self):
+        Device.own_device = None  # cached within securesync, never cleared out
+        self.own_device = Device.get_own_device()
+
+        # the client device
+        self.device = Device(name="remote device")
+        self.device.set_key(Key())
+        self.device.save()
+        self.device.get_metadata().save()
+
+        self.session = SyncSession(
+            client_nonce=uuid.uuid4().hex,
+            client_device=self.device,
+            server_device=self.own_device,
+            client_version=VERSION,
+            verified=True,
+        )
+        self.session.save()
+
+        self.zones = []
+        for counter in range(100, 105):
+            zone = Zone(name="zone %d" % counter)
+            zone.counter = counter
+            zone.sign(device=self.device)
+            self.zones.append(zone)
+
+    def tearDown(self):
+        Device.own_device = None
+
+    def encode(self, models, chunk_size=2):
+        return [encode_chunk(chunk, dest_version=VERSION) for chunk in iter_chunks(models, chunk_size=chunk_size)]
+
+    def test_chunks(self):
+        data = "".join(self.encode(self.zones))
+        # however the content arrives, models come out a whole chunk at a time
+        for pieces in ([data], list(data)):
+            chunks = list(decode_chunks(pieces))
+            self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+            self.assertEqual([obj["pk"] for chunk in chunks for obj in chunk], [zone.id for zone in self.zones])
+
+    def test_interrupted_chunk(self):
+        chunks = decode_chunks(["".join(self.encode(self.zones))[:-5]])
+        self.assertEqual(len(chunks.next()), 2)
+        self.assertEqual(len(chunks.next()), 2)
+        self.assertRaises(IncompleteChunkError, chunks.next)
+
+    def test_upload_resumes_after_last_chunk(self):
+        url = reverse("model_stream_upload") + "?client_nonce=" + self.session.client_nonce
+
+        # only the first chunk makes it through
+        first_chunk = self.encode(self.zones)[0]
+        result = json.loads(self.client.post(url, data=first_chunk, content_type=CHUNK_CONTENT_TYPE).content)
+        self.assertEqual(result["saved_model_count"], 2)
+        self.assertEqual(result["cursors"][self.device.id], [101, self.zones[1].id])
+        self.assertEqual(get_cursors(self.device)[self.device.id][0], 101)
+
+        # so the client picks up from there
+        self.assertEqual(get_resume_points({self.device.id: 101}, result["cursors"]), {self.device.id: result["cursors"][self.device.id][1]})
+        result = json.loads(self.client.post(url, data="".join(self.encode(self.zones[2:])), content_type=CHUNK_CONTENT_TYPE).content)
+        self.assertEqual(result["saved_model_count"], 3)
+        self.assertEqual(Zone.objects.filter(signed_by=self.device).count(), 5)
+
+    def download(self, device_counters, resume_points=None):
+        response = self.client.post(reverse("model_stream_download"), data=json.dumps({
+            "client_nonce": self.session.client_nonce,
+            "device_counters": device_counters,
+            "resume_points": resume_points or {},
+        }), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        return decode_chunks(response.streaming_content)
+
+    def test_download_stream(self):
+        save_serialized_models(serialize(self.zones, sign=False, increment_counters=False))
+
+        objects = [obj for chunk in self.download({self.device.id: 101}) for obj in chunk]
+        self.assertEqual([obj["fields"]["counter"] for obj in objects], [102, 103, 104])
+
+    @override_settings(SYNCING_STREAM_CHUNK_SIZE=2)
+    def test_download_resumes_after_last_chunk(self):
+        save_serialized_models(serialize(self.zones, sign=False, increment_counters=False))
+
+        # the connection drops after the first chunk has been saved
+        save_chunk(self.download({self.device.id: 99}).next(), peer=self.own_device)
+        cursors = get_cursors(self.own_device)
+        self.assertEqual(cursors[self.device.id][0], 101)
+
+        models = list(iter_models_to_sync({self.device.id: 99}, zone=None))
+        resume_points = get_resume_points({self.device.id: 101}, cursors)
+        objects = [obj for chunk in self.download({self.device.id: 101}, resume_points) for obj in chunk]
+        self.assertEqual([obj["pk"] for obj in objects], [model.id for model in models[2:]])
@@ -0,0 +1,103 @@
+"""
+Tests for keeping track of what there is to sync (SyncedModelCounter and UnsyncedModel)
+"""
+from django.test import TestCase
+
+from ..engine.utils import get_device_counters, get_models, prepare_models_for_sync, rebuild_sync_state, save_serialized_models, serialize
+from ..models import Device, SyncedModelCounter, UnsyncedModel, Zone
+from fle_utils.crypto import Key
+
+
+class SyncStateTest(TestCase):
+
+    def setUp(self):
+        Device.own_device = None  # cached within securesync, never cleared out
+        self.own_device = Device.get_own_device()
+
+    def tearDown(self):
+        Device.own_device = None
+
+    def counter(self, device):
+        return SyncedModelCounter.get_counters().get((Zone._meta.db_table, device.id))
+
+    def test_signed_models_are_counted(self):
+        zone = Zone(name="signed")
+        zone.save()
+        self.assertEqual(self.counter(self.own_device), zone.counter)
+        self.assertFalse(UnsyncedModel.objects.exists())
+
+        # so only zones saved since are looked up (the own device itself isn't counted yet, so it may come along)
+        zones = lambda models: [model for model in models if isinstance(model, Zone)]
+        self.assertEqual(zones(get_models({self.own_device.id: zone.counter - 1})), [zone])
+        self.assertEqual(zones(get_models({self.own_device.id: zone.counter})), [])
+
+    def test_unsynced_models_are_queued(self):
+        counter_position = self.own_device.get_counter_position()
+        zone = Zone(name="unsynced")
+        zone.save(sign=False, increment_counters=False)
+        self.assertEqual(UnsyncedModel.get_model_ids(Zone), [zone.id])
+        self.assertEqual(get_device_counters(devices=[self.own_device])[self.own_device.id], counter_position + 1)
+        self.assertEqual(get_models({self.own_device.id: counter_position}), [zone])
+
+        # until they are given a counter position and signed
+        serialize([zone])
+        self.assertFalse(UnsyncedModel.objects.exists())
+        self.assertEqual(self.counter(self.own_device), zone.counter)
+
+    def test_unsynced_models_prepared_together(self):
+        counter_position = self.own_device.get_counter_position()
+        for i in range(3):
+            Zone(name="unsynced %d" % i).save(sign=False, increment_counters=False)
+
+        prepare_models_for_sync(list(Zone.objects.order_by("name")))
+        zones = list(Zone.objects.order_by("name"))
+        self.assertEqual([zone.counter for zone in zones], range(counter_position + 1, counter_position + 4))
+        self.assertEqual(self.own_device.get_fresh_metadata().counter_position, counter_position + 3)
+        self.assertTrue(all(zone.signed_by_id == self.own_device.id and zone.verify() for zone in zones))
+        self.assertFalse(UnsyncedModel.objects.exists())
+
+    def test_models_changed_meanwhile_are_left_unsynced(self):
+        for i in range(3):
+            Zone(name="unsynced %d" % i).save(sign=False, increment_counters=False)
+        zones = list(Zone.objects.order_by("name"))
+
+        # saved again (by a request, say) after being read for syncing
+        changed = Zone.objects.get(pk=zones[1].pk)
+        changed.name = "changed"
+        changed.save(sign=False, increment_counters=False)
+
+        self.assertEqual(prepare_models_for_sync(zones), [zones[0], zones[2]])
+        changed = Zone.objects.get(pk=zones[1].pk)
+        self.assertEqual(changed.name, "changed")
+        self.assertIsNone(changed.signature)
+        self.assertEqual(UnsyncedModel.get_model_ids(Zone), [changed.id])
+
+        # and prepared as it is now, next time
+        self.assertEqual(prepare_models_for_sync([changed]), [changed])
+        self.assertTrue(Zone.objects.get(pk=changed.pk).verify())
+        self.assertFalse(UnsyncedModel.objects.exists())
+
+    def test_imported_models_are_counted(self):
+        device = Device(name="remote device")
+        device.set_key(Key())
+        device.save()
+        device.get_metadata().save()
+
+        zones = []
+        for counter in range(100, 103):
+            zone = Zone(name="zone %d" % counter)
+            zone.counter = counter
+            zone.sign(device=device)
+            zones.append(zone)
+        save_serialized_models(serialize(zones, sign=False, increment_counters=False))
+        self.assertEqual(self.counter(device), 102)
+
+    def test_rebuild(self):
+        Zone(name="signed").save()
+        Zone(name="unsynced").save(sign=False, increment_counters=False)
+        counters = SyncedModelCounter.get_counters()
+        unsynced_ids = UnsyncedModel.get_model_ids(Zone)
+
+        rebuild_sync_state()
+        self.assertEqual(SyncedModelCounter.get_counters(), counters)
+        self.assertEqual(UnsyncedModel.get_model_ids(Zone), unsynced_ids)